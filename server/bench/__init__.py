@@ -0,0 +1,10 @@
+"""
+Offline evaluation and benchmark harness.
+
+Replays a labelled prompt dataset through AnalyzerAgent against a recorded or
+mock LLM, computes the detection metrics from notebooks/evaluation.ipynb per
+pillar and per length bucket, and reports latency, token and throughput
+figures as JSON so runs can be diffed between commits.
+
+Run with ``python -m server.bench --help``.
+"""
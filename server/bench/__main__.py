@@ -0,0 +1,340 @@
+"""
+Bench CLI.
+
+Examples:
+    python -m server.bench run --llm mock --concurrency 1,4,16 --output bench.json
+    python -m server.bench run --llm mock-transport --concurrency 1,8
+    python -m server.bench run --llm recorded --recordings analyzer.jsonl --dataset ECHOdataset.csv
+    python -m server.bench run --llm cassette --cassettes cassettes/ --dataset ECHOdataset.csv
+    python -m server.bench run --llm mock --mock-ms-per-token 2 --budget adaptive --output adaptive.json
+    python -m server.bench run --llm mock --mock-ms-per-token 2 --output-contract offsets --output offsets.json
+    python -m server.bench run --llm mock --mock-ms-per-token 2 --split class --output split.json
+    python -m server.bench run --llm mock --guidelines pruned --output pruned.json
+    python -m server.bench compare bench.json adaptive.json
+    python -m server.bench startup --runs 10 --output startup.json
+    python -m server.bench looplag --prompt-chars 100000 --output looplag.json
+    python -m server.bench serialization --tokens 10,100,1000 --output serialization.json
+"""
+
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+from pathlib import Path
+from typing import Any, Dict, List
+
+# create_client() requires a key for non-mock base URLs; offline runs never use it
+os.environ.setdefault("OPENAI_API_KEY", "bench-offline")
+
+
+def _git_commit() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except Exception:
+        return "unknown"
+
+
+def _build_client(args, items):
+    from .llm import RecordedResponder, ReplayChatClient, mock_client
+
+    if args.llm == "recorded":
+        if not args.recordings:
+            raise SystemExit("--recordings is required with --llm recorded")
+        return ReplayChatClient(RecordedResponder(Path(args.recordings), time_scale=args.time_scale))
+    if args.llm == "cassette":
+        if not args.cassettes:
+            raise SystemExit("--cassettes is required with --llm cassette")
+        import httpx
+        import openai
+        from ..services.cassette import CassetteTransport
+        transport = CassetteTransport(args.cassettes, mode="replay", time_scale=args.time_scale)
+        return openai.AsyncOpenAI(api_key="replay", http_client=httpx.AsyncClient(transport=transport, timeout=None))
+    if args.llm == "mock-transport":
+        # Full SDK/HTTP path against the in-process mock LLM (MOCK_LLM_* env vars)
+        from ..services.openai_client import create_client
+        return create_client("mock://")
+    return mock_client(
+        items,
+        recall=args.mock_recall,
+        false_positive_rate=args.mock_fp_rate,
+        latency_ms=args.mock_latency_ms,
+        ms_per_token=args.mock_ms_per_token,
+        time_scale=args.time_scale,
+        seed=args.seed,
+    )
+
+
+async def _run(args) -> Dict[str, Any]:
+    from ..config import ANALYZER_MAX_TOKENS
+    from ..services.analyzer_agent import AnalyzerAgent
+    from ..services.budget import CompletionBudgeter
+    from ..services.rule_registry import get_rule_registry
+    from .dataset import SAMPLE_DATASET, load_dataset
+    from .detection import detected_rules, evaluate_detection
+    from ..services.split_analysis import split_groups
+    from .runner import UsageRecordingClient, run_items, summarize_performance
+
+    dataset_path = Path(args.dataset) if args.dataset else SAMPLE_DATASET
+    items = load_dataset(dataset_path, limit=args.limit)
+    registry = get_rule_registry()
+    levels = [int(c) for c in str(args.concurrency).split(",") if c.strip()]
+
+    # One budgeter for the whole run: later concurrency levels see the history of earlier ones
+    budgeter = CompletionBudgeter(
+        max_tokens=ANALYZER_MAX_TOKENS,
+        strategy=args.budget,
+        effort_tiers=os.getenv("ANALYZER_EFFORT_TIERS", "50:low,inf:medium"),
+        min_cap=int(os.getenv("ANALYZER_MIN_COMPLETION_TOKENS", "4000")),
+    )
+    performance: List[Dict[str, Any]] = []
+    detection_results = None
+    item_rows: List[Dict[str, Any]] = []
+    for level in levels:
+        agent = AnalyzerAgent(client=UsageRecordingClient(_build_client(args, items)))
+        agent.budgeter = budgeter
+        agent.output_contract = args.output_contract
+        agent.split_groups = split_groups(args.split)
+        agent.guideline_mode = args.guidelines
+        sink = sys.stdout if args.verbose else io.StringIO()
+        with contextlib.redirect_stdout(sink):
+            results, wall = await run_items(agent, items, level)
+        performance.append(summarize_performance(results, wall, level))
+        if detection_results is None:
+            detections = {r.item.id: detected_rules(r.result, registry) for r in results if r.result is not None}
+            detection_results = evaluate_detection(items, detections, registry)
+            item_rows = [{
+                "id": r.item.id,
+                "expected": sorted(r.item.expected_rules),
+                "detected": sorted(detections.get(r.item.id, [])),
+                "latency_ms": round(r.latency_ms, 2),
+                "error": r.error,
+            } for r in results]
+
+    report: Dict[str, Any] = {
+        "meta": {
+            "commit": _git_commit(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "python": platform.python_version(),
+            "dataset": str(dataset_path),
+            "llm": args.llm,
+            "concurrency": levels,
+            "seed": args.seed,
+            "budget": args.budget,
+            "output_contract": args.output_contract,
+            "split": args.split,
+            "guidelines": args.guidelines,
+        },
+        "detection": detection_results,
+        "performance": performance,
+        "budget_model": budgeter.snapshot(),
+    }
+    if args.include_items:
+        report["items"] = item_rows
+    return report
+
+
+def _flatten(prefix: str, value: Any, out: Dict[str, float]) -> None:
+    if isinstance(value, dict):
+        for key, inner in value.items():
+            _flatten(f"{prefix}.{key}" if prefix else str(key), inner, out)
+    elif isinstance(value, (int, float)) and not isinstance(value, bool):
+        out[prefix] = float(value)
+
+
+# Direction of each metric, by the last part of its key: +1 higher is better, -1 lower is better.
+# Keys in neither set (request counts, effort mix, sizes) are printed but never fail a comparison.
+_HIGHER_IS_BETTER = frozenset({
+    "recall", "precision", "f1", "accuracy", "specificity", "balanced_accuracy", "tp", "tn",
+    "throughput_rps", "placed",
+})
+_LOWER_IS_BETTER = frozenset({
+    "fp", "fn", "errors", "truncated_calls", "unresolved", "calls_per_request", "mean_completion_cap",
+    "prompt_tokens", "completion_tokens", "reasoning_tokens", "response_bytes", "wall_seconds",
+})
+_TIMING_KEYS = frozenset({"wall_seconds", "throughput_rps"})
+
+
+def _is_timing(key: str) -> bool:
+    """Wall-clock metrics (``*_ms``, ``*_us``, wall time, throughput), which get the looser threshold."""
+    parts = key.split(".")
+    return parts[-1] in _TIMING_KEYS or any(part.endswith(("_ms", "_us")) for part in parts)
+
+
+def _direction(key: str) -> int:
+    leaf = key.rsplit(".", 1)[-1]
+    if leaf in _HIGHER_IS_BETTER:
+        return 1
+    if leaf in _LOWER_IS_BETTER or _is_timing(key):
+        return -1
+    return 0
+
+
+def _compare(base_path: str, new_path: str, threshold: float, time_threshold: float) -> int:
+    """Print the metrics that moved past their threshold (relative); 1 if any regressed, else 0.
+
+    Timing metrics use ``time_threshold``, everything else ``threshold``.
+    """
+    base = json.loads(Path(base_path).read_text(encoding="utf-8"))
+    new = json.loads(Path(new_path).read_text(encoding="utf-8"))
+    base_flat: Dict[str, float] = {}
+    new_flat: Dict[str, float] = {}
+    _flatten("detection", base.get("detection") or {}, base_flat)
+    _flatten("detection", new.get("detection") or {}, new_flat)
+    _flatten("startup", base.get("startup") or {}, base_flat)
+    _flatten("startup", new.get("startup") or {}, new_flat)
+    _flatten("looplag", base.get("looplag") or {}, base_flat)
+    _flatten("looplag", new.get("looplag") or {}, new_flat)
+    _flatten("serialization", base.get("serialization") or {}, base_flat)
+    _flatten("serialization", new.get("serialization") or {}, new_flat)
+    for entry in base.get("performance", []):
+        _flatten(f"performance.c{entry.get('concurrency')}", entry, base_flat)
+    for entry in new.get("performance", []):
+        _flatten(f"performance.c{entry.get('concurrency')}", entry, new_flat)
+
+    print(f"{'metric':<70} {'base':>12} {'new':>12} {'delta':>10}  verdict")
+    changed = regressed = 0
+    for key in sorted(set(base_flat) | set(new_flat)):
+        b, n = base_flat.get(key), new_flat.get(key)
+        if b is None or n is None:
+            print(f"{key:<70} {str(b):>12} {str(n):>12} {'n/a':>10}")
+            continue
+        delta = n - b
+        limit = time_threshold if _is_timing(key) else threshold
+        if delta == 0 or abs(delta) <= limit * abs(b):
+            continue
+        changed += 1
+        direction = _direction(key)
+        verdict = "changed" if direction == 0 else ("better" if delta * direction > 0 else "worse")
+        if verdict == "worse":
+            regressed += 1
+        print(f"{key:<70} {b:>12.4f} {n:>12.4f} {delta:>+10.4f}  {verdict}")
+    print(f"{changed} metric(s) changed, {regressed} regressed")
+    return 1 if regressed else 0
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m server.bench", description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    run = sub.add_parser("run", help="Replay a dataset through AnalyzerAgent")
+    run.add_argument("--dataset", help="JSONL or ';'-separated CSV (default: bundled sample)")
+    run.add_argument("--llm", choices=["mock", "mock-transport", "recorded", "cassette"], default="mock")
+    run.add_argument("--recordings", help="JSONL of recorded analyzer completions")
+    run.add_argument("--cassettes", help="Cassette directory recorded with LLM_CASSETTE_MODE=record")
+    run.add_argument("--concurrency", default="1", help="Comma-separated concurrency levels, e.g. 1,4,16")
+    run.add_argument("--limit", type=int, default=0, help="Only use the first N items")
+    run.add_argument("--mock-recall", type=float, default=1.0)
+    run.add_argument("--mock-fp-rate", type=float, default=0.0)
+    run.add_argument("--mock-latency-ms", type=float, default=800.0)
+    run.add_argument("--mock-ms-per-token", type=float, default=0.0)
+    run.add_argument("--time-scale", type=float, default=1.0, help="Multiply simulated/recorded delays")
+    run.add_argument("--seed", type=int, default=0)
+    run.add_argument("--budget", choices=["adaptive", "fixed"], default="fixed",
+                     help="Analyzer effort/completion-cap strategy (fixed = medium effort, ANALYZER_MAX_TOKENS cap)")
+    run.add_argument("--output-contract", choices=["annotated", "offsets"], default="annotated",
+                     help="Analyzer output: full annotated prompt, or quoted spans resolved server-side")
+    run.add_argument("--split", default="off",
+                     help="ANALYZER_SPLIT for 'both' items: off, rulesets, class or pillar groups like ABD;EFHIL;CGJK")
+    run.add_argument("--guidelines", choices=["full", "minified", "pruned"], default="full",
+                     help="Guideline XML sent to the analyzer: whole file, minified, or pruned per prompt")
+    run.add_argument("--include-items", action="store_true", help="Include per-item rows in the JSON")
+    run.add_argument("--output", help="Write JSON here instead of stdout")
+    run.add_argument("--verbose", action="store_true", help="Show agent debug output")
+
+    startup = sub.add_parser("startup", help="Cold-start time of a fresh worker, with and without warm-up")
+    startup.add_argument("--runs", type=int, default=5, help="Fresh processes per STARTUP_WARMUP setting")
+    startup.add_argument("--output", help="Write JSON here instead of stdout")
+
+    looplag = sub.add_parser("looplag", help="Event-loop lag during large analyzer post-processing, per executor")
+    looplag.add_argument("--prompt-chars", type=int, default=100_000, help="Size of the synthetic analyzed prompt")
+    looplag.add_argument("--requests", type=int, default=8)
+    looplag.add_argument("--concurrency", type=int, default=4)
+    looplag.add_argument("--latency-ms", type=float, default=50.0, help="Simulated upstream latency")
+    looplag.add_argument("--interval-ms", type=float, default=5.0, help="Lag probe sleep interval")
+    looplag.add_argument("--workers", type=int, default=2, help="POSTPROCESS_WORKERS")
+    looplag.add_argument("--executors", default="inline,thread,process", help="Comma-separated executors to measure")
+    looplag.add_argument("--output", help="Write JSON here instead of stdout")
+
+    serialization = sub.add_parser("serialization", help="Cost of building/serializing analyze responses by token count")
+    serialization.add_argument("--tokens", default="10,100,1000", help="Comma-separated risk token counts")
+    serialization.add_argument("--calls", type=int, default=2000, help="Repeats per size are calls / tokens (min 5)")
+    serialization.add_argument("--output", help="Write JSON here instead of stdout")
+
+    compare = sub.add_parser("compare", help="Diff two bench JSON reports; exits 1 when a metric regressed past its threshold")
+    compare.add_argument("base")
+    compare.add_argument("new")
+    compare.add_argument("--threshold", type=float, default=0.0, help="Ignore relative changes below this")
+    compare.add_argument("--time-threshold", type=float, default=0.1,
+                         help="Threshold for wall-clock metrics (latency, lag, throughput, startup times)")
+
+    args = parser.parse_args(argv)
+    if args.command == "compare":
+        return _compare(args.base, args.new, args.threshold, args.time_threshold)
+
+    if args.command == "startup":
+        from .startup import run_startup_bench
+        report = {
+            "meta": {
+                "commit": _git_commit(),
+                "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+                "python": platform.python_version(),
+                "runs": args.runs,
+            },
+            "startup": run_startup_bench(args.runs),
+        }
+    elif args.command == "looplag":
+        from .looplag import run_looplag_bench
+        report = {
+            "meta": {
+                "commit": _git_commit(),
+                "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+                "python": platform.python_version(),
+                "prompt_chars": args.prompt_chars,
+                "requests": args.requests,
+                "concurrency": args.concurrency,
+                "workers": args.workers,
+            },
+            "looplag": run_looplag_bench(
+                prompt_chars=args.prompt_chars,
+                requests=args.requests,
+                concurrency=args.concurrency,
+                latency_ms=args.latency_ms,
+                interval_ms=args.interval_ms,
+                workers=args.workers,
+                kinds=[k.strip() for k in args.executors.split(",") if k.strip()],
+            ),
+        }
+    elif args.command == "serialization":
+        from .serialization import run_serialization_bench
+        sizes = [int(t) for t in args.tokens.split(",") if t.strip()]
+        report = {
+            "meta": {
+                "commit": _git_commit(),
+                "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+                "python": platform.python_version(),
+                "tokens": sizes,
+            },
+            "serialization": run_serialization_bench(sizes, budget_calls=args.calls),
+        }
+    else:
+        report = asyncio.run(_run(args))
+    text = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.output:
+        Path(args.output).write_text(text + "\n", encoding="utf-8")
+        print(f"Wrote {args.output}")
+    else:
+        print(text)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,79 @@
+"""
+Labelled prompt datasets for the bench harness.
+
+Accepted formats:
+- JSONL, one object per line: {"id", "prompt", "expected_rules", "category", "analysis_mode"}
+- CSV with ";" separator (the notebook's ECHOdataset.csv layout), using the
+  same column names; "expected_rules" is a comma-separated list of rule ids.
+"""
+
+import csv
+import json
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import List
+
+SAMPLE_DATASET = Path(__file__).parent / "data" / "sample.jsonl"
+
+# Word-count buckets from the thesis evaluation (upper bound inclusive)
+LENGTH_BUCKETS = [
+    ("Short", 30),
+    ("Medium", 50),
+    ("Long", 80),
+    ("Agentic", 200),
+    ("Production", None),
+]
+
+
+@dataclass
+class BenchItem:
+    id: str
+    prompt: str
+    expected_rules: List[str] = field(default_factory=list)
+    category: str = "rule"
+    analysis_mode: str = "both"
+
+    @property
+    def word_count(self) -> int:
+        return len(self.prompt.split())
+
+    @property
+    def length_bucket(self) -> str:
+        words = self.word_count
+        for name, upper in LENGTH_BUCKETS:
+            if upper is None or words <= upper:
+                return name
+        return LENGTH_BUCKETS[-1][0]
+
+
+def _parse_rules(value) -> List[str]:
+    if isinstance(value, list):
+        return [str(v).strip() for v in value if str(v).strip()]
+    if not value:
+        return []
+    return [part.strip() for part in str(value).split(",") if part.strip()]
+
+
+def _to_item(row: dict, index: int) -> BenchItem:
+    return BenchItem(
+        id=str(row.get("id") or f"item-{index + 1}"),
+        prompt=str(row.get("prompt", "")),
+        expected_rules=_parse_rules(row.get("expected_rules")),
+        category=str(row.get("category") or "rule"),
+        analysis_mode=str(row.get("analysis_mode") or "both"),
+    )
+
+
+def load_dataset(path: Path = SAMPLE_DATASET, limit: int = 0) -> List[BenchItem]:
+    """Load a labelled dataset from JSONL or ';'-separated CSV."""
+    path = Path(path)
+    rows: List[dict] = []
+    if path.suffix.lower() == ".csv":
+        with open(path, "r", encoding="utf-8", newline="") as f:
+            rows = list(csv.DictReader(f, delimiter=";"))
+    else:
+        with open(path, "r", encoding="utf-8") as f:
+            rows = [json.loads(line) for line in f if line.strip()]
+    items = [_to_item(row, i) for i, row in enumerate(rows)]
+    items = [item for item in items if item.prompt.strip()]
+    return items[:limit] if limit else items
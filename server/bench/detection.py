@@ -0,0 +1,118 @@
+"""
+Detection metrics for the bench harness.
+
+Mirrors the notebook's span-level evaluation at (prompt, rule) granularity:
+every prompt is checked against every guideline rule, so true negatives are
+the rules that were neither expected nor detected. Metrics are reported
+overall, per pillar, per length bucket and per dataset category.
+"""
+
+import re
+from typing import Any, Dict, Iterable, List, Set
+
+from ..services.rule_registry import RuleRegistry
+from .dataset import BenchItem, LENGTH_BUCKETS
+
+_GUIDELINE_ID_RE = re.compile(r"\b([A-Z]\d{1,2})\b")
+
+
+def detected_rules(result: Dict[str, Any], registry: RuleRegistry) -> Set[str]:
+    """Guideline rule ids reported by an analyzer result."""
+    found: Set[str] = set()
+    risk_assessment = result.get("risk_assessment") or {}
+    for level, key in (("prompt", "prompt_violations"), ("meta", "meta_violations")):
+        for violation in (risk_assessment.get(level) or {}).get(key, []) or []:
+            rule_id = str(violation.get("rule_id", "")).strip()
+            if rule_id:
+                found.add(rule_id)
+    for token in result.get("risk_tokens") or []:
+        classification = token.get("classification", "")
+        if isinstance(classification, list):
+            classification = ", ".join(str(x) for x in classification)
+        found.update(_GUIDELINE_ID_RE.findall(str(classification)))
+    return {rule for rule in found if rule in registry.rules and registry.rules[rule].pillar_id}
+
+
+def _div(num: float, den: float) -> float:
+    return num / den if den else 0.0
+
+
+def _ratio(num: float, den: float) -> float:
+    return round(_div(num, den), 4)
+
+
+def detection_metrics(tp: int, fp: int, fn: int, tn: int) -> Dict[str, Any]:
+    # Derived metrics use the unrounded ratios; only the reported values are rounded
+    recall = _div(tp, tp + fn)
+    precision = _div(tp, tp + fp)
+    specificity = _div(tn, tn + fp)
+    return {
+        "recall": round(recall, 4),
+        "precision": round(precision, 4),
+        "f1": _ratio(2 * precision * recall, precision + recall),
+        "accuracy": _ratio(tp + tn, tp + tn + fp + fn),
+        "specificity": round(specificity, 4),
+        "balanced_accuracy": round((recall + specificity) / 2, 4),
+        "counts": {"tp": tp, "fp": fp, "fn": fn, "tn": tn},
+    }
+
+
+def _confusion(pairs: Iterable[tuple], rules: List[str]) -> Dict[str, Any]:
+    tp = fp = fn = tn = 0
+    for expected, detected in pairs:
+        for rule in rules:
+            e, d = rule in expected, rule in detected
+            if e and d:
+                tp += 1
+            elif d:
+                fp += 1
+            elif e:
+                fn += 1
+            else:
+                tn += 1
+    return detection_metrics(tp, fp, fn, tn)
+
+
+def evaluate_detection(
+    items: List[BenchItem],
+    detections: Dict[str, Set[str]],
+    registry: RuleRegistry,
+) -> Dict[str, Any]:
+    """Compute overall, per-pillar, per-length-bucket and per-category metrics."""
+    rules = sorted(r for r, info in registry.rules.items() if info.pillar_id)
+    scored = [item for item in items if item.id in detections]
+    pairs = {item.id: (set(item.expected_rules), detections[item.id]) for item in scored}
+
+    pillars: Dict[str, List[str]] = {}
+    for rule in rules:
+        info = registry.rules[rule]
+        pillars.setdefault(f"{info.pillar_id}. {info.category}", []).append(rule)
+
+    per_pillar = {
+        name: dict(_confusion(pairs.values(), pillar_rules), rule_class=registry.rules[pillar_rules[0]].rule_class)
+        for name, pillar_rules in sorted(pillars.items())
+    }
+
+    per_length = {}
+    for bucket, _ in LENGTH_BUCKETS:
+        bucket_items = [item for item in scored if item.length_bucket == bucket]
+        if bucket_items:
+            per_length[bucket] = dict(
+                _confusion((pairs[i.id] for i in bucket_items), rules), prompts=len(bucket_items)
+            )
+
+    per_category = {}
+    for category in sorted({item.category for item in scored}):
+        category_items = [item for item in scored if item.category == category]
+        per_category[category] = dict(
+            _confusion((pairs[i.id] for i in category_items), rules), prompts=len(category_items)
+        )
+
+    return {
+        "prompts": len(scored),
+        "rules": len(rules),
+        "overall": _confusion(pairs.values(), rules),
+        "per_pillar": per_pillar,
+        "per_length_bucket": per_length,
+        "per_category": per_category,
+    }
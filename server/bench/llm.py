@@ -0,0 +1,238 @@
+"""
+Offline LLM stand-ins for the bench harness.
+
+Both clients duck-type ``openai.AsyncOpenAI`` far enough for the agents
+(``client.chat.completions.create``) and return real ``ChatCompletion``
+objects, so the agents' response handling runs unchanged.
+
+- RecordedResponder replays captured analyzer completions from JSONL:
+  {"prompt", "content", "usage", "latency_ms", "finish_reason"}
+
+``mock_client`` builds a real ``openai.AsyncOpenAI`` over the in-process mock
+LLM (server/mock_llm). Usage, reasoning tokens, truncation at the cap and
+latency come from the mock's engine; only the analyzer's content differs: an
+``OracleResponseLibrary`` answers from the dataset labels with configurable
+recall and false-positive rate.
+"""
+
+import asyncio
+import json
+import random
+import re
+import time
+from pathlib import Path
+from types import SimpleNamespace
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set
+
+from openai.types.chat import ChatCompletion
+
+from ..mock_llm.behavior import LatencyDistribution, MockBehavior
+from ..mock_llm.engine import MockLLM
+from ..mock_llm.responses import ANALYZER, OFFSETS_CONTRACT_MARKER, ResponseLibrary, extract_prompt
+from ..services.rule_registry import RuleRegistry
+from .dataset import BenchItem
+
+_RULE_ID_RE = re.compile(r'<rule id="(\w+)"')
+
+Responder = Callable[[Dict[str, Any]], Awaitable[ChatCompletion]]
+
+
+def extract_analyzed_prompt(messages: List[Dict[str, Any]]) -> str:
+    """Recover the user prompt embedded in the analyzer's system prompt."""
+    return extract_prompt(ANALYZER, messages)
+
+
+def build_completion(
+    content: str,
+    model: str,
+    usage: Optional[Dict[str, Any]] = None,
+    finish_reason: str = "stop",
+) -> ChatCompletion:
+    payload = {
+        "id": f"bench-{int(time.time() * 1000)}",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": model or "bench-model",
+        "choices": [{
+            "index": 0,
+            "finish_reason": finish_reason,
+            "message": {"role": "assistant", "content": content},
+        }],
+    }
+    if usage:
+        payload["usage"] = usage
+    return ChatCompletion.model_validate(payload)
+
+
+class _Completions:
+    def __init__(self, responder: Responder):
+        self._responder = responder
+
+    async def create(self, **kwargs) -> ChatCompletion:
+        return await self._responder(kwargs)
+
+
+class ReplayChatClient:
+    """Minimal async client exposing ``chat.completions.create``."""
+
+    def __init__(self, responder: Responder):
+        self.chat = SimpleNamespace(completions=_Completions(responder))
+
+
+class RecordedResponder:
+    """Replays recorded analyzer completions keyed by the analyzed prompt."""
+
+    def __init__(self, path: Path, time_scale: float = 1.0):
+        self.time_scale = time_scale
+        self.records: Dict[str, Dict[str, Any]] = {}
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    record = json.loads(line)
+                    self.records[str(record.get("prompt", "")).strip()] = record
+
+    async def __call__(self, request: Dict[str, Any]) -> ChatCompletion:
+        prompt = extract_analyzed_prompt(request.get("messages", []))
+        record = self.records.get(prompt)
+        if record is None:
+            raise KeyError(f"No recorded completion for prompt: {prompt[:60]!r}")
+        delay = float(record.get("latency_ms", 0)) / 1000 * self.time_scale
+        if delay > 0:
+            await asyncio.sleep(delay)
+        return build_completion(
+            record.get("content", ""),
+            request.get("model", ""),
+            usage=record.get("usage"),
+            finish_reason=record.get("finish_reason", "stop"),
+        )
+
+
+class OracleResponseLibrary(ResponseLibrary):
+    """Mock LLM responses whose analyzer output comes from dataset labels (an 'oracle' with noise).
+
+    Only rules present in the guidelines it is sent are reported, so split
+    analyses (ANALYZER_SPLIT) and pruned guidelines (ANALYZER_GUIDELINES) show
+    up in the detection metrics. A fixed seed keeps runs repeatable.
+    """
+
+    def __init__(
+        self,
+        items: List[BenchItem],
+        recall: float = 1.0,
+        false_positive_rate: float = 0.0,
+        seed: int = 0,
+        registry: Optional[RuleRegistry] = None,
+    ):
+        super().__init__(registry=registry)
+        self.items = {item.prompt.strip(): item for item in items}
+        self.recall = recall
+        self.false_positive_rate = false_positive_rate
+        self.seed = seed
+        self.guideline_rules = sorted(r for r, info in self.registry.rules.items() if info.pillar_id)
+
+    def synthesize(self, agent: str, prompt: str, messages: List[Dict[str, Any]]) -> str:
+        if agent != ANALYZER:
+            return super().synthesize(agent, prompt, messages)
+        system = next((str(m.get("content") or "") for m in messages if m.get("role") == "system"), "")
+        rules = set(_RULE_ID_RE.findall(system)) or None
+        # Per-prompt seed keeps output independent of request ordering
+        rng = random.Random(f"{self.seed}:{prompt}")
+        return self.build_content(prompt, rng, offsets=OFFSETS_CONTRACT_MARKER in system, rules=rules)
+
+    def build_content(
+        self, prompt: str, rng: random.Random, offsets: bool = False, rules: Optional[Set[str]] = None
+    ) -> str:
+        item = self.items.get(prompt)
+        expected = item.expected_rules if item else []
+        detected = [rule for rule in expected if rng.random() < self.recall]
+        if rng.random() < self.false_positive_rate:
+            candidates = [r for r in self.guideline_rules if r not in expected]
+            if candidates:
+                detected.append(rng.choice(candidates))
+        if rules is not None:
+            # Drawn first so every group of a split sees the same detections
+            detected = [r for r in detected if r in rules]
+
+        words = prompt.split()
+        span = words[0].strip(".,;:!?\"'") if words else ""
+        risk_tokens, prompt_violations, meta_violations = [], [], []
+        for rule_id in detected:
+            info = self.registry.get(rule_id)
+            severity = (info.severity if info else None) or "medium"
+            pillar = (info.category if info else None) or "Unknown"
+            if info and info.rule_class == "meta":
+                meta_violations.append({
+                    "rule_id": rule_id, "pillar": pillar, "severity": severity,
+                    "explanation": f"Mock {rule_id} structural issue.",
+                })
+                continue
+            prompt_violations.append({"rule_id": rule_id, "pillar": pillar, "severity": severity, "span": span})
+            risk_tokens.append({
+                "id": f"RISK_{len(risk_tokens) + 1}",
+                "text": span,
+                "risk_level": severity,
+                "reasoning": f"Mock detection for {rule_id}.",
+                "classification": f'{pillar} rule_ids: ["{rule_id}"]',
+                "mitigation": "Clarify this span.",
+            })
+
+        annotated = prompt
+        if risk_tokens and span and span in prompt:
+            # All prompt-level mock detections share the first word as their span
+            annotated = prompt.replace(span, f"<RISK_1>{span}</RISK_1>", 1)
+            risk_tokens = risk_tokens[:1]
+            if offsets:
+                risk_tokens[0]["occurrence"] = 1
+
+        output = {
+            "annotated_prompt": annotated,
+            "analysis_summary": f"Mock analysis with {len(detected)} detections.",
+            "risk_tokens": risk_tokens,
+            "risk_assessment": {
+                "prompt": {"prompt_PRD": "", "prompt_violations": prompt_violations, "prompt_overview": "Mock."},
+                "meta": {"meta_PRD": "", "meta_violations": meta_violations, "meta_overview": "Mock."},
+            },
+        }
+        if offsets:
+            # Offsets contract: spans are quoted, the prompt is not echoed
+            del output["annotated_prompt"]
+        return json.dumps(output, ensure_ascii=False)
+
+
+def mock_client(
+    items: List[BenchItem],
+    recall: float = 1.0,
+    false_positive_rate: float = 0.0,
+    latency_ms: float = 800.0,
+    latency_sigma: float = 0.25,
+    ms_per_token: float = 0.0,
+    reasoning_ratio: float = 1.5,
+    time_scale: float = 1.0,
+    seed: int = 0,
+):
+    """AsyncOpenAI client over the mock LLM engine, answering analyzer calls from the dataset labels.
+
+    Latency is lognormal around ``latency_ms`` plus ``ms_per_token`` for each
+    completion token, scaled by ``time_scale``. Reasoning tokens scale with the
+    requested ``reasoning_effort`` and count against ``max_completion_tokens``,
+    so budget changes show up in the report.
+    """
+    import httpx
+    import openai
+
+    from ..mock_llm.transport import MockLLMTransport
+    from ..services.openai_client import MOCK_BASE_URL
+
+    behavior = MockBehavior(
+        latency=LatencyDistribution("lognormal" if latency_sigma else "fixed", median_ms=latency_ms, sigma=latency_sigma),
+        ms_per_completion_token=ms_per_token,
+        reasoning_ratio=reasoning_ratio,
+        time_scale=time_scale,
+        seed=seed,
+    )
+    engine = MockLLM(behavior, OracleResponseLibrary(items, recall, false_positive_rate, seed))
+    return openai.AsyncOpenAI(
+        api_key="bench-offline",
+        base_url=MOCK_BASE_URL,
+        http_client=httpx.AsyncClient(transport=MockLLMTransport(engine), timeout=None),
+    )
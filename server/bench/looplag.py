@@ -0,0 +1,140 @@
+"""
+Event-loop lag benchmark for analyzer post-processing.
+
+Runs AnalyzerAgent against a synthetic upstream that returns a large annotated
+completion: a long prompt with a ``<RISK_n>`` tag every few words and matching
+risk tokens and violations. While the analyses run, a probe coroutine sleeps
+``interval_ms`` in a loop and records how late it wakes up. That delay is what
+every other request on the worker would see. Each POSTPROCESS_EXECUTOR setting
+(inline, thread, process) is measured in turn, and the report gives probe lag
+and analysis latency percentiles per setting.
+"""
+
+import asyncio
+import contextlib
+import io
+import json
+import os
+import sys
+import time
+from typing import Any, Dict, List
+
+from ..services import postprocess_pool
+from ..services.analyzer_agent import AnalyzerAgent
+from .llm import ReplayChatClient, build_completion
+from .runner import percentiles
+
+_SENTENCE = "Summarize the latest findings of the study and explain why they prove the theory. "
+
+
+def synthetic_analysis(prompt_chars: int, every: int = 6) -> Dict[str, Any]:
+    """(prompt, completion content) with a risk tag on every ``every``-th word."""
+    words = (_SENTENCE * (prompt_chars // len(_SENTENCE) + 1))[:prompt_chars].split(" ")
+    annotated: List[str] = []
+    risk_tokens: List[Dict[str, Any]] = []
+    violations: List[Dict[str, Any]] = []
+    for i, word in enumerate(words):
+        if i % every == 0 and word:
+            risk_id = f"RISK_{len(risk_tokens) + 1}"
+            annotated.append(f"<{risk_id}>{word}</{risk_id}>")
+            risk_tokens.append({
+                "id": risk_id,
+                "text": word,
+                "risk_level": "high",
+                "reasoning": "Synthetic span.",
+                "classification": 'Referential-Grounding rule_ids: ["A1"]',
+                "mitigation": "Clarify this span.",
+            })
+            violations.append({"rule_id": "A1", "pillar": "Referential-Grounding", "severity": "high", "span": word})
+        else:
+            annotated.append(word)
+    content = json.dumps({
+        "annotated_prompt": " ".join(annotated),
+        "analysis_summary": "Synthetic analysis.",
+        "risk_tokens": risk_tokens,
+        "risk_assessment": {
+            "prompt": {"prompt_PRD": "", "prompt_violations": violations, "prompt_overview": "Synthetic."},
+            "meta": {"meta_PRD": "", "meta_violations": [], "meta_overview": "Synthetic."},
+        },
+    })
+    return {"prompt": " ".join(words), "content": content}
+
+
+@contextlib.contextmanager
+def _quiet_stdout():
+    # Analyzer debug prints, also from spawned pool processes (they inherit fd 1)
+    sys.stdout.flush()
+    saved = os.dup(1)
+    devnull = os.open(os.devnull, os.O_WRONLY)
+    os.dup2(devnull, 1)
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            yield
+    finally:
+        os.dup2(saved, 1)
+        os.close(saved)
+        os.close(devnull)
+
+
+async def _probe(stop: asyncio.Event, interval: float, lags: List[float]) -> None:
+    while not stop.is_set():
+        started = time.perf_counter()
+        await asyncio.sleep(interval)
+        lags.append((time.perf_counter() - started - interval) * 1000)
+
+
+async def _measure(kind: str, payload: Dict[str, Any], requests: int, concurrency: int,
+                   latency_ms: float, interval_ms: float, workers: int, inline_max_chars: int) -> Dict[str, Any]:
+    postprocess_pool.configure(kind, workers=workers, inline_max_chars=inline_max_chars)
+    postprocess_pool.start()
+
+    async def responder(request: Dict[str, Any]):
+        await asyncio.sleep(latency_ms / 1000)
+        return build_completion(payload["content"], request.get("model", ""))
+
+    agent = AnalyzerAgent(client=ReplayChatClient(responder))
+    agent.split_groups = []
+    agent.output_contract = "annotated"
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies: List[float] = []
+
+    async def one() -> None:
+        async with semaphore:
+            started = time.perf_counter()
+            await agent.analyze_prompt(payload["prompt"], "both")
+            latencies.append((time.perf_counter() - started) * 1000)
+
+    lags: List[float] = []
+    stop = asyncio.Event()
+    probe = asyncio.create_task(_probe(stop, interval_ms / 1000, lags))
+    started = time.perf_counter()
+    await asyncio.gather(*(one() for _ in range(requests)))
+    wall = time.perf_counter() - started
+    stop.set()
+    await probe
+    postprocess_pool.shutdown()
+    return {
+        "loop_lag_ms": percentiles(lags),
+        "latency_ms": percentiles(latencies),
+        "wall_seconds": round(wall, 3),
+    }
+
+
+def run_looplag_bench(
+    prompt_chars: int = 100_000,
+    requests: int = 8,
+    concurrency: int = 4,
+    latency_ms: float = 50.0,
+    interval_ms: float = 5.0,
+    workers: int = 2,
+    kinds: List[str] = ("inline", "thread", "process"),
+) -> Dict[str, Any]:
+    payload = synthetic_analysis(prompt_chars)
+    report: Dict[str, Any] = {"content_chars": len(payload["content"])}
+    with _quiet_stdout():
+        for kind in kinds:
+            # Threshold 0: every completion goes to the pool, so the setting is what is measured
+            report[kind] = asyncio.run(_measure(
+                kind, payload, requests, concurrency, latency_ms, interval_ms, workers, inline_max_chars=0
+            ))
+    return report
@@ -0,0 +1,135 @@
+"""
+Bench runner - replays dataset items through AnalyzerAgent at a given concurrency.
+
+Each item is analyzed in its own task; a proxy around the client attributes
+every completion's usage to the item being analyzed, so per-request token
+counts are available even though the agent itself only prints them.
+"""
+
+import asyncio
+import contextvars
+import time
+from dataclasses import dataclass, field
+from types import SimpleNamespace
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+from ..services.analyzer_agent import AnalyzerAgent
+from .dataset import BenchItem
+
+_current_item: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("bench_item", default=None)
+
+
+class _UsageRecordingCompletions:
+    def __init__(self, inner, sink: Dict[str, List[Dict[str, Any]]]):
+        self._inner = inner
+        self._sink = sink
+
+    async def create(self, **kwargs):
+        response = await self._inner.create(**kwargs)
+        usage = getattr(response, "usage", None)
+        item_id = _current_item.get()
+        if usage is not None and item_id is not None:
+            details = getattr(usage, "completion_tokens_details", None)
+            choices = getattr(response, "choices", None) or []
+            self._sink.setdefault(item_id, []).append({
+                "prompt_tokens": usage.prompt_tokens or 0,
+                "completion_tokens": usage.completion_tokens or 0,
+                "reasoning_tokens": (getattr(details, "reasoning_tokens", 0) or 0) if details else 0,
+                "max_completion_tokens": kwargs.get("max_completion_tokens") or 0,
+                "reasoning_effort": kwargs.get("reasoning_effort") or "none",
+                "finish_reason": choices[0].finish_reason if choices else None,
+            })
+        return response
+
+
+class UsageRecordingClient:
+    """Wraps a client and records usage per bench item."""
+
+    def __init__(self, inner):
+        self.usage: Dict[str, List[Dict[str, Any]]] = {}
+        self.chat = SimpleNamespace(completions=_UsageRecordingCompletions(inner.chat.completions, self.usage))
+
+
+@dataclass
+class ItemResult:
+    item: BenchItem
+    latency_ms: float
+    result: Optional[Dict[str, Any]] = None
+    error: Optional[str] = None
+    usage: List[Dict[str, Any]] = field(default_factory=list)
+
+
+def percentiles(values: List[float]) -> Dict[str, float]:
+    if not values:
+        return {}
+    arr = np.asarray(values, dtype=np.float64)
+    p50, p90, p95, p99 = np.percentile(arr, [50, 90, 95, 99])
+    return {
+        "mean": round(float(arr.mean()), 2),
+        "p50": round(float(p50), 2),
+        "p90": round(float(p90), 2),
+        "p95": round(float(p95), 2),
+        "p99": round(float(p99), 2),
+        "max": round(float(arr.max()), 2),
+    }
+
+
+async def run_items(agent: AnalyzerAgent, items: List[BenchItem], concurrency: int) -> tuple:
+    """Analyze every item with at most ``concurrency`` in flight; returns (results, wall_seconds)."""
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+    recorder: UsageRecordingClient = agent.client
+
+    async def run_one(item: BenchItem) -> ItemResult:
+        async with semaphore:
+            _current_item.set(item.id)
+            start = time.perf_counter()
+            try:
+                result = await agent.analyze_prompt(item.prompt, item.analysis_mode)
+                error = None
+            except Exception as e:
+                result, error = None, f"{type(e).__name__}: {e}"
+            latency_ms = (time.perf_counter() - start) * 1000
+            return ItemResult(item=item, latency_ms=latency_ms, result=result, error=error,
+                              usage=recorder.usage.get(item.id, []))
+
+    start = time.perf_counter()
+    results = await asyncio.gather(*(run_one(item) for item in items))
+    return list(results), time.perf_counter() - start
+
+
+def summarize_performance(results: List[ItemResult], wall_seconds: float, concurrency: int) -> Dict[str, Any]:
+    ok = [r for r in results if r.error is None]
+    totals = {"prompt_tokens": [], "completion_tokens": [], "reasoning_tokens": []}
+    for r in ok:
+        for key in totals:
+            totals[key].append(sum(u.get(key, 0) for u in r.usage))
+    calls = [u for r in results for u in r.usage]
+    efforts: Dict[str, int] = {}
+    for u in calls:
+        efforts[u["reasoning_effort"]] = efforts.get(u["reasoning_effort"], 0) + 1
+    risk_tokens = [t for r in ok for t in (r.result or {}).get("risk_tokens") or []]
+    unresolved = [u for r in ok for u in (r.result or {}).get("unresolved_spans") or []]
+    return {
+        "concurrency": concurrency,
+        "requests": len(results),
+        "errors": len(results) - len(ok),
+        "wall_seconds": round(wall_seconds, 3),
+        "throughput_rps": round(len(ok) / wall_seconds, 3) if wall_seconds > 0 else 0.0,
+        "latency_ms": percentiles([r.latency_ms for r in ok]),
+        "tokens_per_request": {
+            key: round(float(np.mean(values)), 1) if values else 0.0 for key, values in totals.items()
+        },
+        "budget": {
+            "calls_per_request": round(len(calls) / len(results), 3) if results else 0.0,
+            "truncated_calls": sum(1 for u in calls if u["finish_reason"] == "length"),
+            "mean_completion_cap": round(float(np.mean([u["max_completion_tokens"] for u in calls])), 1) if calls else 0.0,
+            "reasoning_effort": efforts,
+        },
+        "spans": {
+            "risk_tokens": len(risk_tokens),
+            "placed": sum(1 for t in risk_tokens if "span_start" in t),
+            "unresolved": len(unresolved),
+        },
+    }
@@ -0,0 +1,135 @@
+"""
+Serialization cost of /api/analyze responses by number of risk tokens.
+
+Builds a synthetic analyzer result with N risk tokens (reasoning and
+mitigation text of realistic length, one prompt violation per token) and times
+turning it into response bytes three ways:
+
+- legacy: the previous route. It builds ``RiskToken``/``RiskAssessment``
+  per token and returns the model. FastAPI then dumps it, re-validates it for
+  ``response_model``, dumps it again in JSON mode and calls ``json.dumps``.
+  FastAPI did this before it had a pydantic ``dump_json`` fast path.
+- legacy_dump_json: the same construction, with the re-validation and
+  ``dump_json`` of FastAPI versions that have the fast path.
+- lean: one ``model_validate`` at the agent boundary, then
+  ``FastJSONResponse`` (pydantic-core, no re-validation).
+
+It also times plain-dict encoding (SSE payloads) with orjson and with
+``json.dumps``. All times are microseconds per response.
+"""
+
+import json
+import time
+from typing import Any, Callable, Dict, List
+
+from pydantic import TypeAdapter
+
+from ..models.response import RiskAssessment, RiskToken
+from ..routes.analyze import AnalyzeResponse, _to_response
+from ..services import json_response
+from .runner import percentiles
+
+_REASONING = "The span refers to a source that the prompt never identifies, so the model has to guess which one is meant. "
+_MITIGATION = "Name the study (authors, year, venue) or paste the relevant passage into the prompt. "
+
+
+def synthetic_result(tokens: int) -> Dict[str, Any]:
+    """An analyzer result dict with ``tokens`` risk tokens and as many violations."""
+    words: List[str] = []
+    risk_tokens: List[Dict[str, Any]] = []
+    violations: List[Dict[str, Any]] = []
+    for i in range(tokens):
+        risk_id = f"RISK_{i + 1}"
+        span = f"the study {i}"
+        words.append(f"Explain why <{risk_id}>{span}</{risk_id}> proves the theory.")
+        risk_tokens.append({
+            "id": risk_id,
+            "text": span,
+            "risk_level": ("critical", "high", "medium")[i % 3],
+            "reasoning": _REASONING * 2,
+            # Every third token has a list classification, as the model sometimes returns
+            "classification": ["Referential-Grounding", 'rule_ids: ["A1"]'] if i % 3 == 0 else 'Referential-Grounding rule_ids: ["A1"]',
+            "mitigation": _MITIGATION,
+            "rule_ids": ["A1"],
+        })
+        violations.append({"rule_id": "A1", "pillar": "Referential-Grounding", "severity": "high", "span": span})
+    return {
+        "annotated_prompt": " ".join(words),
+        "analysis_summary": "Synthetic analysis.",
+        "risk_tokens": risk_tokens,
+        "risk_assessment": {
+            "prompt": {"prompt_PRD": 0.42, "prompt_violations": violations, "prompt_overview": "Synthetic."},
+            "meta": {"meta_PRD": 0.0, "meta_violations": [], "meta_overview": "Synthetic."},
+        },
+    }
+
+
+def _legacy_to_response(result: Dict[str, Any]) -> AnalyzeResponse:
+    # The route's conversion before the lean path, kept here for comparison
+    risk_assessment = RiskAssessment(**result["risk_assessment"]) if "risk_assessment" in result else None
+    risk_tokens = None
+    if result.get("risk_tokens"):
+        normalized_tokens = []
+        for token in result["risk_tokens"]:
+            token = dict(token)
+            if isinstance(token.get("classification"), list):
+                token["classification"] = ", ".join(str(x) for x in token["classification"])
+            normalized_tokens.append(token)
+        risk_tokens = [RiskToken(**token) for token in normalized_tokens]
+    return AnalyzeResponse(
+        annotated_prompt=result["annotated_prompt"],
+        analysis_summary=result["analysis_summary"],
+        risk_assessment=risk_assessment,
+        risk_tokens=risk_tokens,
+        unresolved_spans=result.get("unresolved_spans"),
+    )
+
+
+_ADAPTER = TypeAdapter(AnalyzeResponse)
+
+
+def _legacy(result: Dict[str, Any]) -> bytes:
+    model = _legacy_to_response(result)
+    value = _ADAPTER.validate_python(model.model_dump())
+    content = _ADAPTER.dump_python(value, mode="json")
+    return json.dumps(content, ensure_ascii=False, allow_nan=False, separators=(",", ":")).encode("utf-8")
+
+
+def _legacy_dump_json(result: Dict[str, Any]) -> bytes:
+    return _ADAPTER.dump_json(_ADAPTER.validate_python(_legacy_to_response(result)))
+
+
+def _lean(result: Dict[str, Any]) -> bytes:
+    return json_response.FastJSONResponse(_to_response(result)).body
+
+
+def _time(fn: Callable[[], Any], repeats: int) -> Dict[str, float]:
+    fn()  # warm-up (schema/serializer caches)
+    samples: List[float] = []
+    for _ in range(repeats):
+        started = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - started) * 1e6)
+    return percentiles(samples)
+
+
+def run_serialization_bench(sizes: List[int] = (10, 100, 1000), budget_calls: int = 2000) -> Dict[str, Any]:
+    report: Dict[str, Any] = {"orjson": json_response.orjson is not None}
+    for tokens in sizes:
+        result = synthetic_result(tokens)
+        repeats = max(5, budget_calls // tokens)
+        lean_bytes = _lean(result)
+        if json.loads(lean_bytes) != json.loads(_legacy(result)):
+            raise AssertionError(f"lean and legacy responses differ for {tokens} tokens")
+        analysis_output = _to_response(result).model_dump(exclude_none=True)
+        report[f"tokens_{tokens}"] = {
+            "response_bytes": len(lean_bytes),
+            "repeats": repeats,
+            "legacy_us": _time(lambda: _legacy(result), repeats),
+            "legacy_dump_json_us": _time(lambda: _legacy_dump_json(result), repeats),
+            "lean_us": _time(lambda: _lean(result), repeats),
+            "lean_validate_us": _time(lambda: _to_response(result), repeats),
+            "dict_json_us": _time(lambda: json.dumps(analysis_output, ensure_ascii=False), repeats),
+            "dict_fast_us": _time(lambda: json_response.dumps(analysis_output), repeats),
+        }
+    return report
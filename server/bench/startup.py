@@ -0,0 +1,100 @@
+"""
+Cold-start benchmark: how long a fresh worker takes to become useful.
+
+Each run is a new Python process (nothing cached in ``sys.modules``) that
+imports ``server.main``, runs the lifespan startup and then serves one
+``/api/analyze`` request in-process against the mock LLM with all simulated
+delays off. Runs alternate between STARTUP_WARMUP=0 and 1 so both settings see
+the same machine state. The report gives, per setting, the median/p95/max of:
+
+- import_ms: ``import server.main``
+- lifespan_ms: lifespan startup (warm-up, usage ledger flusher)
+- first_request_ms: the first analyze request
+- ready_ms: import + lifespan, i.e. until uvicorn would accept connections
+- first_response_ms: ready_ms + first_request_ms
+"""
+
+import json
+import os
+import subprocess
+import sys
+from pathlib import Path
+from typing import Any, Dict, List
+
+import numpy as np
+
+_REPO_ROOT = Path(__file__).resolve().parents[2]
+
+_CHILD = r"""
+import json, time
+t0 = time.perf_counter()
+from server.main import app
+t1 = time.perf_counter()
+import asyncio, contextlib, io, httpx
+
+async def main():
+    lifespan_started = time.perf_counter()
+    async with app.router.lifespan_context(app):
+        ready = time.perf_counter()
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            with contextlib.redirect_stdout(io.StringIO()):
+                response = await client.post("/api/analyze/", json={"prompt": PROMPT, "analysis_mode": "both"})
+        done = time.perf_counter()
+    return lifespan_started, ready, done, response.status_code
+
+lifespan_started, ready, done, status = asyncio.run(main())
+print(json.dumps({
+    "import_ms": (t1 - t0) * 1000,
+    "lifespan_ms": (ready - lifespan_started) * 1000,
+    "first_request_ms": (done - ready) * 1000,
+    "status": status,
+}))
+"""
+
+PROMPT = "Summarize the latest findings of the study and explain why they prove the theory."
+
+METRICS = ("import_ms", "lifespan_ms", "first_request_ms", "ready_ms", "first_response_ms")
+
+
+def _run_child(warmup: bool) -> Dict[str, float]:
+    env = dict(os.environ)
+    env.update({
+        "STARTUP_WARMUP": "1" if warmup else "0",
+        "OPENAI_API_BASE_URL": "mock://",
+        "MOCK_LLM_TIME_SCALE": "0",
+        "USAGE_DB_PATH": "",
+        "LOG_LEVEL": "WARNING",
+    })
+    code = f"PROMPT = {PROMPT!r}\n{_CHILD}"
+    proc = subprocess.run(
+        [sys.executable, "-c", code], cwd=_REPO_ROOT, env=env, capture_output=True, text=True
+    )
+    if proc.returncode != 0:
+        raise RuntimeError(f"startup child failed:\n{proc.stderr[-2000:]}")
+    sample = json.loads(proc.stdout.strip().splitlines()[-1])
+    if sample["status"] != 200:
+        raise RuntimeError(f"first request returned {sample['status']}")
+    sample["ready_ms"] = sample["import_ms"] + sample["lifespan_ms"]
+    sample["first_response_ms"] = sample["ready_ms"] + sample["first_request_ms"]
+    return sample
+
+
+def _summarize(samples: List[Dict[str, float]]) -> Dict[str, Any]:
+    out: Dict[str, Any] = {"runs": len(samples)}
+    for metric in METRICS:
+        values = np.array([s[metric] for s in samples], dtype=np.float64)
+        out[metric] = {
+            "p50": round(float(np.percentile(values, 50)), 1),
+            "p95": round(float(np.percentile(values, 95)), 1),
+            "max": round(float(values.max()), 1),
+        }
+    return out
+
+
+def run_startup_bench(runs: int = 5) -> Dict[str, Any]:
+    samples: Dict[str, List[Dict[str, float]]] = {"warmup_off": [], "warmup_on": []}
+    for _ in range(runs):
+        samples["warmup_off"].append(_run_child(False))
+        samples["warmup_on"].append(_run_child(True))
+    return {name: _summarize(rows) for name, rows in samples.items()}
@@ -1,6 +1,8 @@
 import os
+import json
 from dotenv import load_dotenv
 
+# The only load_dotenv() call; main.py imports this module before anything that reads os.environ
 load_dotenv()
 
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY", "")
@@ -9,6 +11,69 @@ OPENAI_MODEL = os.getenv("OPENAI_MODEL", "gpt-4o-mini")
 TEMPERATURE = float(os.getenv("TEMPERATURE", "1"))
 LLM_REQUEST_TIMEOUT = int(os.getenv("LLM_REQUEST_TIMEOUT", "40"))
 LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+# Default for /api/analyze?then=initiate: start the initiator from partial analysis (see services/speculation.py)
+SPECULATIVE_INITIATION = os.getenv("SPECULATIVE_INITIATION", "0").lower() in ("1", "true", "yes")
 
-if not OPENAI_API_KEY:
-    raise RuntimeError("OPENAI_API_KEY is not set. Create a .env file based on .env.example.")
\ No newline at end of file
+# Max LLM-backed route calls running at once per worker (0 = unlimited); see services/cancellation.py
+LLM_ROUTE_CONCURRENCY = int(os.getenv("LLM_ROUTE_CONCURRENCY", "0"))
+
+# Request deadlines (see services/deadline.py): seconds per route, overridable per request with the
+# X-Request-Timeout header up to REQUEST_DEADLINE_MAX; 0 = no deadline (each LLM call keeps its own timeout)
+REQUEST_DEADLINES = {
+    "analyze": 180.0, "initiate": 60.0, "refine": 60.0, "prepare": 120.0,
+    **json.loads(os.getenv("REQUEST_DEADLINES_JSON", "") or "{}"),
+}
+REQUEST_DEADLINE_MAX = float(os.getenv("REQUEST_DEADLINE_MAX", "600"))
+# Optional stages (fallbacks, retries) are skipped when less than this many seconds remain
+DEADLINE_MIN_STAGE_SECONDS = float(os.getenv("DEADLINE_MIN_STAGE_SECONDS", "5"))
+
+# Analyzer completion cap (upper bound for services/budget.py). Falls back to MAX_TOKENS, which the
+# other agents read with a default of 20000, so existing deployments keep their analyzer cap
+ANALYZER_MAX_TOKENS = int(os.getenv("ANALYZER_MAX_TOKENS") or os.getenv("MAX_TOKENS", "120000"))
+
+# Pre-flight token limits (see services/estimator.py); 0 disables a check.
+# 413 when one upstream call's input is larger than PREFLIGHT_MAX_INPUT_TOKENS,
+# 422 when its input plus expected completion exceeds the model context PREFLIGHT_CONTEXT_TOKENS.
+# The context depends on OPENAI_MODEL, so that check is off until it is set for the model in use
+PREFLIGHT_MAX_INPUT_TOKENS = int(os.getenv("PREFLIGHT_MAX_INPUT_TOKENS", "100000"))
+PREFLIGHT_CONTEXT_TOKENS = int(os.getenv("PREFLIGHT_CONTEXT_TOKENS", "0"))
+
+# CPU-heavy response post-processing (see services/postprocess_pool.py): inline | thread | process
+POSTPROCESS_EXECUTOR = os.getenv("POSTPROCESS_EXECUTOR", "thread").lower()
+POSTPROCESS_WORKERS = int(os.getenv("POSTPROCESS_WORKERS", "2"))
+# Completions shorter than this are post-processed on the event loop
+POSTPROCESS_INLINE_MAX_CHARS = int(os.getenv("POSTPROCESS_INLINE_MAX_CHARS", "50000"))
+
+# WebSocket refinement sessions, per worker (see services/refine_sessions.py)
+REFINE_WS_MAX_SESSIONS = int(os.getenv("REFINE_WS_MAX_SESSIONS", "200"))  # 0 = unlimited
+REFINE_WS_IDLE_SECONDS = float(os.getenv("REFINE_WS_IDLE_SECONDS", "900"))
+REFINE_WS_START_SECONDS = float(os.getenv("REFINE_WS_START_SECONDS", "5"))  # accept -> start frame
+REFINE_WS_MAX_SESSION_BYTES = int(os.getenv("REFINE_WS_MAX_SESSION_BYTES", str(2 * 1024 * 1024)))
+
+# Event-loop diagnostics (see observability/diagnostics.py)
+LOOP_LAG_INTERVAL = float(os.getenv("LOOP_LAG_INTERVAL", "0.5"))  # seconds between lag probes; 0 disables
+SLOW_CALLBACK_MS = float(os.getenv("SLOW_CALLBACK_MS", "0"))  # log callbacks blocking the loop this long; 0 disables
+# Enables the /api/debug/profile and /api/debug/loop admin endpoints (X-Admin-Token header)
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "")
+
+# Request/response body compression (see services/compression.py)
+RESPONSE_COMPRESSION = os.getenv("RESPONSE_COMPRESSION", "zstd,br,gzip")  # preference order; empty disables
+COMPRESSION_MIN_SIZE = int(os.getenv("COMPRESSION_MIN_SIZE", "1024"))  # smaller responses are sent as is
+MAX_DECOMPRESSED_BODY = int(os.getenv("MAX_DECOMPRESSED_BODY", str(32 * 1024 * 1024)))  # 413 above this
+
+# LLM record/replay (see services/cassette.py): off | record | replay | auto
+LLM_CASSETTE_MODE = os.getenv("LLM_CASSETTE_MODE", "off").lower()
+LLM_CASSETTE_DIR = os.getenv("LLM_CASSETTE_DIR", "cassettes")
+LLM_CASSETTE_TIME_SCALE = float(os.getenv("LLM_CASSETTE_TIME_SCALE", "1"))
+
+# Usage ledger (see services/usage_ledger.py)
+USAGE_DB_PATH = os.getenv("USAGE_DB_PATH", "")  # SQLite file; empty keeps usage in memory only
+USAGE_FLUSH_INTERVAL = float(os.getenv("USAGE_FLUSH_INTERVAL", "30"))
+USAGE_CLIENT_TOKEN_BUDGET = int(os.getenv("USAGE_CLIENT_TOKEN_BUDGET", "0"))  # 0 = unlimited
+USAGE_BUDGET_WINDOW = int(os.getenv("USAGE_BUDGET_WINDOW", "86400"))
+# {"model": {"prompt": usd_per_1m, "cached": usd_per_1m, "completion": usd_per_1m}}
+USAGE_PRICES = json.loads(os.getenv("USAGE_PRICES_JSON", "") or "{}")
+
+# Build agents, read guidelines and load the tokenizer before serving (see services/providers.py).
+# A missing OPENAI_API_KEY then fails startup instead of the first request.
+STARTUP_WARMUP = os.getenv("STARTUP_WARMUP", "1").lower() in ("1", "true", "yes")
\ No newline at end of file
@@ -1,68 +1,150 @@
-from dotenv import load_dotenv
-import os
-
-# Load environment variables FIRST
-load_dotenv()
-
-from fastapi import FastAPI, APIRouter
-from fastapi.middleware.cors import CORSMiddleware
-
-# Try relative imports first (when running from server dir), fall back to absolute
-try:
-    from routes import health, analyze, refine, prepare, initiate
-except ImportError:
-    from server.routes import health, analyze, refine, prepare, initiate
-
-# Create FastAPI app
-app = FastAPI(
-    title="Echo Hallucination Detection API",
-    description="AI-powered prompt analysis for hallucination detection",
-    version="1.0.0"
-)
-
-# Add CORS middleware
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["*"],  # In production, specify exact origins
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
-
-# Create main API router
-api_router = APIRouter()
-
-# Include route modules
-api_router.include_router(health.router, prefix="/health", tags=["health"])
-api_router.include_router(analyze.router, prefix="/analyze", tags=["analyze"])
-api_router.include_router(refine.router, prefix="/refine", tags=["refine"])
-api_router.include_router(prepare.router, prefix="/prepare", tags=["prepare"])
-api_router.include_router(initiate.router, prefix="/initiate", tags=["initiate"])
-
-# Include the main API router
-app.include_router(api_router, prefix="/api")
-
-# Debug router for development
-debug_router = APIRouter()
-
-@debug_router.get("/test")
-async def debug_test():
-    return {"status": "ok", "message": "Debug endpoint working"}
-
-@debug_router.get("/env")
-async def debug_env():
-    return {
-        "has_openai_key": bool(os.getenv("OPENAI_API_KEY")),
-        "api_base": os.getenv("OPENAI_API_BASE", "default"),
-    }
-
-app.include_router(debug_router, prefix="/api/debug", tags=["debug"])
-
-# Root endpoint
-@app.get("/")
-async def root():
-    return {"message": "Echo Hallucination Detection API is running"}
-
-if __name__ == "__main__":
-    import uvicorn
+import os
+import asyncio
+from contextlib import asynccontextmanager
+
+from fastapi import FastAPI, APIRouter, Request
+from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, Response
+
+# Try relative imports first (when running from server dir), fall back to absolute
+try:
+    # config loads .env; import it before anything that reads the environment
+    from config import LOG_LEVEL, LOOP_LAG_INTERVAL, SLOW_CALLBACK_MS, STARTUP_WARMUP, USAGE_FLUSH_INTERVAL
+    from routes import health, analyze, refine, prepare, initiate, usage, diagnostics, estimate
+    from observability.metrics import MetricsMiddleware, metrics_endpoint, route_label
+    from observability.tracing import TracingMiddleware, install_logging
+    from observability.diagnostics import install_slow_callback_logger, monitor_loop_lag
+    from services.usage_ledger import UsageMiddleware, get_usage_ledger
+    from services.compression import CompressionMiddleware
+    from services.cancellation import CLIENT_CLOSED_REQUEST, ClientDisconnected
+    from services.deadline import DeadlineExceeded
+    from services.estimator import PreflightRejected
+    from services.providers import warm_up
+    from services.postprocess_pool import shutdown as shutdown_postprocess_pool
+except ImportError:
+    from server.config import LOG_LEVEL, LOOP_LAG_INTERVAL, SLOW_CALLBACK_MS, STARTUP_WARMUP, USAGE_FLUSH_INTERVAL
+    from server.routes import health, analyze, refine, prepare, initiate, usage, diagnostics, estimate
+    from server.observability.metrics import MetricsMiddleware, metrics_endpoint, route_label
+    from server.observability.tracing import TracingMiddleware, install_logging
+    from server.observability.diagnostics import install_slow_callback_logger, monitor_loop_lag
+    from server.services.usage_ledger import UsageMiddleware, get_usage_ledger
+    from server.services.compression import CompressionMiddleware
+    from server.services.cancellation import CLIENT_CLOSED_REQUEST, ClientDisconnected
+    from server.services.deadline import DeadlineExceeded
+    from server.services.estimator import PreflightRejected
+    from server.services.providers import warm_up
+    from server.services.postprocess_pool import shutdown as shutdown_postprocess_pool
+
+# Log records carry the request's trace id
+install_logging(LOG_LEVEL)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Agents, guidelines and the tokenizer load here rather than on the first request
+    if STARTUP_WARMUP:
+        warm_up()
+    # Periodically persist the usage ledger; flushes once more on shutdown
+    background = [asyncio.create_task(get_usage_ledger().run_flusher(USAGE_FLUSH_INTERVAL))]
+    # Event-loop lag metric and slow-callback log (observability/diagnostics.py)
+    if LOOP_LAG_INTERVAL > 0:
+        background.append(asyncio.create_task(monitor_loop_lag(LOOP_LAG_INTERVAL)))
+    install_slow_callback_logger(SLOW_CALLBACK_MS)
+    try:
+        yield
+    finally:
+        for task in background:
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        install_slow_callback_logger(0)
+        shutdown_postprocess_pool()
+
+
+# Create FastAPI app
+app = FastAPI(
+    title="Echo Hallucination Detection API",
+    description="AI-powered prompt analysis for hallucination detection",
+    version="1.0.0",
+    lifespan=lifespan,
+)
+
+# Add CORS middleware
+app.add_middleware(
+    CORSMiddleware,
+    allow_origins=["*"],  # In production, specify exact origins
+    allow_credentials=True,
+    allow_methods=["*"],
+    allow_headers=["*"],
+)
+
+# gzip/zstd/br request and response bodies; SSE streams pass through uncompressed
+app.add_middleware(CompressionMiddleware)
+# Usage attribution (route, client key) and per-client token budget
+app.add_middleware(UsageMiddleware, route_label=route_label)
+# Per-route latency histograms and in-flight gauges
+app.add_middleware(MetricsMiddleware)
+# Outermost: trace id / root span for everything below (X-Trace-Id header)
+app.add_middleware(TracingMiddleware)
+
+# The client is gone, so nobody reads this; 499 keeps cancellations out of the 5xx rate
+@app.exception_handler(ClientDisconnected)
+async def client_disconnected_handler(request: Request, exc: ClientDisconnected):
+    return Response(status_code=CLIENT_CLOSED_REQUEST)
+
+# The request's deadline ran out; the body and X-Deadline-Stage name the stage it ran out in
+@app.exception_handler(DeadlineExceeded)
+async def deadline_exceeded_handler(request: Request, exc: DeadlineExceeded):
+    return JSONResponse(status_code=504, content=exc.to_dict(), headers={"X-Deadline-Stage": exc.stage})
+
+# Refused on its token estimate before any upstream call (413 input too large, 422 won't fit the context)
+@app.exception_handler(PreflightRejected)
+async def preflight_rejected_handler(request: Request, exc: PreflightRejected):
+    return JSONResponse(status_code=exc.status, content=exc.to_dict())
+
+# Create main API router
+api_router = APIRouter()
+
+# Include route modules
+api_router.include_router(health.router, prefix="/health", tags=["health"])
+api_router.include_router(analyze.router, prefix="/analyze", tags=["analyze"])
+api_router.include_router(refine.router, prefix="/refine", tags=["refine"])
+api_router.include_router(prepare.router, prefix="/prepare", tags=["prepare"])
+api_router.include_router(initiate.router, prefix="/initiate", tags=["initiate"])
+api_router.include_router(usage.router, prefix="/usage", tags=["usage"])
+api_router.include_router(estimate.router, prefix="/estimate", tags=["estimate"])
+
+# Include the main API router
+app.include_router(api_router, prefix="/api")
+
+# Debug router for development
+debug_router = APIRouter()
+
+@debug_router.get("/test")
+async def debug_test():
+    return {"status": "ok", "message": "Debug endpoint working"}
+
+@debug_router.get("/env")
+async def debug_env():
+    return {
+        "has_openai_key": bool(os.getenv("OPENAI_API_KEY")),
+        "api_base": os.getenv("OPENAI_API_BASE", "default"),
+    }
+
+app.include_router(debug_router, prefix="/api/debug", tags=["debug"])
+# Admin-only event-loop status and sampling profiler (ADMIN_TOKEN)
+app.include_router(diagnostics.router, prefix="/api/debug", tags=["debug"])
+
+# Prometheus scrape endpoint
+app.add_api_route("/metrics", metrics_endpoint, methods=["GET"], include_in_schema=False)
+
+# Root endpoint
+@app.get("/")
+async def root():
+    return {"message": "Echo Hallucination Detection API is running"}
+
+if __name__ == "__main__":
+    import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
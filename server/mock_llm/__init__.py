@@ -0,0 +1,18 @@
+"""
+Deterministic OpenAI-compatible stand-in for load testing and benchmarks.
+
+The same engine backs two front ends:
+- MockLLMTransport: an in-process httpx transport, selected by setting
+  ``OPENAI_API_BASE_URL=mock://`` (no network, no separate process).
+- A standalone FastAPI server (``python -m server.mock_llm``) that any
+  OpenAI client can point at, e.g. ``OPENAI_API_BASE_URL=http://127.0.0.1:8100/v1``.
+
+It replays recorded or synthesized analyzer, initiator, conversation and
+preparator responses and simulates latency, streaming chunk timing,
+rate-limit errors and truncation according to a MockBehavior.
+"""
+
+from .behavior import MockBehavior
+from .engine import MockLLM
+
+__all__ = ["MockBehavior", "MockLLM"]
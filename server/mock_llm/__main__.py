@@ -0,0 +1,26 @@
+"""Run the mock LLM server: python -m server.mock_llm [--host 127.0.0.1] [--port 8100] [--config mock.json]"""
+
+import argparse
+import os
+
+import uvicorn
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(prog="python -m server.mock_llm", description=__doc__)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8100)
+    parser.add_argument("--config", help="Behaviour JSON (same as MOCK_LLM_CONFIG)")
+    parser.add_argument("--fixtures", help="Directory of <agent>.jsonl fixtures (same as MOCK_LLM_FIXTURES)")
+    args = parser.parse_args(argv)
+    if args.config:
+        os.environ["MOCK_LLM_CONFIG"] = args.config
+    if args.fixtures:
+        os.environ["MOCK_LLM_FIXTURES"] = args.fixtures
+
+    from .server import create_app
+    uvicorn.run(create_app(), host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+"""
+Mock LLM behaviour: latency distributions, streaming timing and fault injection.
+
+Configured from a JSON file (``MOCK_LLM_CONFIG``) and/or ``MOCK_LLM_*``
+environment variables; environment variables win. Example file:
+
+    {
+      "latency": {"distribution": "lognormal", "median_ms": 1200, "sigma": 0.4},
+      "ms_per_completion_token": 2.0,
+      "stream": {"first_chunk_ms": 300, "inter_chunk_ms": 25, "chunk_chars": 24},
+      "rate_limit_rate": 0.05,
+      "truncate_rate": 0.02,
+      "seed": 7
+    }
+"""
+
+import json
+import math
+import os
+import random
+from dataclasses import dataclass, field, asdict
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+
+@dataclass
+class LatencyDistribution:
+    """Base latency in milliseconds, sampled per request."""
+    distribution: str = "fixed"  # fixed | uniform | normal | lognormal
+    median_ms: float = 0.0
+    sigma: float = 0.0          # lognormal shape, or normal standard deviation in ms
+    min_ms: float = 0.0
+    max_ms: float = 0.0         # uniform upper bound; 0 disables clamping otherwise
+
+    def sample(self, rng: random.Random) -> float:
+        kind = self.distribution
+        if kind == "uniform":
+            value = rng.uniform(self.min_ms, self.max_ms or self.median_ms)
+        elif kind == "normal":
+            value = rng.gauss(self.median_ms, self.sigma)
+        elif kind == "lognormal":
+            value = self.median_ms * math.exp(rng.gauss(0.0, self.sigma)) if self.median_ms > 0 else 0.0
+        else:
+            value = self.median_ms
+        value = max(self.min_ms, value)
+        if self.max_ms and kind != "uniform":
+            value = min(self.max_ms, value)
+        return max(0.0, value)
+
+
+@dataclass
+class StreamTiming:
+    first_chunk_ms: float = 0.0
+    inter_chunk_ms: float = 0.0
+    chunk_chars: int = 24
+
+
+# Reasoning tokens per visible token scale with the requested reasoning_effort
+EFFORT_REASONING_SCALE = {"minimal": 0.25, "low": 0.5, "medium": 1.0, "high": 2.0}
+
+
+def reasoning_tokens_for(visible_tokens: int, ratio: float, effort: Optional[str]) -> int:
+    if not effort:
+        return 0
+    return int(visible_tokens * ratio * EFFORT_REASONING_SCALE.get(effort, 1.0))
+
+
+@dataclass
+class MockBehavior:
+    latency: LatencyDistribution = field(default_factory=LatencyDistribution)
+    ms_per_completion_token: float = 0.0
+    stream: StreamTiming = field(default_factory=StreamTiming)
+    rate_limit_rate: float = 0.0
+    retry_after_ms: int = 500
+    truncate_rate: float = 0.0
+    truncate_fraction: float = 0.5
+    reasoning_ratio: float = 1.0
+    time_scale: float = 1.0
+    seed: int = 0
+    fixtures_dir: Optional[str] = None
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "MockBehavior":
+        data = dict(data or {})
+        latency = LatencyDistribution(**data.pop("latency", {}))
+        stream = StreamTiming(**data.pop("stream", {}))
+        return cls(latency=latency, stream=stream, **data)
+
+    @classmethod
+    def from_env(cls) -> "MockBehavior":
+        data: Dict[str, Any] = {}
+        config_path = os.getenv("MOCK_LLM_CONFIG")
+        if config_path:
+            data = json.loads(Path(config_path).read_text(encoding="utf-8"))
+        behavior = cls.from_dict(data)
+
+        env = os.environ
+        if "MOCK_LLM_LATENCY_MS" in env:
+            behavior.latency.median_ms = float(env["MOCK_LLM_LATENCY_MS"])
+            if behavior.latency.distribution == "fixed" and "MOCK_LLM_LATENCY_SIGMA" in env:
+                behavior.latency.distribution = "lognormal"
+        if "MOCK_LLM_LATENCY_SIGMA" in env:
+            behavior.latency.sigma = float(env["MOCK_LLM_LATENCY_SIGMA"])
+        if "MOCK_LLM_LATENCY_DISTRIBUTION" in env:
+            behavior.latency.distribution = env["MOCK_LLM_LATENCY_DISTRIBUTION"]
+        if "MOCK_LLM_MS_PER_TOKEN" in env:
+            behavior.ms_per_completion_token = float(env["MOCK_LLM_MS_PER_TOKEN"])
+        if "MOCK_LLM_FIRST_CHUNK_MS" in env:
+            behavior.stream.first_chunk_ms = float(env["MOCK_LLM_FIRST_CHUNK_MS"])
+        if "MOCK_LLM_INTER_CHUNK_MS" in env:
+            behavior.stream.inter_chunk_ms = float(env["MOCK_LLM_INTER_CHUNK_MS"])
+        if "MOCK_LLM_RATE_LIMIT_RATE" in env:
+            behavior.rate_limit_rate = float(env["MOCK_LLM_RATE_LIMIT_RATE"])
+        if "MOCK_LLM_TRUNCATE_RATE" in env:
+            behavior.truncate_rate = float(env["MOCK_LLM_TRUNCATE_RATE"])
+        if "MOCK_LLM_TIME_SCALE" in env:
+            behavior.time_scale = float(env["MOCK_LLM_TIME_SCALE"])
+        if "MOCK_LLM_SEED" in env:
+            behavior.seed = int(env["MOCK_LLM_SEED"])
+        if "MOCK_LLM_FIXTURES" in env:
+            behavior.fixtures_dir = env["MOCK_LLM_FIXTURES"]
+        return behavior
+
+    def to_dict(self) -> Dict[str, Any]:
+        return asdict(self)
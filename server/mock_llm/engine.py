@@ -0,0 +1,186 @@
+"""
+Mock chat-completions engine shared by the in-process transport and the HTTP server.
+
+Produces OpenAI wire-format payloads (dicts, SSE lines) so both front ends
+only deal with transport concerns.
+"""
+
+import asyncio
+import hashlib
+import json
+import random
+import threading
+import time
+import uuid
+from dataclasses import dataclass
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+
+from .behavior import MockBehavior, reasoning_tokens_for
+from .responses import ResponseLibrary
+
+
+def estimate_tokens(text: str) -> int:
+    """Cheap token estimate (~4 characters per token) for synthesized usage."""
+    return max(1, len(text) // 4)
+
+
+@dataclass
+class Plan:
+    """Everything decided up front for one request, so timing is reproducible."""
+    agent: str
+    content: str
+    finish_reason: str
+    usage: Dict[str, Any]
+    delay_ms: float
+    rate_limited: bool
+
+
+class MockLLM:
+    def __init__(self, behavior: Optional[MockBehavior] = None, library: Optional[ResponseLibrary] = None):
+        self.behavior = behavior or MockBehavior()
+        self.library = library or ResponseLibrary(self.behavior.fixtures_dir)
+        self._lock = threading.Lock()
+        self._seen: Dict[str, int] = {}
+        self.stats: Dict[str, int] = {"requests": 0, "rate_limited": 0, "truncated": 0, "streamed": 0}
+
+    @classmethod
+    def from_env(cls) -> "MockLLM":
+        return cls(MockBehavior.from_env())
+
+    def _rng(self, messages: List[Dict[str, Any]]) -> random.Random:
+        # Seed from the request content and how often it was seen, so the
+        # outcome of a request does not depend on interleaving with others
+        digest = hashlib.sha256(json.dumps(messages, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+        with self._lock:
+            occurrence = self._seen.get(digest, 0)
+            self._seen[digest] = occurrence + 1
+        return random.Random(f"{self.behavior.seed}:{digest}:{occurrence}")
+
+    def plan(self, request: Dict[str, Any]) -> Plan:
+        behavior = self.behavior
+        messages = request.get("messages") or []
+        rng = self._rng(messages)
+        with self._lock:
+            self.stats["requests"] += 1
+
+        if behavior.rate_limit_rate and rng.random() < behavior.rate_limit_rate:
+            with self._lock:
+                self.stats["rate_limited"] += 1
+            return Plan("", "", "", {}, behavior.latency.min_ms, True)
+
+        response = self.library.respond(messages)
+        content = response["content"]
+        finish_reason = response["finish_reason"] or "stop"
+
+        cap = request.get("max_completion_tokens") or request.get("max_tokens")
+        effort = request.get("reasoning_effort")
+        reasoning = reasoning_tokens_for(estimate_tokens(content), behavior.reasoning_ratio, effort)
+        truncate = behavior.truncate_rate and rng.random() < behavior.truncate_rate
+        # Reasoning tokens count against the cap, as they do upstream
+        if cap and estimate_tokens(content) + reasoning > int(cap):
+            reasoning = min(reasoning, int(cap))
+            content, truncate = content[: (int(cap) - reasoning) * 4], False
+            finish_reason = "length"
+        if truncate:
+            content = content[: max(1, int(len(content) * behavior.truncate_fraction))]
+            finish_reason = "length"
+        if finish_reason == "length":
+            with self._lock:
+                self.stats["truncated"] += 1
+
+        usage = response.get("usage")
+        if not usage:
+            prompt_tokens = sum(estimate_tokens(str(m.get("content") or "")) for m in messages)
+            visible = estimate_tokens(content) if content else 0
+            usage = {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": visible + reasoning,
+                "total_tokens": prompt_tokens + visible + reasoning,
+                "completion_tokens_details": {"reasoning_tokens": reasoning},
+            }
+
+        delay_ms = behavior.latency.sample(rng) + behavior.ms_per_completion_token * usage.get("completion_tokens", 0)
+        return Plan(response["agent"], content, finish_reason, usage, delay_ms, False)
+
+    async def _sleep(self, ms: float) -> None:
+        seconds = ms / 1000 * self.behavior.time_scale
+        if seconds > 0:
+            await asyncio.sleep(seconds)
+
+    def rate_limit_error(self) -> Tuple[int, Dict[str, str], Dict[str, Any]]:
+        retry_ms = self.behavior.retry_after_ms
+        headers = {
+            "retry-after-ms": str(retry_ms),
+            "retry-after": str(max(1, round(retry_ms / 1000))),
+            "x-ratelimit-remaining-requests": "0",
+        }
+        body = {"error": {
+            "message": "Rate limit reached for requests (mock). Please try again later.",
+            "type": "requests",
+            "param": None,
+            "code": "rate_limit_exceeded",
+        }}
+        return 429, headers, body
+
+    async def complete(self, request: Dict[str, Any]) -> Tuple[int, Dict[str, str], Dict[str, Any]]:
+        """Non-streaming completion: (status, headers, JSON body)."""
+        plan = self.plan(request)
+        await self._sleep(plan.delay_ms)
+        if plan.rate_limited:
+            return self.rate_limit_error()
+        body = {
+            "id": f"chatcmpl-mock-{uuid.uuid4().hex[:12]}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": request.get("model") or "mock-model",
+            "choices": [{
+                "index": 0,
+                "finish_reason": plan.finish_reason,
+                "message": {"role": "assistant", "content": plan.content},
+            }],
+            "usage": plan.usage,
+        }
+        return 200, {"x-mock-agent": plan.agent}, body
+
+    async def start_stream(self, request: Dict[str, Any]) -> Tuple[int, Dict[str, str], Any]:
+        """Streaming completion: (status, headers, SSE byte iterator or JSON error body)."""
+        plan = self.plan(request)
+        if plan.rate_limited:
+            await self._sleep(plan.delay_ms)
+            return self.rate_limit_error()
+        headers = {"content-type": "text/event-stream", "x-mock-agent": plan.agent}
+        return 200, headers, self._stream(request, plan)
+
+    async def _stream(self, request: Dict[str, Any], plan: Plan) -> AsyncIterator[bytes]:
+        """SSE body for a planned streaming completion, paced per StreamTiming."""
+        timing = self.behavior.stream
+        with self._lock:
+            self.stats["streamed"] += 1
+        completion_id = f"chatcmpl-mock-{uuid.uuid4().hex[:12]}"
+        created = int(time.time())
+        model = request.get("model") or "mock-model"
+
+        def chunk(delta: Dict[str, Any], finish_reason: Optional[str] = None, usage: Any = None) -> bytes:
+            payload = {
+                "id": completion_id,
+                "object": "chat.completion.chunk",
+                "created": created,
+                "model": model,
+                "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}] if delta is not None else [],
+            }
+            if usage is not None:
+                payload["usage"] = usage
+            return f"data: {json.dumps(payload, ensure_ascii=False)}\n\n".encode("utf-8")
+
+        # Without a dedicated first-chunk delay the sampled latency is time to first token
+        await self._sleep(timing.first_chunk_ms or plan.delay_ms)
+        yield chunk({"role": "assistant", "content": ""})
+        size = max(1, timing.chunk_chars)
+        for start in range(0, len(plan.content), size):
+            if start:
+                await self._sleep(timing.inter_chunk_ms)
+            yield chunk({"content": plan.content[start:start + size]})
+        yield chunk({}, finish_reason=plan.finish_reason)
+        if (request.get("stream_options") or {}).get("include_usage"):
+            yield chunk(None, usage=plan.usage)
+        yield b"data: [DONE]\n\n"
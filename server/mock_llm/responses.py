@@ -0,0 +1,257 @@
+"""
+Response content for the mock LLM.
+
+Each request is attributed to one of the agents by a marker in its system
+prompt. Content then comes from, in order:
+1. Recorded fixtures in ``MOCK_LLM_FIXTURES/<agent>.jsonl``; one JSON object per
+   line with "content" and optionally "match" (substring the request must
+   contain), "finish_reason" and "usage". Records without "match" are the
+   agent's default.
+2. A deterministic synthesizer that produces output in the shape the agent's
+   parser expects (analyzer JSON, preparator JSON, markdown for the chat agents).
+"""
+
+import json
+import re
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from ..services.rule_registry import RuleRegistry, get_rule_registry
+from ..services.span_resolver import occurrence_index
+
+ANALYZER = "analyzer"
+INITIATOR = "initiator"
+CONVERSATION = "conversation"
+PREPARATOR = "preparator"
+PREPARATOR_VARIATIONS = "preparator_variations"
+PREPARATOR_VARIATION = "preparator_variation"
+UNKNOWN = "unknown"
+
+AGENTS = [ANALYZER, INITIATOR, CONVERSATION, PREPARATOR, PREPARATOR_VARIATIONS, PREPARATOR_VARIATION, UNKNOWN]
+
+# Checked in order against the system prompt
+_AGENT_MARKERS = [
+    ("one-shot hallucination DETECTOR", ANALYZER),
+    ("You generate EXACTLY 5 mitigation-focused", PREPARATOR_VARIATIONS),
+    ("You write ONE mitigation-focused variant", PREPARATOR_VARIATION),
+    ("EchoAI-Preparator", PREPARATOR),
+    ("the SECOND agent", INITIATOR),
+    ("conversational agent specializing in mitigating hallucinations", CONVERSATION),
+]
+
+_PROMPT_PATTERNS = {
+    ANALYZER: re.compile(r"ANALYZE THIS PROMPT:\s*\n(.*)\n\s*</run>", re.DOTALL),
+    INITIATOR: re.compile(r"<original_prompt>\s*(.*?)\s*</original_prompt>", re.DOTALL),
+    CONVERSATION: re.compile(r"<current_prompt_state>\s*(.*?)\s*</current_prompt_state>", re.DOTALL),
+    PREPARATOR: re.compile(r"<current_prompt_state>\s*(.*?)\s*</current_prompt_state>", re.DOTALL),
+    PREPARATOR_VARIATIONS: re.compile(r"REFINED_PROMPT:\n(.*?)\n\nPRIOR_ANALYSIS_SUMMARY:", re.DOTALL),
+    PREPARATOR_VARIATION: re.compile(r"REFINED_PROMPT:\n(.*?)\n\nPRIOR_ANALYSIS_SUMMARY:", re.DOTALL),
+}
+_VARIATION_LABEL = re.compile(r"^VARIATION: (.+)$", re.MULTILINE)
+# Only the offsets output contract (ANALYZER_OUTPUT_CONTRACT=offsets) asks for this field
+OFFSETS_CONTRACT_MARKER = '"occurrence":'
+
+# Word-level cues for the synthesized analyzer; enough to exercise span mapping
+# and scoring with realistic shapes, not a detector
+_LEXICON = [
+    (re.compile(r"\b(it|this|that|they|them)\b", re.IGNORECASE), "A1"),
+    (re.compile(r"\b(short|long|detailed|brief|better|best|good)\b", re.IGNORECASE), "B1"),
+    (re.compile(r"\b(recently|recent|soon|nowadays|currently)\b", re.IGNORECASE), "B2"),
+    (re.compile(r"\b(everything|all|any|some)\b", re.IGNORECASE), "B3"),
+    (re.compile(r"\b(obviously|clearly|everyone knows)\b", re.IGNORECASE), "D2"),
+    (re.compile(r"\b\d+(?:\.\d+)?\b(?!\s*(?:%|percent|kg|km|m|s|ms|usd|eur|\$))"), "E1"),
+    (re.compile(r"\b\d+(?:\.\d+)?\s*(?:%|percent)", re.IGNORECASE), "E2"),
+    (re.compile(r"\b(latest|sources?|studies|research)\b", re.IGNORECASE), "F1"),
+    (re.compile(r"\b(amazing|incredible|revolutionary|ultimate)\b", re.IGNORECASE), "H1"),
+    (re.compile(r"\b(don't|do not|never|not)\b", re.IGNORECASE), "L2"),
+]
+
+VARIATION_LABELS = [
+    ("Minimal Patch", "Smallest edit that resolves the detected risks"),
+    ("Structured", "Explicit sections and delimiters"),
+    ("Context-Enriched", "Adds the missing domain context"),
+    ("Precision-Constrained", "Quantified, bounded requirements"),
+    ("Source-Grounded", "Anchors claims to named sources"),
+]
+
+
+def message_text(messages: List[Dict[str, Any]]) -> str:
+    return "\n".join(str(m.get("content") or "") for m in messages)
+
+
+def detect_agent(messages: List[Dict[str, Any]]) -> str:
+    system = next((str(m.get("content") or "") for m in messages if m.get("role") == "system"), "")
+    for marker, agent in _AGENT_MARKERS:
+        if marker in system:
+            return agent
+    return UNKNOWN
+
+
+def extract_prompt(agent: str, messages: List[Dict[str, Any]]) -> str:
+    pattern = _PROMPT_PATTERNS.get(agent)
+    if pattern is None:
+        return ""
+    match = pattern.search(message_text(messages))
+    return match.group(1).strip() if match else ""
+
+
+def load_fixtures(fixtures_dir: Optional[str]) -> Dict[str, List[Dict[str, Any]]]:
+    fixtures: Dict[str, List[Dict[str, Any]]] = {}
+    if not fixtures_dir:
+        return fixtures
+    root = Path(fixtures_dir)
+    for agent in AGENTS:
+        path = root / f"{agent}.jsonl"
+        if not path.exists():
+            continue
+        with open(path, "r", encoding="utf-8") as f:
+            fixtures[agent] = [json.loads(line) for line in f if line.strip()]
+    return fixtures
+
+
+class ResponseLibrary:
+    """Picks fixture or synthesized content for a chat completion request."""
+
+    def __init__(self, fixtures_dir: Optional[str] = None, registry: Optional[RuleRegistry] = None):
+        self.fixtures = load_fixtures(fixtures_dir)
+        self.registry = registry or get_rule_registry()
+
+    def respond(self, messages: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """Return {"agent", "content", "finish_reason", "usage"} for a request."""
+        agent = detect_agent(messages)
+        record = self._match_fixture(agent, messages)
+        if record is not None:
+            return {
+                "agent": agent,
+                "content": str(record.get("content", "")),
+                "finish_reason": record.get("finish_reason", "stop"),
+                "usage": record.get("usage"),
+            }
+        prompt = extract_prompt(agent, messages)
+        return {"agent": agent, "content": self.synthesize(agent, prompt, messages), "finish_reason": "stop", "usage": None}
+
+    def _match_fixture(self, agent: str, messages: List[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+        records = self.fixtures.get(agent)
+        if not records:
+            return None
+        text = message_text(messages)
+        default = None
+        for record in records:
+            match = record.get("match")
+            if match is None:
+                default = default or record
+            elif match in text:
+                return record
+        return default
+
+    def synthesize(self, agent: str, prompt: str, messages: List[Dict[str, Any]]) -> str:
+        if agent == ANALYZER:
+            return self.analyzer_content(prompt, offsets=OFFSETS_CONTRACT_MARKER in message_text(messages))
+        if agent == PREPARATOR:
+            return json.dumps({"refined_prompt": self._refine(prompt), "variations": self._variations(prompt)}, ensure_ascii=False)
+        if agent == PREPARATOR_VARIATIONS:
+            return json.dumps({"variations": self._variations(prompt)}, ensure_ascii=False)
+        if agent == PREPARATOR_VARIATION:
+            label = _VARIATION_LABEL.search(message_text(messages))
+            label = label.group(1).strip() if label else "Variation"
+            focus = dict(VARIATION_LABELS).get(label, label)
+            return json.dumps({"focus": focus, "prompt": f"[{label}] {prompt or 'Describe the task.'}"}, ensure_ascii=False)
+        if agent == INITIATOR:
+            return self.initiator_content(prompt)
+        if agent == CONVERSATION:
+            last_user = next((str(m.get("content") or "") for m in reversed(messages) if m.get("role") == "user"), "")
+            return self.conversation_content(prompt, last_user)
+        return "Mock response."
+
+    def analyzer_content(self, prompt: str, offsets: bool = False) -> str:
+        spans = []
+        taken = []
+        for pattern, rule_id in _LEXICON:
+            match = pattern.search(prompt)
+            if not match:
+                continue
+            start, end = match.span()
+            if any(start < e and s < end for s, e in taken):
+                continue
+            taken.append((start, end))
+            spans.append((start, end, rule_id))
+        spans.sort()
+
+        risk_tokens, prompt_violations = [], []
+        annotated, cursor = [], 0
+        for index, (start, end, rule_id) in enumerate(spans, start=1):
+            info = self.registry.get(rule_id)
+            severity = (info.severity if info else None) or "medium"
+            pillar = (info.category if info else None) or "Unknown"
+            text = prompt[start:end]
+            annotated.append(prompt[cursor:start])
+            annotated.append(f"<RISK_{index}>{text}</RISK_{index}>")
+            cursor = end
+            token = {
+                "id": f"RISK_{index}",
+                "text": text,
+                "risk_level": severity,
+                "reasoning": f"'{text}' matches {rule_id} ({info.name if info else 'rule'}).",
+                "classification": f'{pillar} rule_ids: ["{rule_id}"]',
+                "mitigation": f"Make '{text}' explicit.",
+            }
+            if offsets:
+                token["occurrence"] = occurrence_index(prompt, text, start)
+            risk_tokens.append(token)
+            prompt_violations.append({"rule_id": rule_id, "pillar": pillar, "severity": severity, "span": text})
+        annotated.append(prompt[cursor:])
+
+        meta_violations = []
+        if len(prompt.split()) < 8:
+            info = self.registry.get("J1")
+            meta_violations.append({
+                "rule_id": "J1",
+                "pillar": info.category if info else "Prompt-Structure",
+                "severity": (info.severity if info else None) or "high",
+                "explanation": "Prompt is too short to constrain the answer.",
+            })
+
+        output = {
+            "annotated_prompt": "".join(annotated),
+            "analysis_summary": f"Mock analysis found {len(risk_tokens)} risky span(s).",
+            "risk_tokens": risk_tokens,
+            "risk_assessment": {
+                "prompt": {"prompt_PRD": "", "prompt_violations": prompt_violations, "prompt_overview": "Mock prompt overview."},
+                "meta": {"meta_PRD": "", "meta_violations": meta_violations, "meta_overview": "Mock meta overview."},
+            },
+        }
+        if offsets:
+            del output["annotated_prompt"]
+        return json.dumps(output, ensure_ascii=False)
+
+    def initiator_content(self, prompt: str) -> str:
+        questions = [f"- What exactly should **{m.group(0)}** refer to here?"
+                     for pattern, _ in _LEXICON[:4] for m in [pattern.search(prompt)] if m]
+        if not questions:
+            questions = ["- What context, audience and output format should the answer assume?"]
+        return (
+            "### Summary\n"
+            "The analysis flagged a few underspecified spans in your prompt.\n\n"
+            "### Questions\n" + "\n".join(questions) + "\n\n"
+            "Each answer removes an ambiguity the model would otherwise fill in on its own.\n\n"
+            "Let's refine it together 😊"
+        )
+
+    def conversation_content(self, prompt: str, user_message: str) -> str:
+        return (
+            "Got it — thanks for the extra detail.\n\n"
+            f"Incorporating *{user_message[:80] or 'your note'}* keeps the prompt grounded.\n\n"
+            "```\n" + self._refine(prompt) + "\n```\n\n"
+            "Shall we refine anything else? 😊"
+        )
+
+    def _refine(self, prompt: str) -> str:
+        prompt = prompt or "Describe the task."
+        return f"{prompt}\n\nUse only verifiable information, state the scope explicitly, and say \"I don't know\" when unsure."
+
+    def _variations(self, prompt: str) -> List[Dict[str, Any]]:
+        base = self._refine(prompt) if prompt else "Describe the task."
+        return [
+            {"id": i, "label": label, "focus": focus, "prompt": f"[{label}] {base}"}
+            for i, (label, focus) in enumerate(VARIATION_LABELS, start=1)
+        ]
@@ -0,0 +1,37 @@
+"""
+Standalone OpenAI-compatible mock server.
+
+    python -m server.mock_llm --port 8100
+    OPENAI_API_BASE_URL=http://127.0.0.1:8100/v1 uvicorn server.main:app
+"""
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+from .engine import MockLLM
+
+
+def create_app(engine: MockLLM = None) -> FastAPI:
+    engine = engine or MockLLM.from_env()
+    app = FastAPI(title="Echo mock LLM")
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        body = await request.json()
+        if body.get("stream"):
+            status, headers, payload = await engine.start_stream(body)
+            if status == 200:
+                return StreamingResponse(payload, status_code=status, headers=headers, media_type="text/event-stream")
+            return JSONResponse(payload, status_code=status, headers=headers)
+        status, headers, payload = await engine.complete(body)
+        return JSONResponse(payload, status_code=status, headers=headers)
+
+    @app.get("/v1/models")
+    async def models():
+        return {"object": "list", "data": [{"id": "mock-model", "object": "model", "owned_by": "mock"}]}
+
+    @app.get("/stats")
+    async def stats():
+        return {"stats": engine.stats, "behavior": engine.behavior.to_dict()}
+
+    return app
@@ -0,0 +1,54 @@
+"""
+In-process httpx transport backed by MockLLM.
+
+Used by ``services.openai_client`` when ``OPENAI_API_BASE_URL=mock://``; the
+OpenAI SDK builds real HTTP requests and parses real responses, so retries,
+streaming and error handling behave as they do against the API.
+"""
+
+import json
+from typing import AsyncIterator
+
+import httpx
+
+from .engine import MockLLM
+
+
+class _AsyncByteStream(httpx.AsyncByteStream):
+    def __init__(self, iterator: AsyncIterator[bytes]):
+        self._iterator = iterator
+
+    async def __aiter__(self) -> AsyncIterator[bytes]:
+        async for part in self._iterator:
+            yield part
+
+    async def aclose(self) -> None:
+        close = getattr(self._iterator, "aclose", None)
+        if close is not None:
+            await close()
+
+
+class MockLLMTransport(httpx.AsyncBaseTransport):
+    def __init__(self, engine: MockLLM):
+        self.engine = engine
+
+    @classmethod
+    def from_env(cls) -> "MockLLMTransport":
+        return cls(MockLLM.from_env())
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        path = request.url.path.rstrip("/")
+        if request.method == "GET" and path.endswith("/models"):
+            return httpx.Response(200, json={"object": "list", "data": [{"id": "mock-model", "object": "model", "owned_by": "mock"}]})
+        if request.method != "POST" or not path.endswith("/chat/completions"):
+            return httpx.Response(404, json={"error": {"message": f"Unknown mock route {request.method} {path}", "type": "invalid_request_error"}})
+
+        body = json.loads(await request.aread() or b"{}")
+        if body.get("stream"):
+            status, headers, payload = await self.engine.start_stream(body)
+            if status == 200:
+                return httpx.Response(status, headers=headers, stream=_AsyncByteStream(payload))
+            return httpx.Response(status, headers=headers, json=payload)
+
+        status, headers, payload = await self.engine.complete(body)
+        return httpx.Response(status, headers=headers, json=payload)
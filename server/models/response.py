@@ -1,4 +1,4 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, field_validator
 from typing import List, Optional, Dict, Any, Union
 from datetime import datetime
 
@@ -51,6 +51,22 @@ class RiskToken(BaseModel):
     rule_ids: Optional[List[str]] = None
     span_start: Optional[int] = None
     span_end: Optional[int] = None
+    # Offsets output contract: which appearance of "text" in the prompt is meant
+    occurrence: Optional[int] = None
+
+    @field_validator("classification", mode="before")
+    @classmethod
+    def _join_classification(cls, value: Any) -> Any:
+        # The model sometimes returns a list of labels
+        if isinstance(value, list):
+            return ", ".join(str(x) for x in value)
+        return value
+
+class UnresolvedSpan(BaseModel):
+    id: Optional[str] = None
+    text: str
+    occurrence: int
+    reason: str  # "not_found" or "overlap"
 
 class ChatMessage(BaseModel):
     role: str  # "user" or "assistant"
@@ -0,0 +1 @@
+"""Runtime observability for the Echo API (Prometheus metrics, request tracing)."""
@@ -0,0 +1,263 @@
+"""
+Event-loop diagnostics: lag monitor, slow-callback logger and sampling profiler.
+
+Latency spikes that do not line up with upstream latency usually come from
+the worker's own event loop being blocked. Three tools help find them:
+
+- ``monitor_loop_lag`` sleeps LOOP_LAG_INTERVAL seconds in a loop and records
+  how late it wakes up in ``echo_event_loop_lag_seconds``. Any request on the
+  worker waited at least that long.
+- ``install_slow_callback_logger`` times every callback the loop runs. One that
+  holds the loop for SLOW_CALLBACK_MS or longer is logged with the task's
+  coroutine chain, outermost to innermost (the innermost coroutine is the one
+  that ran until its next ``await``), and counted in
+  ``echo_slow_callbacks_total``. It hooks the stock asyncio loop; uvloop (picked
+  by uvicorn[standard] with ``--loop auto``) never calls that hook, so it is
+  not installed there and a warning says so. Run with ``--loop asyncio`` to use it.
+- ``SamplingProfiler`` samples the Python stacks of the loop thread (or every
+  thread) from a background thread, using ``sys._current_frames``. The result
+  is returned as collapsed stacks (flamegraph.pl / speedscope import) or
+  speedscope JSON. It needs no extra packages, and the worker keeps serving
+  while it samples.
+
+The admin endpoints that expose the profiler are in ``routes/diagnostics.py``.
+"""
+
+import asyncio
+import collections
+import logging
+import os
+import sys
+import threading
+import time
+from asyncio import events
+from typing import Any, Deque, Dict, List, Optional, Set, Tuple
+
+from .metrics import EVENT_LOOP_LAG, SLOW_CALLBACKS
+
+logger = logging.getLogger(__name__)
+
+PROFILE_FORMATS = ("collapsed", "speedscope")
+
+Frame = Tuple[str, str, int]  # (qualified name, file, first line)
+
+# Recent samples for /api/debug/loop
+_recent_lags: Deque[Tuple[float, float]] = collections.deque(maxlen=600)  # (unix time, lag seconds)
+_recent_slow: Deque[Dict[str, Any]] = collections.deque(maxlen=50)
+_slow_threshold = 0.0
+# Loop class the slow-callback logger could not hook, if any
+_unsupported_loop: Optional[str] = None
+_original_run = events.Handle._run
+_ASYNCIO_DIR = os.path.dirname(asyncio.__file__)
+
+
+async def monitor_loop_lag(interval: float) -> None:
+    """Record event-loop lag every ``interval`` seconds until cancelled."""
+    loop = asyncio.get_running_loop()
+    while True:
+        started = loop.time()
+        await asyncio.sleep(interval)
+        lag = max(0.0, loop.time() - started - interval)
+        EVENT_LOOP_LAG.observe(lag)
+        _recent_lags.append((time.time(), lag))
+
+
+def _short_path(path: str) -> str:
+    # Keep the last two components: "services/analyzer_agent.py"
+    parts = path.replace("\\", "/").split("/")
+    return "/".join(parts[-2:])
+
+
+def _coroutine_chain(coro: Any) -> List[str]:
+    """Qualified names from a task's coroutine down to the one it is suspended in.
+
+    asyncio's own coroutines at the end of the chain (``sleep``, ``wait_for``...)
+    are left out, so the last entry is the application code that awaited them.
+    """
+    codes = []
+    while coro is not None and len(codes) < 32:
+        code = getattr(coro, "cr_code", None) or getattr(coro, "gi_code", None)
+        if code is None:
+            break
+        codes.append(code)
+        coro = getattr(coro, "cr_await", None) or getattr(coro, "gi_yieldfrom", None)
+    while len(codes) > 1 and codes[-1].co_filename.startswith(_ASYNCIO_DIR):
+        codes.pop()
+    return [f"{code.co_qualname} ({_short_path(code.co_filename)}:{code.co_firstlineno})" for code in codes]
+
+
+def describe_callback(handle: events.Handle) -> Tuple[str, List[str]]:
+    """(short name, coroutine chain) for a loop callback; the chain is empty for plain callbacks."""
+    callback = getattr(handle, "_callback", None)
+    task = getattr(callback, "__self__", None)
+    if isinstance(task, asyncio.Task):
+        chain = _coroutine_chain(task.get_coro())
+        if chain:
+            return chain[-1].split(" ", 1)[0], chain
+        return task.get_name(), []
+    name = getattr(callback, "__qualname__", None) or repr(callback)
+    return name, []
+
+
+def _timed_run(self: events.Handle) -> None:
+    started = time.perf_counter()
+    try:
+        _original_run(self)
+    finally:
+        elapsed = time.perf_counter() - started
+        if 0 < _slow_threshold <= elapsed:
+            _report_slow_callback(self, elapsed)
+
+
+def _report_slow_callback(handle: events.Handle, elapsed: float) -> None:
+    try:
+        name, chain = describe_callback(handle)
+    except Exception:  # never let diagnostics break the loop
+        name, chain = "unknown", []
+    SLOW_CALLBACKS.labels(name).inc()
+    _recent_slow.append({"at": time.time(), "ms": round(elapsed * 1000, 1), "callback": name, "chain": chain})
+    logger.warning(
+        "Event loop blocked for %.0f ms by %s", elapsed * 1000, " -> ".join(chain) if chain else name
+    )
+
+
+def install_slow_callback_logger(threshold_ms: float) -> bool:
+    """Log loop callbacks that run for ``threshold_ms`` or longer (0 removes the hook).
+
+    Wraps ``asyncio.Handle._run`` process-wide, which costs two
+    ``perf_counter`` calls per callback. Unlike ``loop.set_debug``, it does not
+    capture a traceback for every task and handle. Only loops derived from
+    ``asyncio.BaseEventLoop`` run their callbacks through that method; on any
+    other running loop (uvloop) nothing is installed and False is returned.
+    """
+    global _slow_threshold, _unsupported_loop
+    _unsupported_loop = None
+    if threshold_ms > 0:
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            loop = None  # installed before the loop starts; the stock loop will use it
+        if loop is not None and not isinstance(loop, asyncio.BaseEventLoop):
+            _unsupported_loop = f"{type(loop).__module__}.{type(loop).__qualname__}"
+            logger.warning(
+                "SLOW_CALLBACK_MS is set, but the %s event loop does not run callbacks through "
+                "asyncio.Handle; slow callbacks are not logged. Start uvicorn with --loop asyncio to use it.",
+                _unsupported_loop,
+            )
+            threshold_ms = 0
+    _slow_threshold = threshold_ms / 1000
+    events.Handle._run = _timed_run if threshold_ms > 0 else _original_run
+    return threshold_ms > 0
+
+
+def loop_status() -> Dict[str, Any]:
+    """Recent lag percentiles and slow callbacks of this worker."""
+    lags = sorted(lag for _, lag in _recent_lags)
+
+    def pick(q: float) -> Optional[float]:
+        return round(lags[min(len(lags) - 1, int(q * len(lags)))] * 1000, 2) if lags else None
+
+    return {
+        "pid": os.getpid(),
+        "lag_samples": len(lags),
+        "lag_ms": {"p50": pick(0.5), "p99": pick(0.99), "max": pick(1.0)},
+        "slow_callback_threshold_ms": round(_slow_threshold * 1000, 1) if events.Handle._run is _timed_run else None,
+        # Set when SLOW_CALLBACK_MS could not be honoured on this worker's loop (uvloop)
+        "slow_callback_unsupported_loop": _unsupported_loop,
+        "slow_callbacks": list(_recent_slow),
+    }
+
+
+class SamplingProfiler:
+    """Wall-clock stack sampler for the threads of this process.
+
+        profiler = SamplingProfiler({threading.get_ident()}, interval=0.005)
+        profiler.start()
+        ...
+        profiler.stop()
+        text = profiler.collapsed()
+    """
+
+    def __init__(self, thread_ids: Optional[Set[int]] = None, interval: float = 0.005):
+        self.thread_ids = thread_ids  # None = every thread except the sampler
+        self.interval = interval
+        self.samples = 0
+        self.duration = 0.0
+        self._stacks: Dict[Tuple[Frame, ...], int] = collections.Counter()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._started = 0.0
+
+    def start(self) -> None:
+        self._started = time.perf_counter()
+        self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.duration = time.perf_counter() - self._started
+
+    def _run(self) -> None:
+        own = threading.get_ident()
+        names = {t.ident: t.name for t in threading.enumerate()}
+        while not self._stop.wait(self.interval):
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own or (self.thread_ids is not None and thread_id not in self.thread_ids):
+                    continue
+                stack: List[Frame] = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append((code.co_qualname, _short_path(code.co_filename), code.co_firstlineno))
+                    frame = frame.f_back
+                if self.thread_ids is None or len(self.thread_ids) > 1:
+                    if thread_id not in names:
+                        names = {t.ident: t.name for t in threading.enumerate()}
+                    stack.append((f"thread:{names.get(thread_id, thread_id)}", "", 0))
+                self._stacks[tuple(reversed(stack))] += 1
+            self.samples += 1
+
+    @staticmethod
+    def _label(frame: Frame) -> str:
+        name, path, line = frame
+        return f"{name} ({path}:{line})" if path else name
+
+    def collapsed(self) -> str:
+        """One ``root;...;leaf count`` line per distinct stack."""
+        lines = [
+            ";".join(self._label(frame).replace(";", ":") for frame in stack) + f" {count}"
+            for stack, count in sorted(self._stacks.items(), key=lambda item: -item[1])
+        ]
+        return "\n".join(lines) + "\n"
+
+    def speedscope(self, name: str = "echo") -> Dict[str, Any]:
+        """The samples as a speedscope "sampled" profile (weights in seconds)."""
+        frame_index: Dict[Frame, int] = {}
+        samples: List[List[int]] = []
+        weights: List[float] = []
+        for stack, count in self._stacks.items():
+            samples.append([frame_index.setdefault(frame, len(frame_index)) for frame in stack])
+            weights.append(round(count * self.interval, 6))
+        return {
+            "$schema": "https://www.speedscope.app/file-format-schema.json",
+            "exporter": "echo-diagnostics",
+            "name": name,
+            "activeProfileIndex": 0,
+            "shared": {
+                "frames": [
+                    {"name": frame[0], "file": frame[1], "line": frame[2]} if frame[1] else {"name": frame[0]}
+                    for frame in frame_index
+                ]
+            },
+            "profiles": [{
+                "type": "sampled",
+                "name": name,
+                "unit": "seconds",
+                "startValue": 0,
+                "endValue": round(sum(weights), 6),
+                "samples": samples,
+                "weights": weights,
+            }],
+        }
+
@@ -0,0 +1,289 @@
+"""
+Prometheus metrics for the Echo API, exposed at ``/metrics``.
+
+- HTTP: latency histogram and in-flight gauge per route (analyze, refine,
+  initiate, prepare, ...), recorded by MetricsMiddleware.
+- Stages: per-agent stage durations (e.g. analyzer prompt_build,
+  upstream_wait, json_parse, span_mapping, prd_scoring) via StageTimer.
+- LLM: upstream call latency/outcome, tokens by kind/model/mode and the
+  number of calls waiting on the upstream API, recorded by
+  ``openai_client.create_chat_completion``.
+- Quality of service: parse failures and fallbacks by agent and source
+  (e.g. preparator ``fallback_llm`` / ``local_synthesis``).
+- Event loop: lag and slow callbacks, recorded by ``observability.diagnostics``.
+- Pre-flight: requests refused on their token estimate
+  (``services.estimator``).
+- Deadlines: stages that ran out of request budget or were skipped for it
+  (``services.deadline``).
+- Compression: bytes saved and CPU time per body, by direction and encoding
+  (``services.compression``).
+
+With several uvicorn workers set ``PROMETHEUS_MULTIPROC_DIR`` so every worker
+writes to a shared directory and /metrics aggregates them.
+"""
+
+import os
+import time
+from typing import Any
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest,
+)
+from prometheus_client import REGISTRY as DEFAULT_REGISTRY
+from starlette.responses import Response
+
+from .tracing import record_span
+
+# LLM calls take seconds to minutes; default buckets stop at 10s
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 90, 120, 180, 300)
+STAGE_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+HTTP_REQUEST_DURATION = Histogram(
+    "echo_http_request_duration_seconds",
+    "HTTP request latency by route",
+    ["route", "method", "status"],
+    buckets=LATENCY_BUCKETS,
+)
+HTTP_REQUESTS_IN_FLIGHT = Gauge(
+    "echo_http_requests_in_flight",
+    "HTTP requests currently being served",
+    ["route"],
+    multiprocess_mode="livesum",
+)
+STAGE_DURATION = Histogram(
+    "echo_stage_duration_seconds",
+    "Duration of agent processing stages",
+    ["agent", "stage"],
+    buckets=STAGE_BUCKETS,
+)
+LLM_REQUEST_DURATION = Histogram(
+    "echo_llm_request_duration_seconds",
+    "Upstream chat completion latency",
+    ["agent", "model", "outcome"],
+    buckets=LATENCY_BUCKETS,
+)
+LLM_QUEUE_DEPTH = Gauge(
+    "echo_llm_upstream_queue_depth",
+    "Chat completion calls waiting on the upstream API",
+    ["agent"],
+    multiprocess_mode="livesum",
+)
+LLM_TOKENS = Counter(
+    "echo_llm_tokens_total",
+    "Tokens reported by the upstream API",
+    ["agent", "model", "mode", "kind"],
+)
+LLM_FINISH_REASONS = Counter(
+    "echo_llm_finish_reasons_total",
+    "Completion finish reasons",
+    ["agent", "model", "finish_reason"],
+)
+PARSE_FAILURES = Counter(
+    "echo_parse_failures_total",
+    "LLM outputs that could not be parsed",
+    ["agent"],
+)
+FALLBACKS = Counter(
+    "echo_fallbacks_total",
+    "Results produced by a fallback path instead of the primary LLM output",
+    ["agent", "source"],
+)
+BUDGET_DECISIONS = Counter(
+    "echo_analyzer_budget_decisions_total",
+    "Analyzer reasoning effort / completion cap decisions",
+    ["mode", "effort", "source"],
+)
+BUDGET_CAP = Histogram(
+    "echo_analyzer_completion_cap_tokens",
+    "max_completion_tokens sent with analyzer calls",
+    ["mode"],
+    buckets=(1000, 2000, 4000, 8000, 16000, 32000, 64000, 128000),
+)
+TRUNCATION_RETRIES = Counter(
+    "echo_analyzer_truncation_retries_total",
+    "Analyzer calls re-issued with a larger budget after finish_reason=length",
+    ["mode", "effort"],
+)
+GUIDELINE_CHARS = Histogram(
+    "echo_analyzer_guideline_chars",
+    "Size of the guideline XML embedded in analyzer prompts (ANALYZER_GUIDELINES)",
+    ["mode", "selection"],
+    buckets=(2000, 4000, 6000, 8000, 10000, 12000, 16000, 20000, 26000, 32000),
+)
+UNRESOLVED_SPANS = Counter(
+    "echo_analyzer_unresolved_spans_total",
+    "Quoted risk spans (offsets contract) that could not be placed in the prompt",
+    ["mode", "reason"],
+)
+POSTPROCESS_RUNS = Counter(
+    "echo_postprocess_runs_total",
+    "LLM response post-processing jobs by where they ran (inline, thread, process)",
+    ["agent", "where"],
+)
+SPECULATIVE_INITIATIONS = Counter(
+    "echo_speculative_initiations_total",
+    "Speculative initiator drafts by outcome (kept, rerun, failed, not_started)",
+    ["outcome"],
+)
+CLIENT_DISCONNECTS = Counter(
+    "echo_client_disconnects_total",
+    "Requests whose client went away mid-call (cancelled = upstream work aborted, shared = kept for other waiters)",
+    ["route", "outcome"],
+)
+EVENT_LOOP_LAG = Histogram(
+    "echo_event_loop_lag_seconds",
+    "How late the loop-lag probe woke up (time the event loop was blocked)",
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5),
+)
+SLOW_CALLBACKS = Counter(
+    "echo_slow_callbacks_total",
+    "Event-loop callbacks that ran longer than SLOW_CALLBACK_MS, by innermost coroutine",
+    ["callback"],
+)
+COMPRESSION_SAVED_BYTES = Counter(
+    "echo_compression_saved_bytes_total",
+    "Bytes not transferred thanks to body compression (uncompressed - compressed)",
+    ["direction", "encoding"],
+)
+COMPRESSION_CPU_SECONDS = Histogram(
+    "echo_compression_cpu_seconds",
+    "CPU time spent compressing a response or decompressing a request body",
+    ["direction", "encoding"],
+    buckets=(0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25),
+)
+REFINE_SESSIONS_ACTIVE = Gauge(
+    "echo_refine_sessions_active",
+    "Open /api/refine/ws refinement sessions",
+    multiprocess_mode="livesum",
+)
+REFINE_SESSION_CLOSES = Counter(
+    "echo_refine_session_closes_total",
+    "Refinement sessions closed, by reason (client, idle, error; rejected = refused at start by a limit)",
+    ["reason"],
+)
+DEADLINE_EVENTS = Counter(
+    "echo_deadline_events_total",
+    "Stages hit by the request deadline (exceeded = ran out of budget, skipped = optional stage not started)",
+    ["route", "stage", "outcome"],
+)
+PREFLIGHT_REJECTIONS = Counter(
+    "echo_preflight_rejections_total",
+    "Requests refused before any LLM call because the token estimate exceeded a limit (input = 413, context = 422)",
+    ["route", "limit"],
+)
+SINGLE_FLIGHT_JOINS = Counter(
+    "echo_single_flight_joins_total",
+    "Requests served by an identical call already in flight",
+    ["route"],
+)
+
+# First path segment under /api -> route label; anything else is "other"
+_KNOWN_ROUTES = {"analyze", "refine", "initiate", "prepare", "estimate", "health", "usage", "debug"}
+
+
+def route_label(path: str) -> str:
+    parts = [p for p in path.split("/") if p]
+    if len(parts) >= 2 and parts[0] == "api" and parts[1] in _KNOWN_ROUTES:
+        return parts[1]
+    if path == "/metrics":
+        return "metrics"
+    return "other"
+
+
+class StageTimer:
+    """Records consecutive stages of one operation as laps (histogram + trace span).
+
+        stages = StageTimer("analyzer")
+        ...build prompt...
+        stages.lap("prompt_build")
+        ...call LLM...
+        stages.lap("upstream_wait")
+    """
+
+    def __init__(self, agent: str):
+        self.agent = agent
+        self._last = time.perf_counter()
+
+    def lap(self, stage: str) -> float:
+        now = time.perf_counter()
+        elapsed = now - self._last
+        self._last = now
+        self.record(stage, elapsed)
+        return elapsed
+
+    def record(self, stage: str, elapsed: float) -> None:
+        """Record a stage timed elsewhere (e.g. in a pool worker) without starting a new lap."""
+        STAGE_DURATION.labels(self.agent, stage).observe(elapsed)
+        record_span(f"{self.agent}.{stage}", elapsed)
+
+
+def record_usage(agent: str, model: str, mode: str, usage: Any) -> None:
+    """Count prompt/completion/reasoning tokens from an OpenAI usage object."""
+    if not usage:
+        return
+    prompt_tokens = getattr(usage, "prompt_tokens", 0) or 0
+    completion_tokens = getattr(usage, "completion_tokens", 0) or 0
+    details = getattr(usage, "completion_tokens_details", None)
+    reasoning_tokens = (getattr(details, "reasoning_tokens", 0) or 0) if details else 0
+    LLM_TOKENS.labels(agent, model, mode, "prompt").inc(prompt_tokens)
+    LLM_TOKENS.labels(agent, model, mode, "completion").inc(completion_tokens)
+    LLM_TOKENS.labels(agent, model, mode, "reasoning").inc(reasoning_tokens)
+
+
+def record_fallback(agent: str, source: str) -> None:
+    FALLBACKS.labels(agent, source).inc()
+
+
+def record_parse_failure(agent: str) -> None:
+    PARSE_FAILURES.labels(agent).inc()
+
+
+class MetricsMiddleware:
+    """Pure ASGI middleware (does not buffer streaming responses)."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        route = route_label(scope.get("path", ""))
+        method = scope.get("method", "GET")
+        status_holder = {"status": 500}
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status_holder["status"] = message["status"]
+            await send(message)
+
+        in_flight = HTTP_REQUESTS_IN_FLIGHT.labels(route)
+        in_flight.inc()
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            in_flight.dec()
+            HTTP_REQUEST_DURATION.labels(route, method, str(status_holder["status"])).observe(
+                time.perf_counter() - started
+            )
+
+
+def _registry() -> CollectorRegistry:
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        from prometheus_client import multiprocess
+
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return registry
+    return DEFAULT_REGISTRY
+
+
+async def metrics_endpoint() -> Response:
+    return Response(generate_latest(_registry()), media_type=CONTENT_TYPE_LATEST)
@@ -0,0 +1,266 @@
+"""
+Lightweight per-request tracing.
+
+Every HTTP request gets a trace id (taken from an incoming W3C ``traceparent``
+header when present). It is returned as ``X-Trace-Id`` and attached to log
+records as ``%(trace_id)s``. Sampled requests also record nested spans:
+the route, prompt building, each upstream completion, parsing and
+post-processing. ``StageTimer`` laps are recorded as spans automatically.
+
+Configuration:
+- TRACE_EXPORT_PATH: append finished traces to this JSON-lines file,
+  one span per line.
+- TRACE_SAMPLE_RATE: fraction of requests that record spans (default 0.1).
+  An upstream ``traceparent`` with the sampled flag is always recorded.
+- TRACE_OTEL=1: also emit spans through the OpenTelemetry API, when it is
+  installed and a tracer provider is configured.
+
+With no exporter configured, spans are never built and the cost per request
+is one id and a few context-variable lookups.
+"""
+
+import contextvars
+import json
+import logging
+import os
+import queue
+import random
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional
+
+TRACE_EXPORT_PATH = os.getenv("TRACE_EXPORT_PATH", "")
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", "0.1"))
+TRACE_OTEL = os.getenv("TRACE_OTEL", "").lower() in ("1", "true", "yes")
+
+TRACE_HEADER = "X-Trace-Id"
+
+try:
+    if TRACE_OTEL:
+        from opentelemetry import trace as _otel_trace
+        _otel_tracer = _otel_trace.get_tracer("echo")
+    else:
+        _otel_tracer = None
+except ImportError:  # pragma: no cover - optional dependency
+    _otel_tracer = None
+
+_EXPORT_ENABLED = bool(TRACE_EXPORT_PATH) or _otel_tracer is not None
+
+
+class Span:
+    __slots__ = ("trace", "span_id", "parent_id", "name", "start_ns", "end_ns", "attributes", "status", "_otel")
+
+    def __init__(self, trace: "Trace", name: str, parent_id: Optional[str], attributes: Dict[str, Any]):
+        self.trace = trace
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent_id
+        self.name = name
+        self.start_ns = time.time_ns()
+        self.end_ns: Optional[int] = None
+        self.attributes = attributes
+        self.status = "ok"
+        self._otel = None
+
+    def set(self, **attributes: Any) -> None:
+        self.attributes.update(attributes)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "trace_id": self.trace.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "start_ns": self.start_ns,
+            "duration_ms": round(((self.end_ns or self.start_ns) - self.start_ns) / 1e6, 3),
+            "status": self.status,
+            "attributes": self.attributes,
+        }
+
+
+class Trace:
+    __slots__ = ("trace_id", "sampled", "spans")
+
+    def __init__(self, trace_id: str, sampled: bool):
+        self.trace_id = trace_id
+        self.sampled = sampled
+        self.spans: List[Span] = []
+
+
+_current_trace: contextvars.ContextVar[Optional[Trace]] = contextvars.ContextVar("echo_trace", default=None)
+_current_span: contextvars.ContextVar[Optional[Span]] = contextvars.ContextVar("echo_span", default=None)
+
+
+def current_trace_id() -> str:
+    trace = _current_trace.get()
+    return trace.trace_id if trace else ""
+
+
+def current_span() -> Optional[Span]:
+    return _current_span.get()
+
+
+def _parse_traceparent(value: str) -> Optional[tuple]:
+    # version-traceid-parentid-flags
+    parts = value.strip().split("-")
+    if len(parts) != 4 or len(parts[1]) != 32 or parts[1] == "0" * 32:
+        return None
+    try:
+        sampled = bool(int(parts[3], 16) & 1)
+    except ValueError:
+        return None
+    return parts[1].lower(), sampled
+
+
+def start_trace(traceparent: Optional[str] = None) -> Trace:
+    """Begin a trace for the current context and decide whether to sample it."""
+    upstream = _parse_traceparent(traceparent) if traceparent else None
+    if upstream:
+        trace_id, sampled = upstream
+    else:
+        trace_id, sampled = os.urandom(16).hex(), False
+    sampled = _EXPORT_ENABLED and (sampled or random.random() < TRACE_SAMPLE_RATE)
+    trace = Trace(trace_id, sampled)
+    _current_trace.set(trace)
+    _current_span.set(None)
+    return trace
+
+
+@contextmanager
+def span(name: str, **attributes: Any) -> Iterator[Optional[Span]]:
+    """Nested span under the current one; yields None when the trace is not sampled."""
+    trace = _current_trace.get()
+    if trace is None or not trace.sampled:
+        yield None
+        return
+
+    parent = _current_span.get()
+    current = Span(trace, name, parent.span_id if parent else None, dict(attributes))
+    token = _current_span.set(current)
+    otel_cm = _otel_tracer.start_as_current_span(name, attributes=_otel_attributes(attributes)) if _otel_tracer else None
+    if otel_cm is not None:
+        current._otel = otel_cm.__enter__()
+    try:
+        yield current
+    except BaseException as exc:
+        current.status = "error"
+        current.attributes.setdefault("error", f"{type(exc).__name__}: {exc}")
+        raise
+    finally:
+        current.end_ns = time.time_ns()
+        if otel_cm is not None:
+            if current.attributes:
+                current._otel.set_attributes(_otel_attributes(current.attributes))
+            otel_cm.__exit__(None, None, None)
+        _current_span.reset(token)
+        trace.spans.append(current)
+
+
+def record_span(name: str, duration_s: float, **attributes: Any) -> None:
+    """Record an already-finished span that ended now (used by StageTimer laps)."""
+    trace = _current_trace.get()
+    if trace is None or not trace.sampled:
+        return
+    parent = _current_span.get()
+    done = Span(trace, name, parent.span_id if parent else None, attributes)
+    done.end_ns = time.time_ns()
+    done.start_ns = done.end_ns - int(duration_s * 1e9)
+    trace.spans.append(done)
+
+
+def _otel_attributes(attributes: Dict[str, Any]) -> Dict[str, Any]:
+    return {k: v if isinstance(v, (str, bool, int, float)) else str(v) for k, v in attributes.items()}
+
+
+# -- export -----------------------------------------------------------------
+
+_export_queue: "queue.SimpleQueue[List[Dict[str, Any]]]" = queue.SimpleQueue()
+_writer_lock = threading.Lock()
+_writer: Optional[threading.Thread] = None
+
+
+def _writer_loop() -> None:
+    while True:
+        batch = _export_queue.get()
+        try:
+            with open(TRACE_EXPORT_PATH, "a", encoding="utf-8") as f:
+                for record in batch:
+                    f.write(json.dumps(record, ensure_ascii=False, default=str) + "\n")
+        except OSError as exc:
+            logging.getLogger(__name__).warning("Trace export failed: %s", exc)
+
+
+def finish_trace(trace: Trace) -> None:
+    """Hand a finished trace to the background JSONL writer (no file I/O on the event loop)."""
+    global _writer
+    if not trace.sampled or not TRACE_EXPORT_PATH or not trace.spans:
+        return
+    if _writer is None:
+        with _writer_lock:
+            if _writer is None:
+                _writer = threading.Thread(target=_writer_loop, name="trace-export", daemon=True)
+                _writer.start()
+    _export_queue.put([s.to_dict() for s in sorted(trace.spans, key=lambda s: s.start_ns)])
+
+
+# -- integration --------------------------------------------------------------
+
+class TracingMiddleware:
+    """Pure ASGI middleware: root span per request plus the X-Trace-Id header."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        headers = dict(scope.get("headers") or [])
+        traceparent = headers.get(b"traceparent")
+        trace = start_trace(traceparent.decode("latin-1") if traceparent else None)
+        path = scope.get("path", "")
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                message.setdefault("headers", [])
+                message["headers"] = list(message["headers"]) + [(TRACE_HEADER.lower().encode(), trace.trace_id.encode())]
+                root = current_span()
+                if root is not None:
+                    root.set(status_code=message["status"])
+            await send(message)
+
+        try:
+            with span(f"{scope.get('method', 'GET')} {path}"):
+                await self.app(scope, receive, send_wrapper)
+        finally:
+            finish_trace(trace)
+
+
+LOG_FORMAT = "%(asctime)s %(levelname)s %(name)s [trace=%(trace_id)s] %(message)s"
+_logging_installed = False
+
+
+def install_logging(level: str = "INFO") -> None:
+    """Give every log record a ``trace_id`` attribute and log to stderr with it.
+
+    The attribute is set by the record factory, so any handler (including a
+    custom uvicorn log config) can use ``%(trace_id)s``.
+    """
+    global _logging_installed
+    if _logging_installed:
+        return
+    _logging_installed = True
+    base_factory = logging.getLogRecordFactory()
+
+    def factory(*args, **kwargs):
+        record = base_factory(*args, **kwargs)
+        record.trace_id = current_trace_id() or "-"
+        return record
+
+    logging.setLogRecordFactory(factory)
+    handler = logging.StreamHandler()
+    handler.setFormatter(logging.Formatter(LOG_FORMAT))
+    root = logging.getLogger()
+    root.addHandler(handler)
+    root.setLevel(level.upper())
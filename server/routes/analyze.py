@@ -1,77 +1,231 @@
-from fastapi import APIRouter, HTTPException
-from pydantic import BaseModel
-from typing import Optional, List
-from ..services.llm import OpenAILLM
-from ..models.response import RiskAssessment, RiskToken
-
-router = APIRouter()
-
-class AnalyzeRequest(BaseModel):
-    prompt: str
-    analysis_mode: Optional[str] = "both"  # Options: "faithfulness", "factuality", "both"
-
-class AnalyzeResponse(BaseModel):
-    annotated_prompt: str
-    analysis_summary: str
-    risk_assessment: Optional[RiskAssessment] = None
-    risk_tokens: Optional[List[RiskToken]] = None
-
-# Initialize LLM service
-llm_service = OpenAILLM()
-
-@router.post("/", response_model=AnalyzeResponse)
-async def analyze_prompt(request: AnalyzeRequest):
-    """Analyze a prompt for hallucination risks with detailed risk assessment."""
-    try:
-        print(f"Analyzing prompt: {request.prompt[:50]}...")
-        
-        # Check if prompt is provided
-        if not request.prompt or not request.prompt.strip():
-            raise HTTPException(status_code=400, detail="Prompt is required")
-        
-        # Validate analysis_mode
-        valid_modes = ["faithfulness", "factuality", "both"]
-        analysis_mode = request.analysis_mode or "both"
-        if analysis_mode not in valid_modes:
-            raise HTTPException(status_code=400, detail=f"Invalid analysis_mode. Must be one of: {', '.join(valid_modes)}")
-        
-        # Use LLM service for analysis
-        result = await llm_service.analyze_prompt(request.prompt, analysis_mode)
-        
-        # Convert risk assessment to Pydantic model if present
-        risk_assessment = None
-        if "risk_assessment" in result:
-            risk_data = result["risk_assessment"]
-            risk_assessment = RiskAssessment(**risk_data)
-        
-        # Convert risk tokens to Pydantic models if present
-        risk_tokens = None
-        if "risk_tokens" in result and result["risk_tokens"]:
-            # Normalize tokens to ensure classification is a string
-            normalized_tokens = []
-            for token in result["risk_tokens"]:
-                # Convert classification to string if it's a list
-                if isinstance(token.get("classification"), list):
-                    token["classification"] = ", ".join(str(x) for x in token["classification"])
-                normalized_tokens.append(token)
-            risk_tokens = [RiskToken(**token) for token in normalized_tokens]
-        
-        return AnalyzeResponse(
-            annotated_prompt=result["annotated_prompt"],
-            analysis_summary=result["analysis_summary"],
-            risk_assessment=risk_assessment,
-            risk_tokens=risk_tokens
-        )
-        
-    except Exception as e:
-        print(f"Analysis error: {str(e)}")
-        
-        error_msg = f"Analysis failed: {str(e)}"
-        if "api key" in str(e).lower():
-            error_msg = "OpenAI API key is invalid or missing"
-        elif "rate limit" in str(e).lower():
-            error_msg = "OpenAI API rate limit exceeded"
-        elif "network" in str(e).lower():
-            error_msg = "Network connection error"
-            
-        raise HTTPException(status_code=500, detail=error_msg)
\ No newline at end of file
+import asyncio
+import contextlib
+import hashlib
+import logging
+import time
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
+from pydantic import BaseModel
+from sse_starlette.sse import EventSourceResponse
+from typing import Any, AsyncIterator, Dict, Optional, List
+from ..config import SPECULATIVE_INITIATION
+from ..services.cancellation import ClientDisconnected, cancel_tasks, llm_slot, record_cancelled, run_until_disconnect
+from ..services.estimator import PreflightRejected, check as preflight_check, estimate_analyze
+from ..services.deadline import Deadline, DeadlineExceeded, current_deadline, request_deadline, skipped_headers
+from ..services.json_response import FastJSONResponse, dumps_str
+from ..services.providers import get_llm_service
+from ..services.speculation import record_speculation, speculation_holds
+from ..services.usage_ledger import current_client_key
+from ..observability.metrics import StageTimer
+from ..models.response import RiskAssessment, RiskToken, UnresolvedSpan
+
+router = APIRouter()
+
+class AnalyzeRequest(BaseModel):
+    prompt: str
+    analysis_mode: Optional[str] = "both"  # Options: "faithfulness", "factuality", "both"
+
+class AnalyzeResponse(BaseModel):
+    annotated_prompt: str
+    analysis_summary: str
+    risk_assessment: Optional[RiskAssessment] = None
+    risk_tokens: Optional[List[RiskToken]] = None
+    # Offsets output contract only: risk tokens whose quoted text could not be placed
+    unresolved_spans: Optional[List[UnresolvedSpan]] = None
+
+VALID_MODES = ["faithfulness", "factuality", "both"]
+PIPELINE_STAGES = ["initiate"]
+
+
+def _to_response(result: Dict[str, Any]) -> AnalyzeResponse:
+    """Validate the analyzer's raw dict into the API response model, once.
+
+    The route returns the model through ``FastJSONResponse``, so FastAPI does
+    not validate it a second time for ``response_model``. List classifications
+    are joined by ``RiskToken``.
+    """
+    return AnalyzeResponse.model_validate({
+        "annotated_prompt": result["annotated_prompt"],
+        "analysis_summary": result["analysis_summary"],
+        "risk_assessment": result.get("risk_assessment"),
+        "risk_tokens": result.get("risk_tokens") or None,
+        "unresolved_spans": result.get("unresolved_spans"),
+    })
+
+
+def _error_message(e: Exception) -> str:
+    error_msg = f"Analysis failed: {str(e)}"
+    if "api key" in str(e).lower():
+        error_msg = "OpenAI API key is invalid or missing"
+    elif "rate limit" in str(e).lower():
+        error_msg = "OpenAI API rate limit exceeded"
+    elif "network" in str(e).lower():
+        error_msg = "Network connection error"
+    return error_msg
+
+
+def _stage_error(stage: str, detail: str, e: Exception) -> Dict[str, Any]:
+    payload = {"stage": stage, "detail": detail}
+    if isinstance(e, DeadlineExceeded):
+        payload["deadline_stage"] = e.stage
+    return payload
+
+
+def _sse(event: str, payload: Any) -> Dict[str, str]:
+    data = payload if isinstance(payload, str) else dumps_str(payload)
+    return {"event": event, "data": data}
+
+
+async def _analyze_then_initiate(prompt: str, analysis_mode: str, speculate: bool = False) -> AsyncIterator[Dict[str, str]]:
+    """Analysis and initiation over one SSE stream.
+
+    Events: ``analysis`` (AnalyzeResponse), ``initiation`` (InitiateResponse),
+    ``error`` ({stage, detail}) and a final ``done`` with stage timings.
+    The initiator starts as soon as the analysis is parsed, before the
+    analysis event is serialized and sent. With ``speculate`` it starts even
+    earlier, from the risk tokens of the still-streaming analysis, and the
+    draft is kept unless the final analysis adds a critical/high risk token.
+    The stream holds one LLM_ROUTE_CONCURRENCY slot until it ends.
+    """
+    # aclosing: an early close of this stream runs the inner generator's cleanup right away
+    async with llm_slot(), contextlib.aclosing(_pipeline_events(prompt, analysis_mode, speculate)) as events:
+        async for event in events:
+            yield event
+
+
+async def _pipeline_events(prompt: str, analysis_mode: str, speculate: bool) -> AsyncIterator[Dict[str, str]]:
+    started = time.perf_counter()
+    stages = StageTimer("pipeline")
+    timings: Dict[str, float] = {}
+    # The client sends the prompt wrapped in analysis instructions; the initiator wants the user's own text
+    user_prompt = prompt.split("USER PROMPT TO ANALYZE:")[-1].strip()
+    draft: Dict[str, Any] = {}
+
+    def start_draft(risk_tokens: List[Dict[str, Any]]) -> None:
+        if "task" in draft:
+            return
+        timings["draft_started_ms"] = round((time.perf_counter() - started) * 1000, 1)
+        draft["risk_tokens"] = risk_tokens
+        draft["task"] = asyncio.create_task(
+            get_llm_service().initiate(user_prompt, {"risk_tokens": risk_tokens}, analysis_mode)
+        )
+
+    initiation: Optional[asyncio.Task] = None
+    cancelled = False
+    try:
+        try:
+            result = await get_llm_service().analyze_prompt(
+                prompt, analysis_mode, on_risk_tokens=start_draft if speculate else None
+            )
+            response = _to_response(result)
+        except Exception as e:
+            print(f"Analysis error: {str(e)}")
+            yield _sse("error", _stage_error("analysis", _error_message(e), e))
+            return
+        timings["analysis_ms"] = round(stages.lap("analysis") * 1000, 1)
+
+        analysis_output = response.model_dump(exclude_none=True)
+        speculation = None
+        if speculate:
+            if "task" not in draft:
+                speculation = "not_started"
+            elif speculation_holds(draft["risk_tokens"], analysis_output.get("risk_tokens") or []):
+                speculation = "kept"
+                initiation = draft["task"]
+            else:
+                speculation = "rerun"
+                draft.pop("task").cancel()
+        if initiation is None:
+            initiation = asyncio.create_task(get_llm_service().initiate(user_prompt, analysis_output, analysis_mode))
+
+        yield _sse("analysis", response.model_dump_json())
+        try:
+            try:
+                message = await initiation
+            except Exception:
+                if speculation != "kept":
+                    raise
+                # A failed draft costs a normal initiation, nothing more
+                speculation = "failed"
+                initiation = asyncio.create_task(get_llm_service().initiate(user_prompt, analysis_output, analysis_mode))
+                message = await initiation
+        except Exception as e:
+            logging.getLogger("uvicorn.error").exception("[analyze] Pipelined initiation failed: %s", e)
+            yield _sse("error", _stage_error("initiation", f"Initiation failed: {e}", e))
+        else:
+            timings["initiation_ms"] = round(stages.lap("initiation") * 1000, 1)
+            timings["first_question_ms"] = round((time.perf_counter() - started) * 1000, 1)
+            yield _sse("initiation", {"message": message, "success": True})
+        if speculation is not None:
+            record_speculation(speculation)
+        deadline = current_deadline()
+        yield _sse("done", {
+            "timings": timings,
+            "speculation": speculation,
+            "deadline_skipped": deadline.skipped if deadline is not None else [],
+        })
+    except asyncio.CancelledError:
+        # Client went away while the analysis or initiation was awaited here
+        cancelled = True
+        raise
+    finally:
+        # Client went away mid-stream: don't keep paying for the initiator
+        if cancel_tasks(initiation, draft.get("task")) or cancelled:
+            record_cancelled("analyze")
+
+
+@router.post("/", response_model=AnalyzeResponse)
+async def analyze_prompt(
+    request: AnalyzeRequest,
+    http_request: Request,
+    then: Optional[str] = Query(None, description="Pipeline a follow-up stage: 'initiate'"),
+    speculate: Optional[bool] = Query(None, description="With then=initiate: start the initiator from partial analysis"),
+    deadline: Optional[Deadline] = Depends(request_deadline("analyze")),
+):
+    """Analyze a prompt for hallucination risks with detailed risk assessment.
+
+    With ``?then=initiate`` the initiator runs right after the analysis and
+    both results are streamed back as server-sent events.
+    The ``X-Request-Timeout`` header (seconds) bounds the whole request,
+    including the pipelined stage; see services/deadline.py.
+    """
+    if then is not None and then not in PIPELINE_STAGES:
+        raise HTTPException(status_code=400, detail=f"Invalid then. Must be one of: {', '.join(PIPELINE_STAGES)}")
+    try:
+        print(f"Analyzing prompt: {request.prompt[:50]}...")
+        
+        # Check if prompt is provided
+        if not request.prompt or not request.prompt.strip():
+            raise HTTPException(status_code=400, detail="Prompt is required")
+        
+        # Validate analysis_mode
+        analysis_mode = request.analysis_mode or "both"
+        if analysis_mode not in VALID_MODES:
+            raise HTTPException(status_code=400, detail=f"Invalid analysis_mode. Must be one of: {', '.join(VALID_MODES)}")
+
+        # 413/422 before any upstream call when the analysis cannot fit (services/estimator.py)
+        preflight_check(estimate_analyze(request.prompt, analysis_mode))
+        
+        if then == "initiate":
+            if speculate is None:
+                speculate = SPECULATIVE_INITIATION
+            return EventSourceResponse(_analyze_then_initiate(request.prompt, analysis_mode, speculate), ping=15)
+        
+        # Use LLM service for analysis; identical concurrent analyses share one upstream call.
+        # Only within one client and deadline budget: a joined flight runs under the starting
+        # request's deadline, and its usage and token budget are the starting client's
+        budget = f"{deadline.budget:g}" if deadline is not None else "none"
+        flight = f"{current_client_key()}\0{budget}\0{analysis_mode}\0{request.prompt}"
+        key = hashlib.sha256(flight.encode("utf-8")).hexdigest()
+        result = await run_until_disconnect(
+            http_request,
+            lambda: get_llm_service().analyze_prompt(request.prompt, analysis_mode),
+            route="analyze",
+            key=key,
+        )
+        return FastJSONResponse(_to_response(result), headers=skipped_headers(deadline))
+        
+    except (ClientDisconnected, DeadlineExceeded, PreflightRejected):
+        raise
+    except Exception as e:
+        print(f"Analysis error: {str(e)}")
+        raise HTTPException(status_code=500, detail=_error_message(e))
@@ -0,0 +1,63 @@
+import asyncio
+import hmac
+import threading
+from fastapi import APIRouter, Depends, Header, HTTPException, Query
+from fastapi.responses import JSONResponse, PlainTextResponse
+from typing import Optional
+
+from ..config import ADMIN_TOKEN
+from ..observability.diagnostics import PROFILE_FORMATS, SamplingProfiler, loop_status
+
+router = APIRouter()
+
+# One profile per worker at a time; overlapping samplers would skew each other
+_profile_lock = asyncio.Lock()
+
+
+def require_admin(x_admin_token: Optional[str] = Header(None)) -> None:
+    """Admin endpoints are hidden (404) unless ADMIN_TOKEN is set, and need it in X-Admin-Token."""
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=404, detail="Not Found")
+    if not x_admin_token or not hmac.compare_digest(x_admin_token, ADMIN_TOKEN):
+        raise HTTPException(status_code=403, detail="Invalid admin token")
+
+
+@router.get("/loop", dependencies=[Depends(require_admin)])
+async def event_loop_status():
+    """Recent event-loop lag percentiles and slow callbacks of the worker serving this request."""
+    return loop_status()
+
+
+@router.get("/profile", dependencies=[Depends(require_admin)])
+async def profile(
+    seconds: float = Query(5.0, gt=0, le=60, description="How long to sample"),
+    interval_ms: float = Query(5.0, ge=1, le=100, description="Sampling interval"),
+    format: str = Query("collapsed", description=f"One of: {', '.join(PROFILE_FORMATS)}"),
+    all_threads: bool = Query(False, description="Sample pool threads too, not only the event loop"),
+):
+    """Sample the stacks of this worker for ``seconds`` while it keeps serving traffic.
+
+    ``collapsed`` is one ``frame;frame;... count`` line per stack (flamegraph.pl,
+    speedscope import); ``speedscope`` is a file for https://www.speedscope.app.
+    Only the worker that receives the request is profiled.
+    """
+    if format not in PROFILE_FORMATS:
+        raise HTTPException(status_code=400, detail=f"Invalid format. Must be one of: {', '.join(PROFILE_FORMATS)}")
+    if _profile_lock.locked():
+        raise HTTPException(status_code=409, detail="A profile is already running on this worker")
+
+    async with _profile_lock:
+        # This handler runs on the event-loop thread
+        targets = None if all_threads else {threading.get_ident()}
+        profiler = SamplingProfiler(targets, interval=interval_ms / 1000)
+        profiler.start()
+        try:
+            await asyncio.sleep(seconds)
+        finally:
+            await asyncio.to_thread(profiler.stop)
+
+    headers = {"X-Profile-Samples": str(profiler.samples), "X-Profile-Seconds": f"{profiler.duration:.3f}"}
+    if format == "speedscope":
+        headers["Content-Disposition"] = 'attachment; filename="echo-profile.speedscope.json"'
+        return JSONResponse(profiler.speedscope(name=f"echo worker ({seconds:g}s)"), headers=headers)
+    return PlainTextResponse(profiler.collapsed(), headers=headers)
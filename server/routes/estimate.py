@@ -0,0 +1,58 @@
+from fastapi import APIRouter, HTTPException
+from typing import Any, Dict, Optional
+
+from ..services.estimator import Estimate, estimate_analyze, estimate_initiate, estimate_prepare, estimate_refine, violation
+from .analyze import AnalyzeRequest, VALID_MODES
+from .initiate import InitiateRequest
+from .prepare import PrepareRequest
+from .refine import RefineRequest
+
+router = APIRouter()
+
+
+def _mode(analysis_mode: Optional[str]) -> str:
+    mode = analysis_mode or "both"
+    if mode not in VALID_MODES:
+        raise HTTPException(status_code=400, detail=f"Invalid analysis_mode. Must be one of: {', '.join(VALID_MODES)}")
+    return mode
+
+
+def _report(estimate: Estimate) -> Dict[str, Any]:
+    rejected = violation(estimate)
+    result = estimate.to_dict()
+    result["within_limits"] = rejected is None
+    if rejected is not None:
+        result["status"], result["limit"], result["detail"] = rejected
+    return result
+
+
+# Each endpoint takes the same body as the route it estimates; none of them calls the LLM
+
+@router.post("/analyze")
+async def estimate_analyze_request(request: AnalyzeRequest):
+    """Token estimate for POST /api/analyze (every upstream call, e.g. split groups)."""
+    return _report(estimate_analyze(request.prompt, _mode(request.analysis_mode)))
+
+
+@router.post("/initiate")
+async def estimate_initiate_request(request: InitiateRequest):
+    """Token estimate for POST /api/initiate."""
+    return _report(estimate_initiate(request.prompt, request.analysis_output, _mode(request.analysis_mode)))
+
+
+@router.post("/refine")
+async def estimate_refine_request(request: RefineRequest):
+    """Token estimate for POST /api/refine."""
+    return _report(estimate_refine(
+        request.prompt, request.conversation_history, request.user_message,
+        request.analysis_output, _mode(request.analysis_mode),
+    ))
+
+
+@router.post("/prepare")
+async def estimate_prepare_request(request: PrepareRequest, parallel: Optional[bool] = None):
+    """Token estimate for POST /api/prepare (``parallel`` defaults to PREPARATOR_MODE; /stream is parallel)."""
+    return _report(estimate_prepare(
+        request.current_prompt, request.prior_analysis, request.conversation_history,
+        request.user_final_edits or "", _mode(request.analysis_mode), parallel,
+    ))
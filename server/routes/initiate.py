@@ -1,11 +1,13 @@
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Request
 import logging
 from pydantic import BaseModel
 from typing import Optional, Dict, Any
-from ..services.llm import OpenAILLM
+from ..services.cancellation import ClientDisconnected, run_until_disconnect
+from ..services.deadline import DeadlineExceeded, request_deadline
+from ..services.estimator import PreflightRejected, check as preflight_check, estimate_initiate
+from ..services.providers import get_llm_service
 
 router = APIRouter()
-llm_service = OpenAILLM()
 
 
 class InitiateRequest(BaseModel):
@@ -19,8 +21,8 @@ class InitiateResponse(BaseModel):
     success: bool
 
 
-@router.post("/", response_model=InitiateResponse)
-async def initiate_prompt(request: InitiateRequest):
+@router.post("/", response_model=InitiateResponse, dependencies=[Depends(request_deadline("initiate"))])
+async def initiate_prompt(request: InitiateRequest, http_request: Request):
     """Initiate refinement: single clarifying question + mitigation plan as formatted markdown."""
     try:
         if not request.prompt or not request.prompt.strip():
@@ -38,17 +40,25 @@ async def initiate_prompt(request: InitiateRequest):
             request.analysis_mode,
         )
 
+        preflight_check(estimate_initiate(request.prompt, request.analysis_output, request.analysis_mode))
+
         # Get markdown message from initiator
-        message = await llm_service.initiate(
-            prompt=request.prompt,
-            analysis_output=request.analysis_output,
-            analysis_mode=request.analysis_mode
+        message = await run_until_disconnect(
+            http_request,
+            lambda: get_llm_service().initiate(
+                prompt=request.prompt,
+                analysis_output=request.analysis_output,
+                analysis_mode=request.analysis_mode
+            ),
+            route="initiate",
         )
 
         return InitiateResponse(
             message=message,
             success=True
         )
+    except (ClientDisconnected, DeadlineExceeded, PreflightRejected):
+        raise
     except Exception as e:
         logging.getLogger("uvicorn.error").exception("[initiate] Initiation failed: %s", e)
         raise HTTPException(status_code=500, detail=f"Initiation failed: {e}")
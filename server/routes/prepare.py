@@ -2,17 +2,25 @@
 Prepare Route - Refine prompts for re-analysis
 """
 
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Request, Response
 from pydantic import BaseModel
-from typing import List, Dict, Any, Optional
+from sse_starlette.sse import EventSourceResponse
+from typing import AsyncIterator, List, Dict, Any, Optional
+import asyncio
+import contextlib
+import json
 import logging
+import time
 
-from ..services.preparator import AnalysisPreparator
+from ..services.cancellation import ClientDisconnected, cancel_tasks, llm_slot, record_cancelled, run_until_disconnect
+from ..services.estimator import PreflightRejected, check as preflight_check, estimate_prepare
+from ..services.deadline import Deadline, DeadlineExceeded, current_deadline, request_deadline, skipped_headers
+from ..services.providers import get_preparator
+from ..observability.metrics import record_fallback
 
 logger = logging.getLogger(__name__)
 
 router = APIRouter()
-preparator = AnalysisPreparator()
 
 
 class PrepareRequest(BaseModel):
@@ -38,7 +46,12 @@ class PrepareResponse(BaseModel):
 
 
 @router.post("/prepare", response_model=PrepareResponse)
-async def prepare_prompt(request: PrepareRequest):
+async def prepare_prompt(
+    request: PrepareRequest,
+    http_request: Request,
+    response: Response,
+    deadline: Optional[Deadline] = Depends(request_deadline("prepare")),
+):
     """
     Refine a prompt based on prior analysis and conversation history.
     
@@ -46,6 +59,9 @@ async def prepare_prompt(request: PrepareRequest):
     1. Incorporate insights from previous analysis
     2. Apply mitigation strategies from conversation
     3. Integrate user's final manual edits
+
+    Fallback stages skipped to stay within the request deadline are listed
+    in the ``X-Deadline-Skipped`` response header.
     """
     try:
         logger.info(f"Preparing refined prompt (current length: {len(request.current_prompt)}, mode: {request.analysis_mode})")
@@ -55,13 +71,22 @@ async def prepare_prompt(request: PrepareRequest):
         analysis_mode = request.analysis_mode or "both"
         if analysis_mode not in valid_modes:
             raise HTTPException(status_code=400, detail=f"Invalid analysis_mode. Must be one of: {', '.join(valid_modes)}")
+
+        preflight_check(estimate_prepare(
+            request.current_prompt, request.prior_analysis, request.conversation_history,
+            request.user_final_edits or "", analysis_mode,
+        ))
         
-        refine_data = await preparator.refine_prompt(
-            current_prompt=request.current_prompt,
-            prior_analysis=request.prior_analysis,
-            conversation_history=request.conversation_history,
-            user_final_edits=request.user_final_edits or "",
-            analysis_mode=analysis_mode
+        refine_data = await run_until_disconnect(
+            http_request,
+            lambda: get_preparator().refine_prompt(
+                current_prompt=request.current_prompt,
+                prior_analysis=request.prior_analysis,
+                conversation_history=request.conversation_history,
+                user_final_edits=request.user_final_edits or "",
+                analysis_mode=analysis_mode
+            ),
+            route="prepare",
         )
         refined_prompt = refine_data.get("refined_prompt", "")
         variations_raw = refine_data.get("variations", [])
@@ -69,6 +94,7 @@ async def prepare_prompt(request: PrepareRequest):
         # Route-level safety net: if no variations returned, synthesize deterministic ones
         if not variations_raw:
             logger.warning("[PrepareRoute] No variations from preparator; synthesizing route-level fallbacks.")
+            record_fallback("preparator", "route_synthesis")
             # Minimal deterministic synthesis (mirrors preparator local synthesis pattern)
             base = refined_prompt or request.current_prompt
             edits = (request.user_final_edits or "").strip()
@@ -94,6 +120,7 @@ async def prepare_prompt(request: PrepareRequest):
                 continue
 
         logger.info(f"Successfully refined prompt (len={len(refined_prompt)}), generated {len(variations)} variations (raw={len(variations_raw)})")
+        response.headers.update(skipped_headers(deadline))
 
         return PrepareResponse(
             refined_prompt=refined_prompt,
@@ -102,6 +129,8 @@ async def prepare_prompt(request: PrepareRequest):
             message="Prompt successfully refined with variations" if variations else "Refinement succeeded but variations unavailable",
             debug_source=refine_data.get("source") if variations_raw else "route_synthesis"
         )
+    except (ClientDisconnected, DeadlineExceeded, PreflightRejected):
+        raise
     except Exception as e:
         logger.error(f"Error preparing prompt: {str(e)}")
         raise HTTPException(
@@ -111,6 +140,102 @@ async def prepare_prompt(request: PrepareRequest):
 
 
 @router.post("/", response_model=PrepareResponse)
-async def prepare_prompt_root(request: PrepareRequest):
+async def prepare_prompt_root(
+    request: PrepareRequest,
+    http_request: Request,
+    response: Response,
+    deadline: Optional[Deadline] = Depends(request_deadline("prepare")),
+):
     """Alias endpoint to support /api/prepare/ in addition to /api/prepare/prepare."""
-    return await prepare_prompt(request)
+    return await prepare_prompt(request, http_request, response, deadline)
+
+
+
+async def _prepare_events(request: PrepareRequest, analysis_mode: str) -> AsyncIterator[Dict[str, str]]:
+    """SSE events for /stream: refined_prompt, one variation per ready variation, then done (or error).
+
+    The stream holds one LLM_ROUTE_CONCURRENCY slot until it ends.
+    """
+    # aclosing: an early close of this stream runs the inner generator's cleanup right away
+    async with llm_slot(), contextlib.aclosing(_stream_preparation(request, analysis_mode)) as events:
+        async for event in events:
+            yield event
+
+
+async def _stream_preparation(request: PrepareRequest, analysis_mode: str) -> AsyncIterator[Dict[str, str]]:
+    started = time.perf_counter()
+    timings: Dict[str, float] = {}
+    queue: asyncio.Queue = asyncio.Queue()
+
+    def elapsed_ms() -> float:
+        return round((time.perf_counter() - started) * 1000, 1)
+
+    def on_refined(refined_prompt: str) -> None:
+        timings["refined_prompt_ms"] = elapsed_ms()
+        queue.put_nowait({"event": "refined_prompt", "data": json.dumps({"refined_prompt": refined_prompt}, ensure_ascii=False)})
+
+    def on_variation(variation: Dict[str, Any]) -> None:
+        timings.setdefault("first_variation_ms", elapsed_ms())
+        queue.put_nowait({"event": "variation", "data": Variation(**variation).model_dump_json()})
+
+    task = asyncio.create_task(get_preparator().refine_prompt_parallel(
+        current_prompt=request.current_prompt,
+        prior_analysis=request.prior_analysis,
+        conversation_history=request.conversation_history,
+        user_final_edits=request.user_final_edits or "",
+        analysis_mode=analysis_mode,
+        on_refined=on_refined,
+        on_variation=on_variation,
+    ))
+    task.add_done_callback(lambda _: queue.put_nowait(None))
+    try:
+        while True:
+            event = await queue.get()
+            if event is None:
+                break
+            yield event
+        try:
+            refine_data = task.result()
+        except Exception as e:
+            logger.error(f"Error preparing prompt: {str(e)}")
+            error = {"detail": f"Failed to prepare prompt: {str(e)}"}
+            if isinstance(e, DeadlineExceeded):
+                error["deadline_stage"] = e.stage
+            yield {"event": "error", "data": json.dumps(error)}
+            return
+        timings["total_ms"] = elapsed_ms()
+        deadline = current_deadline()
+        yield {"event": "done", "data": json.dumps({
+            "success": True,
+            "debug_source": refine_data.get("source"),
+            "variation_sources": refine_data.get("variation_sources"),
+            "deadline_skipped": deadline.skipped if deadline is not None else [],
+            "timings": timings,
+        })}
+    finally:
+        # Client disconnected: stop the remaining variation calls
+        if cancel_tasks(task):
+            record_cancelled("prepare")
+
+
+@router.post("/stream", dependencies=[Depends(request_deadline("prepare"))])
+async def prepare_prompt_stream(request: PrepareRequest):
+    """
+    Streaming variant of /prepare (server-sent events).
+
+    Always uses the preparator's parallel path: ``refined_prompt`` is sent as
+    soon as it is parsed and each ``variation`` as soon as it is generated (or
+    synthesized locally after its timeout). The final ``done`` event carries
+    ``debug_source`` and stage timings. /prepare and / keep the blocking
+    PrepareResponse.
+    """
+    valid_modes = ["faithfulness", "factuality", "both"]
+    analysis_mode = request.analysis_mode or "both"
+    if analysis_mode not in valid_modes:
+        raise HTTPException(status_code=400, detail=f"Invalid analysis_mode. Must be one of: {', '.join(valid_modes)}")
+    preflight_check(estimate_prepare(
+        request.current_prompt, request.prior_analysis, request.conversation_history,
+        request.user_final_edits or "", analysis_mode, parallel=True,
+    ))
+    logger.info(f"Streaming refined prompt (current length: {len(request.current_prompt)}, mode: {analysis_mode})")
+    return EventSourceResponse(_prepare_events(request, analysis_mode), ping=15)
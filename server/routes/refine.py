@@ -1,10 +1,27 @@
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Request, WebSocket, WebSocketDisconnect
 from pydantic import BaseModel
 from typing import List, Dict, Optional, Any
+import asyncio
 import json
-from ..services.llm import OpenAILLM
+import logging
+from ..config import REFINE_WS_START_SECONDS
+from ..services.cancellation import ClientDisconnected, cancel_tasks, llm_slot, record_cancelled, run_until_disconnect
+from ..services.deadline import DeadlineExceeded, request_deadline
+from ..services.estimator import PreflightRejected, check as preflight_check, estimate_refine
+from ..services.providers import get_llm_service
+from ..services.refine_sessions import (
+    CLOSE_IDLE,
+    RefineSession,
+    SessionLimitError,
+    check_capacity,
+    close_session,
+    limits as session_limits,
+    open_session,
+)
+from ..services.usage_ledger import CLIENT_KEY_HEADER, client_key_for, get_usage_ledger, set_usage_context
 
 router = APIRouter()
+logger = logging.getLogger(__name__)
 
 class RefineRequest(BaseModel):
     prompt: str
@@ -16,11 +33,8 @@ class RefineRequest(BaseModel):
 class RefineResponse(BaseModel):
     assistant_message: str
 
-# Initialize LLM service
-llm_service = OpenAILLM()
-
-@router.post("/", response_model=RefineResponse)
-async def refine_prompt(request: RefineRequest):
+@router.post("/", response_model=RefineResponse, dependencies=[Depends(request_deadline("refine"))])
+async def refine_prompt(request: RefineRequest, http_request: Request):
     """Refine a prompt through conversation with the user."""
     try:
         print(f"DEBUG: Refining prompt: {request.prompt[:50]}...")
@@ -38,37 +52,52 @@ async def refine_prompt(request: RefineRequest):
         analysis_mode = request.analysis_mode or "both"
         if analysis_mode not in valid_modes:
             raise HTTPException(status_code=400, detail=f"Invalid analysis_mode. Must be one of: {', '.join(valid_modes)}")
+
+        preflight_check(estimate_refine(
+            request.prompt, request.conversation_history, request.user_message, request.analysis_output, analysis_mode
+        ))
         
         # Use LLM service for refinement with conversation
         if request.conversation_history:
             print("DEBUG: Using chat_stream with conversation history")
             # Use the non-streaming chat function
-            assistant_message = await llm_service.chat_stream(
-                current_prompt=request.prompt,
-                conversation_history=request.conversation_history,
-                user_message=request.user_message,
-                analysis_output=request.analysis_output,
-                analysis_mode=analysis_mode
+            assistant_message = await run_until_disconnect(
+                http_request,
+                lambda: get_llm_service().chat_stream(
+                    current_prompt=request.prompt,
+                    conversation_history=request.conversation_history,
+                    user_message=request.user_message,
+                    analysis_output=request.analysis_output,
+                    analysis_mode=analysis_mode
+                ),
+                route="refine",
             )
         else:
             print("DEBUG: Using chat_once without conversation history")
             # No conversation history, use chat_once
-            assistant_message = await llm_service.chat_once(
-                current_prompt=request.prompt,
-                user_message=request.user_message,
-                analysis_output=request.analysis_output,
-                analysis_mode=analysis_mode
+            assistant_message = await run_until_disconnect(
+                http_request,
+                lambda: get_llm_service().chat_once(
+                    current_prompt=request.prompt,
+                    user_message=request.user_message,
+                    analysis_output=request.analysis_output,
+                    analysis_mode=analysis_mode
+                ),
+                route="refine",
             )
         
         print(f"DEBUG: Response length: {len(assistant_message)}")
         return RefineResponse(assistant_message=assistant_message)
         
+    except (ClientDisconnected, DeadlineExceeded, PreflightRejected):
+        raise
     except Exception as e:
         print(f"Refinement error: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Refinement failed: {str(e)}")
 
-@router.get("/stream")
+@router.get("/stream", dependencies=[Depends(request_deadline("refine"))])
 async def refine_stream(
+    http_request: Request,
     prompt: str, 
     user_message: str, 
     history_json: str = "[]", 
@@ -100,17 +129,230 @@ async def refine_stream(
                 print(f"DEBUG: Parsed analysis output successfully")
             except json.JSONDecodeError:
                 print("DEBUG: Failed to parse analysis_json, proceeding without it")
+
+        preflight_check(estimate_refine(prompt, conversation_history, user_message, analysis_output, analysis_mode))
         
         # Use the non-streaming chat function
-        assistant_message = await llm_service.chat_stream(
-            current_prompt=prompt,
-            conversation_history=conversation_history,
-            user_message=user_message,
-            analysis_output=analysis_output,
-            analysis_mode=analysis_mode
+        assistant_message = await run_until_disconnect(
+            http_request,
+            lambda: get_llm_service().chat_stream(
+                current_prompt=prompt,
+                conversation_history=conversation_history,
+                user_message=user_message,
+                analysis_output=analysis_output,
+                analysis_mode=analysis_mode
+            ),
+            route="refine",
         )
         
         return {"assistant_message": assistant_message}
         
+    except (ClientDisconnected, DeadlineExceeded, PreflightRejected):
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Stream failed: {str(e)}")
+
+
+async def _send_error(websocket: WebSocket, detail: str) -> None:
+    await websocket.send_json({"type": "error", "detail": detail})
+
+
+async def _run_turn(websocket: WebSocket, session: RefineSession, content: str) -> None:
+    """One user message -> streamed assistant reply; errors are reported without closing the session.
+
+    The turn holds one LLM_ROUTE_CONCURRENCY slot while its upstream call runs.
+    """
+    try:
+        dropped = session.add_user_message(content)
+    except SessionLimitError as e:
+        await _send_error(websocket, str(e))
+        return
+    user_entry = session.history[-1]
+    deltas: asyncio.Queue = asyncio.Queue()
+
+    async def complete() -> str:
+        try:
+            return await get_llm_service().chat_turn(
+                session.system_prompt, list(session.history), session.analysis_mode, on_delta=deltas.put_nowait
+            )
+        finally:
+            deltas.put_nowait(None)
+
+    call: Optional[asyncio.Task] = None
+    try:
+        async with llm_slot():
+            call = asyncio.create_task(complete())
+            while (delta := await deltas.get()) is not None:
+                await websocket.send_json({"type": "delta", "content": delta})
+            assistant_message = await call
+    except Exception as e:
+        # A failed turn leaves no trace in the history, so the client can simply resend
+        if session.history and session.history[-1] is user_entry:
+            session.history.pop()
+        if isinstance(e, WebSocketDisconnect):
+            raise
+        await _send_error(websocket, f"Refinement failed: {e}")
+        return
+    except asyncio.CancelledError:
+        if session.history and session.history[-1] is user_entry:
+            session.history.pop()
+        raise
+    finally:
+        # A cancel frame or a disconnect aborts the upstream call
+        if cancel_tasks(call):
+            record_cancelled("refine")
+    dropped += session.add_assistant_message(assistant_message)
+    await websocket.send_json({
+        "type": "done",
+        "assistant_message": assistant_message,
+        "turn": session.turns,
+        "trimmed": dropped,
+        "memory_bytes": session.memory_bytes,
+    })
+
+
+async def _serve_session(websocket: WebSocket, session: RefineSession, client_key: str) -> str:
+    """Handle frames until the session ends; returns the close reason."""
+    receiver = asyncio.create_task(websocket.receive_text())
+    turn: Optional[asyncio.Task] = None
+    try:
+        while True:
+            waiting = {receiver} if turn is None else {receiver, turn}
+            timeout = None if turn is not None else max(0.0, session.idle_remaining())
+            done, _ = await asyncio.wait(waiting, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+            if not done:
+                await websocket.close(code=CLOSE_IDLE, reason="Idle timeout")
+                return "idle"
+            if turn is not None and turn in done:
+                turn.result()  # a disconnect while streaming ends the session here
+                turn = None
+                session.touch()
+            if receiver not in done:
+                continue
+            text = receiver.result()
+            receiver = asyncio.create_task(websocket.receive_text())
+            session.touch()
+            try:
+                frame = json.loads(text)
+                kind = frame.get("type")
+            except (ValueError, AttributeError):
+                await _send_error(websocket, "Frames must be JSON objects with a type")
+                continue
+
+            if kind == "ping":
+                await websocket.send_json({"type": "pong"})
+            elif kind == "cancel":
+                if turn is not None:
+                    turn.cancel()
+                    try:
+                        await turn
+                    except asyncio.CancelledError:
+                        pass
+                    turn = None
+                await websocket.send_json({"type": "cancelled"})
+            elif turn is not None:
+                await _send_error(websocket, "A turn is already in progress; wait for done or send cancel")
+            elif kind == "message":
+                content = frame.get("content")
+                if not isinstance(content, str) or not content.strip():
+                    await _send_error(websocket, "content is required")
+                elif get_usage_ledger().over_budget(client_key):
+                    await _send_error(websocket, "Token budget exceeded for this client")
+                else:
+                    turn = asyncio.create_task(_run_turn(websocket, session, content))
+            elif kind == "update":
+                prompt = frame.get("prompt")
+                if not isinstance(prompt, str) or not prompt.strip():
+                    await _send_error(websocket, "prompt is required")
+                    continue
+                # Leaving out analysis_output keeps the current analysis; an explicit null clears it
+                analysis_output = frame["analysis_output"] if "analysis_output" in frame else session.analysis_output
+                try:
+                    session.set_prompt(prompt, analysis_output)
+                except SessionLimitError as e:
+                    await _send_error(websocket, str(e))
+                    continue
+                trimmed = session.trim()
+                await websocket.send_json({"type": "updated", "trimmed": trimmed, "memory_bytes": session.memory_bytes})
+            else:
+                await _send_error(websocket, f"Unknown frame type: {kind}")
+    finally:
+        receiver.cancel()
+        if turn is not None:
+            turn.cancel()
+
+
+@router.websocket("/ws")
+async def refine_session(websocket: WebSocket):
+    """Multi-turn refinement over one WebSocket; history and system prompt stay on the server.
+
+    JSON text frames:
+      -> {"type": "start", "prompt", "analysis_output"?, "analysis_mode"?, "conversation_history"?}
+      <- {"type": "ready", "session_id", "limits"}
+      -> {"type": "message", "content"}
+      <- {"type": "delta", "content"} ... {"type": "done", "assistant_message", "turn", "trimmed", "memory_bytes"}
+      -> {"type": "update", "prompt", "analysis_output"?}     <- {"type": "updated", ...}
+      -> {"type": "cancel"}                                  <- {"type": "cancelled"}
+      -> {"type": "ping"}                                    <- {"type": "pong"}
+      <- {"type": "error", "detail"} (the session stays open)
+
+    ``conversation_history`` seeds the session, e.g. with the initiator's
+    question. Limits are described in services/refine_sessions.py.
+    """
+    client_key = client_key_for(websocket.headers.get(CLIENT_KEY_HEADER), websocket.client.host if websocket.client else None)
+    # Upstream calls of this session are attributed like POST /api/refine
+    set_usage_context("refine", client_key)
+    try:
+        # Refuse the handshake when full, rather than holding a socket the session count does not see
+        check_capacity()
+    except SessionLimitError:
+        await websocket.close(code=1013)
+        return
+    await websocket.accept()
+
+    session: Optional[RefineSession] = None
+    reason = "client"
+    try:
+        try:
+            start = json.loads(await asyncio.wait_for(websocket.receive_text(), timeout=REFINE_WS_START_SECONDS))
+        except asyncio.TimeoutError:
+            await websocket.close(code=CLOSE_IDLE, reason="No start frame")
+            return
+        except ValueError:
+            start = None
+        if not isinstance(start, dict):
+            start = {}
+        prompt = start.get("prompt")
+        analysis_mode = start.get("analysis_mode") or "both"
+        if start.get("type") != "start" or not isinstance(prompt, str) or not prompt.strip():
+            await websocket.close(code=1008, reason="First frame must be a start frame with a prompt")
+            return
+        if analysis_mode not in ["faithfulness", "factuality", "both"]:
+            await websocket.close(code=1008, reason="Invalid analysis_mode. Must be one of: faithfulness, factuality, both")
+            return
+        try:
+            session = open_session(
+                prompt,
+                start.get("analysis_output"),
+                analysis_mode,
+                start.get("conversation_history") or [],
+            )
+        except SessionLimitError as e:
+            await websocket.close(code=e.code, reason=str(e)[:120])
+            return
+        except (KeyError, TypeError):
+            await websocket.close(code=1008, reason="conversation_history entries need role and content")
+            return
+        await websocket.send_json({"type": "ready", "session_id": session.id, "limits": session_limits()})
+        reason = await _serve_session(websocket, session, client_key)
+    except WebSocketDisconnect:
+        reason = "client"
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Stream failed: {str(e)}")
\ No newline at end of file
+        reason = "error"
+        logger.exception("[refine] Refinement session error: %s", e)
+        try:
+            await websocket.close(code=1011, reason="Internal error")
+        except Exception:
+            pass
+    finally:
+        close_session(session, reason)
\ No newline at end of file
@@ -0,0 +1,23 @@
+from fastapi import APIRouter, Depends, HTTPException, Query
+from typing import Optional
+
+from ..services.usage_ledger import get_usage_ledger
+from .diagnostics import require_admin
+
+router = APIRouter()
+
+
+# Rows name every client (IP and X-Client-Key) with its spend, so this is admin-only like /api/debug
+@router.get("/", dependencies=[Depends(require_admin)])
+async def usage_totals(
+    window: int = Query(3600, description="Rolling window in seconds"),
+    client_key: Optional[str] = Query(None, description="Only this client key, or every key of this IP"),
+):
+    """Rolling token usage (and estimated cost) per route, mode, model, client and agent."""
+    if window <= 0:
+        raise HTTPException(status_code=400, detail="window must be positive")
+    ledger = get_usage_ledger()
+    result = ledger.totals(window=window, client_key=client_key)
+    if ledger.budget:
+        result["budget"] = {"tokens": ledger.budget, "window_seconds": ledger.budget_window}
+    return result
@@ -5,30 +5,91 @@ This agent focuses solely on analyzing prompts for hallucination risks,
 identifying risky tokens, and calculating PRD (Prompt Risk Density) scores.
 """
 
-import openai
 import os
 import asyncio
 import re
 import json
-import tiktoken
-from typing import Dict, Any, List
-from dotenv import load_dotenv
-from pathlib import Path
-from ..config import OPENAI_MODEL
+import time
+from typing import Callable, Dict, Any, List, Optional, Tuple
+from ..config import ANALYZER_MAX_TOKENS, OPENAI_MODEL
+from .deadline import DeadlineExceeded, run_stage, stage_allowed
+from .openai_client import create_chat_completion, get_client, stream_chat_completion
+from .postprocess_pool import run_postprocess
+from .guidelines import read_data_file
+from .guideline_selector import GUIDELINE_MODES, select_guidelines
+from .span_resolver import build_annotated_prompt, resolve_risk_spans
+from .split_analysis import SplitGroup, merge_analyses, merge_risk_tokens, split_groups
+from .stream_parser import RiskTokenStreamParser
+from .tokenizer import count_tokens
+from .scoring_config import (
+    SEVERITY_WEIGHTS,
+    CATEGORY_WEIGHTS,
+    DOMINANT_CATEGORY,
+)
+from .rule_registry import get_rule_registry
+from .budget import get_completion_budgeter
+from ..observability.metrics import (
+    BUDGET_CAP,
+    BUDGET_DECISIONS,
+    GUIDELINE_CHARS,
+    TRUNCATION_RETRIES,
+    UNRESOLVED_SPANS,
+    StageTimer,
+    record_fallback,
+    record_parse_failure,
+)
 
-load_dotenv()
+# Prompt parts that depend on ANALYZER_OUTPUT_CONTRACT. "annotated" has the model echo
+# the prompt with inline <RISK_n> tags; "offsets" has it quote each span once and the
+# server rebuilds annotated_prompt (see span_resolver.py)
+OUTPUT_CONTRACTS = {
+    "annotated": {
+        "requirement": ' Use only <RISK_1></RISK_1>, <RISK_2></RISK_2>, … tags inside "annotated_prompt".',
+        "thinking_step": "Surround the risky spans with a <RISK_n></RISK_n> XML tags and then create an entry for every span in the risk assessment section of the output. ",
+        "check": 'Every <RISK_n></RISK_n> in "annotated_prompt" must have a corresponding object in "risk_tokens", and vice versa.',
+        "annotation_rules": [
+            "Preserve the original text and whitespace. Do not rewrite content.",
+            "Wrap each risky token/span with unique, sequential tags by order of appearance: <RISK_1>…</RISK_1>, <RISK_2>…</RISK_2>, etc.",
+            "Tags must not overlap or nest. If two risky spans are adjacent, merge them and use the highest risk level among them.",
+            'Every <RISK_n></RISK_n> must have a matching entry in "risk_tokens".',
+        ],
+        "schema_prompt": '"annotated_prompt": "The ORIGINAL prompt with <RISK_1>risky token 1</RISK_1> ...",\n          ',
+        "schema_occurrence": "",
+    },
+    "offsets": {
+        "requirement": 'Do NOT repeat the prompt. Quote each risky span in "text" and say which appearance it is in "occurrence".',
+        "thinking_step": 'Create an entry in "risk_tokens" for every risky span, quoting it exactly with its "occurrence", and then an entry in the risk assessment section of the output.',
+        "check": 'Every "text" in "risk_tokens" must appear verbatim in the prompt at least "occurrence" times.',
+        "annotation_rules": [
+            "Do NOT reproduce the prompt. Copy each risky token/span into \"text\" exactly as written: same characters, case and whitespace.",
+            '"occurrence" tells which appearance of that exact text is meant: 1 for the first in the prompt, 2 for the second, etc.',
+            "Give spans unique, sequential ids by order of appearance: RISK_1, RISK_2, etc.",
+            "Spans must not overlap. If two risky spans are adjacent, merge them and use the highest risk level among them.",
+        ],
+        "schema_prompt": "",
+        "schema_occurrence": '\n              "occurrence": 1,',
+    },
+}
 
 
 class AnalyzerAgent:
     """Agent specialized in detecting hallucination risks in prompts."""
     
-    def __init__(self):
-        self.client = openai.AsyncOpenAI(
-            api_key=os.getenv("OPENAI_API_KEY")
-        )
+    def __init__(self, client=None):
+        # An injected client (e.g. the bench harness's replay client) skips the OpenAI client
+        self.client = client or get_client()
         self.model = OPENAI_MODEL
-        self.max_tokens = int(os.getenv("MAX_TOKENS", "120000"))  # Increased for analyzer's large responses
+        self.max_tokens = ANALYZER_MAX_TOKENS  # Increased for analyzer's large responses
         self.timeout = int(os.getenv("LLM_REQUEST_TIMEOUT", "180"))
+        self.budgeter = get_completion_budgeter()
+        # annotated: model echoes the prompt with <RISK_n> tags; offsets: model quotes spans only
+        self.output_contract = os.getenv("ANALYZER_OUTPUT_CONTRACT", "annotated").lower()
+        # "both" mode as concurrent per-ruleset/pillar completions (see split_analysis.py)
+        self.split_groups = split_groups(os.getenv("ANALYZER_SPLIT", "off"))
+        # full | minified | pruned guideline XML in the system prompt (see guideline_selector.py)
+        self.guideline_mode = os.getenv("ANALYZER_GUIDELINES", "full").lower()
+        if self.guideline_mode not in GUIDELINE_MODES:
+            raise ValueError(f"ANALYZER_GUIDELINES must be one of {GUIDELINE_MODES}, got {self.guideline_mode!r}")
         self.temperature = 1  # Lower temperature for analysis consistency
         
     def _load_guidelines(self, analysis_mode: str = "both") -> str:
@@ -42,24 +103,31 @@ class AnalyzerAgent:
         
         filename = mode_files.get(analysis_mode, "both.xml")
         
-        # Get the path to the data directory
-        current_dir = Path(__file__).parent.parent
-        guidelines_path = current_dir / "data" / filename
-        
-        try:
-            with open(guidelines_path, 'r', encoding='utf-8') as f:
-                return f.read()
-        except FileNotFoundError:
+        # Read once per process (see guidelines.py)
+        guidelines_xml = read_data_file(filename)
+        if guidelines_xml is None:
             print(f"Warning: Guidelines file {filename} not found, using default")
             # Fallback to both.xml if specified file doesn't exist
-            fallback_path = current_dir / "data" / "both.xml"
-            with open(fallback_path, 'r', encoding='utf-8') as f:
-                return f.read()
+            guidelines_xml = read_data_file("both.xml")
+        return guidelines_xml
     
-    def _get_hallucination_analysis_prompt(self, prompt: str, analysis_mode: str = "both") -> str:
-        """Generate the system prompt for hallucination analysis."""
-        # Load guidelines dynamically based on analysis mode
-        guidelines_xml = self._load_guidelines(analysis_mode)
+    def _get_hallucination_analysis_prompt(
+        self, prompt: str, analysis_mode: str = "both", guidelines_xml: Optional[str] = None, record: bool = True
+    ) -> str:
+        """Generate the system prompt for hallucination analysis (``record=False``: no guideline-size metric)."""
+        # Load guidelines dynamically based on analysis mode (split groups pass their own subset)
+        if guidelines_xml is None:
+            guidelines_xml = self._load_guidelines(analysis_mode)
+        guidelines_xml = select_guidelines(guidelines_xml, prompt, self.guideline_mode)
+        if record:
+            GUIDELINE_CHARS.labels(analysis_mode, self.guideline_mode).observe(len(guidelines_xml))
+        contract = OUTPUT_CONTRACTS.get(self.output_contract, OUTPUT_CONTRACTS["annotated"])
+        span_requirement = contract["requirement"]
+        span_step = contract["thinking_step"]
+        span_check = contract["check"]
+        annotation_rules = "\n".join(f"        - {rule}" for rule in contract["annotation_rules"])
+        schema_prompt = contract["schema_prompt"]
+        schema_occurrence = contract["schema_occurrence"]
         
         return f"""<system>
   <context>
@@ -91,7 +159,7 @@ class AnalyzerAgent:
             - Example: If rule B2 has severity="medium", you MUST output "risk_level": "medium", NOT "high".
         - Only output risk tokens for rules with severity="critical", "high", or "medium". 
         - Violating this requirement breaks the entire detection system. Severity levels are deterministic, not interpretive.
-        -  Use only <RISK_1></RISK_1>, <RISK_2></RISK_2>, … tags inside "annotated_prompt".
+        - {span_requirement}
         - Respond with ONLY the JSON object. No surrounding text.
         - Ensure valid JSON syntax (machine-parseable).
       </requirements>
@@ -113,14 +181,14 @@ class AnalyzerAgent:
           2- Read the user input. 
           3- Identify the intent behind the prompt and the different elements that could be used by an LLM to answer the prompt. 
           4- Use the hallucination detection guidelines to detect hallucination inducing tokens and assign the correct severity grades. For detecting risky tokens using the "pattern" xml tag for detection and the "example" xml tag for guidance and sanity checks.
-          5- Surround the risky spans with a <RISK_n></RISK_n> XML tags and then create an entry for every span in the risk assessment section of the output. 
+          5- {span_step}
           6- Read the hallucination detection guidelines again to check for rules that have not been detected (false negatives) and for rules that have been wrongly detected or misunderstood for another risk (false positives). 
           7- Generate the JSON output. 
           8- Check the JSON output for correctness as the following rules state:
             * Double quotes for all keys/strings; no trailing commas; no comments; no extra fields.
             * "risk_level" must be "critical", "high", or "medium" in "risk_tokens".
             * The "risk_level" MUST exactly match the severity attribute from the XML rule that triggered it.
-            * Every <RISK_n></RISK_n> in "annotated_prompt" must have a corresponding object in "risk_tokens", and vice versa.
+            * {span_check}
             * In risk_assessment, leave "prompt_PRD" and "meta_PRD" as empty strings "" - do NOT calculate scores.
             * Violations must reference the correct class attribute from XML (prompt vs meta) and include appropriate fields.
       </thinking>
@@ -128,10 +196,7 @@ class AnalyzerAgent:
   
   <output_contract>
       <annotation_rules>
-        - Preserve the original text and whitespace. Do not rewrite content.
-        - Wrap each risky token/span with unique, sequential tags by order of appearance: <RISK_1>…</RISK_1>, <RISK_2>…</RISK_2>, etc.
-        - Tags must not overlap or nest. If two risky spans are adjacent, merge them and use the highest risk level among them.
-        - Every <RISK_n></RISK_n> must have a matching entry in "risk_tokens".
+{annotation_rules}
         - The following is a guide for the possible severity levels of the risky spans :
             - CRITICAL: Use CRITICAL severity level for rules marked with severity="critical" in the XML.
             - HIGH RISK : token/span that triggers any rule with severity="high" in the XML.
@@ -156,12 +221,11 @@ class AnalyzerAgent:
       
       <output_schema>
         {{
-          "annotated_prompt": "The ORIGINAL prompt with <RISK_1>risky token 1</RISK_1> ...",
-          "analysis_summary": "Brief (≤3 sentences) overview of key risks found.",
+          {schema_prompt}"analysis_summary": "Brief (≤3 sentences) overview of key risks found.",
           "risk_tokens": [
             {{
               "id": "RISK_#",
-              "text": "exact text of the risky token/span",
+              "text": "exact text of the risky token/span",{schema_occurrence}
               "risk_level": "critical | high | medium (MUST match the XML rule's severity attribute EXACTLY)",
               "reasoning": "One or two concise sentences on why this token/span is risky.",
               "classification": "one of the categories listed in the hallucination detection guidelines with the corresponding rule_id: [\"R#\",\"R#\"]",
@@ -210,7 +274,8 @@ class AnalyzerAgent:
 </system>
 """
     
-    def _calculate_prd(self, text: str, violations: List[Dict[str, Any]]) -> float:
+    @staticmethod
+    def _calculate_prd(text: str, violations: List[Dict[str, Any]]) -> float:
         """
         Compute Prompt Risk Density (PRD).
         
@@ -223,22 +288,8 @@ class AnalyzerAgent:
         Returns:
             float: PRD score normalized by token length, rounded to 4 decimal places.
         """
-        # Define severity weights
-        SEVERITY_WEIGHTS = {
-            "medium": 1,
-            "high": 2,
-            "critical": 3
-        }
-        
-        # Use tiktoken for accurate OpenAI token counting
-        try:
-            encoding = tiktoken.encoding_for_model("gpt-4")
-            total_tokens = len(encoding.encode(text))
-        except Exception as e:
-            # Fallback to whitespace split if tiktoken fails
-            print(f"Warning: tiktoken failed ({e}), using whitespace tokenization")
-            total_tokens = len(text.split())
-            encoding = None
+        # tiktoken for accurate OpenAI token counting (whitespace split if unavailable)
+        total_tokens = count_tokens(text)
         
         print("="*80)
         print("PRD CALCULATION - DETAILED BREAKDOWN")
@@ -266,14 +317,7 @@ class AnalyzerAgent:
             classification = violation.get("classification", "N/A")
             
             # Calculate span length in tokens
-            if encoding:
-                try:
-                    span_tokens = len(encoding.encode(span))
-                except:
-                    # Fallback to whitespace split
-                    span_tokens = len(span.split())
-            else:
-                span_tokens = len(span.split())
+            span_tokens = count_tokens(span)
             
             # Weight multiplied by span length
             violation_risk = severity_weight * span_tokens
@@ -314,7 +358,8 @@ class AnalyzerAgent:
         
         return prd_rounded
     
-    def _calculate_meta_prd(self, text: str, violations: List[Dict[str, Any]]) -> float:
+    @staticmethod
+    def _calculate_meta_prd(text: str, violations: List[Dict[str, Any]]) -> float:
         """
         Compute Meta-level Prompt Risk Density (PRD).
         
@@ -330,21 +375,8 @@ class AnalyzerAgent:
         Returns:
             float: Meta PRD score normalized by token length, rounded to 4 decimal places.
         """
-        # Define severity weights
-        SEVERITY_WEIGHTS = {
-            "medium": 1,
-            "high": 2,
-            "critical": 3
-        }
-        
-        # Use tiktoken for accurate OpenAI token counting
-        try:
-            encoding = tiktoken.encoding_for_model("gpt-4")
-            total_tokens = len(encoding.encode(text))
-        except Exception as e:
-            # Fallback to whitespace split if tiktoken fails
-            print(f"Warning: tiktoken failed ({e}), using whitespace tokenization")
-            total_tokens = len(text.split())
+        # tiktoken for accurate OpenAI token counting (whitespace split if unavailable)
+        total_tokens = count_tokens(text)
         
         print("="*80)
         print("META PRD CALCULATION - DETAILED BREAKDOWN")
@@ -416,14 +448,9 @@ class AnalyzerAgent:
     def _calculate_deterministic_risk_scores(self, prompt: str, risk_tokens: List[Dict[str, Any]]) -> Dict[str, Any]:
         """Calculate deterministic risk scores based on the provided algorithm."""
         
-        # Category mapping (C1-C5)
-        category_rules = {
-            "Referential Ambiguity & Quantification": ["R1", "R7", "R17"],
-            "Context Sufficiency & Integrity": ["R3", "R6", "R16"], 
-            "Instruction Structure & Delimitation": ["R2", "R4", "R5", "R8", "R14", "R20", "R21"],
-            "Verifiability & Factuality": ["R9", "R10", "R15", "R19"],
-            "Reasoning & Uncertainty Handling": ["R11", "R12", "R13", "R18", "R22"]
-        }
+        # Category mapping (C1-C5) and rule extraction come from the shared registry
+        registry = get_rule_registry()
+        category_rules = registry.category_rules
         
         # Calculate prompt metrics
         N = len(prompt.split())  # whitespace token count
@@ -439,29 +466,15 @@ class AnalyzerAgent:
                 "spans": []
             }
         
-        # Categorize risk tokens
+        # Categorize risk tokens (single pass also counts critical-rule hits)
+        crit_hits = 0
         for token in risk_tokens:
-            classification = token.get("classification", "")
-            # Extract rule IDs from classification string (handles both "R1" and "1" formats)
-            rule_ids = []
-            if "rule_ids:" in classification:
-                rule_part = classification.split("rule_ids:")[-1].strip()
-                # Extract rule patterns - handle both R# and # formats
-                # First try to find R# patterns
-                r_patterns = re.findall(r'"(R\d+)"', rule_part)
-                if r_patterns:
-                    rule_ids = r_patterns
-                else:
-                    # Try numeric patterns and add R prefix
-                    numeric_patterns = re.findall(r'(\d+)', rule_part)
-                    rule_ids = [f"R{num}" for num in numeric_patterns]
-                
+            token_rules = registry.classify(token)
+            if token_rules.critical:
+                crit_hits += 1
+            
             # Map to category based on first matching rule set
-            token_category = None
-            for category, rules in category_rules.items():
-                if any(rule in rule_ids for rule in rules):
-                    token_category = category
-                    break
+            token_category = token_rules.category
             
             if token_category:
                 risk_level = token.get("risk_level", "medium")
@@ -509,37 +522,21 @@ class AnalyzerAgent:
             }
         
         # Calculate overall score using Option A logic
-        weights = {
-            "Referential Ambiguity & Quantification": 0.35,
-            "Context Sufficiency & Integrity": 0.20,
-            "Instruction Structure & Delimitation": 0.10, 
-            "Verifiability & Factuality": 0.25,
-            "Reasoning & Uncertainty Handling": 0.10
-        }
+        weights = CATEGORY_WEIGHTS
         
         # Weighted blend
         overall_raw = sum(weights[cat] * category_scores[cat]["percentage"] for cat in weights)
         
         # Soft floors for C1 dominance
-        c1_score = category_scores["Referential Ambiguity & Quantification"]["percentage"]
-        c1_span_count = category_scores["Referential Ambiguity & Quantification"]["span_count"]
+        c1_score = category_scores[DOMINANT_CATEGORY]["percentage"]
+        c1_span_count = category_scores[DOMINANT_CATEGORY]["span_count"]
         
         if c1_score >= 90:
             overall_raw = max(overall_raw, 60)
         if c1_score == 100 and c1_span_count >= 5:
             overall_raw = max(overall_raw, 70)
         
-        # Critical override (faithfulness floor)
-        critical_rules = ["R9", "R10", "R13", "R22"]
-        crit_hits = 0
-        for token in risk_tokens:
-            classification = token.get("classification", "")
-            if "rule_ids:" in classification:
-                rule_part = classification.split("rule_ids:")[-1].strip()
-                rule_ids = re.findall(r'"(R\d+)"', rule_part)
-                if any(rule in critical_rules for rule in rule_ids):
-                    crit_hits += 1
-        
+        # Critical override (faithfulness floor), hits counted while categorizing
         if crit_hits >= 3:
             overall_raw = max(overall_raw, 90)
         elif crit_hits >= 2:
@@ -586,9 +583,337 @@ class AnalyzerAgent:
         
         return fallback_response
     
-    async def analyze_prompt(self, prompt: str, analysis_mode: str = "both") -> Dict[str, Any]:
-        """Analyze prompt for hallucination risks and return structured JSON response."""
+    @staticmethod
+    def _risk_token_watcher(on_risk_tokens: Callable[[List[Dict[str, Any]]], None]) -> Callable[[str], None]:
+        """Content-delta callback that fires ``on_risk_tokens`` once the array is complete."""
+        parser = RiskTokenStreamParser()
+
+        def on_delta(text: str) -> None:
+            if parser.complete:
+                return
+            parser.feed(text)
+            if parser.complete:
+                on_risk_tokens(list(parser.risk_tokens))
+
+        return on_delta
+
+    async def _complete_analysis(
+        self,
+        analysis_prompt: str,
+        user_prompt: str,
+        analysis_mode: str,
+        on_delta: Optional[Callable[[str], None]] = None,
+    ) -> str:
+        """Run the analyzer completion (retrying once on truncation) and return its content."""
+        print(f"Analyzing clean user prompt: {user_prompt[:100]}...")  # Debug
+        budget = self.budgeter.decide(user_prompt, analysis_mode)
+        while True:
+            print(f"[ANALYZER DEBUG] Requesting max_completion_tokens: {budget.max_completion_tokens}, reasoning_effort: {budget.reasoning_effort} ({budget.source}, attempt {budget.attempt})")
+            print(f"[ANALYZER DEBUG] Model: {self.model}, Temperature: {self.temperature}")
+            BUDGET_DECISIONS.labels(analysis_mode, budget.reasoning_effort, budget.source).inc()
+            BUDGET_CAP.labels(analysis_mode).observe(budget.max_completion_tokens)
+
+            request = dict(
+                agent="analyzer",
+                mode=analysis_mode,
+                model=self.model,
+                messages=[
+                    {"role": "system", "content": analysis_prompt}
+                ],
+                max_completion_tokens=budget.max_completion_tokens,
+                temperature=self.temperature,
+                # Effort and cap come from the completion budgeter (ANALYZER_BUDGET)
+                reasoning_effort=budget.reasoning_effort,
+            )
+            if on_delta is not None:
+                call = stream_chat_completion(self.client, on_delta=on_delta, **request)
+            else:
+                call = create_chat_completion(self.client, **request)
+            response = await run_stage("analyzer", call, self.timeout)
+            finish_reason = response.choices[0].finish_reason if response.choices else None
+            usage = getattr(response, "usage", None)
+            self.budgeter.observe(budget, analysis_mode, getattr(usage, "completion_tokens", None), finish_reason)
+            if not self.budgeter.should_retry(budget, finish_reason) or not stage_allowed("analyzer_retry"):
+                break
+            # The cap cut the answer short (usually mid-JSON): retry once with more room
+            TRUNCATION_RETRIES.labels(analysis_mode, budget.reasoning_effort).inc()
+            print(f"[ANALYZER WARNING] Truncated at {budget.max_completion_tokens} tokens, retrying with a larger budget")
+            budget = self.budgeter.escalate(budget, analysis_mode)
+
+        # Log token usage details
+        if hasattr(response, 'usage') and response.usage:
+            print(f"[ANALYZER DEBUG] Token usage - Prompt: {response.usage.prompt_tokens}, Completion: {response.usage.completion_tokens}, Total: {response.usage.total_tokens}")
+            if hasattr(response.usage, 'completion_tokens_details'):
+                details = response.usage.completion_tokens_details
+                print(f"[ANALYZER DEBUG] Completion details - Reasoning: {getattr(details, 'reasoning_tokens', 0)}, Audio: {getattr(details, 'audio_tokens', 0)}")
+
+        content = response.choices[0].message.content
+
+        # Check if content is None or empty - this is the <no output> issue
+        if not content or len(content.strip()) == 0:
+            print(f"[ANALYZER ERROR] LLM returned empty/no content! Response object: {response}")
+            print(f"[ANALYZER ERROR] Finish reason: {response.choices[0].finish_reason if response.choices else 'NO_CHOICES'}")
+            print(f"[ANALYZER ERROR] Model used: {self.model}")
+            raise ValueError(f"LLM returned empty response. Finish reason: {response.choices[0].finish_reason}")
+
+        print(f"[ANALYZER DEBUG] Raw LLM response length: {len(content)}")
+        print(f"[ANALYZER DEBUG] First 500 chars: {content[:500]}")
+        print(f"[ANALYZER DEBUG] Last 200 chars: {content[-200:] if len(content) > 200 else content}")
+        return content
+
+    @staticmethod
+    def _parse_analysis(content: str, output_contract: str) -> Dict[str, Any]:
+        """Parse the analyzer's JSON answer; raises json.JSONDecodeError or ValueError."""
+        # Step 1: Strip markdown code blocks if present
+        cleaned_content = content
+        if '```' in cleaned_content:
+            # Extract content between code fences
+            match = re.search(r'```(?:json)?\s*\n(.*?)\n```', cleaned_content, re.DOTALL)
+            if match:
+                cleaned_content = match.group(1)
+            else:
+                # Try removing all code fences
+                cleaned_content = re.sub(r'```(?:json)?', '', cleaned_content)
+
+        # Step 2: Try to extract JSON object from text (find first { to last })
+        start_idx = cleaned_content.find('{')
+        end_idx = cleaned_content.rfind('}')
+        if start_idx != -1 and end_idx != -1 and end_idx > start_idx:
+            cleaned_content = cleaned_content[start_idx:end_idx+1]
+
+        # Step 3: Clean up common JSON errors
+        cleaned_content = re.sub(r',\s*}', '}', cleaned_content)  # Remove trailing commas before }
+        cleaned_content = re.sub(r',\s*]', ']', cleaned_content)  # Remove trailing commas before ]
+
+        print(f"[ANALYZER DEBUG] Cleaned content length: {len(cleaned_content)}")
+        print(f"[ANALYZER DEBUG] Attempting JSON parse...")
+
+        # Parse the JSON response
+        try:
+            parsed_response = json.loads(cleaned_content)
+        except json.JSONDecodeError as e:
+            print(f"[ANALYZER DEBUG] JSON parsing failed: {e}")
+            print(f"[ANALYZER DEBUG] Failed content preview: {cleaned_content[:1000] if cleaned_content else 'EMPTY'}")
+            raise
+        print(f"[ANALYZER DEBUG] Successfully parsed JSON response")  # Debug
+
+        # Validate required fields (the offsets contract has no annotated_prompt)
+        required = ["analysis_summary", "risk_tokens", "risk_assessment"]
+        if output_contract != "offsets":
+            required.append("annotated_prompt")
+        if not all(key in parsed_response for key in required):
+            raise ValueError("Missing required fields in JSON response")
+        return parsed_response
+
+    @staticmethod
+    def _map_spans(annotated_text: str):
+        """Strip <RISK_n> tags; returns (clean text, {RISK_n: (start, end)})."""
+        clean_chars = []
+        idx = 0
+        span_map = {}
+        i2 = 0
+        n2 = len(annotated_text)
+        open_stack = []
+        while i2 < n2:
+            if annotated_text.startswith("<RISK_", i2):
+                j2 = annotated_text.find('>', i2)
+                if j2 == -1:
+                    break
+                tag = annotated_text[i2:j2+1]
+                m2 = re.match(r"<(?P<id>RISK_\d+)>", tag)
+                if m2:
+                    rid = m2.group('id')
+                    open_stack.append((rid, idx))
+                i2 = j2 + 1
+                continue
+            if annotated_text.startswith("</RISK_", i2):
+                j2 = annotated_text.find('>', i2)
+                if j2 == -1:
+                    break
+                tag = annotated_text[i2:j2+1]
+                m2 = re.match(r"</(?P<id>RISK_\d+)>", tag)
+                if m2 and open_stack:
+                    rid = m2.group('id')
+                    open_id, start_idx = open_stack.pop()
+                    use_id = rid if rid else open_id
+                    span_map[use_id] = (start_idx, idx)
+                i2 = j2 + 1
+                continue
+            # normal char
+            clean_chars.append(annotated_text[i2])
+            idx += 1
+            i2 += 1
+        clean_text_local = ''.join(clean_chars)
+        return clean_text_local, span_map
+
+    @staticmethod
+    def _locate_spans(user_prompt: str, parsed_response: Dict[str, Any], analysis_mode: str, output_contract: str) -> None:
+        """Enrich risk tokens with rule_ids and span indices if possible (in place)."""
         try:
+            annotated = parsed_response.get("annotated_prompt", "")
+            risk_tokens = parsed_response.get("risk_tokens", []) or []
+            if output_contract == "offsets":
+                # Quoted spans -> offsets; annotated_prompt is built here, not by the model
+                # (the clean prompt if resolution fails below)
+                parsed_response["annotated_prompt"] = user_prompt
+                unresolved = resolve_risk_spans(user_prompt, risk_tokens)
+                parsed_response["annotated_prompt"] = build_annotated_prompt(user_prompt, risk_tokens)
+                parsed_response["unresolved_spans"] = unresolved
+                if unresolved:
+                    print(f"[ANALYZER WARNING] {len(unresolved)} risk span(s) not placed: {unresolved}")
+                span_map = {}
+            else:
+                # Build a mapping from RISK_n to (start,end) in the cleaned text
+                _, span_map = AnalyzerAgent._map_spans(annotated)
+            # Attach span indices and rule_ids
+            registry = get_rule_registry(analysis_mode)
+            for token in risk_tokens:
+                ids = registry.classify(token).rule_ids
+                if ids:
+                    token["rule_ids"] = ids
+                rid = token.get("id")
+                if rid and rid in span_map:
+                    start_idx, end_idx = span_map[rid]
+                    token["span_start"] = start_idx
+                    token["span_end"] = end_idx
+        except Exception as enrich_err:
+            print(f"DEBUG: Failed to enrich risk tokens with spans/rule_ids: {enrich_err}")
+
+    @staticmethod
+    def _score_analysis(user_prompt: str, parsed_response: Dict[str, Any]) -> Dict[str, Any]:
+        """Fill in prompt_PRD and meta_PRD; returns the same (mutated) dict."""
+        # Calculate PRD scores for prompt and meta violations
+        risk_assessment = parsed_response.get("risk_assessment", {})
+        
+        # Calculate Prompt PRD
+        if "prompt" in risk_assessment:
+            prompt_violations = risk_assessment["prompt"].get("prompt_violations", [])
+            print("\n" + "🔵 CALCULATING PROMPT-LEVEL PRD 🔵")
+            prompt_prd = AnalyzerAgent._calculate_prd(user_prompt, prompt_violations)
+            parsed_response["risk_assessment"]["prompt"]["prompt_PRD"] = prompt_prd
+            print(f"✅ Prompt PRD Result: {prompt_prd}\n")
+        
+        # Calculate Meta PRD  
+        if "meta" in risk_assessment:
+            meta_violations = risk_assessment["meta"].get("meta_violations", [])
+            print("\n" + "🟣 CALCULATING META-LEVEL PRD 🟣")
+            meta_prd = AnalyzerAgent._calculate_meta_prd(user_prompt, meta_violations)
+            parsed_response["risk_assessment"]["meta"]["meta_PRD"] = meta_prd
+            print(f"✅ Meta PRD Result: {meta_prd}\n")
+        
+        print(f"📊 FINAL PRD SUMMARY: prompt_PRD={prompt_prd if 'prompt' in risk_assessment else 0}, meta_PRD={meta_prd if 'meta' in risk_assessment else 0}")
+        return parsed_response
+
+    async def _analyze_split(
+        self,
+        user_prompt: str,
+        groups: List[SplitGroup],
+        on_risk_tokens: Optional[Callable[[List[Dict[str, Any]]], None]] = None,
+    ) -> Optional[Dict[str, Any]]:
+        """Analyze each rule group concurrently and merge; None if no group could be parsed.
+
+        A group whose call or parse fails is left out of the merge. Only when
+        every group failed, and at least one upstream, is that error raised.
+        """
+        streamed: Dict[str, List[Dict[str, Any]]] = {}
+        content_chars: List[int] = []
+
+        def watcher(group: SplitGroup) -> Optional[Callable[[str], None]]:
+            if on_risk_tokens is None:
+                return None
+
+            def collect(tokens: List[Dict[str, Any]]) -> None:
+                streamed[group.label] = tokens
+                # Fires once, when the last group's risk_tokens array is complete
+                if len(streamed) == len(groups):
+                    merged, _ = merge_risk_tokens([{"risk_tokens": streamed[g.label]} for g in groups])
+                    on_risk_tokens(merged)
+
+            return self._risk_token_watcher(collect)
+
+        upstream_errors: List[Exception] = []
+
+        async def run(group: SplitGroup) -> Optional[Dict[str, Any]]:
+            # A failed group is dropped; the other groups still give a (partial) analysis.
+            # DeadlineExceeded (and cancellation) end the whole analysis
+            analysis_prompt = self._get_hallucination_analysis_prompt(
+                user_prompt, group.analysis_mode, group.guidelines_xml
+            )
+            try:
+                content = await self._complete_analysis(analysis_prompt, user_prompt, group.budget_mode, watcher(group))
+            except DeadlineExceeded:
+                raise
+            except Exception as e:
+                # Upstream error, timeout or empty completion for this group only
+                print(f"[ANALYZER WARNING] Split group {group.label} failed: {type(e).__name__}: {e}")
+                upstream_errors.append(e)
+                record_fallback("analyzer", "split_partial")
+                return None
+            content_chars.append(len(content))
+            try:
+                parsed, timings = await run_postprocess(
+                    "analyzer", len(content), postprocess_analysis,
+                    user_prompt, content, group.analysis_mode, self.output_contract, False,
+                )
+            except ValueError as e:
+                # JSONDecodeError or missing required fields
+                print(f"[ANALYZER WARNING] Split group {group.label} unparseable: {e}")
+                record_parse_failure("analyzer")
+                record_fallback("analyzer", "split_partial")
+                return None
+            record_postprocess(StageTimer("analyzer"), group.analysis_mode, parsed, timings)
+            return parsed
+
+        print(f"[ANALYZER DEBUG] Split analysis over {len(groups)} groups: {[g.label for g in groups]}")
+        tasks = [asyncio.ensure_future(run(group)) for group in groups]
+        try:
+            parts = await asyncio.gather(*tasks)
+        finally:
+            # The deadline ran out or the request was cancelled: don't keep paying for the others
+            for task in tasks:
+                task.cancel()
+        parts = [part for part in parts if part is not None]
+        if not parts:
+            if upstream_errors:
+                # Nothing came back at all; fail like an unsplit analysis would
+                raise upstream_errors[0]
+            return None
+        merged = merge_analyses(user_prompt, parts)
+        return await run_postprocess(
+            "analyzer", sum(content_chars), AnalyzerAgent._score_analysis, user_prompt, merged
+        )
+
+    def request_prompts(self, prompt: str, analysis_mode: str = "both") -> Tuple[str, List[Tuple[str, str]]]:
+        """The user prompt and (budget mode, system prompt) of each completion ``analyze_prompt`` would request.
+
+        Builds the prompts only, without calling the LLM (see services/estimator.py).
+        """
+        user_prompt = prompt.split("USER PROMPT TO ANALYZE:")[-1].strip() if "USER PROMPT TO ANALYZE:" in prompt else prompt
+        if analysis_mode == "both" and self.split_groups:
+            return user_prompt, [
+                (group.budget_mode, self._get_hallucination_analysis_prompt(
+                    user_prompt, group.analysis_mode, group.guidelines_xml, record=False
+                ))
+                for group in self.split_groups
+            ]
+        return user_prompt, [(analysis_mode, self._get_hallucination_analysis_prompt(user_prompt, analysis_mode, record=False))]
+
+    async def analyze_prompt(
+        self,
+        prompt: str,
+        analysis_mode: str = "both",
+        on_risk_tokens: Optional[Callable[[List[Dict[str, Any]]], None]] = None,
+    ) -> Dict[str, Any]:
+        """Analyze prompt for hallucination risks and return structured JSON response.
+
+        With ``on_risk_tokens`` the completion is streamed and the callback gets
+        the raw risk tokens as soon as the model closes the ``risk_tokens``
+        array, before the rest of the JSON (risk assessment) has arrived.
+        With ANALYZER_SPLIT, "both" runs as concurrent group completions and
+        the callback gets the merged tokens once every group has closed its array.
+        """
+        try:
+            stages = StageTimer("analyzer")
             # Extract the actual user prompt from the full context
             user_prompt = prompt
             
@@ -602,173 +927,86 @@ class AnalyzerAgent:
             else:
                 print("No 'USER PROMPT TO ANALYZE:' found, using full prompt")  # Debug
             
-            # Create the analysis prompt with the clean user prompt and analysis mode
-            analysis_prompt = self._get_hallucination_analysis_prompt(user_prompt, analysis_mode)
-            
-            print(f"Analyzing clean user prompt: {user_prompt[:100]}...")  # Debug
-            print(f"[ANALYZER DEBUG] Requesting max_completion_tokens: {self.max_tokens}")
-            print(f"[ANALYZER DEBUG] Model: {self.model}, Temperature: {self.temperature}")
-            
-            response = await asyncio.wait_for(
-                self.client.chat.completions.create(
-                    model=self.model,
-                    messages=[
-                        {"role": "system", "content": analysis_prompt}
-                    ],
-                    max_completion_tokens=self.max_tokens,
-                    temperature=self.temperature,
-                    # Medium reasoning effort for balanced speed and quality
-                    reasoning_effort="medium",
-                ),
-                timeout=self.timeout
-            )
-            
-            # Log token usage details
-            if hasattr(response, 'usage') and response.usage:
-                print(f"[ANALYZER DEBUG] Token usage - Prompt: {response.usage.prompt_tokens}, Completion: {response.usage.completion_tokens}, Total: {response.usage.total_tokens}")
-                if hasattr(response.usage, 'completion_tokens_details'):
-                    details = response.usage.completion_tokens_details
-                    print(f"[ANALYZER DEBUG] Completion details - Reasoning: {getattr(details, 'reasoning_tokens', 0)}, Audio: {getattr(details, 'audio_tokens', 0)}")
-            
-            content = response.choices[0].message.content
-            
-            # Check if content is None or empty - this is the <no output> issue
-            if not content or len(content.strip()) == 0:
-                print(f"[ANALYZER ERROR] LLM returned empty/no content! Response object: {response}")
-                print(f"[ANALYZER ERROR] Finish reason: {response.choices[0].finish_reason if response.choices else 'NO_CHOICES'}")
-                print(f"[ANALYZER ERROR] Model used: {self.model}")
-                raise ValueError(f"LLM returned empty response. Finish reason: {response.choices[0].finish_reason}")
-            
-            print(f"[ANALYZER DEBUG] Raw LLM response length: {len(content)}")
-            print(f"[ANALYZER DEBUG] First 500 chars: {content[:500]}")
-            print(f"[ANALYZER DEBUG] Last 200 chars: {content[-200:] if len(content) > 200 else content}")
-            
-            try:
-                # Step 1: Strip markdown code blocks if present
-                cleaned_content = content
-                if '```' in cleaned_content:
-                    # Extract content between code fences
-                    match = re.search(r'```(?:json)?\s*\n(.*?)\n```', cleaned_content, re.DOTALL)
-                    if match:
-                        cleaned_content = match.group(1)
-                    else:
-                        # Try removing all code fences
-                        cleaned_content = re.sub(r'```(?:json)?', '', cleaned_content)
-                
-                # Step 2: Try to extract JSON object from text (find first { to last })
-                start_idx = cleaned_content.find('{')
-                end_idx = cleaned_content.rfind('}')
-                if start_idx != -1 and end_idx != -1 and end_idx > start_idx:
-                    cleaned_content = cleaned_content[start_idx:end_idx+1]
-                
-                # Step 3: Clean up common JSON errors
-                cleaned_content = re.sub(r',\s*}', '}', cleaned_content)  # Remove trailing commas before }
-                cleaned_content = re.sub(r',\s*]', ']', cleaned_content)  # Remove trailing commas before ]
-                
-                print(f"[ANALYZER DEBUG] Cleaned content length: {len(cleaned_content)}")
-                print(f"[ANALYZER DEBUG] Attempting JSON parse...")
-                
-                # Parse the JSON response
-                parsed_response = json.loads(cleaned_content)
-                print(f"[ANALYZER DEBUG] Successfully parsed JSON response")  # Debug
-                
-                # Validate required fields
-                if not all(key in parsed_response for key in ["annotated_prompt", "analysis_summary", "risk_tokens", "risk_assessment"]):
-                    raise ValueError("Missing required fields in JSON response")
-                
-                # Enrich risk tokens with rule_ids and span indices if possible
+            if analysis_mode == "both" and self.split_groups:
+                parsed_response = await self._analyze_split(user_prompt, self.split_groups, on_risk_tokens)
+                stages.lap("split_analysis")
+                if parsed_response is None:
+                    return self._create_fallback_response(user_prompt, "")
+            else:
+                # Create the analysis prompt with the clean user prompt and analysis mode
+                analysis_prompt = self._get_hallucination_analysis_prompt(user_prompt, analysis_mode)
+                stages.lap("prompt_build")
+
+                on_delta = self._risk_token_watcher(on_risk_tokens) if on_risk_tokens is not None else None
+                content = await self._complete_analysis(analysis_prompt, user_prompt, analysis_mode, on_delta)
+                stages.lap("upstream_wait")
+
+                # Parse, span mapping and PRD scoring; large completions go to the post-processing pool
                 try:
-                    annotated = parsed_response.get("annotated_prompt", "")
-                    # Build a mapping from RISK_n to (start,end) in the cleaned text
-                    def map_spans(annotated_text: str):
-                        clean_chars = []
-                        idx = 0
-                        span_map = {}
-                        i2 = 0
-                        n2 = len(annotated_text)
-                        open_stack = []
-                        while i2 < n2:
-                            if annotated_text.startswith("<RISK_", i2):
-                                j2 = annotated_text.find('>', i2)
-                                if j2 == -1:
-                                    break
-                                tag = annotated_text[i2:j2+1]
-                                m2 = re.match(r"<(?P<id>RISK_\d+)>", tag)
-                                if m2:
-                                    rid = m2.group('id')
-                                    open_stack.append((rid, idx))
-                                i2 = j2 + 1
-                                continue
-                            if annotated_text.startswith("</RISK_", i2):
-                                j2 = annotated_text.find('>', i2)
-                                if j2 == -1:
-                                    break
-                                tag = annotated_text[i2:j2+1]
-                                m2 = re.match(r"</(?P<id>RISK_\d+)>", tag)
-                                if m2 and open_stack:
-                                    rid = m2.group('id')
-                                    open_id, start_idx = open_stack.pop()
-                                    use_id = rid if rid else open_id
-                                    span_map[use_id] = (start_idx, idx)
-                                i2 = j2 + 1
-                                continue
-                            # normal char
-                            clean_chars.append(annotated_text[i2])
-                            idx += 1
-                            i2 += 1
-                        clean_text_local = ''.join(clean_chars)
-                        return clean_text_local, span_map
-                    _, span_map = map_spans(annotated)
-                    # Attach span indices and rule_ids
-                    for token in parsed_response.get("risk_tokens", []) or []:
-                        cls = token.get("classification", "")
-                        ids = re.findall(r'"(R\d+)"', cls)
-                        if not ids:
-                            nums = re.findall(r'\b(\d+)\b', cls)
-                            ids = [f"R{n}" for n in nums]
-                        if ids:
-                            token["rule_ids"] = ids
-                        rid = token.get("id")
-                        if rid and rid in span_map:
-                            start_idx, end_idx = span_map[rid]
-                            token["span_start"] = start_idx
-                            token["span_end"] = end_idx
-                except Exception as enrich_err:
-                    print(f"DEBUG: Failed to enrich risk tokens with spans/rule_ids: {enrich_err}")
-
-                # Calculate PRD scores for prompt and meta violations
-                risk_assessment = parsed_response.get("risk_assessment", {})
-                
-                # Calculate Prompt PRD
-                if "prompt" in risk_assessment:
-                    prompt_violations = risk_assessment["prompt"].get("prompt_violations", [])
-                    print("\n" + "🔵 CALCULATING PROMPT-LEVEL PRD 🔵")
-                    prompt_prd = self._calculate_prd(user_prompt, prompt_violations)
-                    parsed_response["risk_assessment"]["prompt"]["prompt_PRD"] = prompt_prd
-                    print(f"✅ Prompt PRD Result: {prompt_prd}\n")
-                
-                # Calculate Meta PRD  
-                if "meta" in risk_assessment:
-                    meta_violations = risk_assessment["meta"].get("meta_violations", [])
-                    print("\n" + "🟣 CALCULATING META-LEVEL PRD 🟣")
-                    meta_prd = self._calculate_meta_prd(user_prompt, meta_violations)
-                    parsed_response["risk_assessment"]["meta"]["meta_PRD"] = meta_prd
-                    print(f"✅ Meta PRD Result: {meta_prd}\n")
-                
-                print(f"📊 FINAL PRD SUMMARY: prompt_PRD={prompt_prd if 'prompt' in risk_assessment else 0}, meta_PRD={meta_prd if 'meta' in risk_assessment else 0}")
-                
-                return parsed_response
-                
-            except json.JSONDecodeError as e:
-                print(f"[ANALYZER DEBUG] JSON parsing failed: {e}")
-                print(f"[ANALYZER DEBUG] Failed content preview: {cleaned_content[:1000] if cleaned_content else 'EMPTY'}")
-                
-                # Fallback to create a basic response
-                return self._create_fallback_response(user_prompt, content)
+                    parsed_response, timings = await run_postprocess(
+                        "analyzer", len(content), postprocess_analysis,
+                        user_prompt, content, analysis_mode, self.output_contract,
+                    )
+                except json.JSONDecodeError:
+                    # Fallback to create a basic response
+                    record_parse_failure("analyzer")
+                    record_fallback("analyzer", "fallback_response")
+                    return self._create_fallback_response(user_prompt, content)
+                record_postprocess(stages, analysis_mode, parsed_response, timings)
+                stages.lap("postprocess")
             
+            return parsed_response
+            
+        except DeadlineExceeded:
+            raise
         except Exception as e:
             import traceback
             print(f"[ANALYZER ERROR] Analysis failed with exception type: {type(e).__name__}")
             print(f"[ANALYZER ERROR] Exception message: {str(e)}")
             print(f"[ANALYZER ERROR] Full traceback:\n{traceback.format_exc()}")
             raise Exception(f"Analysis failed: {type(e).__name__}: {str(e)}")
+
+
+def postprocess_analysis(
+    user_prompt: str,
+    content: str,
+    analysis_mode: str,
+    output_contract: str,
+    score: bool = True,
+) -> Tuple[Dict[str, Any], Dict[str, float]]:
+    """Parse, span-map and (with ``score``) PRD-score one analyzer completion.
+
+    CPU-only work on plain data, so it can run in the post-processing pool
+    (threads or processes, see postprocess_pool.py). Returns the result and the
+    seconds spent per stage. Raises json.JSONDecodeError or ValueError like
+    ``_parse_analysis``. It records no metrics or trace spans: in a worker
+    process they would be lost. The caller passes the result to
+    ``record_postprocess``.
+    """
+    timings: Dict[str, float] = {}
+    started = time.perf_counter()
+    parsed_response = AnalyzerAgent._parse_analysis(content, output_contract)
+    timings["json_parse"] = time.perf_counter() - started
+
+    started = time.perf_counter()
+    AnalyzerAgent._locate_spans(user_prompt, parsed_response, analysis_mode, output_contract)
+    timings["span_mapping"] = time.perf_counter() - started
+
+    if score:
+        started = time.perf_counter()
+        AnalyzerAgent._score_analysis(user_prompt, parsed_response)
+        timings["prd_scoring"] = time.perf_counter() - started
+    return parsed_response, timings
+
+
+def record_postprocess(
+    stages: StageTimer, analysis_mode: str, parsed_response: Dict[str, Any], timings: Dict[str, float]
+) -> None:
+    """Record the stage timings and unresolved-span counts of a ``postprocess_analysis`` result.
+
+    Runs in the calling process, so pool workers never touch metrics or traces.
+    """
+    for stage, elapsed in timings.items():
+        stages.record(stage, elapsed)
+    for entry in parsed_response.get("unresolved_spans") or []:
+        UNRESOLVED_SPANS.labels(analysis_mode, entry["reason"]).inc()
@@ -0,0 +1,275 @@
+"""
+BatchRiskScorer - Vectorized re-scoring of many stored analyses at once.
+
+AnalyzerAgent scores one prompt at a time. When severity weights or category
+mappings change, the archive of past analyses has to be re-scored; this engine
+flattens every violation and risk token into NumPy arrays so PRD, meta PRD,
+category percentages and critical-hit floors are computed in a handful of
+array operations. Results match the per-item methods on AnalyzerAgent.
+"""
+
+import re
+from typing import Dict, Any, List, Optional
+
+import numpy as np
+
+from .scoring_config import (
+    SEVERITY_WEIGHTS,
+    CATEGORY_RULES,
+    CATEGORY_WEIGHTS,
+    DOMINANT_CATEGORY,
+    CRITICAL_RULES,
+)
+from .rule_registry import RuleRegistry
+from .tokenizer import get_encoding
+
+_RISK_TAG_RE = re.compile(r"</?RISK_\d+>")
+
+
+class BatchRiskScorer:
+    """Score PRD, meta PRD and deterministic category risk for many analyses."""
+
+    def __init__(
+        self,
+        severity_weights: Optional[Dict[str, float]] = None,
+        category_rules: Optional[Dict[str, List[str]]] = None,
+        category_weights: Optional[Dict[str, float]] = None,
+        critical_rules: Optional[List[str]] = None,
+        dominant_category: str = DOMINANT_CATEGORY,
+        encoding_model: str = "gpt-4",
+    ):
+        self.severity_weights = dict(SEVERITY_WEIGHTS if severity_weights is None else severity_weights)
+        self.category_rules = dict(CATEGORY_RULES if category_rules is None else category_rules)
+        self.category_weights = dict(CATEGORY_WEIGHTS if category_weights is None else category_weights)
+        self.critical_rules = set(CRITICAL_RULES if critical_rules is None else critical_rules)
+        self.dominant_category = dominant_category
+        self.registry = RuleRegistry(category_rules=self.category_rules, critical_rules=list(self.critical_rules))
+        self.categories = self.registry.categories
+        # Shared with the analyzer; None (whitespace tokens) if tiktoken cannot load
+        self.encoding = get_encoding(encoding_model)
+
+    # ------------------------------------------------------------------
+    # Token counting
+    # ------------------------------------------------------------------
+    def _count_tokens_checked(self, texts: List[str]) -> tuple:
+        """Token counts plus a mask of texts the encoder accepted."""
+        if self.encoding is None:
+            return np.array([len(t.split()) for t in texts], dtype=np.int64), np.zeros(len(texts), dtype=bool)
+        counts = np.empty(len(texts), dtype=np.int64)
+        ok = np.ones(len(texts), dtype=bool)
+        try:
+            counts[:] = [len(tokens) for tokens in self.encoding.encode_batch(texts)]
+            return counts, ok
+        except Exception:
+            pass
+        for i, text in enumerate(texts):
+            try:
+                counts[i] = len(self.encoding.encode(text))
+            except Exception:
+                counts[i] = len(text.split())
+                ok[i] = False
+        return counts, ok
+
+    @staticmethod
+    def _finalize_prd(total_risk: np.ndarray, total_tokens: np.ndarray) -> List[float]:
+        safe_tokens = np.where(total_tokens > 0, total_tokens, 1)
+        prd = np.where(total_tokens > 0, total_risk / safe_tokens, 0.0)
+        prd = np.minimum(prd, 1.0)
+        # Python's round() keeps results identical to the per-item methods
+        return [round(float(value), 4) for value in prd]
+
+    # ------------------------------------------------------------------
+    # PRD
+    # ------------------------------------------------------------------
+    def calculate_prd_batch(self, texts: List[str], violations_batch: List[List[Dict[str, Any]]]) -> List[float]:
+        """Vectorized counterpart of AnalyzerAgent._calculate_prd."""
+        n = len(texts)
+        total_tokens, text_ok = self._count_tokens_checked(texts)
+
+        owners: List[int] = []
+        weights: List[float] = []
+        spans: List[str] = []
+        for i, violations in enumerate(violations_batch):
+            for violation in violations or []:
+                owners.append(i)
+                weights.append(self.severity_weights.get(violation.get("severity", "medium"), 1))
+                spans.append(violation.get("span", "N/A"))
+
+        total_risk = np.zeros(n, dtype=np.float64)
+        if owners:
+            owner_arr = np.asarray(owners, dtype=np.int64)
+            weight_arr = np.asarray(weights, dtype=np.float64)
+            span_tokens, _ = self._count_tokens_checked(spans)
+            # Texts the encoder rejected fall back to whitespace spans as well
+            fallback = ~text_ok[owner_arr]
+            if fallback.any():
+                span_tokens = span_tokens.copy()
+                for j in np.flatnonzero(fallback):
+                    span_tokens[j] = len(spans[j].split())
+            total_risk = np.bincount(owner_arr, weights=weight_arr * span_tokens, minlength=n)
+
+        return self._finalize_prd(total_risk, total_tokens)
+
+    def calculate_meta_prd_batch(self, texts: List[str], violations_batch: List[List[Dict[str, Any]]]) -> List[float]:
+        """Vectorized counterpart of AnalyzerAgent._calculate_meta_prd (fixed span of 1)."""
+        n = len(texts)
+        total_tokens, _ = self._count_tokens_checked(texts)
+
+        owners: List[int] = []
+        weights: List[float] = []
+        for i, violations in enumerate(violations_batch):
+            for violation in violations or []:
+                owners.append(i)
+                weights.append(self.severity_weights.get(violation.get("severity", "medium"), 1))
+
+        total_risk = np.zeros(n, dtype=np.float64)
+        if owners:
+            total_risk = np.bincount(
+                np.asarray(owners, dtype=np.int64),
+                weights=np.asarray(weights, dtype=np.float64),
+                minlength=n,
+            )
+        return self._finalize_prd(total_risk, total_tokens)
+
+    # ------------------------------------------------------------------
+    # Deterministic category scores
+    # ------------------------------------------------------------------
+    def calculate_risk_scores_batch(
+        self, prompts: List[str], risk_tokens_batch: List[List[Dict[str, Any]]]
+    ) -> List[Dict[str, Any]]:
+        """Vectorized counterpart of AnalyzerAgent._calculate_deterministic_risk_scores."""
+        n = len(prompts)
+        n_cat = len(self.categories)
+        word_counts = np.array([len(p.split()) for p in prompts], dtype=np.int64)
+        char_totals = np.array([len(p) for p in prompts], dtype=np.int64)
+
+        cells: List[int] = []
+        is_high: List[bool] = []
+        char_lengths: List[int] = []
+        crit_owners: List[int] = []
+        for i, risk_tokens in enumerate(risk_tokens_batch):
+            for token in risk_tokens or []:
+                token_rules = self.registry.classify(token)
+                category_idx = token_rules.category_index
+                if category_idx is not None:
+                    cells.append(i * n_cat + category_idx)
+                    is_high.append(token.get("risk_level", "medium") == "high")
+                    char_lengths.append(len(token.get("text", "")))
+                if token_rules.critical:
+                    crit_owners.append(i)
+
+        size = n * n_cat
+        if cells:
+            cell_arr = np.asarray(cells, dtype=np.int64)
+            high_arr = np.asarray(is_high, dtype=bool)
+            high = np.bincount(cell_arr[high_arr], minlength=size).reshape(n, n_cat)
+            medium = np.bincount(cell_arr[~high_arr], minlength=size).reshape(n, n_cat)
+            chars = np.bincount(cell_arr, weights=np.asarray(char_lengths, dtype=np.float64), minlength=size).reshape(n, n_cat)
+        else:
+            high = np.zeros((n, n_cat), dtype=np.int64)
+            medium = np.zeros((n, n_cat), dtype=np.int64)
+            chars = np.zeros((n, n_cat), dtype=np.float64)
+
+        weighted = 1.0 * high + 0.5 * medium
+        threshold = np.maximum(1, np.rint(0.02 * word_counts))[:, None]
+        safe_chars = np.where(char_totals > 0, char_totals, 1)[:, None]
+        coverage = np.where(char_totals[:, None] > 0, chars / safe_chars, 0.0)
+
+        base = np.where(weighted == 0, 0.0, 30.0)
+        intensity = 100 * np.minimum(1, weighted / threshold)
+        coverage_bonus = 20 * np.minimum(1, coverage / 0.05)
+        pct_raw = np.clip(base + 0.7 * intensity + coverage_bonus, 0, 100)
+        pct = (np.rint(pct_raw / 10) * 10).astype(np.int64)
+        span_counts = high + medium
+
+        # Accumulate category by category to keep the per-item summation order
+        overall_raw = np.zeros(n, dtype=np.float64)
+        for category, weight in self.category_weights.items():
+            overall_raw = overall_raw + weight * pct[:, self.categories.index(category)]
+        # Floors replace the blend with an integer in the per-item code
+        floored = np.zeros(n, dtype=bool)
+
+        def apply_floor(mask: np.ndarray, floor: int) -> None:
+            nonlocal overall_raw
+            hit = mask & (floor > overall_raw)
+            overall_raw = np.where(hit, floor, overall_raw)
+            floored[hit] = True
+
+        dominant = self.categories.index(self.dominant_category)
+        c1_score = pct[:, dominant]
+        c1_span_count = span_counts[:, dominant]
+        apply_floor(c1_score >= 90, 60)
+        apply_floor((c1_score == 100) & (c1_span_count >= 5), 70)
+
+        crit_hits = np.bincount(np.asarray(crit_owners, dtype=np.int64), minlength=n) if crit_owners else np.zeros(n, dtype=np.int64)
+        apply_floor(crit_hits >= 3, 90)
+        apply_floor(crit_hits == 2, 80)
+        apply_floor(crit_hits == 1, 60)
+
+        overall_quantized = (np.rint(overall_raw / 10) * 10).astype(np.int64)
+        labels = np.where(pct <= 20, "low", np.where(pct <= 60, "medium", "high"))
+
+        results: List[Dict[str, Any]] = []
+        for i in range(n):
+            category_scores = {
+                category: {
+                    "percentage": int(pct[i, c]),
+                    "risk": str(labels[i, c]),
+                    "span_count": int(span_counts[i, c]),
+                }
+                for c, category in enumerate(self.categories)
+            }
+            raw = int(overall_raw[i]) if floored[i] else float(overall_raw[i])
+            results.append({
+                "category_scores": category_scores,
+                "overall_percentage": int(overall_quantized[i]),
+                "critical_hits": int(crit_hits[i]),
+                "debug_info": {
+                    "N": int(word_counts[i]),
+                    "char_total": int(char_totals[i]),
+                    "overall_raw": raw,
+                    "c1_dominance": {"score": int(c1_score[i]), "span_count": int(c1_span_count[i])}
+                }
+            })
+        return results
+
+    # ------------------------------------------------------------------
+    # Archive re-scoring
+    # ------------------------------------------------------------------
+    @staticmethod
+    def _prompt_text(analysis: Dict[str, Any]) -> str:
+        """Original prompt for a stored analysis, recovered from annotations if needed."""
+        prompt = analysis.get("prompt")
+        if isinstance(prompt, str):
+            return prompt
+        return _RISK_TAG_RE.sub("", analysis.get("annotated_prompt", "") or "")
+
+    def score(self, analyses: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Score stored analyses, returning prompt_PRD, meta_PRD and risk_scores per item.
+
+        Each analysis is an analyzer response; an optional "prompt" key holds the
+        original prompt, otherwise it is recovered from "annotated_prompt".
+        """
+        prompts = [self._prompt_text(a) for a in analyses]
+        assessments = [a.get("risk_assessment", {}) or {} for a in analyses]
+        prompt_prd = self.calculate_prd_batch(
+            prompts, [(ra.get("prompt") or {}).get("prompt_violations", []) for ra in assessments]
+        )
+        meta_prd = self.calculate_meta_prd_batch(
+            prompts, [(ra.get("meta") or {}).get("meta_violations", []) for ra in assessments]
+        )
+        risk_scores = self.calculate_risk_scores_batch(prompts, [a.get("risk_tokens") or [] for a in analyses])
+        return [
+            {"prompt_PRD": p, "meta_PRD": m, "risk_scores": r}
+            for p, m, r in zip(prompt_prd, meta_prd, risk_scores)
+        ]
+
+    def rescore(self, analyses: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Write fresh prompt_PRD / meta_PRD values back into the given analyses."""
+        for analysis, scores in zip(analyses, self.score(analyses)):
+            risk_assessment = analysis.get("risk_assessment") or {}
+            if "prompt" in risk_assessment:
+                risk_assessment["prompt"]["prompt_PRD"] = scores["prompt_PRD"]
+            if "meta" in risk_assessment:
+                risk_assessment["meta"]["meta_PRD"] = scores["meta_PRD"]
+        return analyses
@@ -0,0 +1,200 @@
+"""
+Completion Budgeter - adaptive reasoning effort and completion caps for the analyzer.
+
+With ``ANALYZER_BUDGET=adaptive``, instead of always sending
+``reasoning_effort="medium"`` with ``max_completion_tokens=ANALYZER_MAX_TOKENS``,
+the analyzer asks the budgeter. It picks:
+
+- Reasoning effort from the size of the user prompt, using ANALYZER_EFFORT_TIERS.
+  Tiny prompts have few spans to reason about.
+- A completion cap from a per-(mode, effort) model, completion ≈ base + slope·prompt.
+  The model starts from priors and is refit on the observed history of
+  completed calls. Headroom covers the 95th percentile of past overshoot.
+
+A cap that is too small shows up as ``finish_reason == "length"``.
+``should_retry`` lets the analyzer re-issue such a call once with a larger
+budget (``escalate``). Truncated calls are not fed back into the history, but
+each one widens the headroom for its mode.
+
+``ANALYZER_BUDGET=fixed`` (the default) keeps the previous behaviour (medium,
+ANALYZER_MAX_TOKENS). Adaptive lowers the effort for tiny prompts, which changes
+their output, so it is opt-in. Any other value is a ValueError when the analyzer
+is built (at startup with STARTUP_WARMUP), not a silent switch to adaptive.
+Prompt sizes use a ~4 chars/token estimate; tiers and caps do not need exact
+counts and this keeps the tokenizer off the request path.
+"""
+
+import os
+import threading
+from collections import deque
+from dataclasses import dataclass
+from typing import Deque, Dict, List, Optional, Tuple
+
+from ..config import ANALYZER_MAX_TOKENS
+
+EFFORTS = ("minimal", "low", "medium", "high")
+STRATEGIES = ("fixed", "adaptive")
+
+# Priors (completion tokens incl. reasoning) before enough history exists
+_PRIOR_BASE = {"low": 2500, "medium": 5000, "high": 10000, "minimal": 1500}
+_PRIOR_SLOPE = 8.0
+_PRIOR_HEADROOM = 2.0
+# Fewer guideline rules -> less output than "both"
+_MODE_FACTOR = {"both": 1.0, "factuality": 0.7, "faithfulness": 0.7}
+
+MIN_OBSERVATIONS = 10
+HISTORY_SIZE = 200
+SAFETY = 1.2
+
+
+def estimate_prompt_tokens(text: str) -> int:
+    return max(1, len(text or "") // 4)
+
+
+def parse_effort_tiers(spec: str) -> List[Tuple[float, str]]:
+    """'50:low,inf:medium' -> [(50, 'low'), (inf, 'medium')] (upper bound in prompt tokens)."""
+    tiers = []
+    for part in spec.split(","):
+        if not part.strip():
+            continue
+        bound, effort = part.split(":")
+        effort = effort.strip()
+        if effort not in EFFORTS:
+            raise ValueError(f"Unknown reasoning effort {effort!r} in ANALYZER_EFFORT_TIERS")
+        tiers.append((float(bound), effort))
+    return sorted(tiers) or [(float("inf"), "medium")]
+
+
+@dataclass
+class BudgetDecision:
+    reasoning_effort: str
+    max_completion_tokens: int
+    prompt_tokens: int
+    predicted_tokens: int
+    source: str  # fixed | prior | history
+    attempt: int = 1
+
+
+class CompletionBudgeter:
+    def __init__(
+        self,
+        max_tokens: int,
+        strategy: str = "adaptive",
+        effort_tiers: str = "50:low,inf:medium",
+        min_cap: int = 4000,
+        escalation: float = 2.5,
+    ):
+        if strategy not in STRATEGIES:
+            raise ValueError(f"ANALYZER_BUDGET must be one of {STRATEGIES}, got {strategy!r}")
+        self.max_tokens = max_tokens
+        self.strategy = strategy
+        self.tiers = parse_effort_tiers(effort_tiers)
+        self.min_cap = min(min_cap, max_tokens)
+        self.escalation = escalation
+        self._history: Dict[Tuple[str, str], Deque[Tuple[int, int]]] = {}
+        self._truncations: Dict[Tuple[str, str], int] = {}
+        self._fits: Dict[Tuple[str, str], Tuple[float, float, float]] = {}
+        self._lock = threading.Lock()
+
+    def effort_for(self, prompt_tokens: int) -> str:
+        for bound, effort in self.tiers:
+            if prompt_tokens <= bound:
+                return effort
+        return self.tiers[-1][1]
+
+    def _model(self, mode: str, effort: str) -> Tuple[float, float, float, str]:
+        """(base, slope, headroom, source) for a mode/effort pair."""
+        key = (mode, effort)
+        fit = self._fits.get(key)
+        if fit is not None:
+            base, slope, headroom = fit
+            source = "history"
+        else:
+            factor = _MODE_FACTOR.get(mode, 1.0)
+            base, slope, headroom = _PRIOR_BASE[effort] * factor, _PRIOR_SLOPE * factor, _PRIOR_HEADROOM
+            source = "prior"
+        # Each recent truncation widens the margin until the history catches up
+        headroom *= 1.0 + 0.25 * min(self._truncations.get(key, 0), 4)
+        return base, slope, headroom, source
+
+    def decide(self, user_prompt: str, mode: str) -> BudgetDecision:
+        prompt_tokens = estimate_prompt_tokens(user_prompt)
+        if self.strategy == "fixed":
+            # The cap is fixed; the prediction (for pre-flight estimates) still comes from the medium model
+            base, slope, _, _ = self._model(mode, "medium")
+            predicted = min(self.max_tokens, base + slope * prompt_tokens)
+            return BudgetDecision("medium", self.max_tokens, prompt_tokens, int(predicted), "fixed")
+        effort = self.effort_for(prompt_tokens)
+        base, slope, headroom, source = self._model(mode, effort)
+        predicted = base + slope * prompt_tokens
+        cap = int(min(self.max_tokens, max(self.min_cap, predicted * headroom)))
+        return BudgetDecision(effort, cap, prompt_tokens, int(predicted), source)
+
+    def should_retry(self, decision: BudgetDecision, finish_reason: Optional[str]) -> bool:
+        """Retry once, and only when the cap (not the model) ended the completion."""
+        return finish_reason == "length" and decision.attempt == 1 and decision.max_completion_tokens < self.max_tokens
+
+    def escalate(self, decision: BudgetDecision, mode: str) -> BudgetDecision:
+        with self._lock:
+            key = (mode, decision.reasoning_effort)
+            self._truncations[key] = self._truncations.get(key, 0) + 1
+        cap = int(min(self.max_tokens, decision.max_completion_tokens * self.escalation))
+        return BudgetDecision(decision.reasoning_effort, cap, decision.prompt_tokens,
+                              decision.predicted_tokens, decision.source, attempt=decision.attempt + 1)
+
+    def observe(self, decision: BudgetDecision, mode: str, completion_tokens: Optional[int], finish_reason: Optional[str]) -> None:
+        """Feed a completed (non-truncated) call back into the per-mode history."""
+        if decision.source == "fixed" or not completion_tokens or finish_reason == "length":
+            return
+        key = (mode, decision.reasoning_effort)
+        with self._lock:
+            history = self._history.setdefault(key, deque(maxlen=HISTORY_SIZE))
+            history.append((decision.prompt_tokens, int(completion_tokens)))
+            if self._truncations.get(key):
+                self._truncations[key] -= 1
+            if len(history) >= MIN_OBSERVATIONS:
+                self._fits[key] = self._fit(history)
+
+    @staticmethod
+    def _fit(history: Deque[Tuple[int, int]]) -> Tuple[float, float, float]:
+        # numpy is only needed once history exists; keep it out of server import
+        import numpy as np
+
+        data = np.asarray(history, dtype=np.float64)
+        x, y = data[:, 0], data[:, 1]
+        if np.ptp(x) > 0:
+            slope, base = np.polyfit(x, y, 1)
+        else:
+            slope, base = 0.0, float(y.mean())
+        slope, base = max(0.0, float(slope)), max(1.0, float(base))
+        predicted = np.maximum(base + slope * x, 1.0)
+        overshoot = float(np.percentile(y / predicted, 95))
+        headroom = min(3.0, max(1.0, overshoot)) * SAFETY
+        return base, slope, headroom
+
+    def snapshot(self) -> Dict[str, Dict[str, float]]:
+        """Current per-mode/effort model, for debugging and bench reports."""
+        out = {}
+        for mode, effort in sorted(set(self._history) | set(self._fits)):
+            base, slope, headroom, source = self._model(mode, effort)
+            out[f"{mode}/{effort}"] = {
+                "base": round(base, 1), "slope": round(slope, 3), "headroom": round(headroom, 3),
+                "observations": len(self._history.get((mode, effort), ())), "source": source,
+            }
+        return out
+
+
+_budgeter: Optional[CompletionBudgeter] = None
+
+
+def get_completion_budgeter() -> CompletionBudgeter:
+    """Process-wide budgeter so history accumulates across requests."""
+    global _budgeter
+    if _budgeter is None:
+        _budgeter = CompletionBudgeter(
+            max_tokens=ANALYZER_MAX_TOKENS,
+            strategy=os.getenv("ANALYZER_BUDGET", "fixed").strip().lower(),
+            effort_tiers=os.getenv("ANALYZER_EFFORT_TIERS", "50:low,inf:medium"),
+            min_cap=int(os.getenv("ANALYZER_MIN_COMPLETION_TOKENS", "4000")),
+        )
+    return _budgeter
@@ -0,0 +1,158 @@
+"""
+Cancellation on client disconnect for LLM-backed routes.
+
+``run_until_disconnect`` runs a route's agent call as a task and watches the
+ASGI receive channel at the same time. If the client goes away (a closed tab
+during a multi-minute analysis), the task is cancelled. That aborts the
+upstream HTTP request and frees the route concurrency slot, so the rest of the
+completion is never paid for. The route then raises ``ClientDisconnected``,
+which main.py answers with status 499 (client closed request). Cancelled
+work is therefore counted apart from 5xx failures.
+
+Identical concurrent requests can share one call by passing a ``key``
+(single-flight; used for analyze). A shared call runs in the context of the
+request that started it (deadline, usage attribution), so the key must
+include whatever of that context the joiners have to share. Analyze keys on
+the client and deadline budget as well as the prompt. A shared call is
+cancelled only when its last waiter disconnects.
+
+Streams and WebSocket turns do not return a single result, so they cannot
+go through ``run_until_disconnect``. They hold ``llm_slot()`` for as long as
+their upstream work runs: the SSE generators of analyze?then=initiate and
+prepare/stream for the whole stream, and a refinement session for each turn.
+When the generator closes early or a turn is cancelled, ``cancel_tasks``
+aborts the work still running and the route records it as ``cancelled``.
+
+Configuration:
+- LLM_ROUTE_CONCURRENCY: max route calls running agent work at once per
+  worker (0 = unlimited). Queued calls are also cancelled on disconnect.
+"""
+
+import asyncio
+import contextlib
+import copy
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Optional
+
+from starlette.requests import Request
+
+from ..config import LLM_ROUTE_CONCURRENCY
+from ..observability.metrics import CLIENT_DISCONNECTS, SINGLE_FLIGHT_JOINS
+
+CLIENT_CLOSED_REQUEST = 499
+
+
+class ClientDisconnected(Exception):
+    """The client went away before the route finished; the work was cancelled."""
+
+
+class _Flight:
+    __slots__ = ("task", "waiters", "shared")
+
+    def __init__(self, task: asyncio.Task):
+        self.task = task
+        self.waiters = 0
+        self.shared = False
+
+
+_flights: Dict[str, _Flight] = {}
+_limiter: Optional[asyncio.Semaphore] = None
+
+
+def _get_limiter() -> Optional[asyncio.Semaphore]:
+    global _limiter
+    if LLM_ROUTE_CONCURRENCY > 0 and _limiter is None:
+        _limiter = asyncio.Semaphore(LLM_ROUTE_CONCURRENCY)
+    return _limiter
+
+
+@contextlib.asynccontextmanager
+async def llm_slot() -> AsyncIterator[None]:
+    """Hold one LLM_ROUTE_CONCURRENCY slot (waiting for it if needed); a no-op when unlimited."""
+    limiter = _get_limiter()
+    if limiter is None:
+        yield
+        return
+    async with limiter:
+        yield
+
+
+async def _limited(factory: Callable[[], Awaitable[Any]]) -> Any:
+    async with llm_slot():
+        return await factory()
+
+
+def record_cancelled(route: str) -> None:
+    """Count upstream work of ``route`` aborted because its client went away or cancelled it."""
+    CLIENT_DISCONNECTS.labels(route, "cancelled").inc()
+
+
+def cancel_tasks(*tasks: Optional[asyncio.Task]) -> bool:
+    """Cancel the given tasks that are still running; True if there were any."""
+    pending = [task for task in tasks if task is not None and not task.done()]
+    for task in pending:
+        task.cancel()
+    return bool(pending)
+
+
+async def _wait_for_disconnect(request: Request) -> None:
+    # The body was already read by FastAPI, so the next message is the disconnect
+    while True:
+        message = await request.receive()
+        if message["type"] == "http.disconnect":
+            return
+
+
+def _start_flight(key: Optional[str], factory: Callable[[], Awaitable[Any]]) -> _Flight:
+    if key is not None:
+        flight = _flights.get(key)
+        if flight is not None and not flight.task.done():
+            flight.shared = True
+            return flight
+    flight = _Flight(asyncio.create_task(_limited(factory)))
+    if key is not None:
+        _flights[key] = flight
+
+        def forget(_task: asyncio.Task) -> None:
+            if _flights.get(key) is flight:
+                del _flights[key]
+
+        flight.task.add_done_callback(forget)
+    return flight
+
+
+async def run_until_disconnect(
+    request: Request,
+    factory: Callable[[], Awaitable[Any]],
+    *,
+    route: str,
+    key: Optional[str] = None,
+) -> Any:
+    """Await ``factory()`` unless the client disconnects first (then raise ClientDisconnected).
+
+    ``factory`` is called only when no identical call (same ``key``) is in flight.
+    """
+    flight = _start_flight(key, factory)
+    joined = flight.waiters > 0
+    if joined:
+        SINGLE_FLIGHT_JOINS.labels(route).inc()
+    flight.waiters += 1
+    watcher = asyncio.create_task(_wait_for_disconnect(request))
+    try:
+        await asyncio.wait({flight.task, watcher}, return_when=asyncio.FIRST_COMPLETED)
+        if not flight.task.done():
+            # Others may still want the result; only the last waiter cancels
+            if flight.waiters > 1:
+                CLIENT_DISCONNECTS.labels(route, "shared").inc()
+            else:
+                record_cancelled(route)
+                flight.task.cancel()
+            raise ClientDisconnected(route)
+        result = flight.task.result()
+        # Waiters of a shared call get their own copy; routes normalize results in place
+        return copy.deepcopy(result) if flight.shared else result
+    finally:
+        flight.waiters -= 1
+        watcher.cancel()
+        # Handler cancelled (e.g. shutdown) with nobody else waiting
+        if flight.waiters == 0 and not flight.task.done():
+            flight.task.cancel()
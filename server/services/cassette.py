@@ -0,0 +1,280 @@
+"""
+Record/replay cassettes for LLM calls.
+
+CassetteTransport wraps the httpx transport under the shared OpenAI client
+(see ``openai_client``), so every ``chat.completions.create`` made by the
+agents passes through it:
+
+- record: forward to the real (or mock) transport and store the exchange.
+- replay: serve stored exchanges only; a missing cassette is an error.
+- auto:   replay when a cassette exists, record otherwise.
+
+Each cassette is one gzip-compressed JSON file named after the SHA-256 of the
+canonical request (method, path, JSON body with sorted keys; no headers, so
+API keys never reach disk and cassettes work against any base URL). The
+completion budget fields (``max_completion_tokens``, ``max_tokens``,
+``reasoning_effort``) are left out of the key: the adaptive analyzer budget
+picks them from in-process history, so a replay would otherwise miss whenever
+that history differs from the recording run. The stored request keeps them.
+
+Identical requests share one file holding their exchanges in order. The
+analyzer's truncated first call and its escalated retry differ only in budget
+fields, so both land there. Replay serves the Nth identical request the Nth
+exchange, so the truncation path replays too. After the last exchange it
+starts over from the first, which keeps repeated passes over a dataset (bench
+concurrency levels) in step. A recording run rewrites a file on the first
+exchange it records for a key and appends the rest.
+
+Each exchange also keeps the time to response headers, the total time and,
+for streaming responses, every SSE chunk with its offset. Replay sleeps for
+the same offsets scaled by ``time_scale`` (0 disables the delays), which
+reproduces production timing deterministically. A file written by another
+cassette version raises CassetteVersionError instead of replaying or missing.
+"""
+
+import asyncio
+import codecs
+import gzip
+import hashlib
+import json
+import logging
+import os
+import time
+from pathlib import Path
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+CASSETTE_VERSION = 3
+MODES = ("off", "record", "replay", "auto")
+
+# Response headers worth keeping; everything else (cookies, org ids) is dropped
+_KEPT_HEADERS = {
+    "content-type",
+    "openai-processing-ms",
+    "retry-after",
+    "retry-after-ms",
+    "x-request-id",
+}
+
+
+# Request fields chosen by the completion budgeter rather than by the request's content
+_BUDGET_FIELDS = ("max_completion_tokens", "max_tokens", "reasoning_effort")
+
+
+class CassetteMissError(LookupError):
+    """Raised in replay mode when no cassette exists for a request."""
+
+
+class CassetteVersionError(ValueError):
+    """Raised when a cassette file was written by a different CASSETTE_VERSION."""
+
+
+def request_key(method: str, path: str, body: bytes) -> str:
+    """Content address of a request: SHA-256 over its canonical form."""
+    try:
+        canonical_body: Any = json.loads(body) if body else None
+    except ValueError:
+        canonical_body = body.decode("utf-8", errors="replace")
+    if isinstance(canonical_body, dict):
+        canonical_body = {k: v for k, v in canonical_body.items() if k not in _BUDGET_FIELDS}
+    canonical = json.dumps(
+        {"method": method.upper(), "path": path.rstrip("/"), "body": canonical_body},
+        sort_keys=True,
+        separators=(",", ":"),
+        ensure_ascii=False,
+    )
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+def _kept_headers(headers: httpx.Headers) -> Dict[str, str]:
+    return {k: v for k, v in headers.items() if k.lower() in _KEPT_HEADERS or k.lower().startswith("x-ratelimit-")}
+
+
+class _RecordingStream(httpx.AsyncByteStream):
+    """Passes SSE bytes through while noting each chunk's offset; saves on close."""
+
+    def __init__(self, inner: httpx.AsyncByteStream, started: float, on_complete):
+        self._inner = inner
+        self._started = started
+        self._on_complete = on_complete
+        self._chunks: List[Dict[str, Any]] = []
+        self._finished = False
+        self._saved = False
+        # Network chunks can split a multi-byte character
+        self._decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+
+    async def __aiter__(self) -> AsyncIterator[bytes]:
+        async for part in self._inner:
+            self._chunks.append({
+                "t_ms": round((time.perf_counter() - self._started) * 1000, 3),
+                "data": self._decoder.decode(part),
+            })
+            yield part
+        self._finished = True
+
+    async def aclose(self) -> None:
+        await self._inner.aclose()
+        # A stream abandoned midway is not a faithful recording
+        if self._finished and not self._saved:
+            self._saved = True
+            self._on_complete(self._chunks, round((time.perf_counter() - self._started) * 1000, 3))
+
+
+class _ReplayStream(httpx.AsyncByteStream):
+    def __init__(self, chunks: List[Dict[str, Any]], headers_ms: float, time_scale: float):
+        self._chunks = chunks
+        self._headers_ms = headers_ms
+        self._time_scale = time_scale
+
+    async def __aiter__(self) -> AsyncIterator[bytes]:
+        elapsed = self._headers_ms
+        for chunk in self._chunks:
+            wait = (chunk["t_ms"] - elapsed) / 1000 * self._time_scale
+            if wait > 0:
+                await asyncio.sleep(wait)
+            elapsed = chunk["t_ms"]
+            yield chunk["data"].encode("utf-8")
+
+
+class CassetteTransport(httpx.AsyncBaseTransport):
+    def __init__(
+        self,
+        directory: str,
+        mode: str = "auto",
+        inner: Optional[httpx.AsyncBaseTransport] = None,
+        time_scale: float = 1.0,
+    ):
+        if mode not in MODES or mode == "off":
+            raise ValueError(f"Unsupported cassette mode: {mode!r}")
+        self.directory = Path(directory)
+        self.mode = mode
+        self.inner = inner
+        self.time_scale = time_scale
+        self.stats = {"recorded": 0, "replayed": 0, "missed": 0}
+        # Exchanges recorded by this transport, and replays served, per key
+        self._recorded: Dict[str, List[Dict[str, Any]]] = {}
+        self._replayed: Dict[str, int] = {}
+        if mode != "replay":
+            self.directory.mkdir(parents=True, exist_ok=True)
+
+    def path_for(self, key: str) -> Path:
+        return self.directory / f"{key}.json.gz"
+
+    def load(self, key: str) -> Optional[Dict[str, Any]]:
+        path = self.path_for(key)
+        if not path.exists():
+            return None
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            cassette = json.load(f)
+        version = cassette.get("version")
+        if version != CASSETTE_VERSION:
+            raise CassetteVersionError(
+                f"Cassette {path} has version {version}; this build reads version {CASSETTE_VERSION}. Re-record it."
+            )
+        return cassette
+
+    def next_exchange(self, key: str) -> Optional[Dict[str, Any]]:
+        """The exchange for the next replay of ``key``, cycling through the recorded ones."""
+        cassette = self.load(key)
+        if cassette is None or not cassette.get("exchanges"):
+            return None
+        exchanges = cassette["exchanges"]
+        count = self._replayed.get(key, 0)
+        self._replayed[key] = count + 1
+        return exchanges[count % len(exchanges)]
+
+    def save(self, key: str, record: Dict[str, Any]) -> None:
+        exchanges = self._recorded.setdefault(key, [])
+        exchanges.append(record)
+        path = self.path_for(key)
+        tmp = path.with_suffix(f".tmp{os.getpid()}")
+        with gzip.open(tmp, "wt", encoding="utf-8") as f:
+            json.dump(
+                {"version": CASSETTE_VERSION, "key": key, "exchanges": exchanges},
+                f, ensure_ascii=False, separators=(",", ":"),
+            )
+        os.replace(tmp, path)
+        self.stats["recorded"] += 1
+        logger.info("[cassette] recorded %s #%d (%s ms)", key[:12], len(exchanges), record["response"]["total_ms"])
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        body = await request.aread()
+        key = request_key(request.method, request.url.path, body)
+
+        if self.mode in ("replay", "auto"):
+            record = self.next_exchange(key)
+            if record is not None:
+                self.stats["replayed"] += 1
+                return await self._replay(record, request)
+            if self.mode == "replay":
+                self.stats["missed"] += 1
+                raise CassetteMissError(f"No cassette for {request.method} {request.url.path} (key {key}) in {self.directory}")
+
+        if self.inner is None:
+            raise CassetteMissError("Cassette recording needs an inner transport")
+        return await self._record(key, body, request)
+
+    async def _record(self, key: str, body: bytes, request: httpx.Request) -> httpx.Response:
+        started = time.perf_counter()
+        response = await self.inner.handle_async_request(request)
+        headers_ms = round((time.perf_counter() - started) * 1000, 3)
+
+        try:
+            request_body: Any = json.loads(body) if body else None
+        except ValueError:
+            request_body = body.decode("utf-8", errors="replace")
+        record: Dict[str, Any] = {
+            "recorded_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "request": {"method": request.method, "path": request.url.path, "body": request_body},
+            "response": {
+                "status": response.status_code,
+                "headers": _kept_headers(response.headers),
+                "headers_ms": headers_ms,
+            },
+        }
+
+        is_stream = response.headers.get("content-type", "").startswith("text/event-stream")
+        if is_stream and response.headers.get("content-encoding"):
+            logger.warning("[cassette] not recording compressed stream %s", key[:12])
+            return response
+        if is_stream:
+            def on_complete(chunks: List[Dict[str, Any]], total_ms: float) -> None:
+                record["response"].update(chunks=chunks, total_ms=total_ms)
+                self.save(key, record)
+
+            stream = _RecordingStream(response.stream, started, on_complete)
+            return httpx.Response(response.status_code, headers=response.headers, stream=stream, request=request)
+
+        content = await response.aread()
+        await response.aclose()
+        record["response"].update(
+            body=content.decode("utf-8", errors="replace"),
+            total_ms=round((time.perf_counter() - started) * 1000, 3),
+        )
+        self.save(key, record)
+        # The body was consumed; hand back a fresh response without the
+        # original content-encoding since the bytes are already decoded
+        headers = [(k, v) for k, v in response.headers.items() if k.lower() not in ("content-encoding", "content-length")]
+        return httpx.Response(response.status_code, headers=headers, content=content, request=request)
+
+    async def _replay(self, record: Dict[str, Any], request: httpx.Request) -> httpx.Response:
+        stored = record["response"]
+        headers = stored.get("headers", {})
+        if "chunks" in stored:
+            await self._sleep(stored.get("headers_ms", 0))
+            stream = _ReplayStream(stored["chunks"], stored.get("headers_ms", 0), self.time_scale)
+            return httpx.Response(stored["status"], headers=headers, stream=stream, request=request)
+        await self._sleep(stored.get("total_ms", 0))
+        return httpx.Response(stored["status"], headers=headers, content=stored.get("body", "").encode("utf-8"), request=request)
+
+    async def _sleep(self, ms: float) -> None:
+        seconds = ms / 1000 * self.time_scale
+        if seconds > 0:
+            await asyncio.sleep(seconds)
+
+    async def aclose(self) -> None:
+        if self.inner is not None:
+            await self.inner.aclose()
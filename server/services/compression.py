@@ -0,0 +1,323 @@
+"""
+Compressed request and response bodies.
+
+Analysis responses carry the annotated prompt, every risk token with its
+reasoning and mitigation text, and the risk assessment. Refine, initiate and
+prepare send the same analysis back up. On slow client links the transfer
+takes longer than the server work. ``CompressionMiddleware`` handles both
+directions:
+
+- Responses: the encoding is negotiated from ``Accept-Encoding`` in
+  RESPONSE_COMPRESSION order (default ``zstd,br,gzip``). zstd needs the
+  ``zstandard`` package and br needs ``brotli``; when a package is missing its
+  encoding is skipped. Bodies smaller than COMPRESSION_MIN_SIZE bytes,
+  server-sent events (each event must reach the client when it is sent),
+  responses that are already encoded and 204/304 responses are sent as they
+  are. An empty RESPONSE_COMPRESSION disables response compression.
+- Requests: a body with ``Content-Encoding`` gzip, deflate, br or zstd is
+  decompressed before the route sees it. Unsupported encodings get a 415. A
+  body that inflates beyond MAX_DECOMPRESSED_BODY bytes gets a 413, which
+  guards against decompression bombs.
+
+``echo_compression_saved_bytes_total`` counts the bytes not sent or received,
+and ``echo_compression_cpu_seconds`` the CPU time spent on each body.
+Compression runs on the event loop. The fast levels used here (gzip 6,
+zstd 3, br 4) take a few milliseconds for a megabyte of analysis JSON.
+"""
+
+import io
+import json
+import time
+import zlib
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from ..config import COMPRESSION_MIN_SIZE, MAX_DECOMPRESSED_BODY, RESPONSE_COMPRESSION
+from ..observability.metrics import COMPRESSION_CPU_SECONDS, COMPRESSION_SAVED_BYTES
+
+try:
+    import zstandard
+except ImportError:  # optional
+    zstandard = None
+
+try:
+    import brotli
+except ImportError:  # optional
+    try:
+        import brotlicffi as brotli
+    except ImportError:
+        brotli = None
+
+_NOT_COMPRESSED_TYPES = ("text/event-stream", "image/", "audio/", "video/", "application/zip", "application/gzip")
+_READ_CHUNK = 64 * 1024
+
+
+class _Compressor:
+    """Incremental compressor; each ``compress`` call returns all output produced so far."""
+
+    def __init__(self, encoding: str):
+        self.encoding = encoding
+        if encoding == "zstd":
+            self._obj = zstandard.ZstdCompressor(level=3).compressobj()
+        elif encoding == "br":
+            self._obj = brotli.Compressor(quality=4)
+        else:
+            self._obj = zlib.compressobj(6, zlib.DEFLATED, 31)  # wbits 31 = gzip container
+
+    def compress(self, data: bytes, final: bool) -> bytes:
+        if self.encoding == "zstd":
+            out = self._obj.compress(data)
+            return out + self._obj.flush(
+                zstandard.COMPRESSOBJ_FLUSH_FINISH if final else zstandard.COMPRESSOBJ_FLUSH_BLOCK
+            )
+        if self.encoding == "br":
+            out = self._obj.process(data)
+            return out + (self._obj.finish() if final else self._obj.flush())
+        out = self._obj.compress(data)
+        return out + self._obj.flush(zlib.Z_FINISH if final else zlib.Z_SYNC_FLUSH)
+
+
+def available_encodings() -> List[str]:
+    """Response encodings from RESPONSE_COMPRESSION whose codec is installed, in preference order."""
+    installed = {"gzip": True, "zstd": zstandard is not None, "br": brotli is not None}
+    names = [name.strip().lower() for name in RESPONSE_COMPRESSION.split(",") if name.strip()]
+    return [name for name in names if installed.get(name)]
+
+
+def negotiate(accept_encoding: str, encodings: List[str]) -> Optional[str]:
+    """The first of ``encodings`` the client accepts (q > 0), or None."""
+    accepted: Dict[str, float] = {}
+    for part in accept_encoding.split(","):
+        name, _, params = part.strip().partition(";")
+        q = 1.0
+        for param in params.split(";"):
+            key, _, value = param.strip().partition("=")
+            if key == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        if name:
+            accepted[name.strip().lower()] = q
+    for encoding in encodings:
+        q = accepted.get(encoding, accepted.get("*", 0.0))
+        if q > 0:
+            return encoding
+    return None
+
+
+def decompress(body: bytes, encoding: str, limit: int) -> bytes:
+    """Decode a request body.
+
+    Raises LookupError for an unsupported encoding, OverflowError when the
+    output would exceed ``limit`` bytes and ValueError for a corrupt body.
+    """
+    out = io.BytesIO()
+
+    def write(chunk: bytes) -> None:
+        if out.tell() + len(chunk) > limit:
+            raise OverflowError(f"Decompressed body exceeds {limit} bytes")
+        out.write(chunk)
+
+    try:
+        if encoding in ("gzip", "x-gzip", "deflate"):
+            # gzip header, or zlib-wrapped deflate (auto-detected), or raw deflate
+            obj = zlib.decompressobj(47 if encoding != "deflate" or body[:1] == b"\x78" else -15)
+            data = body
+            while data:
+                write(obj.decompress(data, _READ_CHUNK))
+                data = obj.unconsumed_tail
+            write(obj.flush())
+        elif encoding == "zstd" and zstandard is not None:
+            with zstandard.ZstdDecompressor().stream_reader(io.BytesIO(body)) as reader:
+                while True:
+                    chunk = reader.read(_READ_CHUNK)
+                    if not chunk:
+                        break
+                    write(chunk)
+        elif encoding == "br" and brotli is not None:
+            obj = brotli.Decompressor()
+            for start in range(0, len(body), _READ_CHUNK):
+                write(obj.process(body[start:start + _READ_CHUNK]))
+        else:
+            raise LookupError(encoding)
+    except (OverflowError, LookupError):
+        raise
+    except Exception as e:
+        raise ValueError(f"Invalid {encoding} request body: {e}") from e
+    return out.getvalue()
+
+
+def _header(headers: List[Tuple[bytes, bytes]], name: bytes) -> str:
+    for key, value in headers:
+        if key.lower() == name:
+            return value.decode("latin-1")
+    return ""
+
+
+async def _send_error(send: Callable, status: int, detail: str) -> None:
+    body = json.dumps({"detail": detail}).encode("utf-8")
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())],
+    })
+    await send({"type": "http.response.body", "body": body})
+
+
+class CompressionMiddleware:
+    """Pure ASGI middleware: decodes compressed request bodies and compresses responses."""
+
+    def __init__(self, app, min_size: int = COMPRESSION_MIN_SIZE, max_request_body: int = MAX_DECOMPRESSED_BODY):
+        self.app = app
+        self.min_size = min_size
+        self.max_request_body = max_request_body
+        self.encodings = available_encodings()
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        headers = list(scope.get("headers") or [])
+        content_encoding = _header(headers, b"content-encoding").strip().lower()
+        if content_encoding and content_encoding != "identity":
+            decoded = await self._decode_request(scope, receive, send, headers, content_encoding)
+            if decoded is None:
+                return
+            scope, receive = decoded
+
+        encoding = negotiate(_header(headers, b"accept-encoding"), self.encodings) if self.encodings else None
+        if encoding is None or scope.get("method") == "HEAD":
+            await self.app(scope, receive, send)
+            return
+        await self.app(scope, receive, _ResponseCompressor(send, encoding, self.min_size).send)
+
+    async def _decode_request(self, scope, receive, send, headers, encoding) -> Optional[Tuple[Dict[str, Any], Callable]]:
+        chunks: List[bytes] = []
+        while True:
+            message = await receive()
+            if message["type"] == "http.disconnect":
+                return None
+            chunks.append(message.get("body", b""))
+            if not message.get("more_body", False):
+                break
+        raw = b"".join(chunks)
+
+        started = time.thread_time()
+        try:
+            body = decompress(raw, encoding, self.max_request_body)
+        except LookupError:
+            await _send_error(send, 415, f"Unsupported Content-Encoding: {encoding}")
+            return None
+        except OverflowError as e:
+            await _send_error(send, 413, str(e))
+            return None
+        except ValueError as e:
+            await _send_error(send, 400, str(e))
+            return None
+        COMPRESSION_CPU_SECONDS.labels("request", encoding).observe(time.thread_time() - started)
+        COMPRESSION_SAVED_BYTES.labels("request", encoding).inc(max(0, len(body) - len(raw)))
+
+        headers = [
+            (key, value) for key, value in headers if key.lower() not in (b"content-encoding", b"content-length")
+        ]
+        headers.append((b"content-length", str(len(body)).encode()))
+        delivered = False
+
+        async def decoded_receive():
+            nonlocal delivered
+            if delivered:
+                return await receive()
+            delivered = True
+            return {"type": "http.request", "body": body, "more_body": False}
+
+        return {**scope, "headers": headers}, decoded_receive
+
+
+class _ResponseCompressor:
+    """Wraps ``send`` for one response: holds back the start message until the body size is known."""
+
+    def __init__(self, send: Callable, encoding: str, min_size: int):
+        self._send = send
+        self.encoding = encoding
+        self.min_size = min_size
+        self._start: Optional[Dict[str, Any]] = None
+        self._buffer: List[bytes] = []
+        self._buffered = 0
+        self._compressor: Optional[_Compressor] = None
+        self._passthrough = False
+        self._raw_bytes = 0
+        self._sent_bytes = 0
+        self._cpu = 0.0
+
+    def _eligible(self, start: Dict[str, Any]) -> bool:
+        headers = start.get("headers") or []
+        if start["status"] in (204, 304) or _header(headers, b"content-encoding"):
+            return False
+        content_type = _header(headers, b"content-type").lower()
+        return not content_type.startswith(_NOT_COMPRESSED_TYPES)
+
+    async def send(self, message: Dict[str, Any]) -> None:
+        if message["type"] == "http.response.start":
+            if self._eligible(message):
+                self._start = message
+            else:
+                self._passthrough = True
+                await self._send(message)
+            return
+        if message["type"] != "http.response.body" or self._passthrough:
+            await self._send(message)
+            return
+
+        body = message.get("body", b"")
+        more_body = message.get("more_body", False)
+        if self._compressor is None:
+            self._buffer.append(body)
+            self._buffered += len(body)
+            if more_body and self._buffered < self.min_size:
+                return
+            body = b"".join(self._buffer)
+            self._buffer = []
+            if self._buffered < self.min_size:
+                # Complete and small: send it unchanged
+                self._passthrough = True
+                await self._send(self._start)
+                await self._send({"type": "http.response.body", "body": body, "more_body": False})
+                return
+            self._compressor = _Compressor(self.encoding)
+            if not more_body:
+                # Whole body in hand: compress it first so the response keeps a Content-Length
+                chunk = self._compress(body, final=True)
+                await self._send(self._encoded_start(len(chunk)))
+                await self._send({"type": "http.response.body", "body": chunk, "more_body": False})
+                self._record()
+                return
+            await self._send(self._encoded_start(None))
+
+        chunk = self._compress(body, final=not more_body)
+        if chunk or not more_body:
+            await self._send({"type": "http.response.body", "body": chunk, "more_body": more_body})
+        if not more_body:
+            self._record()
+
+    def _encoded_start(self, content_length: Optional[int]) -> Dict[str, Any]:
+        original = self._start.get("headers") or []
+        headers = [(key, value) for key, value in original if key.lower() not in (b"content-length", b"vary")]
+        vary = _header(original, b"vary")
+        headers.append((b"content-encoding", self.encoding.encode()))
+        headers.append((b"vary", (f"{vary}, Accept-Encoding" if vary else "Accept-Encoding").encode()))
+        if content_length is not None:
+            headers.append((b"content-length", str(content_length).encode()))
+        return {**self._start, "headers": headers}
+
+    def _compress(self, data: bytes, final: bool) -> bytes:
+        started = time.thread_time()
+        out = self._compressor.compress(data, final)
+        self._cpu += time.thread_time() - started
+        self._raw_bytes += len(data)
+        self._sent_bytes += len(out)
+        return out
+
+    def _record(self) -> None:
+        COMPRESSION_CPU_SECONDS.labels("response", self.encoding).observe(self._cpu)
+        COMPRESSION_SAVED_BYTES.labels("response", self.encoding).inc(max(0, self._raw_bytes - self._sent_bytes))
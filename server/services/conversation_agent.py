@@ -6,25 +6,21 @@ refine their prompts through iterative conversations based on hallucination
 mitigation guidelines.
 """
 
-import openai
 import os
 import asyncio
 import json
-from typing import Dict, Any, List, Optional
-from dotenv import load_dotenv
-from pathlib import Path
+from typing import Callable, Dict, Any, List, Optional
 from ..config import OPENAI_MODEL, TEMPERATURE
-
-load_dotenv()
+from .guidelines import read_data_file
+from .deadline import DeadlineExceeded, run_stage
+from .openai_client import create_chat_completion, get_client, stream_chat_completion
 
 
 class ConversationAgent:
     """Agent specialized in conversational prompt refinement."""
     
-    def __init__(self):
-        self.client = openai.AsyncOpenAI(
-            api_key=os.getenv("OPENAI_API_KEY")
-        )
+    def __init__(self, client=None):
+        self.client = client or get_client()
         self.model = OPENAI_MODEL
         self.max_tokens = int(os.getenv("MAX_TOKENS", "20000"))
         self.temperature = TEMPERATURE
@@ -41,19 +37,13 @@ class ConversationAgent:
         
         filename = mode_files.get(analysis_mode, "m_both.xml")
         
-        # Get the path to the data directory
-        current_dir = Path(__file__).parent.parent
-        guidelines_path = current_dir / "data" / filename
-        
-        try:
-            with open(guidelines_path, 'r', encoding='utf-8') as f:
-                return f.read()
-        except FileNotFoundError:
+        # Read once per process (see guidelines.py)
+        guidelines_xml = read_data_file(filename)
+        if guidelines_xml is None:
             print(f"Warning: Mitigation guidelines file {filename} not found, using default")
             # Fallback to m_both.xml if specified file doesn't exist
-            fallback_path = current_dir / "data" / "m_both.xml"
-            with open(fallback_path, 'r', encoding='utf-8') as f:
-                return f.read()
+            guidelines_xml = read_data_file("m_both.xml")
+        return guidelines_xml
     
     def _get_conversation_system_prompt(self, current_prompt: str, guidelines_xml: str, analysis_output: Optional[Dict[str, Any]] = None) -> str:
         """Generate the system prompt for conversational prompt refinement."""
@@ -238,18 +228,24 @@ class ConversationAgent:
                     "content": "Please rewrite this prompt to be clearer and reduce hallucination risks. Explain what changes you made and why."
                 })
             
-            response = await asyncio.wait_for(
-                self.client.chat.completions.create(
+            response = await run_stage(
+                "conversation",
+                create_chat_completion(
+                    self.client,
+                    agent="conversation",
+                    mode=analysis_mode,
                     model=self.model,
                     messages=messages,
                     max_completion_tokens=self.max_tokens,
                     temperature=self.temperature,
                 ),
-                timeout=self.timeout
+                self.timeout
             )
             
             return response.choices[0].message.content
             
+        except DeadlineExceeded:
+            raise
         except Exception as e:
             raise Exception(f"Chat response failed: {str(e)}")
     
@@ -288,16 +284,69 @@ class ConversationAgent:
             
             print(f"DEBUG: Total messages count: {len(messages)}")
             
-            response = await self.client.chat.completions.create(
-                model=self.model,
-                messages=messages,
-                max_completion_tokens=self.max_tokens,
-                temperature=self.temperature,
-                stream=False
+            response = await run_stage(
+                "conversation",
+                create_chat_completion(
+                    self.client,
+                    agent="conversation",
+                    mode=analysis_mode,
+                    model=self.model,
+                    messages=messages,
+                    max_completion_tokens=self.max_tokens,
+                    temperature=self.temperature,
+                    stream=False
+                ),
+                self.timeout
             )
             
             return response.choices[0].message.content
                     
+        except DeadlineExceeded:
+            raise
         except Exception as e:
             print(f"DEBUG: chat_stream error: {str(e)}")
             raise Exception(f"Chat response failed: {str(e)}")
+
+    def build_system_prompt(
+        self,
+        current_prompt: str,
+        analysis_output: Optional[Dict[str, Any]] = None,
+        analysis_mode: str = "both"
+    ) -> str:
+        """System prompt for a refinement session; built once and reused for every turn."""
+        guidelines_xml = self._load_mitigation_guidelines(analysis_mode)
+        return self._get_conversation_system_prompt(current_prompt, guidelines_xml, analysis_output)
+
+    async def chat_turn(
+        self,
+        system_prompt: str,
+        messages: List[Dict[str, str]],
+        analysis_mode: str = "both",
+        on_delta: Optional[Callable[[str], None]] = None
+    ) -> str:
+        """One refinement turn over a prebuilt system prompt, streaming content deltas to ``on_delta``.
+
+        ``messages`` is the conversation so far, ending with the new user message.
+        """
+        try:
+            response = await run_stage(
+                "conversation",
+                stream_chat_completion(
+                    self.client,
+                    agent="conversation",
+                    mode=analysis_mode,
+                    on_delta=on_delta,
+                    model=self.model,
+                    messages=[{"role": "system", "content": system_prompt}, *messages],
+                    max_completion_tokens=self.max_tokens,
+                    temperature=self.temperature,
+                ),
+                self.timeout
+            )
+            return response.choices[0].message.content
+        except asyncio.CancelledError:
+            raise
+        except DeadlineExceeded:
+            raise
+        except Exception as e:
+            raise Exception(f"Chat response failed: {str(e)}")
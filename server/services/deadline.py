@@ -0,0 +1,165 @@
+"""
+Request deadlines for LLM-backed routes.
+
+Every agent used to wrap its upstream call in its own
+``asyncio.wait_for(timeout=self.timeout)``, with defaults of 40, 60 or 180
+seconds depending on the agent. A request had no overall bound. The
+preparator could spend a full timeout on its primary call and then a full
+timeout again on the variation fallback.
+
+A route now starts a ``Deadline`` (``request_deadline`` dependency) from the
+``X-Request-Timeout`` header (seconds, capped at REQUEST_DEADLINE_MAX), or
+from the route's REQUEST_DEADLINES entry. The deadline lives in a context
+variable, so the agent tasks a route starts inherit it. Each stage awaits its
+upstream call through ``run_stage``:
+
+- the call gets ``min(agent timeout, remaining budget)``;
+- a call that runs out of budget raises ``DeadlineExceeded``, which names the
+  stage. main.py answers it with a 504 whose body names that stage;
+- optional stages (preparator fallbacks, the analyzer's truncation retry) ask
+  ``stage_allowed`` first. They are skipped when less than
+  DEADLINE_MIN_STAGE_SECONDS remain, and the response lists them in the
+  ``X-Deadline-Skipped`` header (``deadline_skipped`` in SSE ``done`` events).
+
+An agent's own timeout still applies, and still raises ``asyncio.TimeoutError``,
+when it is shorter than the remaining budget. Without a deadline (WebSocket
+sessions, the bench) ``run_stage`` is a plain ``wait_for``. A single-flight
+analysis is only shared by identical requests from the same client with the
+same budget, since it runs under the deadline of the request that started it.
+"""
+
+import asyncio
+import time
+from contextvars import ContextVar
+from typing import Any, Awaitable, Dict, List, Optional
+
+from fastapi import Header, HTTPException
+
+from ..config import DEADLINE_MIN_STAGE_SECONDS, REQUEST_DEADLINE_MAX, REQUEST_DEADLINES
+from ..observability.metrics import DEADLINE_EVENTS
+
+DEADLINE_HEADER = "X-Request-Timeout"
+SKIPPED_HEADER = "X-Deadline-Skipped"
+
+
+class DeadlineExceeded(Exception):
+    """The request's deadline ran out during ``stage``."""
+
+    def __init__(self, route: str, stage: str, budget: float, elapsed: float):
+        super().__init__(f"Request deadline of {budget:g}s exceeded during {stage} (after {elapsed:.1f}s)")
+        self.route = route
+        self.stage = stage
+        self.budget = budget
+        self.elapsed = elapsed
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "detail": str(self),
+            "stage": self.stage,
+            "budget_seconds": self.budget,
+            "elapsed_seconds": round(self.elapsed, 3),
+        }
+
+
+class Deadline:
+    """Time budget of one request; shared by every task the request starts."""
+
+    __slots__ = ("route", "budget", "started", "expires_at", "skipped")
+
+    def __init__(self, route: str, budget: float):
+        self.route = route
+        self.budget = budget
+        self.started = time.monotonic()
+        self.expires_at = self.started + budget
+        self.skipped: List[str] = []
+
+    def remaining(self) -> float:
+        return self.expires_at - time.monotonic()
+
+    def exceeded(self, stage: str) -> DeadlineExceeded:
+        DEADLINE_EVENTS.labels(self.route, stage, "exceeded").inc()
+        return DeadlineExceeded(self.route, stage, self.budget, time.monotonic() - self.started)
+
+    def skip(self, stage: str) -> None:
+        DEADLINE_EVENTS.labels(self.route, stage, "skipped").inc()
+        self.skipped.append(stage)
+
+
+_current: ContextVar[Optional[Deadline]] = ContextVar("echo_request_deadline", default=None)
+
+
+def current_deadline() -> Optional[Deadline]:
+    return _current.get()
+
+
+def start_deadline(route: str, header_value: Optional[str] = None) -> Optional[Deadline]:
+    """Start the deadline of the current request; None when the route has no deadline."""
+    budget = float(REQUEST_DEADLINES.get(route, 0) or 0)
+    if header_value:
+        try:
+            budget = float(header_value)
+        except ValueError:
+            budget = 0.0
+        if not 0 < budget < float("inf"):
+            raise HTTPException(status_code=400, detail=f"{DEADLINE_HEADER} must be a positive number of seconds")
+        if REQUEST_DEADLINE_MAX > 0:
+            budget = min(budget, REQUEST_DEADLINE_MAX)
+    deadline = Deadline(route, budget) if budget > 0 else None
+    _current.set(deadline)
+    return deadline
+
+
+def request_deadline(route: str):
+    """FastAPI dependency that starts the request's deadline for ``route``.
+
+    It is async, so it runs in the request's own task and the context variable
+    it sets is visible to the handler and everything the handler starts.
+    """
+    async def dependency(x_request_timeout: Optional[str] = Header(None)) -> Optional[Deadline]:
+        return start_deadline(route, x_request_timeout)
+
+    return dependency
+
+
+async def run_stage(stage: str, awaitable: Awaitable[Any], timeout: Optional[float]) -> Any:
+    """Await ``awaitable`` within ``timeout`` and the remaining request budget.
+
+    Raises DeadlineExceeded when the budget, not ``timeout``, runs out.
+    """
+    deadline = _current.get()
+    if deadline is None:
+        return await asyncio.wait_for(awaitable, timeout=timeout)
+    left = deadline.remaining()
+    if left <= 0:
+        if asyncio.iscoroutine(awaitable):
+            awaitable.close()
+        raise deadline.exceeded(stage)
+    if timeout is not None and timeout < left:
+        return await asyncio.wait_for(awaitable, timeout=timeout)
+    try:
+        return await asyncio.wait_for(awaitable, timeout=left)
+    except asyncio.TimeoutError:
+        raise deadline.exceeded(stage) from None
+
+
+def stage_allowed(stage: str, min_seconds: float = DEADLINE_MIN_STAGE_SECONDS) -> bool:
+    """Whether an optional stage still fits in the budget; a refused stage is recorded as skipped."""
+    deadline = _current.get()
+    if deadline is None or deadline.remaining() >= min_seconds:
+        return True
+    deadline.skip(stage)
+    return False
+
+
+def note_skipped(error: DeadlineExceeded) -> None:
+    """Record an optional stage cut short by the deadline whose failure the caller absorbed."""
+    deadline = _current.get()
+    if deadline is not None:
+        deadline.skipped.append(error.stage)
+
+
+def skipped_headers(deadline: Optional[Deadline]) -> Dict[str, str]:
+    """``X-Deadline-Skipped`` for a response that dropped optional stages, else nothing."""
+    if deadline is None or not deadline.skipped:
+        return {}
+    return {SKIPPED_HEADER: ",".join(dict.fromkeys(deadline.skipped))}
@@ -0,0 +1,221 @@
+"""
+Pre-flight token estimates for LLM-backed requests.
+
+An oversized prompt (or analysis, or conversation) used to show up only when
+the upstream call failed on the context window or came back truncated,
+often after a long wait. ``estimate_<route>`` builds the same system prompts
+the agents would send and counts their tokens with the cached tokenizer
+(services/tokenizer.py). It then adds the expected completion size of each
+upstream call:
+
+- analyzer: the completion budgeter's prediction for the mode (and each split
+  group), capped at the ``max_completion_tokens`` the call will request;
+- initiator, conversation and preparator: ``base + slope * prompt tokens``
+  priors, capped at the agent's ``max_completion_tokens``. The preparator's
+  single mode writes the refined prompt and five variations in one answer.
+
+Guideline XML makes up most of every system prompt and never changes, so its
+token count is computed once per file and only the rest of the prompt is
+tokenized per request.
+
+``check`` enforces two limits per upstream call; 0 disables either one:
+
+- PREFLIGHT_MAX_INPUT_TOKENS: the input is larger than this -> 413.
+- PREFLIGHT_CONTEXT_TOKENS: input plus expected completion does not fit the
+  model's context -> 422. Off by default, since the context depends on the
+  model.
+
+``PreflightRejected`` carries the estimate, and main.py returns it in the
+body. ``/api/estimate/<route>`` returns the same estimate for a request body
+without calling the LLM. Counts use the ``gpt-4`` encoding and per-message
+framing overhead, so treat them as close estimates, not exact usage.
+"""
+
+import functools
+from dataclasses import asdict, dataclass, field
+from typing import Any, Dict, List, Optional, Tuple
+
+from ..config import PREFLIGHT_CONTEXT_TOKENS, PREFLIGHT_MAX_INPUT_TOKENS
+from ..observability.metrics import PREFLIGHT_REJECTIONS
+from .guidelines import GUIDELINE_FILES, MITIGATION_FILES, read_data_file
+from .providers import get_llm_service, get_preparator
+from .tokenizer import count_tokens
+
+# Chat framing: tokens per message plus the primed assistant reply
+_TOKENS_PER_MESSAGE = 3
+_REPLY_PRIMING = 3
+
+# Expected completion tokens = base + slope * tokens of the user's prompt (agent -> (base, slope))
+_COMPLETION_PRIORS = {
+    "initiator": (600, 0.5),
+    "conversation": (500, 1.0),
+    "preparator": (600, 6.0),  # refined prompt + 5 variations
+    "preparator_parallel": (200, 1.2),  # refined prompt only; variations are separate, smaller calls
+}
+
+
+class PreflightRejected(Exception):
+    """A request's token estimate exceeds a configured limit; ``status`` is 413 or 422."""
+
+    def __init__(self, status: int, detail: str, estimate: "Estimate"):
+        super().__init__(detail)
+        self.status = status
+        self.detail = detail
+        self.estimate = estimate
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"detail": self.detail, "estimate": self.estimate.to_dict()}
+
+
+@dataclass
+class CallEstimate:
+    agent: str
+    mode: str
+    input_tokens: int
+    completion_tokens: int  # expected
+    max_completion_tokens: int  # cap the call requests
+
+    @property
+    def context_tokens(self) -> int:
+        return self.input_tokens + self.completion_tokens
+
+
+@dataclass
+class Estimate:
+    route: str
+    calls: List[CallEstimate] = field(default_factory=list)
+
+    @property
+    def input_tokens(self) -> int:
+        return sum(call.input_tokens for call in self.calls)
+
+    @property
+    def completion_tokens(self) -> int:
+        return sum(call.completion_tokens for call in self.calls)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "route": self.route,
+            "input_tokens": self.input_tokens,
+            "completion_tokens": self.completion_tokens,
+            "calls": [asdict(call) for call in self.calls],
+            "limits": {"max_input_tokens": PREFLIGHT_MAX_INPUT_TOKENS, "context_tokens": PREFLIGHT_CONTEXT_TOKENS},
+        }
+
+
+@functools.lru_cache(maxsize=None)
+def _file_tokens(filename: str) -> Tuple[str, int]:
+    text = read_data_file(filename) or ""
+    return text, count_tokens(text) if text else 0
+
+
+def _text_tokens(text: str, mode: str) -> int:
+    """Token count of a system prompt; the mode's guideline files count from the per-file cache."""
+    total = 0
+    for filename in (GUIDELINE_FILES.get(mode), MITIGATION_FILES.get(mode)):
+        if filename is None:
+            continue
+        static, tokens = _file_tokens(filename)
+        if static and static in text:
+            text = text.replace(static, "", 1)
+            total += tokens
+    return total + count_tokens(text)
+
+
+def _messages_tokens(system_prompt: str, mode: str, messages: List[Dict[str, str]]) -> int:
+    total = _text_tokens(system_prompt, mode) + _REPLY_PRIMING + _TOKENS_PER_MESSAGE * (len(messages) + 1)
+    return total + sum(count_tokens(str(message.get("content", ""))) for message in messages)
+
+
+def _prior(agent: str, prompt_tokens: int, cap: int) -> int:
+    base, slope = _COMPLETION_PRIORS[agent]
+    return int(min(cap, base + slope * prompt_tokens))
+
+
+def estimate_analyze(prompt: str, analysis_mode: str = "both") -> Estimate:
+    analyzer = get_llm_service().analyzer
+    user_prompt, prompts = analyzer.request_prompts(prompt, analysis_mode)
+    estimate = Estimate("analyze")
+    for budget_mode, system_prompt in prompts:
+        budget = analyzer.budgeter.decide(user_prompt, budget_mode)
+        # The call cannot produce more than its cap, however large the prediction
+        expected = min(budget.predicted_tokens, budget.max_completion_tokens)
+        estimate.calls.append(CallEstimate(
+            "analyzer", budget_mode, _messages_tokens(system_prompt, analysis_mode, []),
+            expected, budget.max_completion_tokens,
+        ))
+    return estimate
+
+
+def estimate_initiate(prompt: str, analysis_output: Optional[Dict[str, Any]] = None, analysis_mode: str = "both") -> Estimate:
+    initiator = get_llm_service().initiator
+    system_prompt = initiator.build_system_prompt(prompt, analysis_output, analysis_mode)
+    expected = _prior("initiator", count_tokens(prompt), initiator.max_tokens)
+    return Estimate("initiate", [CallEstimate(
+        "initiator", analysis_mode, _messages_tokens(system_prompt, analysis_mode, []), expected, initiator.max_tokens,
+    )])
+
+
+def estimate_refine(
+    prompt: str,
+    conversation_history: List[Dict[str, str]],
+    user_message: str,
+    analysis_output: Optional[Dict[str, Any]] = None,
+    analysis_mode: str = "both",
+) -> Estimate:
+    conversation = get_llm_service().conversation
+    system_prompt = conversation.build_system_prompt(prompt, analysis_output, analysis_mode)
+    messages = [*conversation_history, {"role": "user", "content": user_message}]
+    expected = _prior("conversation", count_tokens(prompt), conversation.max_tokens)
+    return Estimate("refine", [CallEstimate(
+        "conversation", analysis_mode, _messages_tokens(system_prompt, analysis_mode, messages), expected, conversation.max_tokens,
+    )])
+
+
+def estimate_prepare(
+    current_prompt: str,
+    prior_analysis: Dict[str, Any],
+    conversation_history: List[Dict[str, str]],
+    user_final_edits: str = "",
+    analysis_mode: str = "both",
+    parallel: Optional[bool] = None,
+) -> Estimate:
+    """The primary refinement call. The parallel mode's short instruction message and its variation
+    calls (smaller prompts than the primary) are not counted."""
+    preparator = get_preparator()
+    if parallel is None:
+        parallel = preparator.mode == "parallel"
+    system_prompt = preparator.build_refinement_prompt(
+        current_prompt, prior_analysis, conversation_history, user_final_edits, analysis_mode
+    )
+    expected = _prior("preparator_parallel" if parallel else "preparator", count_tokens(current_prompt), preparator.max_tokens)
+    return Estimate("prepare", [CallEstimate(
+        "preparator", analysis_mode, _messages_tokens(system_prompt, analysis_mode, []), expected, preparator.max_tokens,
+    )])
+
+
+def violation(estimate: Estimate) -> Optional[Tuple[int, str, str]]:
+    """(status, limit, detail) for the first limit the estimate exceeds, or None."""
+    for call in estimate.calls:
+        if PREFLIGHT_MAX_INPUT_TOKENS and call.input_tokens > PREFLIGHT_MAX_INPUT_TOKENS:
+            return 413, "input", (
+                f"The {call.agent} request needs about {call.input_tokens} input tokens; "
+                f"the limit is {PREFLIGHT_MAX_INPUT_TOKENS}. Shorten the prompt, analysis or conversation."
+            )
+        if PREFLIGHT_CONTEXT_TOKENS and call.context_tokens > PREFLIGHT_CONTEXT_TOKENS:
+            return 422, "context", (
+                f"The {call.agent} request needs about {call.input_tokens} input and {call.completion_tokens} "
+                f"completion tokens, more than the {PREFLIGHT_CONTEXT_TOKENS}-token context."
+            )
+    return None
+
+
+def check(estimate: Estimate) -> Estimate:
+    """Raise PreflightRejected when the estimate exceeds a limit; returns the estimate otherwise."""
+    rejected = violation(estimate)
+    if rejected is not None:
+        status, limit, detail = rejected
+        PREFLIGHT_REJECTIONS.labels(estimate.route, limit).inc()
+        raise PreflightRejected(status, detail, estimate)
+    return estimate
+
@@ -0,0 +1,198 @@
+"""
+Per-prompt guideline selection for the analyzer system prompt.
+
+Every analysis used to embed the whole guideline file (~26 KB, all 32 rules
+with every example and banner comment), whether or not the prompt could
+trigger a rule. ``select_guidelines`` shrinks it before the prompt is built:
+
+- minified: banner comments and indentation are stripped, and each rule keeps
+  at most GUIDELINE_MAX_EXAMPLES examples. The global rules comment stays.
+- pruned: minified, and only rules that are always on or that local signals
+  point at. A rule is selected when the prompt contains one of its lexical
+  cues, or when a structural signal of its rule/pillar fires. Lexical cues are
+  taken from the guidelines themselves: ``<RISK>`` spans in examples, quoted
+  terms, and "a, b, c" lists in patterns. Structural signals are things like
+  numbers/units (E), URLs and source words (F), dialogue references (G),
+  multi-step markers or several task verbs (G2, J, K), pasted text (J2),
+  math/proof tasks (K3), role-play (H3) and negation (L2). Pillars with no
+  selected rules are dropped.
+
+ANALYZER_GUIDELINES: full (default) | minified | pruned.
+The selection is deterministic and cached per (file, rule set), so prompts
+that select the same rules share one document.
+"""
+
+import functools
+import os
+import re
+from dataclasses import dataclass
+from typing import Dict, FrozenSet, List, Tuple
+
+GUIDELINE_MODES = ("full", "minified", "pruned")
+
+# Broad semantic rules that no cheap signal can rule out
+ALWAYS_ON_RULES = frozenset({"A1", "B1", "B2", "B3", "C1", "C2", "D1", "D2", "I1", "I2", "J1", "L3"})
+
+_MULTI_STEP = r"\b(?:then|after(?:wards| that)?|finally|first(?:ly)?|second(?:ly)?|next|also|step|lastly|additionally)\b|^\s*(?:\d+[.)]|[-*•])\s"
+_SIGNALS: Dict[str, re.Pattern] = {
+    "numbers": re.compile(
+        r"\d|%|[$€£¥]|\b(?:percent|dozen|hundred|thousand|million|billion|budget|cost|price|temperature|weight|"
+        r"distance|speed|duration|hours?|minutes?|seconds?|days?|weeks?|months?|years?|am|pm|kg|km|mb|gb)\b",
+        re.IGNORECASE,
+    ),
+    "sources": re.compile(
+        r"https?://|www\.|\b(?:source|sources|cite|citation|reference|references|according|paper|papers|study|"
+        r"studies|report|article|dataset|benchmark|document|research|search|look up|find|check|literature)\b",
+        re.IGNORECASE,
+    ),
+    "dialogue": re.compile(
+        r"\b(?:earlier|previous(?:ly)?|before|again|you said|as discussed|last time|continue|ignore|forget|"
+        r"disregard|above|instead)\b",
+        re.IGNORECASE,
+    ),
+    "multi_step": re.compile(_MULTI_STEP, re.IGNORECASE | re.MULTILINE),
+    "roleplay": re.compile(r"\b(?:act as|pretend|you are|role|persona|imagine|play)\b", re.IGNORECASE),
+    "negation": re.compile(r"\b(?:not|no|never|don't|do not|without|avoid|except|neither|nor|none)\b|n't\b", re.IGNORECASE),
+    # Acronyms, or capitalized words that do not start a sentence
+    "names": re.compile(r"\b[A-Z]{2,}\b|[a-z,;:]\s+[A-Z][a-z]"),
+    # Pasted data/text the prompt refers to ("Text: ...", quotes, code fences, several lines)
+    "embedded": re.compile(r"\w:\s*\S|[\"“”]|```|\n\s*\S"),
+    "reasoning": re.compile(
+        r"\b(?:solve|prove|proof|derive|calculate|compute|math|problem|equation|logic|puzzle|reason|steps?)\b",
+        re.IGNORECASE,
+    ),
+    "opinion": re.compile(r"\b(?:best|worst|obvious(?:ly)?|clearly|everyone|always|never|should|why)\b", re.IGNORECASE),
+}
+# Imperative task verbs; two or more in one prompt count as multi-step
+_TASK_VERB_RE = re.compile(
+    r"\b(?:analy[sz]e|assess|calculate|compare|compose|create|critique|describe|discuss|draft|evaluate|explain|"
+    r"generate|list|outline|produce|prove|rank|review|rewrite|solve|summari[sz]e|translate|write)\b",
+    re.IGNORECASE,
+)
+_RULE_SIGNALS: Dict[str, Tuple[str, ...]] = {
+    "A2": ("names",),
+    "E": ("numbers",),
+    "F": ("sources",),
+    "G1": ("dialogue",),
+    "G2": ("multi_step",),
+    "H1": ("opinion",),
+    "H2": ("opinion",),
+    "H3": ("roleplay",),
+    "J2": ("multi_step", "embedded"),
+    "J3": ("multi_step",),
+    "K": ("multi_step",),
+    "K3": ("reasoning",),
+    "L1": ("multi_step", "negation"),
+    "L2": ("negation",),
+}
+
+_RULE_BLOCK_RE = re.compile(r'[ \t]*<rule id="(?P<id>\w+)"[^>]*>.*?</rule>[ \t]*\n(?:[ \t]*\n)?', re.DOTALL)
+_PILLAR_RE = re.compile(r'[ \t]*<pillar id="(?P<id>\w+)"[^>]*>(?P<body>.*?)</pillar>[ \t]*\n', re.DOTALL)
+_BANNER_RE = re.compile(r"[ \t]*<!--[^\n]*-->[ \t]*\n")
+_EXAMPLE_RE = re.compile(r"[ \t]*<example>.*?</example>[ \t]*\n", re.DOTALL)
+_RISK_SPAN_RE = re.compile(r"<RISK>(.*?)</RISK>")
+_QUOTED_RE = re.compile(r'["“]([^"”]{2,40})["”]')
+_PATTERN_RE = re.compile(r"<pattern>(.*?)</pattern>", re.DOTALL)
+_PROMPT_WORD_RE = re.compile(r"[\w'%$€£]+")
+_SENTENCE_END_RE = re.compile(r"[.!?](?:\s|$)")
+
+
+@dataclass(frozen=True)
+class GuidelineRule:
+    rule_id: str
+    pillar_id: str
+    cues: FrozenSet[str]  # lowercased words/phrases that point at this rule
+
+
+def _cue_terms(text: str) -> List[str]:
+    return [term.strip().lower() for term in text.split(",") if 0 < len(term.strip()) <= 30]
+
+
+def _rule_cues(block: str) -> FrozenSet[str]:
+    cues = set()
+    for span in _RISK_SPAN_RE.findall(block):
+        cues.add(span.strip().lower())
+    for pattern in _PATTERN_RE.findall(block):
+        cues.update(q.strip().lower() for q in _QUOTED_RE.findall(pattern))
+        # "Deixis without anchor: here, there, then" -> here / there / then
+        if ":" in pattern:
+            cues.update(_cue_terms(pattern.split(":", 1)[1].split("(")[0]))
+    cues = {c.strip('"“”') for c in cues}
+    return frozenset(c for c in cues if c and not c.isdigit())
+
+
+@functools.lru_cache(maxsize=16)
+def guideline_rules(guidelines_xml: str) -> Tuple[GuidelineRule, ...]:
+    """Every rule of a guideline document with its lexical cues."""
+    rules = []
+    for pillar in _PILLAR_RE.finditer(guidelines_xml):
+        for rule in _RULE_BLOCK_RE.finditer(pillar.group("body") + "\n"):
+            rules.append(GuidelineRule(rule.group("id"), pillar.group("id"), _rule_cues(rule.group(0))))
+    return tuple(rules)
+
+
+def _has_cue(prompt_lower: str, words: FrozenSet[str], cues: FrozenSet[str]) -> bool:
+    for cue in cues:
+        if " " in cue or "-" in cue:
+            if cue in prompt_lower:
+                return True
+        elif cue in words:
+            return True
+    return False
+
+
+def select_rules(guidelines_xml: str, prompt: str) -> FrozenSet[str]:
+    """Rule ids worth sending for this prompt (always-on rules included)."""
+    prompt_lower = prompt.lower()
+    words = frozenset(_PROMPT_WORD_RE.findall(prompt_lower))
+    fired = {name for name, signal in _SIGNALS.items() if signal.search(prompt)}
+    # Two or more sentences or task verbs also count as multi-step
+    if len(_SENTENCE_END_RE.findall(prompt.strip())) >= 2 or len(_TASK_VERB_RE.findall(prompt)) >= 2:
+        fired.add("multi_step")
+    selected = set()
+    for rule in guideline_rules(guidelines_xml):
+        signals = _RULE_SIGNALS.get(rule.rule_id, ()) + _RULE_SIGNALS.get(rule.pillar_id, ())
+        if (
+            rule.rule_id in ALWAYS_ON_RULES
+            or any(name in fired for name in signals)
+            or _has_cue(prompt_lower, words, rule.cues)
+        ):
+            selected.add(rule.rule_id)
+    return frozenset(selected)
+
+
+@functools.lru_cache(maxsize=16)
+def minify(guidelines_xml: str, max_examples: int = 1) -> str:
+    """Drop banner comments, examples beyond ``max_examples`` per rule and indentation."""
+    text = _BANNER_RE.sub("", guidelines_xml)
+
+    def trim_examples(rule: re.Match) -> str:
+        kept = 0
+
+        def keep(example: re.Match) -> str:
+            nonlocal kept
+            kept += 1
+            return example.group(0) if kept <= max_examples else ""
+
+        return _EXAMPLE_RE.sub(keep, rule.group(0))
+
+    text = _RULE_BLOCK_RE.sub(trim_examples, text)
+    lines = (line.strip() for line in text.splitlines())
+    return "\n".join(line for line in lines if line)
+
+
+@functools.lru_cache(maxsize=256)
+def prune(guidelines_xml: str, rule_ids: FrozenSet[str]) -> str:
+    """The document with only ``rule_ids``; pillars left without rules are removed."""
+    text = _RULE_BLOCK_RE.sub(lambda m: m.group(0) if m.group("id") in rule_ids else "", guidelines_xml)
+    return _PILLAR_RE.sub(lambda m: m.group(0) if "<rule " in m.group("body") else "", text)
+
+
+def select_guidelines(guidelines_xml: str, prompt: str, mode: str = "full") -> str:
+    """The guideline document to embed for ``prompt`` under ANALYZER_GUIDELINES ``mode``."""
+    if mode == "full" or not guidelines_xml:
+        return guidelines_xml
+    max_examples = int(os.getenv("GUIDELINE_MAX_EXAMPLES", "1"))
+    if mode == "pruned":
+        guidelines_xml = prune(guidelines_xml, select_rules(guidelines_xml, prompt))
+    return minify(guidelines_xml, max_examples)
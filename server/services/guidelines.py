@@ -0,0 +1,67 @@
+"""
+Guideline XML files under ``server/data``, read once per process.
+
+Every analysis, refinement, initiation and preparation embeds one of these
+files in its system prompt. They never change while the server runs, so the
+agents share one cached copy instead of reading the file on each request.
+``pillar_subset`` derives smaller rulesets (selected pillars only) from them,
+also cached, for the analyzer's split mode.
+"""
+
+import functools
+import re
+from pathlib import Path
+from typing import Dict, FrozenSet, Optional
+
+DATA_DIR = Path(__file__).parent.parent / "data"
+
+GUIDELINE_FILES = {
+    "faithfulness": "faithfulness.xml",
+    "factuality": "factuality.xml",
+    "both": "both.xml",
+}
+MITIGATION_FILES = {
+    "faithfulness": "m_faithfulness.xml",
+    "factuality": "m_factuality.xml",
+    "both": "m_both.xml",
+}
+
+# One pillar with its "<!-- ==== X. NAME ==== -->" banner line, if any
+_PILLAR_BLOCK_RE = re.compile(
+    r'(?:[ \t]*<!--[^\n]*-->[ \t]*\n)?[ \t]*<pillar id="(?P<id>\w+)"(?P<attrs>[^>]*)>.*?</pillar>[ \t]*\n(?:[ \t]*\n)?',
+    re.DOTALL,
+)
+_CLASS_ATTR_RE = re.compile(r'\bclass="(\w+)"')
+
+
+@functools.lru_cache(maxsize=None)
+def read_data_file(filename: str) -> Optional[str]:
+    """Contents of ``server/data/<filename>``, or None if it does not exist."""
+    try:
+        return (DATA_DIR / filename).read_text(encoding="utf-8")
+    except FileNotFoundError:
+        return None
+
+
+def preload() -> int:
+    """Read every guideline file into the cache; returns how many were found."""
+    filenames = set(GUIDELINE_FILES.values()) | set(MITIGATION_FILES.values())
+    return sum(read_data_file(name) is not None for name in filenames)
+
+
+@functools.lru_cache(maxsize=None)
+def pillar_classes(filename: str) -> Dict[str, str]:
+    """Pillar id -> class ("prompt" or "meta") for a guideline file."""
+    xml = read_data_file(filename) or ""
+    classes = {}
+    for match in _PILLAR_BLOCK_RE.finditer(xml):
+        cls = _CLASS_ATTR_RE.search(match.group("attrs"))
+        classes[match.group("id")] = cls.group(1) if cls else "prompt"
+    return classes
+
+
+@functools.lru_cache(maxsize=None)
+def pillar_subset(filename: str, pillar_ids: FrozenSet[str]) -> str:
+    """The guideline file with only the given pillars (header and global rules kept)."""
+    xml = read_data_file(filename) or ""
+    return _PILLAR_BLOCK_RE.sub(lambda m: m.group(0) if m.group("id") in pillar_ids else "", xml)
@@ -9,20 +9,17 @@ that initiates the conversation with the user for iterative prompt refinement.
 
 import os
 import json
-import openai
-import asyncio
 import logging
-from pathlib import Path
 from typing import Dict, Any, List, Optional
-from dotenv import load_dotenv
 from ..config import OPENAI_MODEL, TEMPERATURE
-
-load_dotenv()
+from .deadline import DeadlineExceeded, run_stage
+from .guidelines import read_data_file
+from .openai_client import create_chat_completion, get_client
 
 
 class InitiatorAgent:
-    def __init__(self):
-        self.client = openai.AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+    def __init__(self, client=None):
+        self.client = client or get_client()
         self.model = OPENAI_MODEL
         self.temperature = TEMPERATURE
         self.max_tokens = int(os.getenv("MAX_TOKENS", "20000"))
@@ -36,11 +33,10 @@ class InitiatorAgent:
             "both": "m_both.xml",
         }
         filename = mode_files.get(analysis_mode, "m_both.xml")
-        # Look for a server-local data folder first; otherwise fall back
-        data_dir = Path(__file__).parent.parent / "data"
-        file_path = data_dir / filename
-        if file_path.exists():
-            return file_path.read_text(encoding="utf-8")
+        # Server-local data folder, read once per process; otherwise fall back
+        guidelines_xml = read_data_file(filename)
+        if guidelines_xml is not None:
+            return guidelines_xml
         # Fallback: embed a minimal skeleton to keep model deterministic
         return f"""<mitigation_guidelines mode='{analysis_mode}'>
 <pillars>
@@ -144,6 +140,16 @@ class InitiatorAgent:
 </system>
 """
 
+    def build_system_prompt(
+        self,
+        prompt: str,
+        analysis_output: Optional[Dict[str, Any]] = None,
+        analysis_mode: str = "both"
+    ) -> str:
+        """The system prompt ``initiate`` sends; also used for pre-flight token estimates."""
+        guidelines_xml = self._load_mitigation_guidelines(analysis_mode)
+        return self._build_system_prompt(prompt, guidelines_xml, analysis_output or {})
+
     async def initiate(
         self,
         prompt: str,
@@ -151,23 +157,25 @@ class InitiatorAgent:
         analysis_mode: str = "both"
     ) -> str:
         """Run single-turn initiation and return formatted markdown text."""
-        # Load mitigation guidelines based on analysis mode
-        guidelines_xml = self._load_mitigation_guidelines(analysis_mode)
-        
-        system_prompt = self._build_system_prompt(prompt, guidelines_xml, analysis_output or {})
+        # Mitigation guidelines for the analysis mode, plus the analysis itself
+        system_prompt = self.build_system_prompt(prompt, analysis_output, analysis_mode)
         logger = logging.getLogger("uvicorn.error")
         
         try:
             logger.info("[initiator] calling LLM model=%s prompt_len=%d", self.model, len(system_prompt))
             
-            response = await asyncio.wait_for(
-                self.client.chat.completions.create(
+            response = await run_stage(
+                "initiator",
+                create_chat_completion(
+                    self.client,
+                    agent="initiator",
+                    mode=analysis_mode,
                     model=self.model,
                     messages=[{"role": "system", "content": system_prompt}],
                     max_completion_tokens=self.max_tokens,
                     temperature=self.temperature,
                 ),
-                timeout=self.timeout
+                self.timeout
             )
             
             content = response.choices[0].message.content
@@ -175,6 +183,8 @@ class InitiatorAgent:
             
             return content or "Unable to generate initiation message."
             
+        except DeadlineExceeded:
+            raise
         except Exception as e:
             logger.exception("[initiator] LLM call failed")
             raise Exception(f"Initiation LLM call failed: {e}")
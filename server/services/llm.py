@@ -8,25 +8,20 @@ This class delegates to specialized agents:
 Maintains backward compatibility with existing code.
 """
 
-import openai
 import os
-from typing import Dict, Any, List, Optional
-from dotenv import load_dotenv
+from typing import Callable, Dict, Any, List, Optional
 from ..config import OPENAI_MODEL, TEMPERATURE
+from .openai_client import get_client
 from .analyzer_agent import AnalyzerAgent
 from .conversation_agent import ConversationAgent
 from .initiator_agent import InitiatorAgent
 
-load_dotenv()
-
 
 class OpenAILLM:
     """Facade class that delegates to specialized agents for analysis and conversation."""
     
     def __init__(self):
-        self.client = openai.AsyncOpenAI(
-            api_key=os.getenv("OPENAI_API_KEY")
-        )
+        self.client = get_client()
         self.model = OPENAI_MODEL
         self.max_tokens = int(os.getenv("MAX_TOKENS", "20000"))
         self.temperature = TEMPERATURE
@@ -36,13 +31,18 @@ class OpenAILLM:
         self.conversation = ConversationAgent()
         self.initiator = InitiatorAgent()
     
-    async def analyze_prompt(self, prompt: str, analysis_mode: str = "both") -> Dict[str, Any]:
+    async def analyze_prompt(
+        self,
+        prompt: str,
+        analysis_mode: str = "both",
+        on_risk_tokens: Optional[Callable[[List[Dict[str, Any]]], None]] = None,
+    ) -> Dict[str, Any]:
         """
         Analyze prompt for hallucination risks.
         
         Delegates to AnalyzerAgent for all analysis logic.
         """
-        return await self.analyzer.analyze_prompt(prompt, analysis_mode)
+        return await self.analyzer.analyze_prompt(prompt, analysis_mode, on_risk_tokens=on_risk_tokens)
     
     async def chat_once(
         self, 
@@ -73,6 +73,25 @@ class OpenAILLM:
         """
         return await self.conversation.chat_stream(current_prompt, conversation_history, user_message, analysis_output, analysis_mode)
 
+    def build_conversation_system_prompt(
+        self,
+        current_prompt: str,
+        analysis_output: Optional[Dict[str, Any]] = None,
+        analysis_mode: str = "both"
+    ) -> str:
+        """Conversation system prompt for a refinement session (see ConversationAgent.build_system_prompt)."""
+        return self.conversation.build_system_prompt(current_prompt, analysis_output, analysis_mode)
+
+    async def chat_turn(
+        self,
+        system_prompt: str,
+        messages: List[Dict[str, str]],
+        analysis_mode: str = "both",
+        on_delta: Optional[Callable[[str], None]] = None
+    ) -> str:
+        """Streamed refinement turn over a prebuilt system prompt. Delegates to ConversationAgent."""
+        return await self.conversation.chat_turn(system_prompt, messages, analysis_mode, on_delta=on_delta)
+
     async def initiate(self, prompt: str, analysis_output: Optional[Dict[str, Any]] = None, analysis_mode: str = "both") -> str:
         """Single-turn initiation producing clarifying question and mitigation plan as markdown text."""
         return await self.initiator.initiate(prompt, analysis_output, analysis_mode)
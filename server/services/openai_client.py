@@ -0,0 +1,216 @@
+"""
+Shared OpenAI client.
+
+All agents use one ``openai.AsyncOpenAI`` instance so they share a connection
+pool and honour ``OPENAI_API_BASE_URL``. Setting the base URL to ``mock://``
+routes every call to the in-process mock LLM (see ``server/mock_llm``), which
+makes load tests and benchmarks possible without network access or API budget.
+``LLM_CASSETTE_MODE`` additionally records or replays every exchange (see
+``cassette``), over either the network or the mock.
+
+``openai`` and ``httpx`` are imported when the first client is built, so
+importing the server does not pay for the SDK's type modules (the bulk of
+cold-start import time).
+"""
+
+import asyncio
+import os
+import time
+from contextlib import contextmanager
+from typing import TYPE_CHECKING, Any, Callable, Iterator, List, Optional
+
+from ..config import (
+    LLM_CASSETTE_DIR,
+    LLM_CASSETTE_MODE,
+    LLM_CASSETTE_TIME_SCALE,
+    OPENAI_API_BASE_URL,
+)
+from ..observability.metrics import (
+    LLM_FINISH_REASONS,
+    LLM_QUEUE_DEPTH,
+    LLM_REQUEST_DURATION,
+    record_usage,
+)
+from ..observability.tracing import span
+from .usage_ledger import get_usage_ledger
+
+if TYPE_CHECKING:
+    import httpx
+    import openai
+    from openai.types.chat import ChatCompletion
+
+MOCK_SCHEME = "mock://"
+MOCK_BASE_URL = "http://mock-llm/v1"
+
+_client: Optional["openai.AsyncOpenAI"] = None
+
+
+def _build_transport(base_url: str) -> Optional["httpx.AsyncBaseTransport"]:
+    """Transport for the configured base URL; None means the default network transport."""
+    import httpx
+
+    transport: Optional[httpx.AsyncBaseTransport] = None
+    if base_url.startswith(MOCK_SCHEME):
+        from ..mock_llm.transport import MockLLMTransport
+        transport = MockLLMTransport.from_env()
+    if LLM_CASSETTE_MODE != "off":
+        from .cassette import CassetteTransport
+        transport = CassetteTransport(
+            LLM_CASSETTE_DIR,
+            mode=LLM_CASSETTE_MODE,
+            inner=transport or httpx.AsyncHTTPTransport(),
+            time_scale=LLM_CASSETTE_TIME_SCALE,
+        )
+    return transport
+
+
+def create_client(base_url: Optional[str] = None, api_key: Optional[str] = None) -> "openai.AsyncOpenAI":
+    """Build a new AsyncOpenAI client for the given (or configured) base URL."""
+    import httpx
+    import openai
+
+    base_url = base_url or OPENAI_API_BASE_URL
+    api_key = api_key or os.getenv("OPENAI_API_KEY")
+    # The mock LLM (OPENAI_API_BASE_URL=mock://) needs no key
+    if not api_key and not base_url.startswith(MOCK_SCHEME):
+        raise RuntimeError("OPENAI_API_KEY is not set. Create a .env file based on .env.example.")
+    transport = _build_transport(base_url)
+    http_client = None
+    if transport is not None:
+        http_client = httpx.AsyncClient(transport=transport, timeout=None)
+    if base_url.startswith(MOCK_SCHEME):
+        base_url = MOCK_BASE_URL
+        api_key = api_key or "mock"
+    return openai.AsyncOpenAI(
+        api_key=api_key,
+        base_url=base_url,
+        http_client=http_client,
+    )
+
+
+def get_client() -> "openai.AsyncOpenAI":
+    """Process-wide shared client, created on first use."""
+    global _client
+    if _client is None:
+        _client = create_client()
+    return _client
+
+
+def reset_client() -> None:
+    """Drop the shared client so the next get_client() rebuilds it (tests, config reloads)."""
+    global _client
+    _client = None
+
+
+@contextmanager
+def _track_upstream(agent: str, model: str) -> Iterator[None]:
+    """Queue depth and latency-by-outcome around one upstream call."""
+    import openai
+
+    depth = LLM_QUEUE_DEPTH.labels(agent)
+    depth.inc()
+    started = time.perf_counter()
+    outcome = "error"
+    try:
+        yield
+        outcome = "ok"
+    except asyncio.CancelledError:
+        outcome = "cancelled"
+        raise
+    except openai.RateLimitError:
+        outcome = "rate_limited"
+        raise
+    except openai.APITimeoutError:
+        outcome = "timeout"
+        raise
+    finally:
+        depth.dec()
+        LLM_REQUEST_DURATION.labels(agent, model, outcome).observe(time.perf_counter() - started)
+
+
+def _record_completion(agent: str, model: str, mode: str, response: Any, current: Any) -> None:
+    usage = getattr(response, "usage", None)
+    record_usage(agent, model, mode, usage)
+    get_usage_ledger().record(agent, model, mode, usage)
+    finish_reasons = [str(choice.finish_reason) for choice in getattr(response, "choices", None) or []]
+    for finish_reason in finish_reasons:
+        LLM_FINISH_REASONS.labels(agent, model, finish_reason).inc()
+    if current is not None:
+        current.set(
+            finish_reason=",".join(finish_reasons),
+            prompt_tokens=getattr(usage, "prompt_tokens", None),
+            completion_tokens=getattr(usage, "completion_tokens", None),
+        )
+
+
+async def create_chat_completion(client: Any, *, agent: str, mode: str = "n/a", **kwargs) -> Any:
+    """``client.chat.completions.create(**kwargs)`` with upstream metrics and a trace span.
+
+    Tracks calls waiting on the API, upstream latency by outcome, token usage
+    by model and analysis mode (metrics and the usage ledger), and finish reasons. Streaming calls return the
+    stream as-is; their usage is not counted here (see ``stream_chat_completion``).
+    """
+    model = kwargs.get("model") or "unknown"
+    with span("llm.chat_completion", agent=agent, model=model, mode=mode) as current:
+        with _track_upstream(agent, model):
+            response = await client.chat.completions.create(**kwargs)
+        if not kwargs.get("stream"):
+            _record_completion(agent, model, mode, response, current)
+    return response
+
+
+async def stream_chat_completion(
+    client: Any,
+    *,
+    agent: str,
+    mode: str = "n/a",
+    on_delta: Optional[Callable[[str], None]] = None,
+    **kwargs,
+) -> "ChatCompletion":
+    """Stream a completion, passing each content delta to ``on_delta``.
+
+    Returns the assembled ``ChatCompletion`` (content, finish reason, usage),
+    so callers handle it exactly like a non-streamed response; metrics and
+    the usage ledger are recorded the same way.
+    """
+    from openai.types.chat import ChatCompletion
+
+    model = kwargs.get("model") or "unknown"
+    parts: List[str] = []
+    finish_reason = None
+    usage = None
+    response_id, response_model = "", model
+    with span("llm.chat_completion", agent=agent, model=model, mode=mode, stream=True) as current:
+        with _track_upstream(agent, model):
+            stream = await client.chat.completions.create(
+                stream=True, stream_options={"include_usage": True}, **kwargs
+            )
+            async for chunk in stream:
+                response_id = chunk.id or response_id
+                response_model = chunk.model or response_model
+                if chunk.usage is not None:
+                    usage = chunk.usage
+                for choice in chunk.choices:
+                    delta = choice.delta.content if choice.delta else None
+                    if delta:
+                        parts.append(delta)
+                        if on_delta is not None:
+                            on_delta(delta)
+                    if choice.finish_reason:
+                        finish_reason = choice.finish_reason
+        payload = {
+            "id": response_id or "stream",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": response_model,
+            "choices": [{
+                "index": 0,
+                "finish_reason": finish_reason or "stop",
+                "message": {"role": "assistant", "content": "".join(parts)},
+            }],
+        }
+        if usage is not None:
+            payload["usage"] = usage.model_dump()
+        response = ChatCompletion.model_validate(payload)
+        _record_completion(agent, model, mode, response, current)
+    return response
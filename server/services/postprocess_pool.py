@@ -0,0 +1,104 @@
+"""
+Executor for CPU-heavy post-processing of LLM responses.
+
+Parsing a large analyzer completion (megabytes of JSON, a char-by-char span
+scan, regex clean-up and the PRD loops) takes long enough to stall every other
+request on the worker if it runs on the event loop. ``run_postprocess`` sends
+such work to a bounded pool and awaits it. Small payloads stay inline, because
+handing them off costs more than it saves.
+
+Configuration:
+- POSTPROCESS_EXECUTOR: ``thread`` (default), ``process`` or ``inline``.
+  Threads still share the GIL, but the loop gets the interpreter back at every
+  switch interval (5 ms) instead of after the whole job. ``process`` moves the
+  work off the loop completely, at the cost of pickling the content and result.
+  The function must then be a module-level function taking plain data. Metric
+  and trace updates it makes happen in the worker and are lost, so it returns
+  what should be recorded (e.g. stage timings) and the caller records it (see
+  ``analyzer_agent.record_postprocess``).
+- POSTPROCESS_WORKERS: pool size (default 2).
+- POSTPROCESS_INLINE_MAX_CHARS: payloads below this size run inline (default 50000).
+"""
+
+import asyncio
+import functools
+import multiprocessing
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Callable, Optional, TypeVar
+
+from ..config import POSTPROCESS_EXECUTOR, POSTPROCESS_INLINE_MAX_CHARS, POSTPROCESS_WORKERS
+from ..observability.metrics import POSTPROCESS_RUNS
+
+EXECUTOR_KINDS = ("inline", "thread", "process")
+
+T = TypeVar("T")
+
+_kind = POSTPROCESS_EXECUTOR
+_workers = POSTPROCESS_WORKERS
+_inline_max_chars = POSTPROCESS_INLINE_MAX_CHARS
+_executor: Optional[Executor] = None
+
+
+def _warm_process() -> None:
+    # Spawned workers start cold; read the guideline files once up front
+    from . import guidelines
+
+    guidelines.preload()
+
+
+def configure(kind: Optional[str] = None, workers: Optional[int] = None, inline_max_chars: Optional[int] = None) -> None:
+    """Change the executor settings (shuts down the current pool); used by the bench."""
+    global _kind, _workers, _inline_max_chars
+    if kind is not None:
+        if kind not in EXECUTOR_KINDS:
+            raise ValueError(f"POSTPROCESS_EXECUTOR must be one of {EXECUTOR_KINDS}, got {kind!r}")
+        _kind = kind
+    if workers is not None:
+        _workers = workers
+    if inline_max_chars is not None:
+        _inline_max_chars = inline_max_chars
+    shutdown()
+
+
+def _get_executor() -> Optional[Executor]:
+    global _executor
+    if _kind not in EXECUTOR_KINDS:
+        raise ValueError(f"POSTPROCESS_EXECUTOR must be one of {EXECUTOR_KINDS}, got {_kind!r}")
+    if _kind == "inline":
+        return None
+    if _executor is None:
+        if _kind == "process":
+            # spawn, not fork: the server process has threads (pool, ledger, SDK)
+            _executor = ProcessPoolExecutor(
+                max_workers=_workers, mp_context=multiprocessing.get_context("spawn"), initializer=_warm_process
+            )
+        else:
+            _executor = ThreadPoolExecutor(max_workers=_workers, thread_name_prefix="postprocess")
+    return _executor
+
+
+def start() -> None:
+    """Create the pool now (startup warm-up); process workers are spawned and warmed here."""
+    executor = _get_executor()
+    if isinstance(executor, ProcessPoolExecutor):
+        for future in [executor.submit(_warm_process) for _ in range(_workers)]:
+            future.result()
+
+
+async def run_postprocess(agent: str, size: int, fn: Callable[..., T], *args: Any) -> T:
+    """``fn(*args)`` inline when ``size`` is below the threshold, else in the pool."""
+    executor = _get_executor()
+    if executor is None or size < _inline_max_chars:
+        POSTPROCESS_RUNS.labels(agent, "inline").inc()
+        return fn(*args)
+    POSTPROCESS_RUNS.labels(agent, _kind).inc()
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(executor, functools.partial(fn, *args))
+
+
+def shutdown() -> None:
+    """Stop the pool (lifespan shutdown); the next call starts a new one."""
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
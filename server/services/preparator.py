@@ -3,17 +3,26 @@ Analysis Preparator Service
 Refines prompts based on prior analysis, conversation history, and mitigation strategies.
 """
 
-import openai
 import os
 import asyncio
 import json
-from typing import Dict, Any, List
-from pathlib import Path
+from typing import Callable, Dict, Any, List, Optional
 import logging
-from dotenv import load_dotenv
 from ..config import OPENAI_MODEL, TEMPERATURE
+from .deadline import DeadlineExceeded, note_skipped, run_stage, stage_allowed
+from .guidelines import read_data_file
+from .openai_client import create_chat_completion, get_client
+from ..observability.metrics import StageTimer, record_fallback, record_parse_failure
 
-load_dotenv()
+
+# The five canonical variations, in output order: (label, what the variation must do)
+VARIATION_SPECS = [
+    ("Minimal Patch", "Apply only the critical/high-severity fixes; keep the surface of the refined prompt."),
+    ("Structured", "Emphasize clear sections, steps, or output formatting."),
+    ("Context-Enriched", "Expand referents, actors, and temporal information."),
+    ("Precision-Constrained", "Introduce quantitative or conditional parameters and success criteria."),
+    ("Source-Grounded", "Add verifiable source or citation placeholders such as [SOURCE: ...]."),
+]
 
 
 class AnalysisPreparator:
@@ -24,14 +33,15 @@ class AnalysisPreparator:
     mitigation dimension while preserving original intent.
     """
     
-    def __init__(self):
-        self.client = openai.AsyncOpenAI(
-            api_key=os.getenv("OPENAI_API_KEY")
-        )
+    def __init__(self, client=None):
+        self.client = client or get_client()
         self.model = OPENAI_MODEL
         self.temperature = TEMPERATURE
         self.max_tokens = int(os.getenv("MAX_TOKENS", "20000"))
         self.timeout = int(os.getenv("LLM_REQUEST_TIMEOUT", "60"))
+        # single: one completion for everything; parallel: refined prompt, then 5 concurrent variation calls
+        self.mode = os.getenv("PREPARATOR_MODE", "single").lower()
+        self.variation_timeout = float(os.getenv("PREPARATOR_VARIATION_TIMEOUT", "20"))
         self.logger = logging.getLogger(__name__)
     
     def _load_mitigation_guidelines(self, analysis_mode: str = "both") -> str:
@@ -44,19 +54,13 @@ class AnalysisPreparator:
         
         filename = mode_files.get(analysis_mode, "m_both.xml")
         
-        # Get the path to the data directory
-        current_dir = Path(__file__).parent.parent
-        guidelines_path = current_dir / "data" / filename
-        
-        try:
-            with open(guidelines_path, 'r', encoding='utf-8') as f:
-                return f.read()
-        except FileNotFoundError:
+        # Read once per process (see guidelines.py)
+        guidelines_xml = read_data_file(filename)
+        if guidelines_xml is None:
             self.logger.warning(f"Mitigation guidelines file {filename} not found, using default")
             # Fallback to m_both.xml if specified file doesn't exist
-            fallback_path = current_dir / "data" / "m_both.xml"
-            with open(fallback_path, 'r', encoding='utf-8') as f:
-                return f.read()
+            guidelines_xml = read_data_file("m_both.xml")
+        return guidelines_xml
     
     def _build_system_prompt(
         self,
@@ -224,28 +228,24 @@ class AnalysisPreparator:
           refined_prompt: str  (primary recommended prompt)
           variations: List[ {id,label,prompt,focus} ] (5 items)
         """
+        if self.mode == "parallel":
+            return await self.refine_prompt_parallel(
+                current_prompt, prior_analysis, conversation_history, user_final_edits, analysis_mode
+            )
 
-        # Load mitigation guidelines based on analysis mode
-        mitigation_xml = self._load_mitigation_guidelines(analysis_mode)
-
-        # Build conversation context
-        conversation_context = self._format_conversation(conversation_history)
-
-        # Extract key findings from prior analysis
-        analysis_context = self._format_analysis(prior_analysis)
-
-        # Create the refinement prompt using the new system prompt
-        system_prompt = self._build_system_prompt(
-            current_prompt=current_prompt,
-            analysis_context=analysis_context,
-            conversation_history=conversation_context,
-            final_user_changes=user_final_edits,
-            mitigation_xml=mitigation_xml
+        stages = StageTimer("preparator")
+        system_prompt = self.build_refinement_prompt(
+            current_prompt, prior_analysis, conversation_history, user_final_edits, analysis_mode
         )
+        stages.lap("prompt_build")
 
         try:
-            response = await asyncio.wait_for(
-                self.client.chat.completions.create(
+            response = await run_stage(
+                "preparator",
+                create_chat_completion(
+                    self.client,
+                    agent="preparator",
+                    mode=analysis_mode,
                     model=self.model,
                     messages=[
                         {"role": "system", "content": system_prompt}
@@ -253,13 +253,15 @@ class AnalysisPreparator:
                     temperature=self.temperature,
                     max_completion_tokens=self.max_tokens
                 ),
-                timeout=self.timeout
+                self.timeout
             )
+            stages.lap("upstream_wait")
 
             raw = response.choices[0].message.content.strip()
             self.logger.info("[Preparator] Raw LLM length=%d", len(raw) if raw else 0)
             cleaned = self._extract_json(raw)
             source = "primary_json"
+            stages.lap("json_parse")
 
             # Ensure we have refined_prompt as string
             if not isinstance(cleaned.get("refined_prompt", ""), str):
@@ -270,7 +272,8 @@ class AnalysisPreparator:
             if not isinstance(variations, list):
                 variations = []
 
-            if len(variations) != 5:
+            # The fallback call is skipped when the request deadline leaves no room for it
+            if len(variations) != 5 and stage_allowed("preparator_fallback"):
                 self.logger.warning("[Preparator] Expected 5 variations, got %d. Attempting fallback generation.", len(variations))
                 try:
                     generated = await self._generate_variations_from_refined(
@@ -282,8 +285,12 @@ class AnalysisPreparator:
                     )
                     variations = generated
                     source = "fallback_llm"
+                except DeadlineExceeded as e:
+                    self.logger.warning("[Preparator] Fallback variation generation cut off by the request deadline")
+                    note_skipped(e)
                 except Exception as e:
                     self.logger.error("[Preparator] Fallback variation generation failed: %s", str(e))
+                stages.lap("fallback_llm")
             
             # If still not 5, synthesize locally as last resort
             if len(variations) != 5:
@@ -293,19 +300,195 @@ class AnalysisPreparator:
                     user_final_edits=user_final_edits
                 )
                 source = "local_synthesis"
+                stages.lap("local_synthesis")
             
             # Normalize and enforce schema/id/labels
             variations = self._normalize_variations(variations)
             cleaned["variations"] = variations
             cleaned["source"] = source
+            if source != "primary_json":
+                record_fallback("preparator", source)
+            stages.lap("postprocess")
             self.logger.info("[Preparator] Returning refined prompt and %d variations", len(variations))
             return cleaned
             
         except asyncio.TimeoutError:
             raise Exception(f"Prompt refinement timed out after {self.timeout}s")
+        except DeadlineExceeded:
+            raise
         except Exception as e:
             raise Exception(f"Error refining prompt: {str(e)}")
     
+    def build_refinement_prompt(
+        self,
+        current_prompt: str,
+        prior_analysis: Dict[str, Any],
+        conversation_history: List[Dict[str, str]],
+        user_final_edits: str = "",
+        analysis_mode: str = "both"
+    ) -> str:
+        """System prompt of the primary refinement call; also used for pre-flight token estimates."""
+        # Mitigation guidelines for the mode, the conversation and the prior analysis's key findings
+        return self._build_system_prompt(
+            current_prompt=current_prompt,
+            analysis_context=self._format_analysis(prior_analysis),
+            conversation_history=self._format_conversation(conversation_history),
+            final_user_changes=user_final_edits,
+            mitigation_xml=self._load_mitigation_guidelines(analysis_mode)
+        )
+
+    async def refine_prompt_parallel(
+        self,
+        current_prompt: str,
+        prior_analysis: Dict[str, Any],
+        conversation_history: List[Dict[str, str]],
+        user_final_edits: str = "",
+        analysis_mode: str = "both",
+        on_refined: Optional[Callable[[str], None]] = None,
+        on_variation: Optional[Callable[[Dict[str, Any]], None]] = None,
+    ) -> Dict[str, Any]:
+        """Refined prompt first, then each variation as its own concurrent completion.
+
+        Every variation call has ``variation_timeout`` seconds (less if the
+        request deadline is closer); one that times out, fails or does not
+        parse is replaced by its locally synthesized counterpart, so a slow
+        variation never holds up the other four.
+        ``on_refined`` / ``on_variation`` are called as soon as each part is
+        ready (used by the streaming prepare route).
+
+        Returns the same dict as ``refine_prompt`` plus ``variation_sources``
+        ("llm" or "local" per variation); ``source`` is "parallel".
+        """
+        stages = StageTimer("preparator")
+        system_prompt = self.build_refinement_prompt(
+            current_prompt, prior_analysis, conversation_history, user_final_edits, analysis_mode
+        )
+        # The variation calls reuse the same context pieces
+        mitigation_xml = self._load_mitigation_guidelines(analysis_mode)
+        conversation_context = self._format_conversation(conversation_history)
+        analysis_context = self._format_analysis(prior_analysis)
+        stages.lap("prompt_build")
+
+        try:
+            response = await run_stage(
+                "preparator",
+                create_chat_completion(
+                    self.client,
+                    agent="preparator",
+                    mode=analysis_mode,
+                    model=self.model,
+                    messages=[
+                        {"role": "system", "content": system_prompt},
+                        {"role": "user", "content": 'For this call output ONLY {"refined_prompt": "..."}. The 5 variations are generated separately.'}
+                    ],
+                    temperature=self.temperature,
+                    max_completion_tokens=self.max_tokens
+                ),
+                self.timeout
+            )
+        except asyncio.TimeoutError:
+            raise Exception(f"Prompt refinement timed out after {self.timeout}s")
+        except DeadlineExceeded:
+            raise
+        except Exception as e:
+            raise Exception(f"Error refining prompt: {str(e)}")
+        stages.lap("upstream_wait")
+
+        raw = (response.choices[0].message.content or "").strip()
+        parsed = self._extract_json(raw)
+        refined_prompt = parsed.get("refined_prompt", "") if isinstance(parsed, dict) else ""
+        if not isinstance(refined_prompt, str):
+            refined_prompt = str(refined_prompt)
+        stages.lap("json_parse")
+        if on_refined is not None:
+            on_refined(refined_prompt)
+
+        # Variations build on the refined prompt; on a parse failure fall back to the current one
+        base_prompt = refined_prompt if refined_prompt and refined_prompt != "PARSE_FAILURE" else current_prompt
+        local = self._synthesize_variations_locally(refined_prompt=base_prompt, user_final_edits=user_final_edits)
+        variation_system = self._variation_system_prompt(mitigation_xml)
+        variation_sources = ["local"] * len(VARIATION_SPECS)
+        # Too little of the request deadline left: all five are synthesized locally
+        call_variations = stage_allowed("preparator_variations")
+
+        async def one(idx: int) -> Dict[str, Any]:
+            label, instruction = VARIATION_SPECS[idx]
+            variation = local[idx]
+            if call_variations:
+                try:
+                    variation = await run_stage(
+                        "preparator_variations",
+                        self._generate_single_variation(
+                            variation_system, label, instruction, base_prompt,
+                            analysis_context, conversation_context, user_final_edits, analysis_mode
+                        ),
+                        self.variation_timeout
+                    )
+                    variation_sources[idx] = "llm"
+                except Exception as e:
+                    self.logger.warning("[Preparator] Variation %d (%s) unavailable (%s); using local synthesis", idx + 1, label, type(e).__name__)
+                    if isinstance(e, DeadlineExceeded):
+                        note_skipped(e)
+            if variation_sources[idx] == "local":
+                record_fallback("preparator", "variation_local")
+            variation = self._normalize_variations([variation])[0]
+            variation["id"] = idx + 1
+            if on_variation is not None:
+                on_variation(variation)
+            return variation
+
+        variations = list(await asyncio.gather(*(one(idx) for idx in range(len(VARIATION_SPECS)))))
+        stages.lap("variations")
+
+        self.logger.info("[Preparator] Parallel mode: %d/%d variations from the LLM", variation_sources.count("llm"), len(variation_sources))
+        stages.lap("postprocess")
+        return {
+            "refined_prompt": refined_prompt,
+            "variations": variations,
+            "source": "parallel",
+            "variation_sources": variation_sources,
+        }
+
+    def _variation_system_prompt(self, mitigation_xml: str) -> str:
+        """Shared by all five variation calls, so the upstream prompt cache can reuse it."""
+        return f"""You write ONE mitigation-focused variant of a refined prompt (JSON only).
+Preserve the user's intent, never fabricate facts or sources, and use placeholders like [SOURCE] or [DATE] where needed.
+Output exactly: {{"focus": "what risk focus it addresses", "prompt": "..."}}
+
+Use these hallucination mitigation guidelines as your ground truth:
+{mitigation_xml}
+"""
+
+    async def _generate_single_variation(
+        self,
+        system: str,
+        label: str,
+        instruction: str,
+        refined_prompt: str,
+        analysis_ctx: str,
+        convo: str,
+        user_final_edits: str,
+        analysis_mode: str
+    ) -> Dict[str, Any]:
+        user = f"""VARIATION: {label}\nINSTRUCTION: {instruction}\n\nREFINED_PROMPT:\n{refined_prompt}\n\nPRIOR_ANALYSIS_SUMMARY:\n{analysis_ctx}\n\nCONVERSATION_HISTORY_CONTEXT:\n{convo}\n\nUSER_FINAL_EDITS:\n{user_final_edits or '(None)'}\n\nOutput JSON ONLY."""
+        response = await create_chat_completion(
+            self.client,
+            agent="preparator_variations",
+            mode=analysis_mode,
+            model=self.model,
+            messages=[
+                {"role": "system", "content": system},
+                {"role": "user", "content": user}
+            ],
+            temperature=self.temperature,
+            max_completion_tokens=min(self.max_tokens, 1500)
+        )
+        data = self._extract_json((response.choices[0].message.content or "").strip())
+        prompt = data.get("prompt") if isinstance(data, dict) else None
+        if not isinstance(prompt, str) or not prompt.strip():
+            raise ValueError("variation JSON has no prompt")
+        return {"label": label, "focus": data.get("focus") or instruction, "prompt": prompt}
+
     def _format_conversation(self, history: List[Dict[str, str]]) -> str:
         """Format conversation history for context only - not for copying into prompt."""
         if not history:
@@ -404,6 +587,7 @@ class AnalysisPreparator:
             return data_from_xml
 
         # Fallback minimal structure
+        record_parse_failure("preparator")
         return {"refined_prompt": "PARSE_FAILURE", "variations": []}
 
     def _extract_from_xml(self, text: str) -> Dict[str, Any] | None:
@@ -482,8 +666,12 @@ Use these hallucination mitigation guidelines as your ground truth:
         
         user = f"""REFINED_PROMPT:\n{refined_prompt}\n\nPRIOR_ANALYSIS_SUMMARY:\n{analysis_ctx}\n\nCONVERSATION_HISTORY_CONTEXT:\n{convo}\n\nUSER_FINAL_EDITS:\n{user_final_edits or '(None)'}\n\nSCHEMA:\n{{\n  \"variations\": [\n    {{\"id\":1, \"label\":\"Minimal Patch\", \"focus\":\"...\", \"prompt\":\"...\"}},\n    {{\"id\":2, \"label\":\"Structured\", \"focus\":\"...\", \"prompt\":\"...\"}},\n    {{\"id\":3, \"label\":\"Context-Enriched\", \"focus\":\"...\", \"prompt\":\"...\"}},\n    {{\"id\":4, \"label\":\"Precision-Constrained\", \"focus\":\"...\", \"prompt\":\"...\"}},\n    {{\"id\":5, \"label\":\"Source-Grounded\", \"focus\":\"...\", \"prompt\":\"...\"}}\n  ]\n}}\n\nOutput JSON ONLY."""
 
-        response = await asyncio.wait_for(
-            self.client.chat.completions.create(
+        response = await run_stage(
+            "preparator_fallback",
+            create_chat_completion(
+                self.client,
+                agent="preparator_variations",
+                mode=analysis_mode,
                 model=self.model,
                 messages=[
                     {"role": "system", "content": system},
@@ -492,7 +680,7 @@ Use these hallucination mitigation guidelines as your ground truth:
                 temperature=self.temperature,
                 max_completion_tokens=min(self.max_tokens, 1500)
             ),
-            timeout=self.timeout
+            self.timeout
         )
         raw = response.choices[0].message.content.strip()
         self.logger.info("[Preparator] Fallback raw length=%d", len(raw) if raw else 0)
@@ -0,0 +1,72 @@
+"""
+Lazily built, process-wide services for the routes.
+
+Routes used to construct ``OpenAILLM()`` / ``AnalysisPreparator()`` at module
+import, which pulled in the OpenAI SDK and built every agent before the app
+object even existed. The getters below build each service on first use
+instead, and import the agent modules only then.
+
+``warm_up`` does all of that up front, plus guideline files and the rule
+registries parsed from them, the tokenizer and numpy (completion budgeter). main.py calls it from the lifespan hook when
+STARTUP_WARMUP is on, so the first request does not pay for it. With warm-up off,
+a worker is ready as soon as the app is imported and the work moves to the first
+request.
+"""
+
+import logging
+import time
+from typing import TYPE_CHECKING, Dict, Optional
+
+if TYPE_CHECKING:
+    from .llm import OpenAILLM
+    from .preparator import AnalysisPreparator
+
+logger = logging.getLogger(__name__)
+
+_llm_service: Optional["OpenAILLM"] = None
+_preparator: Optional["AnalysisPreparator"] = None
+
+
+def get_llm_service() -> "OpenAILLM":
+    """Shared OpenAILLM facade (analyzer, conversation and initiator agents)."""
+    global _llm_service
+    if _llm_service is None:
+        from .llm import OpenAILLM
+
+        _llm_service = OpenAILLM()
+    return _llm_service
+
+
+def get_preparator() -> "AnalysisPreparator":
+    """Shared AnalysisPreparator."""
+    global _preparator
+    if _preparator is None:
+        from .preparator import AnalysisPreparator
+
+        _preparator = AnalysisPreparator()
+    return _preparator
+
+
+def warm_up() -> Dict[str, float]:
+    """Build services and load per-process caches now; returns seconds per step."""
+    from . import guidelines, postprocess_pool, tokenizer
+    from .rule_registry import get_rule_registry
+
+    timings: Dict[str, float] = {}
+
+    def step(name: str, fn) -> None:
+        started = time.perf_counter()
+        fn()
+        timings[name] = round(time.perf_counter() - started, 4)
+
+    def load_numpy() -> None:
+        import numpy  # noqa: F401  (completion budgeter fits)
+
+    step("services", lambda: (get_llm_service(), get_preparator()))
+    step("guidelines", guidelines.preload)
+    step("rule_registry", lambda: [get_rule_registry(mode) for mode in guidelines.GUIDELINE_FILES])
+    step("tokenizer", tokenizer.get_encoding)
+    step("numpy", load_numpy)
+    step("postprocess_pool", postprocess_pool.start)
+    logger.info("Warm-up done in %.3fs: %s", sum(timings.values()), timings)
+    return timings
@@ -0,0 +1,170 @@
+"""
+Refinement sessions for the ``/api/refine/ws`` WebSocket.
+
+Every POST to /api/refine carries the prompt, the whole conversation and the
+analysis. The server parses all of it and rebuilds the conversation agent's
+system prompt (guidelines plus analysis, tens of KB) on every turn. A
+``RefineSession`` keeps all of that on the server for the life of one
+WebSocket connection. The system prompt is built once, when the session
+starts and when the client sends a new prompt state. The client then only
+sends new user messages.
+
+Limits, per worker:
+- REFINE_WS_MAX_SESSIONS: open sessions; further connections are closed with
+  1013 (try again later).
+- REFINE_WS_IDLE_SECONDS: a session with no client frame and no turn running
+  for this long is closed with 4408.
+- REFINE_WS_MAX_SESSION_BYTES: text held by a session (system prompt, analysis
+  and history). The oldest turns after the first exchange (the initiator's
+  question and the user's answer) are dropped to stay under it. A start or
+  update that cannot fit even with an empty history is refused.
+"""
+
+import json
+import time
+import uuid
+from typing import Any, Dict, List, Optional
+
+from ..config import REFINE_WS_IDLE_SECONDS, REFINE_WS_MAX_SESSION_BYTES, REFINE_WS_MAX_SESSIONS
+from ..observability.metrics import REFINE_SESSIONS_ACTIVE, REFINE_SESSION_CLOSES
+from .providers import get_llm_service
+
+# Close codes sent with the final WebSocket frame
+CLOSE_TOO_MANY_SESSIONS = 1013
+CLOSE_TOO_BIG = 1009
+CLOSE_IDLE = 4408
+
+# Leading messages never trimmed: the initiator's question and the user's answer
+_PINNED_MESSAGES = 2
+
+
+class SessionLimitError(Exception):
+    """A session limit was hit; ``code`` is the WebSocket close code to use."""
+
+    def __init__(self, detail: str, code: int):
+        super().__init__(detail)
+        self.code = code
+
+
+def _size(text: str) -> int:
+    return len(text.encode("utf-8"))
+
+
+class RefineSession:
+    """Server-side state of one refinement conversation."""
+
+    def __init__(
+        self,
+        prompt: str,
+        analysis_output: Optional[Dict[str, Any]] = None,
+        analysis_mode: str = "both",
+        history: Optional[List[Dict[str, str]]] = None,
+        max_bytes: int = REFINE_WS_MAX_SESSION_BYTES,
+    ):
+        self.id = uuid.uuid4().hex
+        self.analysis_mode = analysis_mode
+        self.max_bytes = max_bytes
+        self.history: List[Dict[str, str]] = [
+            {"role": str(m["role"]), "content": str(m["content"])} for m in (history or [])
+        ]
+        self.turns = 0
+        self.last_active = time.monotonic()
+        self.set_prompt(prompt, analysis_output)
+        self.trim()
+
+    def set_prompt(self, prompt: str, analysis_output: Optional[Dict[str, Any]] = None) -> None:
+        """Set a new prompt state (and analysis) and rebuild the system prompt once."""
+        system_prompt = get_llm_service().build_conversation_system_prompt(
+            prompt, analysis_output, self.analysis_mode
+        )
+        # The analysis is embedded in the system prompt; the dict is kept only for later updates
+        fixed = _size(system_prompt) + _size(prompt) + (
+            _size(json.dumps(analysis_output, ensure_ascii=False)) if analysis_output else 0
+        )
+        if fixed > self.max_bytes:
+            raise SessionLimitError(
+                f"Prompt and analysis need {fixed} bytes; the session limit is {self.max_bytes}", CLOSE_TOO_BIG
+            )
+        self.prompt = prompt
+        self.analysis_output = analysis_output
+        self.system_prompt = system_prompt
+        self._fixed_bytes = fixed
+
+    @property
+    def memory_bytes(self) -> int:
+        return self._fixed_bytes + sum(_size(m["content"]) for m in self.history)
+
+    def trim(self) -> int:
+        """Drop the oldest unpinned messages until under ``max_bytes``; returns how many were dropped."""
+        dropped = 0
+        while self.memory_bytes > self.max_bytes and len(self.history) > _PINNED_MESSAGES + 1:
+            # Drop a whole exchange where possible so roles keep alternating
+            count = 2 if len(self.history) > _PINNED_MESSAGES + 2 else 1
+            del self.history[_PINNED_MESSAGES:_PINNED_MESSAGES + count]
+            dropped += count
+        return dropped
+
+    def add_user_message(self, content: str) -> int:
+        """Append a user message, trimming old turns; returns how many messages were dropped."""
+        if self._fixed_bytes + _size(content) > self.max_bytes:
+            raise SessionLimitError(f"Message exceeds the session limit of {self.max_bytes} bytes", CLOSE_TOO_BIG)
+        self.history.append({"role": "user", "content": content})
+        return self.trim()
+
+    def add_assistant_message(self, content: str) -> int:
+        self.history.append({"role": "assistant", "content": content})
+        self.turns += 1
+        return self.trim()
+
+    def touch(self) -> None:
+        self.last_active = time.monotonic()
+
+    def idle_remaining(self, idle_seconds: float = REFINE_WS_IDLE_SECONDS) -> float:
+        return idle_seconds - (time.monotonic() - self.last_active)
+
+
+_sessions: Dict[str, RefineSession] = {}
+
+
+def limits() -> Dict[str, Any]:
+    return {
+        "max_sessions": REFINE_WS_MAX_SESSIONS,
+        "idle_seconds": REFINE_WS_IDLE_SECONDS,
+        "max_session_bytes": REFINE_WS_MAX_SESSION_BYTES,
+    }
+
+
+def check_capacity() -> None:
+    """Raise SessionLimitError when this worker already holds REFINE_WS_MAX_SESSIONS sessions."""
+    if REFINE_WS_MAX_SESSIONS and len(_sessions) >= REFINE_WS_MAX_SESSIONS:
+        REFINE_SESSION_CLOSES.labels("rejected").inc()
+        raise SessionLimitError("Too many refinement sessions on this worker", CLOSE_TOO_MANY_SESSIONS)
+
+
+def open_session(
+    prompt: str,
+    analysis_output: Optional[Dict[str, Any]] = None,
+    analysis_mode: str = "both",
+    history: Optional[List[Dict[str, str]]] = None,
+) -> RefineSession:
+    check_capacity()
+    try:
+        session = RefineSession(prompt, analysis_output, analysis_mode, history)
+    except SessionLimitError:
+        REFINE_SESSION_CLOSES.labels("rejected").inc()
+        raise
+    _sessions[session.id] = session
+    REFINE_SESSIONS_ACTIVE.inc()
+    return session
+
+
+def close_session(session: Optional[RefineSession], reason: str) -> None:
+    """Forget a session; ``reason`` labels echo_refine_session_closes_total (client, idle, error)."""
+    if session is None or _sessions.pop(session.id, None) is None:
+        return
+    REFINE_SESSIONS_ACTIVE.dec()
+    REFINE_SESSION_CLOSES.labels(reason).inc()
+
+
+def active_sessions() -> int:
+    return len(_sessions)
@@ -0,0 +1,167 @@
+"""
+RuleRegistry - Rule metadata and rule-id extraction built once per process.
+
+Risk tokens carry their rule ids inside a free-text "classification" string.
+Span enrichment and deterministic scoring each used to re-parse that string
+with uncompiled regexes and then scan the category lists for every token.
+The registry compiles the extractor once, indexes every rule id (guideline
+ids such as "B1" and scoring ids such as "R9") to its category, severity and
+critical flag, and classifies a token in a single pass for both stages.
+"""
+
+import functools
+import re
+import xml.etree.ElementTree as ET
+from dataclasses import dataclass
+from typing import Dict, Any, List, Optional
+
+from .guidelines import GUIDELINE_FILES, read_data_file
+from .scoring_config import CATEGORY_RULES, CRITICAL_RULES
+
+
+# Quoted scoring ids ("R12") or bare digit runs, matched in one scan
+_RULE_TOKEN_RE = re.compile(r'"(R\d+)"|(\d+)')
+_RULE_IDS_MARKER = "rule_ids:"
+
+
+def _is_word_char(ch: str) -> bool:
+    return ch.isalnum() or ch == "_"
+
+
+@dataclass(frozen=True)
+class RuleInfo:
+    """Metadata for a single rule id."""
+    rule_id: str
+    category: Optional[str]
+    severity: Optional[str] = None
+    critical: bool = False
+    pillar_id: Optional[str] = None
+    rule_class: Optional[str] = None
+    name: Optional[str] = None
+
+
+@dataclass(frozen=True)
+class TokenRules:
+    """Result of classifying one risk token.
+
+    rule_ids: ids attached to the token during span enrichment.
+    scoring_rule_ids: ids read after "rule_ids:" for category scoring.
+    category / category_index: first matching scoring category, if any.
+    critical: True when a quoted scoring id is one of the critical rules.
+    """
+    rule_ids: List[str]
+    scoring_rule_ids: List[str]
+    category: Optional[str]
+    category_index: Optional[int]
+    critical: bool
+
+
+class RuleRegistry:
+    """Index of guideline and scoring rules with a one-pass token classifier."""
+
+    def __init__(
+        self,
+        guidelines_xml: str = "",
+        category_rules: Optional[Dict[str, List[str]]] = None,
+        critical_rules: Optional[List[str]] = None,
+    ):
+        self.category_rules = dict(CATEGORY_RULES if category_rules is None else category_rules)
+        self.critical_rules = frozenset(CRITICAL_RULES if critical_rules is None else critical_rules)
+        self.categories = list(self.category_rules)
+        self.rules: Dict[str, RuleInfo] = {}
+        # First matching category wins, so keep the lowest index per rule
+        self.category_index: Dict[str, int] = {}
+        for idx, (category, rules) in enumerate(self.category_rules.items()):
+            for rule in rules:
+                if rule in self.category_index:
+                    continue
+                self.category_index[rule] = idx
+                self.rules[rule] = RuleInfo(rule_id=rule, category=category, critical=rule in self.critical_rules)
+        for rule in self.critical_rules:
+            self.rules.setdefault(rule, RuleInfo(rule_id=rule, category=None, critical=True))
+        if guidelines_xml:
+            self._index_guidelines(guidelines_xml)
+
+    def _index_guidelines(self, guidelines_xml: str) -> None:
+        """Add every <rule> of the guideline XML, keyed by its id."""
+        try:
+            root = ET.fromstring(guidelines_xml)
+        except ET.ParseError as e:
+            print(f"Warning: could not parse guidelines for rule registry ({e})")
+            return
+        for pillar in root.iter("pillar"):
+            for rule in pillar.iter("rule"):
+                rule_id = rule.get("id")
+                if not rule_id:
+                    continue
+                severity = rule.get("severity")
+                self.rules[rule_id] = RuleInfo(
+                    rule_id=rule_id,
+                    category=pillar.get("name"),
+                    severity=severity,
+                    critical=severity == "critical",
+                    pillar_id=pillar.get("id"),
+                    rule_class=pillar.get("class"),
+                    name=rule.get("name"),
+                )
+
+    def get(self, rule_id: str) -> Optional[RuleInfo]:
+        return self.rules.get(rule_id)
+
+    def classify_classification(self, classification: str) -> TokenRules:
+        """Extract enrichment ids, scoring ids, category and critical flag in one scan."""
+        classification = classification or ""
+        marker = classification.rfind(_RULE_IDS_MARKER)
+        rule_part_start = marker + len(_RULE_IDS_MARKER) if marker != -1 else -1
+
+        quoted: List[str] = []
+        bounded_numbers: List[str] = []
+        quoted_after: List[str] = []
+        numbers_after: List[str] = []
+        length = len(classification)
+        for match in _RULE_TOKEN_RE.finditer(classification):
+            after_marker = rule_part_start != -1 and match.start() >= rule_part_start
+            rule_id = match.group(1)
+            if rule_id:
+                quoted.append(rule_id)
+                if after_marker:
+                    quoted_after.append(rule_id)
+                continue
+            number = match.group(2)
+            if after_marker:
+                numbers_after.append(number)
+            start, end = match.span(2)
+            if (start == 0 or not _is_word_char(classification[start - 1])) and (
+                end == length or not _is_word_char(classification[end])
+            ):
+                bounded_numbers.append(number)
+
+        rule_ids = quoted or [f"R{n}" for n in bounded_numbers]
+        scoring_rule_ids = quoted_after or [f"R{n}" for n in numbers_after]
+
+        category_index = None
+        for rule in scoring_rule_ids:
+            idx = self.category_index.get(rule)
+            if idx is not None and (category_index is None or idx < category_index):
+                category_index = idx
+        critical = any(rule in self.critical_rules for rule in quoted_after)
+
+        return TokenRules(
+            rule_ids=rule_ids,
+            scoring_rule_ids=scoring_rule_ids,
+            category=self.categories[category_index] if category_index is not None else None,
+            category_index=category_index,
+            critical=critical,
+        )
+
+    def classify(self, token: Dict[str, Any]) -> TokenRules:
+        """Classify a risk token dict by its "classification" string."""
+        return self.classify_classification(token.get("classification", ""))
+
+
+@functools.lru_cache(maxsize=None)
+def get_rule_registry(analysis_mode: str = "both") -> RuleRegistry:
+    """Shared registry for an analysis mode, built from its guideline XML on first use."""
+    filename = GUIDELINE_FILES.get(analysis_mode, "both.xml")
+    guidelines_xml = read_data_file(filename) or read_data_file("both.xml")
+    return RuleRegistry(guidelines_xml)
@@ -0,0 +1,40 @@
+"""
+Scoring configuration shared by the per-prompt and batch risk scorers.
+
+These tables were previously defined inline in AnalyzerAgent's PRD and
+deterministic risk score methods. They live here so an offline re-score can
+swap weights or severities without touching the agent.
+"""
+
+from typing import Dict, List
+
+# Severity weights used by prompt-level and meta-level PRD
+SEVERITY_WEIGHTS: Dict[str, int] = {
+    "medium": 1,
+    "high": 2,
+    "critical": 3
+}
+
+# Category mapping (C1-C5); order matters, the first matching category wins
+CATEGORY_RULES: Dict[str, List[str]] = {
+    "Referential Ambiguity & Quantification": ["R1", "R7", "R17"],
+    "Context Sufficiency & Integrity": ["R3", "R6", "R16"],
+    "Instruction Structure & Delimitation": ["R2", "R4", "R5", "R8", "R14", "R20", "R21"],
+    "Verifiability & Factuality": ["R9", "R10", "R15", "R19"],
+    "Reasoning & Uncertainty Handling": ["R11", "R12", "R13", "R18", "R22"]
+}
+
+# Weighted blend used for the overall percentage (Option A)
+CATEGORY_WEIGHTS: Dict[str, float] = {
+    "Referential Ambiguity & Quantification": 0.35,
+    "Context Sufficiency & Integrity": 0.20,
+    "Instruction Structure & Delimitation": 0.10,
+    "Verifiability & Factuality": 0.25,
+    "Reasoning & Uncertainty Handling": 0.10
+}
+
+# Category whose saturation applies the C1 soft floors
+DOMINANT_CATEGORY = "Referential Ambiguity & Quantification"
+
+# Rules that trigger the critical override (faithfulness floor)
+CRITICAL_RULES: List[str] = ["R9", "R10", "R13", "R22"]
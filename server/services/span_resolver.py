@@ -0,0 +1,150 @@
+"""
+Resolve quoted risk spans to offsets in the analyzed prompt.
+
+With ``ANALYZER_OUTPUT_CONTRACT=offsets`` the analyzer no longer echoes the
+whole prompt with inline ``<RISK_n>`` tags. Each risk token instead carries its
+exact ``text`` plus an ``occurrence`` (1 = first time that text appears in the
+prompt). ``SpanIndex`` finds the offsets, and ``build_annotated_prompt`` puts
+the tags back in locally, so the response shape the client sees does not change.
+
+Lookups first try the exact text. If that fails they retry ignoring case and
+runs of whitespace, which covers most model paraphrasing of quotes. Offsets
+always refer to the original prompt. Tokens that cannot be placed, or that
+overlap a span placed earlier, are returned as unresolved with a reason rather
+than dropped silently.
+"""
+
+import re
+from typing import Any, Dict, List, Optional, Tuple
+
+Span = Tuple[int, int]
+
+_WHITESPACE_RE = re.compile(r"\s+")
+
+
+def occurrence_positions(text: str, needle: str) -> List[int]:
+    """Start offsets of every (possibly overlapping) occurrence of ``needle``."""
+    positions: List[int] = []
+    if not needle:
+        return positions
+    start = text.find(needle)
+    while start != -1:
+        positions.append(start)
+        start = text.find(needle, start + 1)
+    return positions
+
+
+def occurrence_index(text: str, needle: str, start: int) -> int:
+    """The 1-based ``occurrence`` of ``needle`` that begins at ``start``."""
+    return sum(1 for position in occurrence_positions(text, needle) if position < start) + 1
+
+
+class SpanIndex:
+    """Occurrence lookups over one prompt, cached per quoted text."""
+
+    def __init__(self, text: str):
+        self.text = text
+        self._exact: Dict[str, List[int]] = {}
+        self._loose: Dict[str, List[Span]] = {}
+        self._folded: Optional[str] = None
+        self._folded_to_original: List[int] = []
+
+    def _fold(self) -> None:
+        # Lowercase and collapse whitespace runs to one space, keeping a map to original offsets
+        chars: List[str] = []
+        mapping: List[int] = []
+        previous_space = False
+        for i, ch in enumerate(self.text):
+            if ch.isspace():
+                if previous_space:
+                    continue
+                previous_space = True
+                chars.append(" ")
+                mapping.append(i)
+                continue
+            previous_space = False
+            lowered = ch.lower()
+            # Keep a 1:1 mapping; lowercasing that changes length (rare) keeps the original char
+            chars.append(lowered if len(lowered) == 1 else ch)
+            mapping.append(i)
+        self._folded = "".join(chars)
+        mapping.append(len(self.text))
+        self._folded_to_original = mapping
+
+    def _loose_spans(self, quote: str) -> List[Span]:
+        key = _WHITESPACE_RE.sub(" ", quote.strip()).lower()
+        if key not in self._loose:
+            if self._folded is None:
+                self._fold()
+            spans = []
+            for start in occurrence_positions(self._folded, key):
+                end = start + len(key)
+                spans.append((self._folded_to_original[start], self._folded_to_original[end - 1] + 1))
+            self._loose[key] = spans
+        return self._loose[key]
+
+    def find(self, quote: str, occurrence: int = 1) -> Optional[Span]:
+        """(start, end) of the ``occurrence``-th match of ``quote``, or None."""
+        if not quote or not quote.strip():
+            return None
+        occurrence = max(1, occurrence)
+        if quote not in self._exact:
+            self._exact[quote] = occurrence_positions(self.text, quote)
+        positions = self._exact[quote]
+        if len(positions) >= occurrence:
+            start = positions[occurrence - 1]
+            return start, start + len(quote)
+        spans = self._loose_spans(quote)
+        if len(spans) >= occurrence:
+            return spans[occurrence - 1]
+        return None
+
+
+def _occurrence(token: Dict[str, Any]) -> int:
+    try:
+        return int(token.get("occurrence", 1) or 1)
+    except (TypeError, ValueError):
+        return 1
+
+
+def resolve_risk_spans(prompt: str, risk_tokens: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Set ``span_start``/``span_end`` on each risk token; returns the unresolved ones.
+
+    Unresolved entries are ``{"id", "text", "occurrence", "reason"}`` where
+    reason is ``not_found`` or ``overlap``.
+    """
+    index = SpanIndex(prompt)
+    placed: List[Span] = []
+    unresolved: List[Dict[str, Any]] = []
+    for token in risk_tokens:
+        quote = str(token.get("text") or "")
+        occurrence = token["occurrence"] = _occurrence(token)
+        span = index.find(quote, occurrence)
+        reason = None
+        if span is None:
+            reason = "not_found"
+        elif any(span[0] < end and start < span[1] for start, end in placed):
+            reason = "overlap"
+        if reason is not None:
+            unresolved.append({"id": token.get("id"), "text": quote, "occurrence": occurrence, "reason": reason})
+            continue
+        placed.append(span)
+        token["span_start"], token["span_end"] = span
+    return unresolved
+
+
+def build_annotated_prompt(prompt: str, risk_tokens: List[Dict[str, Any]]) -> str:
+    """Wrap every resolved span in ``<RISK_n>`` tags named after the token id."""
+    spans = sorted(
+        (token["span_start"], token["span_end"], str(token.get("id") or f"RISK_{i}"))
+        for i, token in enumerate(risk_tokens, start=1)
+        if "span_start" in token and "span_end" in token
+    )
+    parts: List[str] = []
+    cursor = 0
+    for start, end, risk_id in spans:
+        parts.append(prompt[cursor:start])
+        parts.append(f"<{risk_id}>{prompt[start:end]}</{risk_id}>")
+        cursor = end
+    parts.append(prompt[cursor:])
+    return "".join(parts)
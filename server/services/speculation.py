@@ -0,0 +1,35 @@
+"""
+Speculative initiation: decide whether a draft built from partial analysis can be kept.
+
+The pipelined ``/api/analyze?then=initiate&speculate=true`` mode starts the
+initiator as soon as the streaming analyzer closes its ``risk_tokens`` array,
+while the risk assessment is still being generated. The initiator asks one
+question per risky span, so the draft stays valid unless the final analysis
+contains a critical/high risk token that the draft did not see.
+"""
+
+from typing import Any, Dict, Iterable, Set, Tuple
+
+from ..observability.metrics import SPECULATIVE_INITIATIONS
+
+HIGH_RISK_LEVELS = {"critical", "high"}
+
+
+def high_risk_items(risk_tokens: Iterable[Dict[str, Any]]) -> Set[Tuple[str, str]]:
+    """(span text, level) of every critical/high risk token, normalized for comparison."""
+    items = set()
+    for token in risk_tokens or []:
+        level = str(token.get("risk_level") or "").strip().lower()
+        if level in HIGH_RISK_LEVELS:
+            items.add((" ".join(str(token.get("text") or "").lower().split()), level))
+    return items
+
+
+def speculation_holds(draft_tokens: Iterable[Dict[str, Any]], final_tokens: Iterable[Dict[str, Any]]) -> bool:
+    """True when the final analysis adds no critical/high item the draft was not built from."""
+    return high_risk_items(final_tokens) <= high_risk_items(draft_tokens)
+
+
+def record_speculation(outcome: str) -> None:
+    """kept | rerun | failed | not_started - the keep rate is kept / (kept + rerun + failed)."""
+    SPECULATIVE_INITIATIONS.labels(outcome).inc()
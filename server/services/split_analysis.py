@@ -0,0 +1,181 @@
+"""
+Split analysis for ``analysis_mode="both"``: several smaller concurrent completions.
+
+One "both" analysis asks the model to apply all 32 rules in a single long
+completion. With ``ANALYZER_SPLIT`` set, the analyzer instead issues one
+completion per rule group at the same time and merges the results. Each
+completion has a smaller guideline prompt and less to write, so the wall-clock
+time approaches that of the slowest group instead of the sum.
+
+ANALYZER_SPLIT:
+- off (default): one completion.
+- rulesets: factuality.xml and faithfulness.xml, each analyzed in its own mode.
+  both.xml rates every rule at the higher of the two severities, which is
+  what the merge keeps.
+- class: prompt-level pillars vs meta-level pillars of both.xml.
+- explicit pillar groups of both.xml separated by ";", e.g. ``ABD;EFHIL;CGJK``.
+
+``merge_analyses`` combines the parsed group results. Risk tokens must already
+carry ``span_start``/``span_end`` from span location. Overlapping spans keep
+the higher severity, and the survivors are renumbered ``RISK_1..n`` by
+position. Violations are de-duplicated the same way. ``annotated_prompt`` is
+rebuilt from the merged spans. An unresolved span whose token did not survive
+the merge gets an id after the merged ones, so it never names a merged token.
+"""
+
+from dataclasses import dataclass
+from typing import Any, Dict, List, Tuple
+
+from .guidelines import pillar_classes, pillar_subset, read_data_file
+from .scoring_config import SEVERITY_WEIGHTS
+from .span_resolver import build_annotated_prompt
+
+@dataclass(frozen=True)
+class SplitGroup:
+    label: str
+    analysis_mode: str  # guideline wording / rule registry mode for this group
+    guidelines_xml: str
+
+    @property
+    def budget_mode(self) -> str:
+        # Rulesets share budget history with plain factuality/faithfulness calls
+        return self.analysis_mode if self.analysis_mode != "both" else f"both:{self.label}"
+
+
+def split_groups(spec: str) -> List[SplitGroup]:
+    """Parse ANALYZER_SPLIT into rule groups; an empty list means no split."""
+    spec = (spec or "off").strip()
+    if spec.lower() in ("", "off", "0", "none"):
+        return []
+    if spec.lower() == "rulesets":
+        return [
+            SplitGroup(mode, mode, read_data_file(f"{mode}.xml") or "")
+            for mode in ("factuality", "faithfulness")
+        ]
+    classes = pillar_classes("both.xml")
+    if spec.lower() == "class":
+        pillar_groups = [
+            "".join(pid for pid, cls in classes.items() if cls == wanted) for wanted in ("prompt", "meta")
+        ]
+    else:
+        pillar_groups = [part.strip().upper() for part in spec.split(";") if part.strip()]
+    unknown = {pid for group in pillar_groups for pid in group} - set(classes)
+    if unknown:
+        raise ValueError(f"Unknown pillar(s) {sorted(unknown)} in ANALYZER_SPLIT={spec!r}")
+    if len(pillar_groups) < 2:
+        return []
+    return [
+        SplitGroup(group, "both", pillar_subset("both.xml", frozenset(group)))
+        for group in pillar_groups
+    ]
+
+
+def _weight(item: Dict[str, Any]) -> int:
+    return SEVERITY_WEIGHTS.get(str(item.get("risk_level") or item.get("severity") or "").lower(), 0)
+
+
+def _dedupe(items: List[Dict[str, Any]], key) -> List[Dict[str, Any]]:
+    # First occurrence keeps its position; a duplicate with higher severity replaces it
+    kept: Dict[Any, Dict[str, Any]] = {}
+    for item in items:
+        k = key(item)
+        if k not in kept or _weight(item) > _weight(kept[k]):
+            kept[k] = item
+    return list(kept.values())
+
+
+def merge_risk_tokens(
+    parts: List[Dict[str, Any]]
+) -> Tuple[List[Dict[str, Any]], List[Dict[str, str]]]:
+    """Merged, renumbered risk tokens plus, per part, the map old id -> new id.
+
+    Tokens without offsets (e.g. streamed before span location) are
+    de-duplicated by text instead.
+    """
+    candidates = [
+        (index, token)
+        for index, part in enumerate(parts)
+        for token in (part.get("risk_tokens") or [])
+    ]
+    placed = [(i, t) for i, t in candidates if "span_start" in t and "span_end" in t]
+    unplaced = [(i, t) for i, t in candidates if not ("span_start" in t and "span_end" in t)]
+
+    # Most severe first; a span overlapping one already kept is dropped
+    kept: List[Tuple[int, Dict[str, Any]]] = []
+    for index, token in sorted(placed, key=lambda it: (-_weight(it[1]), it[1]["span_start"])):
+        start, end = token["span_start"], token["span_end"]
+        if any(start < other["span_end"] and other["span_start"] < end for _, other in kept):
+            continue
+        kept.append((index, token))
+    kept.sort(key=lambda it: it[1]["span_start"])
+
+    seen_text: Dict[str, Tuple[int, Dict[str, Any]]] = {}
+    for index, token in unplaced:
+        text = str(token.get("text") or "").strip().lower()
+        if text not in seen_text or _weight(token) > _weight(seen_text[text][1]):
+            seen_text[text] = (index, token)
+
+    renamed: List[Dict[str, str]] = [{} for _ in parts]
+    merged: List[Dict[str, Any]] = []
+    for n, (index, token) in enumerate(kept + list(seen_text.values()), start=1):
+        new_id = f"RISK_{n}"
+        if token.get("id"):
+            renamed[index][token["id"]] = new_id
+        merged.append({**token, "id": new_id})
+    return merged, renamed
+
+
+def merge_analyses(user_prompt: str, parts: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """One analysis result from the parsed, span-located results of each group."""
+    risk_tokens, renamed = merge_risk_tokens(parts)
+
+    prompt_violations: List[Dict[str, Any]] = []
+    meta_violations: List[Dict[str, Any]] = []
+    prompt_overviews: List[str] = []
+    meta_overviews: List[str] = []
+    summaries: List[str] = []
+    unresolved: List[Dict[str, Any]] = []
+    next_id = len(risk_tokens)
+    for index, part in enumerate(parts):
+        assessment = part.get("risk_assessment") or {}
+        prompt_level = assessment.get("prompt") or {}
+        meta_level = assessment.get("meta") or {}
+        prompt_violations.extend(prompt_level.get("prompt_violations") or [])
+        meta_violations.extend(meta_level.get("meta_violations") or [])
+        if prompt_level.get("prompt_overview"):
+            prompt_overviews.append(prompt_level["prompt_overview"])
+        if meta_level.get("meta_overview"):
+            meta_overviews.append(meta_level["meta_overview"])
+        if part.get("analysis_summary"):
+            summaries.append(part["analysis_summary"])
+        for entry in part.get("unresolved_spans") or []:
+            new_id = renamed[index].get(entry.get("id"))
+            if new_id is None:
+                # Group-local ids would collide with the renumbered RISK_1..n
+                next_id += 1
+                new_id = f"RISK_{next_id}"
+            unresolved.append({**entry, "id": new_id})
+
+    merged: Dict[str, Any] = {
+        "annotated_prompt": build_annotated_prompt(user_prompt, risk_tokens),
+        "analysis_summary": "\n\n".join(summaries),
+        "risk_tokens": risk_tokens,
+        "risk_assessment": {
+            "prompt": {
+                "prompt_PRD": 0.0,
+                "prompt_violations": _dedupe(
+                    prompt_violations,
+                    lambda v: (str(v.get("span") or v.get("text") or "").strip().lower(), v.get("rule_id")),
+                ),
+                "prompt_overview": "\n\n".join(prompt_overviews),
+            },
+            "meta": {
+                "meta_PRD": 0.0,
+                "meta_violations": _dedupe(meta_violations, lambda v: v.get("rule_id")),
+                "meta_overview": "\n\n".join(meta_overviews),
+            },
+        },
+    }
+    if any("unresolved_spans" in part for part in parts):
+        merged["unresolved_spans"] = unresolved
+    return merged
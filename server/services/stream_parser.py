@@ -0,0 +1,94 @@
+"""
+Incremental extraction of ``risk_tokens`` from a streamed analyzer response.
+
+The analyzer's JSON has ``risk_tokens`` before the (much longer)
+``risk_assessment`` block, so the risky spans are known well before the
+completion ends. ``RiskTokenStreamParser`` is fed content deltas as they
+arrive and yields each risk token object as soon as it closes, and reports
+when the array itself is complete.
+
+It only tracks string/escape state and bracket depth; it never re-parses the
+whole buffer, so feeding is linear in the response size.
+"""
+
+import json
+from typing import Any, Dict, List
+
+_KEY = '"risk_tokens"'
+
+
+class RiskTokenStreamParser:
+    def __init__(self):
+        self.risk_tokens: List[Dict[str, Any]] = []
+        self.complete = False
+        self._buffer = ""
+        self._pos = 0
+        self._state = "seek"  # seek -> array -> done
+        self._depth = 0
+        self._in_string = False
+        self._escaped = False
+        self._object_start = -1
+
+    def feed(self, text: str) -> List[Dict[str, Any]]:
+        """Consume a content delta; returns risk tokens that closed within it."""
+        if self._state == "done" or not text:
+            return []
+        self._buffer += text
+        if self._state == "seek":
+            key = self._buffer.find(_KEY)
+            if key == -1:
+                # Keep just enough to match a key split across deltas
+                self._buffer = self._buffer[-len(_KEY):]
+                return []
+            start = self._buffer.find("[", key + len(_KEY))
+            if start == -1:
+                self._buffer = self._buffer[key:]
+                return []
+            self._buffer = self._buffer[start + 1:]
+            self._pos = 0
+            self._state = "array"
+
+        closed: List[Dict[str, Any]] = []
+        buffer = self._buffer
+        i = self._pos
+        while i < len(buffer):
+            ch = buffer[i]
+            if self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                elif ch == "\\":
+                    self._escaped = True
+                elif ch == '"':
+                    self._in_string = False
+            elif ch == '"':
+                self._in_string = True
+            elif ch in "{[":
+                if self._depth == 0 and ch == "{":
+                    self._object_start = i
+                self._depth += 1
+            elif ch in "}]":
+                if self._depth == 0 and ch == "]":
+                    self.complete = True
+                    self._state = "done"
+                    break
+                self._depth -= 1
+                if self._depth == 0 and ch == "}" and self._object_start != -1:
+                    try:
+                        token = json.loads(buffer[self._object_start:i + 1])
+                    except json.JSONDecodeError:
+                        token = None
+                    if isinstance(token, dict):
+                        self.risk_tokens.append(token)
+                        closed.append(token)
+                    self._object_start = -1
+            i += 1
+
+        # Drop what is already consumed, keeping the open object (if any)
+        keep_from = self._object_start if self._object_start != -1 else i
+        self._buffer = buffer[keep_from:]
+        self._pos = i - keep_from
+        if self._object_start != -1:
+            self._object_start = 0
+        if self._state == "done":
+            self._buffer = ""
+        return closed
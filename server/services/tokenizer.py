@@ -0,0 +1,39 @@
+"""
+Shared tiktoken encoding for PRD scoring.
+
+``tiktoken`` is imported on first use, not at server import. The encoding is
+built once per model name. A failure is cached too: offline, tiktoken retries
+the BPE download on every ``encoding_for_model`` call, which used to stall
+each analysis for seconds before falling back to whitespace tokens.
+"""
+
+import functools
+import logging
+from typing import Any, Optional
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_ENCODING_MODEL = "gpt-4"
+
+
+@functools.lru_cache(maxsize=None)
+def get_encoding(model: str = DEFAULT_ENCODING_MODEL) -> Optional[Any]:
+    """tiktoken encoding for ``model``, or None if it cannot be loaded (cached either way)."""
+    try:
+        import tiktoken
+
+        return tiktoken.encoding_for_model(model)
+    except Exception as e:
+        logger.warning("tiktoken unavailable (%s); using whitespace tokenization", e)
+        return None
+
+
+def count_tokens(text: str, model: str = DEFAULT_ENCODING_MODEL) -> int:
+    """Token count of ``text``; whitespace-split words when no encoding is available."""
+    encoding = get_encoding(model)
+    if encoding is not None:
+        try:
+            return len(encoding.encode(text))
+        except Exception:
+            pass
+    return len(text.split())
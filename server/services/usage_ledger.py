@@ -0,0 +1,355 @@
+"""
+Usage Ledger - token and cost accounting per request and per client.
+
+Every upstream completion made through ``openai_client.create_chat_completion``
+is recorded here. Each record holds the prompt, cached-prompt, completion and
+reasoning tokens, and is attributed to the API route, analysis mode, model,
+agent and client key of the request that triggered it. The client key is the
+client IP, followed by ``/<X-Client-Key>`` when that header is sent. The
+header is not authenticated, so it only labels usage: budgets count per IP
+(``budget_key``). Behind a reverse proxy, run uvicorn with ``--proxy-headers``
+and ``--forwarded-allow-ips`` so the IP is the caller's, not the proxy's.
+
+Totals live in memory in per-minute buckets (rolling windows for /api/usage
+and budgets). With ``USAGE_DB_PATH`` set, a background task flushes new
+deltas to SQLite every ``USAGE_FLUSH_INTERVAL`` seconds. With
+``USAGE_CLIENT_TOKEN_BUDGET`` set, a client IP that has used that many tokens
+within ``USAGE_BUDGET_WINDOW`` seconds gets a 429 from every LLM-backed route
+(``LLM_ROUTES``, any method) before any LLM work starts.
+"""
+
+import asyncio
+import contextvars
+import json
+import logging
+import sqlite3
+import time
+from collections import defaultdict
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Tuple
+
+from ..config import (
+    USAGE_BUDGET_WINDOW,
+    USAGE_CLIENT_TOKEN_BUDGET,
+    USAGE_DB_PATH,
+    USAGE_PRICES,
+)
+
+logger = logging.getLogger(__name__)
+
+CLIENT_KEY_HEADER = "X-Client-Key"
+BUCKET_SECONDS = 60
+# Longest window kept in memory; older buckets only exist in SQLite
+RETENTION_SECONDS = 7 * 24 * 3600
+
+FIELDS = ("calls", "prompt_tokens", "cached_tokens", "completion_tokens", "reasoning_tokens")
+KEY_FIELDS = ("route", "mode", "model", "client_key", "agent")
+# Route labels (observability.metrics.route_label) whose handlers call the LLM
+LLM_ROUTES = frozenset({"analyze", "initiate", "refine", "prepare"})
+
+# (route, mode, model, client_key, agent)
+UsageKey = Tuple[str, str, str, str, str]
+
+
+@dataclass
+class UsageContext:
+    route: str = "other"
+    client_key: str = "anonymous"
+
+
+_usage_context: contextvars.ContextVar[UsageContext] = contextvars.ContextVar(
+    "echo_usage_context", default=UsageContext()
+)
+
+
+def set_usage_context(route: str, client_key: str) -> None:
+    _usage_context.set(UsageContext(route=route, client_key=client_key))
+
+
+def current_client_key() -> str:
+    return _usage_context.get().client_key
+
+
+def client_key_for(header_value: Optional[str], client_host: Optional[str]) -> str:
+    """``<ip>`` or ``<ip>/<X-Client-Key>``; the IP part is what budgets count against."""
+    key = client_host or "anonymous"
+    label = (header_value or "").strip()
+    return f"{key}/{label}" if label else key
+
+
+def budget_key(client_key: str) -> str:
+    """The client IP part of a client key."""
+    return client_key.split("/", 1)[0]
+
+
+def _zero() -> List[int]:
+    return [0] * len(FIELDS)
+
+
+def _usage_numbers(usage: Any) -> List[int]:
+    prompt_tokens = getattr(usage, "prompt_tokens", 0) or 0
+    completion_tokens = getattr(usage, "completion_tokens", 0) or 0
+    prompt_details = getattr(usage, "prompt_tokens_details", None)
+    completion_details = getattr(usage, "completion_tokens_details", None)
+    cached = (getattr(prompt_details, "cached_tokens", 0) or 0) if prompt_details else 0
+    reasoning = (getattr(completion_details, "reasoning_tokens", 0) or 0) if completion_details else 0
+    return [1, prompt_tokens, cached, completion_tokens, reasoning]
+
+
+def estimate_cost(model: str, totals: Dict[str, int]) -> Optional[float]:
+    """USD cost from USAGE_PRICES (per 1M tokens); None when the model has no price.
+
+    Reasoning tokens are billed as completion tokens and are already part of
+    ``completion_tokens``; cached prompt tokens use the "cached" price when given.
+    """
+    price = USAGE_PRICES.get(model)
+    if not price:
+        return None
+    uncached = totals["prompt_tokens"] - totals["cached_tokens"]
+    cost = (
+        uncached * price.get("prompt", 0)
+        + totals["cached_tokens"] * price.get("cached", price.get("prompt", 0))
+        + totals["completion_tokens"] * price.get("completion", 0)
+    ) / 1_000_000
+    return round(cost, 6)
+
+
+class UsageLedger:
+    def __init__(self, db_path: str = "", budget: int = 0, budget_window: int = 86400):
+        self.db_path = db_path
+        self.budget = budget
+        self.budget_window = budget_window
+        self.started_at = time.time()
+        # bucket_start -> key -> counters
+        self._buckets: Dict[int, Dict[UsageKey, List[int]]] = defaultdict(lambda: defaultdict(_zero))
+        # Deltas not yet written to SQLite
+        self._pending: Dict[Tuple[int, UsageKey], List[int]] = defaultdict(_zero)
+        # client_key -> bucket_start -> tokens, for cheap budget checks
+        self._client_tokens: Dict[str, Dict[int, int]] = defaultdict(lambda: defaultdict(int))
+        self._db_ready = False
+
+    # -- recording ------------------------------------------------------------
+
+    def record(self, agent: str, model: str, mode: str, usage: Any) -> None:
+        if not usage:
+            return
+        context = _usage_context.get()
+        key: UsageKey = (context.route, mode or "n/a", model or "unknown", context.client_key, agent)
+        numbers = _usage_numbers(usage)
+        bucket = int(time.time()) // BUCKET_SECONDS * BUCKET_SECONDS
+        self._add(bucket, key, numbers)
+        if self.db_path:
+            pending = self._pending[(bucket, key)]
+            for i, value in enumerate(numbers):
+                pending[i] += value
+
+    def _add(self, bucket: int, key: UsageKey, numbers: List[int]) -> None:
+        counters = self._buckets[bucket][key]
+        for i, value in enumerate(numbers):
+            counters[i] += value
+        self._client_tokens[budget_key(key[3])][bucket] += numbers[1] + numbers[3]
+
+    # -- queries --------------------------------------------------------------
+
+    def client_tokens(self, client_key: str, window: Optional[int] = None) -> int:
+        """Tokens used by the client's IP (all of its X-Client-Key labels) within the window."""
+        cutoff = time.time() - (window or self.budget_window)
+        tokens = self._client_tokens.get(budget_key(client_key), {})
+        return sum(count for bucket, count in tokens.items() if bucket + BUCKET_SECONDS > cutoff)
+
+    def over_budget(self, client_key: str) -> bool:
+        return bool(self.budget) and self.client_tokens(client_key) >= self.budget
+
+    def totals(self, window: int = 3600, client_key: Optional[str] = None) -> Dict[str, Any]:
+        """Rolling totals over the last ``window`` seconds, grouped by route/mode/model/client/agent.
+
+        ``client_key`` matches one client key, or every key of an IP when it is a bare IP.
+        """
+        cutoff = time.time() - window
+        grouped: Dict[UsageKey, List[int]] = defaultdict(_zero)
+        for bucket, entries in self._buckets.items():
+            if bucket + BUCKET_SECONDS <= cutoff:
+                continue
+            for key, counters in entries.items():
+                if client_key and client_key not in (key[3], budget_key(key[3])):
+                    continue
+                target = grouped[key]
+                for i, value in enumerate(counters):
+                    target[i] += value
+
+        rows = []
+        overall = dict.fromkeys(FIELDS, 0)
+        overall_cost = 0.0
+        for key, counters in sorted(grouped.items()):
+            row: Dict[str, Any] = dict(zip(KEY_FIELDS, key))
+            row.update(zip(FIELDS, counters))
+            row["cost_usd"] = estimate_cost(key[2], row)
+            overall_cost += row["cost_usd"] or 0.0
+            for name in FIELDS:
+                overall[name] += row[name]
+            rows.append(row)
+        overall["cost_usd"] = round(overall_cost, 6)
+        return {
+            "window_seconds": window,
+            "since": max(self.started_at, cutoff),
+            "totals": overall,
+            "rows": rows,
+        }
+
+    # -- persistence ------------------------------------------------------------
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.db_path, timeout=10)
+
+    def _init_db(self) -> None:
+        with self._connect() as conn:
+            conn.execute(
+                """CREATE TABLE IF NOT EXISTS usage (
+                    bucket_start INTEGER NOT NULL,
+                    route TEXT NOT NULL,
+                    mode TEXT NOT NULL,
+                    model TEXT NOT NULL,
+                    client_key TEXT NOT NULL,
+                    agent TEXT NOT NULL,
+                    calls INTEGER NOT NULL DEFAULT 0,
+                    prompt_tokens INTEGER NOT NULL DEFAULT 0,
+                    cached_tokens INTEGER NOT NULL DEFAULT 0,
+                    completion_tokens INTEGER NOT NULL DEFAULT 0,
+                    reasoning_tokens INTEGER NOT NULL DEFAULT 0,
+                    PRIMARY KEY (bucket_start, route, mode, model, client_key, agent)
+                )"""
+            )
+
+    def _write(self, rows: List[Tuple[int, UsageKey, List[int]]]) -> None:
+        if not self._db_ready:
+            self._init_db()
+            self._db_ready = True
+        with self._connect() as conn:
+            conn.executemany(
+                """INSERT INTO usage (bucket_start, route, mode, model, client_key, agent,
+                                      calls, prompt_tokens, cached_tokens, completion_tokens, reasoning_tokens)
+                   VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                   ON CONFLICT (bucket_start, route, mode, model, client_key, agent) DO UPDATE SET
+                       calls = calls + excluded.calls,
+                       prompt_tokens = prompt_tokens + excluded.prompt_tokens,
+                       cached_tokens = cached_tokens + excluded.cached_tokens,
+                       completion_tokens = completion_tokens + excluded.completion_tokens,
+                       reasoning_tokens = reasoning_tokens + excluded.reasoning_tokens""",
+                [(bucket, *key, *counters) for bucket, key, counters in rows],
+            )
+
+    def _load_recent(self) -> int:
+        """Seed the in-memory buckets from SQLite so windows and budgets survive restarts."""
+        if not self._db_ready:
+            self._init_db()
+            self._db_ready = True
+        cutoff = int(time.time() - max(RETENTION_SECONDS, self.budget_window))
+        with self._connect() as conn:
+            rows = conn.execute(
+                f"SELECT bucket_start, {', '.join(KEY_FIELDS)}, {', '.join(FIELDS)} FROM usage WHERE bucket_start >= ?",
+                (cutoff,),
+            ).fetchall()
+        for row in rows:
+            self._add(row[0], tuple(row[1:6]), list(row[6:]))
+        return len(rows)
+
+    async def flush(self) -> int:
+        """Write pending deltas to SQLite off the event loop; returns rows written."""
+        self._prune()
+        if not self.db_path or not self._pending:
+            return 0
+        pending, self._pending = self._pending, defaultdict(_zero)
+        rows = [(bucket, key, counters) for (bucket, key), counters in pending.items()]
+        try:
+            await asyncio.to_thread(self._write, rows)
+        except Exception as e:
+            logger.error("[usage] flush failed, keeping %d rows for retry: %s", len(rows), e)
+            for bucket, key, counters in rows:
+                target = self._pending[(bucket, key)]
+                for i, value in enumerate(counters):
+                    target[i] += value
+            return 0
+        return len(rows)
+
+    def _prune(self) -> None:
+        cutoff = time.time() - max(RETENTION_SECONDS, self.budget_window)
+        for bucket in [b for b in self._buckets if b + BUCKET_SECONDS <= cutoff]:
+            del self._buckets[bucket]
+        for buckets in self._client_tokens.values():
+            for bucket in [b for b in buckets if b + BUCKET_SECONDS <= cutoff]:
+                del buckets[bucket]
+
+    async def run_flusher(self, interval: float) -> None:
+        """Background task: load recent history, then flush periodically until cancelled."""
+        if self.db_path:
+            try:
+                loaded = await asyncio.to_thread(self._load_recent)
+                logger.info("[usage] loaded %d usage rows from %s", loaded, self.db_path)
+            except Exception as e:
+                logger.error("[usage] could not load %s: %s", self.db_path, e)
+        try:
+            while True:
+                await asyncio.sleep(interval)
+                await self.flush()
+        except asyncio.CancelledError:
+            await self.flush()
+            raise
+
+
+_ledger: Optional[UsageLedger] = None
+
+
+def get_usage_ledger() -> UsageLedger:
+    global _ledger
+    if _ledger is None:
+        _ledger = UsageLedger(
+            db_path=USAGE_DB_PATH,
+            budget=USAGE_CLIENT_TOKEN_BUDGET,
+            budget_window=USAGE_BUDGET_WINDOW,
+        )
+    return _ledger
+
+
+class UsageMiddleware:
+    """Pure ASGI middleware: attributes usage to route/client and enforces the token budget on LLM routes."""
+
+    def __init__(self, app, route_label):
+        self.app = app
+        self.route_label = route_label
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        headers = dict(scope.get("headers") or [])
+        client = scope.get("client")
+        client_key = client_key_for(
+            headers.get(CLIENT_KEY_HEADER.lower().encode(), b"").decode("latin-1"),
+            client[0] if client else None,
+        )
+        route = self.route_label(scope.get("path", ""))
+        set_usage_context(route, client_key)
+
+        ledger = get_usage_ledger()
+        # Every method: GET /api/refine/stream calls the LLM as much as the POST routes do
+        if route in LLM_ROUTES and ledger.over_budget(client_key):
+            body = json.dumps({
+                "detail": "Token budget exceeded for this client",
+                "budget_tokens": ledger.budget,
+                "window_seconds": ledger.budget_window,
+                "used_tokens": ledger.client_tokens(client_key),
+            }).encode("utf-8")
+            await send({
+                "type": "http.response.start",
+                "status": 429,
+                "headers": [
+                    (b"content-type", b"application/json"),
+                    (b"content-length", str(len(body)).encode()),
+                    (b"retry-after", str(BUCKET_SECONDS).encode()),
+                ],
+            })
+            await send({"type": "http.response.body", "body": body})
+            return
+
+        await self.app(scope, receive, send)
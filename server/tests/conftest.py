@@ -0,0 +1,17 @@
+"""
+Shared test setup.
+
+Settings are read from the environment when ``server.config`` is imported, so
+they are set here, before any test module imports the server: every LLM call
+goes to the in-process mock (no network, no API key) without simulated
+delays, and nothing is persisted.
+
+Run from the repository root: ``python -m pytest -q server/tests``.
+"""
+
+import os
+
+os.environ.setdefault("OPENAI_API_BASE_URL", "mock://")
+os.environ.setdefault("MOCK_LLM_TIME_SCALE", "0")
+os.environ["USAGE_DB_PATH"] = ""
+os.environ["LLM_CASSETTE_MODE"] = "off"
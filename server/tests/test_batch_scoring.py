@@ -0,0 +1,97 @@
+import random
+
+import pytest
+
+from server.services.analyzer_agent import AnalyzerAgent
+from server.services.batch_scoring import BatchRiskScorer
+from server.services.providers import get_llm_service
+from server.services.scoring_config import CATEGORY_RULES
+
+RULES = [rule for rules in CATEGORY_RULES.values() for rule in rules] + ["R30", "B1"]
+WORDS = "the report said most people agree it was better than before and some".split()
+
+
+def _classification(rng: random.Random) -> str:
+    rules = rng.sample(RULES, rng.randint(0, 3))
+    style = rng.choice(["quoted", "numeric", "none"])
+    if style == "quoted":
+        return "Vague referent; rule_ids: [" + ", ".join(f'"{rule}"' for rule in rules) + "]"
+    if style == "numeric":
+        return "See guideline 4; rule_ids: " + ", ".join(rule.lstrip("RB") for rule in rules)
+    return "Unclassified"
+
+
+def _analysis(rng: random.Random) -> dict:
+    prompt = " ".join(rng.choice(WORDS) for _ in range(rng.randint(0, 60)))
+    severities = ["medium", "high", "critical", "unknown"]
+    return {
+        "prompt": prompt,
+        "risk_tokens": [
+            {
+                "id": f"RISK_{n}",
+                "text": " ".join(rng.choice(WORDS) for _ in range(rng.randint(1, 4))),
+                "risk_level": rng.choice(["high", "medium"]),
+                "classification": _classification(rng),
+            }
+            for n in range(1, rng.randint(0, 12) + 1)
+        ],
+        "risk_assessment": {
+            "prompt": {"prompt_violations": [
+                {"severity": rng.choice(severities), "span": " ".join(rng.sample(WORDS, rng.randint(1, 5)))}
+                for _ in range(rng.randint(0, 6))
+            ]},
+            "meta": {"meta_violations": [{"severity": rng.choice(severities)} for _ in range(rng.randint(0, 4))]},
+        },
+    }
+
+
+@pytest.fixture(scope="module")
+def analyses():
+    rng = random.Random(7)
+    return [_analysis(rng) for _ in range(200)]
+
+
+def test_batch_matches_per_item_scores(analyses):
+    analyzer = get_llm_service().analyzer
+    batch = BatchRiskScorer().score(analyses)
+    for analysis, scores in zip(analyses, batch):
+        prompt = analysis["prompt"]
+        assessment = analysis["risk_assessment"]
+        assert scores["prompt_PRD"] == AnalyzerAgent._calculate_prd(prompt, assessment["prompt"]["prompt_violations"])
+        assert scores["meta_PRD"] == AnalyzerAgent._calculate_meta_prd(prompt, assessment["meta"]["meta_violations"])
+        assert scores["risk_scores"] == analyzer._calculate_deterministic_risk_scores(prompt, analysis["risk_tokens"])
+
+
+def test_prompt_recovered_from_annotations():
+    analysis = {
+        "annotated_prompt": "Tell me <RISK_1>everything</RISK_1> now",
+        "risk_tokens": [{"text": "everything", "risk_level": "high", "classification": 'rule_ids: ["R1"]'}],
+    }
+    scores = BatchRiskScorer().score([analysis, {**analysis, "prompt": "Tell me everything now"}])
+    assert scores[0] == scores[1]
+    assert scores[0]["risk_scores"]["category_scores"]["Referential Ambiguity & Quantification"]["span_count"] == 1
+
+
+def test_rescore_writes_prd_back(analyses):
+    copies = [{**a, "risk_assessment": {k: dict(v) for k, v in a["risk_assessment"].items()}} for a in analyses[:5]]
+    expected = BatchRiskScorer().score(copies)
+    for analysis, scores in zip(BatchRiskScorer().rescore(copies), expected):
+        assert analysis["risk_assessment"]["prompt"]["prompt_PRD"] == scores["prompt_PRD"]
+        assert analysis["risk_assessment"]["meta"]["meta_PRD"] == scores["meta_PRD"]
+
+
+def test_empty_overrides_are_not_defaults():
+    analysis = {
+        "prompt": "Tell me everything now",
+        "risk_tokens": [{"text": "everything", "risk_level": "high", "classification": 'rule_ids: ["R9"]'}],
+        "risk_assessment": {"prompt": {"prompt_violations": [{"severity": "high", "span": "everything"}]}},
+    }
+    default = BatchRiskScorer().score([analysis])[0]
+    assert default["risk_scores"]["critical_hits"] == 1
+    assert default["risk_scores"]["overall_percentage"] >= 60
+
+    scores = BatchRiskScorer(critical_rules=set(), severity_weights={}).score([analysis])[0]
+    assert scores["risk_scores"]["critical_hits"] == 0
+    assert scores["risk_scores"]["overall_percentage"] < 60
+    # Unknown severities weigh 1, so the high violation counts like a medium one
+    assert scores["prompt_PRD"] == round(1 / 4, 4)
@@ -0,0 +1,65 @@
+import json
+
+import pytest
+
+from server.bench.__main__ import _compare, _direction, _is_timing
+from server.bench.detection import detection_metrics
+
+
+def _report(recall=0.8, p50=100.0, completion=300.0, requests=10):
+    return {
+        "detection": {"overall": {"recall": recall, "counts": {"tp": 8, "fn": 2}}},
+        "performance": [{
+            "concurrency": 1,
+            "requests": requests,
+            "latency_ms": {"p50": p50},
+            "tokens_per_request": {"completion_tokens": completion},
+        }],
+    }
+
+
+@pytest.fixture
+def compare(tmp_path):
+    def run(base, new, threshold=0.0, time_threshold=0.1):
+        base_path, new_path = tmp_path / "base.json", tmp_path / "new.json"
+        base_path.write_text(json.dumps(base))
+        new_path.write_text(json.dumps(new))
+        return _compare(str(base_path), str(new_path), threshold, time_threshold)
+    return run
+
+
+def test_directions():
+    assert _direction("detection.overall.recall") == 1
+    assert _direction("performance.c1.throughput_rps") == 1
+    assert _direction("performance.c1.latency_ms.p95") == -1
+    assert _direction("performance.c1.tokens_per_request.completion_tokens") == -1
+    assert _direction("looplag.thread.loop_lag_ms.max") == -1
+    assert _direction("performance.c1.requests") == 0
+    assert _is_timing("startup.warmup_on.import_ms.p50")
+    assert not _is_timing("detection.overall.recall")
+
+
+def test_improvements_pass(compare):
+    assert compare(_report(), _report(recall=0.9, p50=50.0, completion=200.0)) == 0
+
+
+@pytest.mark.parametrize("new", [_report(recall=0.7), _report(completion=301.0), _report(p50=120.0)])
+def test_regressions_fail(compare, new):
+    assert compare(_report(), new) == 1
+
+
+def test_timing_noise_within_time_threshold(compare):
+    assert compare(_report(), _report(p50=108.0)) == 0
+    assert compare(_report(), _report(p50=108.0), time_threshold=0.05) == 1
+
+
+def test_neutral_metrics_never_fail(compare, capsys):
+    assert compare(_report(), _report(requests=20)) == 0
+    assert "changed" in capsys.readouterr().out
+
+
+def test_f1_from_unrounded_ratios():
+    metrics = detection_metrics(tp=1, fp=2, fn=0, tn=0)
+    # precision 1/3 and recall 1 give f1 = 0.5 exactly; the rounded precision would give 0.4999
+    assert metrics["precision"] == 0.3333
+    assert metrics["f1"] == 0.5
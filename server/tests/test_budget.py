@@ -0,0 +1,74 @@
+import pytest
+
+from server.services.budget import MIN_OBSERVATIONS, CompletionBudgeter, parse_effort_tiers
+
+SHORT = "Fix it."  # 1 estimated token
+LONG = "word " * 400  # 500 estimated tokens
+
+
+def test_unknown_strategy_is_rejected():
+    with pytest.raises(ValueError, match="ANALYZER_BUDGET"):
+        CompletionBudgeter(max_tokens=1000, strategy="fxed")
+
+
+def test_effort_tiers():
+    assert parse_effort_tiers("inf:medium, 50:low") == [(50, "low"), (float("inf"), "medium")]
+    with pytest.raises(ValueError):
+        parse_effort_tiers("50:turbo")
+
+
+def test_fixed_keeps_cap_and_predicts_below_it():
+    budgeter = CompletionBudgeter(max_tokens=20_000, strategy="fixed")
+    decision = budgeter.decide(LONG, "both")
+    assert (decision.reasoning_effort, decision.max_completion_tokens, decision.source) == ("medium", 20_000, "fixed")
+    assert 0 < decision.predicted_tokens <= 20_000
+    budgeter.observe(decision, "both", 100, "stop")
+    assert budgeter.snapshot() == {}
+
+
+def test_adaptive_prior_decisions():
+    budgeter = CompletionBudgeter(max_tokens=120_000, strategy="adaptive", min_cap=4000)
+    short = budgeter.decide(SHORT, "both")
+    long = budgeter.decide(LONG, "both")
+    assert (short.reasoning_effort, long.reasoning_effort) == ("low", "medium")
+    assert short.source == long.source == "prior"
+    assert short.max_completion_tokens >= 4000
+    assert long.max_completion_tokens > long.predicted_tokens
+    assert budgeter.decide(LONG, "factuality").predicted_tokens < long.predicted_tokens
+
+
+def test_observe_fits_history():
+    budgeter = CompletionBudgeter(max_tokens=120_000, strategy="adaptive", min_cap=100)
+    for i in range(MIN_OBSERVATIONS):
+        prompt = "word " * (200 + 40 * i)
+        decision = budgeter.decide(prompt, "both")
+        budgeter.observe(decision, "both", 1000 + 2 * decision.prompt_tokens, "stop")
+    decision = budgeter.decide(LONG, "both")
+    assert decision.source == "history"
+    assert decision.predicted_tokens == pytest.approx(1000 + 2 * decision.prompt_tokens, rel=0.01)
+    assert decision.max_completion_tokens < 5000
+    model = budgeter.snapshot()["both/medium"]
+    assert model["observations"] == MIN_OBSERVATIONS and model["source"] == "history"
+
+
+def test_truncation_retry_and_headroom():
+    budgeter = CompletionBudgeter(max_tokens=20_000, strategy="adaptive", min_cap=1000, escalation=2.5)
+    decision = budgeter.decide(LONG, "both")
+    assert not budgeter.should_retry(decision, "stop")
+    assert budgeter.should_retry(decision, "length")
+
+    retry = budgeter.escalate(decision, "both")
+    assert retry.attempt == 2
+    assert retry.max_completion_tokens == min(20_000, int(decision.max_completion_tokens * 2.5))
+    assert not budgeter.should_retry(retry, "length")
+    # The truncation widens the next cap; a truncated call is not history
+    assert budgeter.decide(LONG, "both").max_completion_tokens > decision.max_completion_tokens
+    budgeter.observe(retry, "both", 5000, "length")
+    assert not budgeter._history
+
+
+def test_no_retry_at_max_cap():
+    budgeter = CompletionBudgeter(max_tokens=2000, strategy="adaptive", min_cap=4000)
+    decision = budgeter.decide(LONG, "both")
+    assert decision.max_completion_tokens == 2000
+    assert not budgeter.should_retry(decision, "length")
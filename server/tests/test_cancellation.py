@@ -0,0 +1,185 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+from fastapi import FastAPI
+from prometheus_client import REGISTRY
+from starlette.testclient import TestClient
+
+from server.routes import analyze, prepare, refine
+from server.services import cancellation
+from server.services.cancellation import ClientDisconnected, cancel_tasks, llm_slot, run_until_disconnect
+
+
+def _count(name, **labels):
+    return REGISTRY.get_sample_value(name, labels) or 0.0
+
+
+def _disconnects(route, outcome):
+    return _count("echo_client_disconnects_total", route=route, outcome=outcome)
+
+
+class FakeRequest:
+    """The part of a starlette Request run_until_disconnect uses; ``disconnect()`` ends the client."""
+
+    def __init__(self):
+        self.gone = asyncio.Event()
+
+    async def receive(self):
+        await self.gone.wait()
+        return {"type": "http.disconnect"}
+
+    def disconnect(self):
+        self.gone.set()
+
+
+@pytest.fixture
+def one_slot(monkeypatch):
+    monkeypatch.setattr(cancellation, "LLM_ROUTE_CONCURRENCY", 1)
+    monkeypatch.setattr(cancellation, "_limiter", None)
+
+
+@pytest.mark.asyncio
+async def test_single_flight_shares_one_call_and_copies_results():
+    calls = []
+    release = asyncio.Event()
+
+    async def work():
+        calls.append(1)
+        await release.wait()
+        return {"risk_tokens": []}
+
+    joins = _count("echo_single_flight_joins_total", route="test")
+    waiters = [asyncio.create_task(run_until_disconnect(FakeRequest(), work, route="test", key="k")) for _ in range(3)]
+    await asyncio.sleep(0)
+    release.set()
+    results = await asyncio.gather(*waiters)
+    assert calls == [1]
+    assert _count("echo_single_flight_joins_total", route="test") == joins + 2
+    results[0]["risk_tokens"].append("mutated")
+    assert results[1] == {"risk_tokens": []}
+    # Once finished, the same key starts a new call
+    release.set()
+    await run_until_disconnect(FakeRequest(), work, route="test", key="k")
+    assert calls == [1, 1]
+
+
+@pytest.mark.asyncio
+async def test_last_waiter_disconnect_cancels():
+    started, cancelled = asyncio.Event(), asyncio.Event()
+
+    async def work():
+        started.set()
+        try:
+            await asyncio.sleep(60)
+        except asyncio.CancelledError:
+            cancelled.set()
+            raise
+
+    first, second = FakeRequest(), FakeRequest()
+    before = (_disconnects("test", "shared"), _disconnects("test", "cancelled"))
+    a = asyncio.create_task(run_until_disconnect(first, work, route="test", key="c"))
+    b = asyncio.create_task(run_until_disconnect(second, work, route="test", key="c"))
+    await started.wait()
+
+    first.disconnect()
+    with pytest.raises(ClientDisconnected):
+        await a
+    assert not cancelled.is_set()
+    second.disconnect()
+    with pytest.raises(ClientDisconnected):
+        await b
+    await asyncio.wait_for(cancelled.wait(), 1)
+    assert (_disconnects("test", "shared"), _disconnects("test", "cancelled")) == (before[0] + 1, before[1] + 1)
+
+
+@pytest.mark.asyncio
+async def test_llm_slot_limits_concurrency(one_slot):
+    order = []
+
+    async def hold(name):
+        async with llm_slot():
+            order.append(f"{name}+")
+            await asyncio.sleep(0.01)
+            order.append(f"{name}-")
+
+    await asyncio.gather(hold("a"), hold("b"))
+    assert order == ["a+", "a-", "b+", "b-"]
+
+
+@pytest.mark.asyncio
+async def test_cancel_tasks_reports_running_ones():
+    done = asyncio.create_task(asyncio.sleep(0))
+    await done
+    running = asyncio.create_task(asyncio.sleep(60))
+    assert not cancel_tasks(None, done)
+    assert cancel_tasks(done, running)
+    with pytest.raises(asyncio.CancelledError):
+        await running
+
+
+async def _forever(*_args, **_kwargs):
+    await asyncio.sleep(60)
+
+
+@pytest.mark.asyncio
+async def test_prepare_stream_closed_early_cancels_and_frees_slot(monkeypatch, one_slot):
+    async def refine_prompt_parallel(on_refined, **_kwargs):
+        on_refined("Refined.")
+        await asyncio.sleep(60)
+
+    monkeypatch.setattr(prepare, "get_preparator", lambda: SimpleNamespace(refine_prompt_parallel=refine_prompt_parallel))
+    request = prepare.PrepareRequest(current_prompt="p", prior_analysis={}, conversation_history=[])
+    before = _disconnects("prepare", "cancelled")
+    events = prepare._prepare_events(request, "both")
+    assert (await events.__anext__())["event"] == "refined_prompt"
+    await events.aclose()
+    assert _disconnects("prepare", "cancelled") == before + 1
+    async with llm_slot():  # released, or this would wait forever
+        pass
+
+
+@pytest.mark.asyncio
+async def test_pipelined_analyze_cancelled_mid_analysis(monkeypatch, one_slot):
+    monkeypatch.setattr(analyze, "get_llm_service", lambda: SimpleNamespace(analyze_prompt=_forever))
+    before = _disconnects("analyze", "cancelled")
+
+    async def consume():
+        async for _ in analyze._analyze_then_initiate("p", "both"):
+            pass
+
+    task = asyncio.create_task(consume())
+    await asyncio.sleep(0.01)
+    # The stream holds the only slot while it runs
+    with pytest.raises(asyncio.TimeoutError):
+        async with asyncio.timeout(0.01):
+            async with llm_slot():
+                pass
+    task.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await task
+    assert _disconnects("analyze", "cancelled") == before + 1
+    async with llm_slot():
+        pass
+
+
+def test_websocket_cancel_frame_aborts_turn(monkeypatch):
+    async def chat_turn(system_prompt, history, analysis_mode, on_delta):
+        on_delta("Thinking")
+        await asyncio.sleep(60)
+
+    service = SimpleNamespace(chat_turn=chat_turn, build_conversation_system_prompt=lambda *a: "system")
+    monkeypatch.setattr(refine, "get_llm_service", lambda: service)
+    monkeypatch.setattr("server.services.refine_sessions.get_llm_service", lambda: service)
+    app = FastAPI()
+    app.include_router(refine.router, prefix="/api/refine")
+    before = _disconnects("refine", "cancelled")
+
+    with TestClient(app).websocket_connect("/api/refine/ws") as ws:
+        ws.send_json({"type": "start", "prompt": "Summarize it."})
+        assert ws.receive_json()["type"] == "ready"
+        ws.send_json({"type": "message", "content": "Shorter please."})
+        assert ws.receive_json() == {"type": "delta", "content": "Thinking"}
+        ws.send_json({"type": "cancel"})
+        assert ws.receive_json() == {"type": "cancelled"}
+    assert _disconnects("refine", "cancelled") == before + 1
@@ -0,0 +1,93 @@
+import gzip
+import json
+
+import httpx
+import openai
+import pytest
+
+from server.mock_llm import MockBehavior, MockLLM
+from server.mock_llm.transport import MockLLMTransport
+from server.services.cassette import (
+    CassetteMissError,
+    CassetteTransport,
+    CassetteVersionError,
+    request_key,
+)
+
+MESSAGES = [{"role": "system", "content": "You are the analyzer.\nANALYZE THIS PROMPT:\nTell me everything about it."}]
+
+
+def _client(transport):
+    return openai.AsyncOpenAI(
+        api_key="test", base_url="http://llm.test/v1", max_retries=0,
+        http_client=httpx.AsyncClient(transport=transport),
+    )
+
+
+def _body(**fields):
+    return json.dumps({"model": "m", "messages": MESSAGES, **fields}).encode()
+
+
+def test_request_key_ignores_budget_fields_and_key_order():
+    base = request_key("POST", "/v1/chat/completions", _body())
+    assert request_key("post", "/v1/chat/completions/", _body(max_completion_tokens=10, reasoning_effort="low")) == base
+    reordered = json.dumps({"messages": MESSAGES, "model": "m"}).encode()
+    assert request_key("POST", "/v1/chat/completions", reordered) == base
+    assert request_key("POST", "/v1/chat/completions", _body(temperature=0)) != base
+
+
+@pytest.mark.asyncio
+async def test_record_then_replay_round_trip(tmp_path):
+    recorder = CassetteTransport(str(tmp_path), mode="record", inner=MockLLMTransport(MockLLM(MockBehavior())))
+    recorded = await _client(recorder).chat.completions.create(model="m", messages=MESSAGES)
+    stream = await _client(recorder).chat.completions.create(model="m", messages=MESSAGES, stream=True)
+    recorded_stream = "".join([c.choices[0].delta.content or "" async for c in stream if c.choices])
+    assert recorder.stats["recorded"] == 2
+
+    player = CassetteTransport(str(tmp_path), mode="replay", time_scale=0)
+    replayed = await _client(player).chat.completions.create(model="m", messages=MESSAGES)
+    assert replayed.choices[0].message.content == recorded.choices[0].message.content
+    assert replayed.usage == recorded.usage
+    stream = await _client(player).chat.completions.create(model="m", messages=MESSAGES, stream=True)
+    assert "".join([c.choices[0].delta.content or "" async for c in stream if c.choices]) == recorded_stream
+
+    with pytest.raises(CassetteMissError):
+        await player.handle_async_request(httpx.Request("POST", "http://llm.test/v1/chat/completions", content=_body(n=2)))
+
+
+@pytest.mark.asyncio
+async def test_truncated_call_and_retry_replay_in_order(tmp_path):
+    recorder = CassetteTransport(str(tmp_path), mode="record", inner=MockLLMTransport(MockLLM(MockBehavior())))
+    client = _client(recorder)
+    first = await client.chat.completions.create(model="m", messages=MESSAGES, max_completion_tokens=1)
+    retry = await client.chat.completions.create(model="m", messages=MESSAGES, max_completion_tokens=50_000)
+    assert (first.choices[0].finish_reason, retry.choices[0].finish_reason) == ("length", "stop")
+    assert len(list(tmp_path.glob("*.json.gz"))) == 1
+
+    client = _client(CassetteTransport(str(tmp_path), mode="replay", time_scale=0))
+    reasons = [
+        (await client.chat.completions.create(model="m", messages=MESSAGES, max_completion_tokens=n)).choices[0].finish_reason
+        for n in (1, 50_000, 1, 50_000)
+    ]
+    # A second pass over the same requests starts the sequence over
+    assert reasons == ["length", "stop", "length", "stop"]
+
+
+@pytest.mark.asyncio
+async def test_new_recording_run_replaces_exchanges(tmp_path):
+    for _ in range(2):
+        recorder = CassetteTransport(str(tmp_path), mode="record", inner=MockLLMTransport(MockLLM(MockBehavior())))
+        await _client(recorder).chat.completions.create(model="m", messages=MESSAGES)
+    (path,) = tmp_path.glob("*.json.gz")
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        assert len(json.load(f)["exchanges"]) == 1
+
+
+@pytest.mark.asyncio
+async def test_old_version_fails_loudly(tmp_path):
+    key = request_key("POST", "/v1/chat/completions", _body())
+    with gzip.open(tmp_path / f"{key}.json.gz", "wt", encoding="utf-8") as f:
+        json.dump({"version": 1, "key": key, "response": {"status": 200, "body": "{}"}}, f)
+    player = CassetteTransport(str(tmp_path), mode="replay", time_scale=0)
+    with pytest.raises(CassetteVersionError):
+        await player.handle_async_request(httpx.Request("POST", "http://llm.test/v1/chat/completions", content=_body()))
@@ -0,0 +1,92 @@
+import gzip
+import json
+import zlib
+
+import pytest
+from fastapi import FastAPI, Request
+from fastapi.testclient import TestClient
+
+from server.services import compression
+from server.services.compression import CompressionMiddleware, decompress, negotiate
+
+_BODY = json.dumps({"risk_tokens": [{"text": "quickly", "reasoning": "vague " * 50}] * 20}).encode()
+
+
+def test_negotiate_follows_server_preference():
+    assert negotiate("gzip, br, zstd", ["zstd", "br", "gzip"]) == "zstd"
+    assert negotiate("gzip;q=1.0, br;q=0.5", ["br", "gzip"]) == "br"
+    assert negotiate("GZIP", ["gzip"]) == "gzip"
+
+
+def test_negotiate_rejects_q_zero_and_unknown():
+    assert negotiate("br;q=0, gzip", ["br", "gzip"]) == "gzip"
+    assert negotiate("br;q=0", ["br"]) is None
+    assert negotiate("br;q=oops", ["br"]) is None
+    assert negotiate("identity", ["gzip"]) is None
+    assert negotiate("", ["gzip"]) is None
+
+
+def test_negotiate_wildcard():
+    assert negotiate("*", ["br", "gzip"]) == "br"
+    assert negotiate("*, br;q=0", ["br", "gzip"]) == "gzip"
+
+
+@pytest.mark.parametrize("encoding, encode", [
+    ("gzip", gzip.compress),
+    ("deflate", zlib.compress),
+    ("deflate", lambda data: zlib.compress(data, wbits=-15)),
+])
+def test_decompress_round_trip(encoding, encode):
+    assert decompress(encode(_BODY), encoding, len(_BODY)) == _BODY
+
+
+def test_decompress_over_limit_raises_overflow():
+    bomb = gzip.compress(b"\0" * 1_000_000)
+    with pytest.raises(OverflowError):
+        decompress(bomb, "gzip", 64 * 1024)
+    with pytest.raises(OverflowError):
+        decompress(gzip.compress(_BODY), "gzip", len(_BODY) - 1)
+
+
+def test_decompress_unsupported_and_corrupt():
+    with pytest.raises(LookupError):
+        decompress(b"data", "compress", 1024)
+    with pytest.raises(ValueError):
+        decompress(b"not gzip", "gzip", 1024)
+
+
+@pytest.mark.skipif(compression.zstandard is None, reason="zstandard is not installed")
+def test_decompress_zstd_over_limit():
+    data = compression.zstandard.ZstdCompressor().compress(b"\0" * 1_000_000)
+    with pytest.raises(OverflowError):
+        decompress(data, "zstd", 64 * 1024)
+
+
+def _client(max_request_body=1024 * 1024):
+    app = FastAPI()
+
+    @app.post("/echo")
+    async def echo(request: Request):
+        return json.loads(await request.body())
+
+    app.add_middleware(CompressionMiddleware, min_size=500, max_request_body=max_request_body)
+    return TestClient(app)
+
+
+def test_middleware_compresses_large_responses_only():
+    client = _client()
+    response = client.post("/echo", content=_BODY, headers={"Accept-Encoding": "gzip"})
+    assert response.headers["content-encoding"] == "gzip"
+    assert "Accept-Encoding" in response.headers["vary"]
+    assert response.json() == json.loads(_BODY)
+    small = client.post("/echo", content=b'{"a": 1}', headers={"Accept-Encoding": "gzip"})
+    assert "content-encoding" not in small.headers
+
+
+def test_middleware_decodes_requests_and_rejects_bombs():
+    client = _client(max_request_body=len(_BODY))
+    headers = {"Content-Encoding": "gzip", "Accept-Encoding": "identity"}
+    assert client.post("/echo", content=gzip.compress(_BODY), headers=headers).json() == json.loads(_BODY)
+    assert client.post("/echo", content=gzip.compress(_BODY + b" "), headers=headers).status_code == 413
+    assert client.post("/echo", content=b"x", headers={"Content-Encoding": "compress"}).status_code == 415
+    assert client.post("/echo", content=b"not gzip", headers=headers).status_code == 400
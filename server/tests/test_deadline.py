@@ -0,0 +1,94 @@
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+from prometheus_client import REGISTRY
+
+from server.services import deadline as deadline_module
+from server.services.deadline import (
+    DeadlineExceeded,
+    current_deadline,
+    run_stage,
+    skipped_headers,
+    stage_allowed,
+    start_deadline,
+)
+
+
+@pytest.fixture(autouse=True)
+def no_deadline():
+    token = deadline_module._current.set(None)
+    yield
+    deadline_module._current.reset(token)
+
+
+def _events(route, stage, outcome):
+    return REGISTRY.get_sample_value(
+        "echo_deadline_events_total", {"route": route, "stage": stage, "outcome": outcome}
+    ) or 0.0
+
+
+async def _value(delay=0.0, value="ok"):
+    await asyncio.sleep(delay)
+    return value
+
+
+def test_start_deadline_from_header_and_route(monkeypatch):
+    monkeypatch.setattr(deadline_module, "REQUEST_DEADLINES", {"analyze": 30})
+    monkeypatch.setattr(deadline_module, "REQUEST_DEADLINE_MAX", 60)
+    assert start_deadline("analyze").budget == 30
+    assert start_deadline("analyze", "45").budget == 45
+    assert start_deadline("analyze", "600").budget == 60
+    assert start_deadline("other") is None and current_deadline() is None
+    assert start_deadline("other", "2.5").budget == 2.5
+
+
+@pytest.mark.parametrize("value", ["0", "-1", "soon", "inf", "nan"])
+def test_start_deadline_rejects_bad_header(value):
+    with pytest.raises(HTTPException) as exc:
+        start_deadline("analyze", value)
+    assert exc.value.status_code == 400
+
+
+@pytest.mark.asyncio
+async def test_run_stage_without_deadline_is_wait_for():
+    assert await run_stage("primary", _value(), timeout=1) == "ok"
+    with pytest.raises(asyncio.TimeoutError):
+        await run_stage("primary", _value(1), timeout=0.01)
+
+
+@pytest.mark.asyncio
+async def test_run_stage_budget_exhausted_names_the_stage():
+    start_deadline("test", "0.02")
+    before = _events("test", "primary", "exceeded")
+    with pytest.raises(DeadlineExceeded) as exc:
+        await run_stage("primary", _value(1), timeout=10)
+    assert exc.value.stage == "primary"
+    assert exc.value.to_dict()["budget_seconds"] == 0.02
+    # Nothing left: the next stage fails without starting its call
+    coro = _value()
+    with pytest.raises(DeadlineExceeded):
+        await run_stage("fallback", coro, timeout=10)
+    assert coro.cr_frame is None
+    assert _events("test", "primary", "exceeded") == before + 1
+
+
+@pytest.mark.asyncio
+async def test_shorter_agent_timeout_still_raises_timeout_error():
+    start_deadline("test", "10")
+    with pytest.raises(asyncio.TimeoutError):
+        await run_stage("primary", _value(1), timeout=0.01)
+    assert await run_stage("primary", _value(), timeout=0.5) == "ok"
+
+
+def test_stage_allowed_records_skips():
+    assert stage_allowed("fallback")
+    deadline = start_deadline("test", "1")
+    before = _events("test", "fallback", "skipped")
+    assert stage_allowed("fallback", min_seconds=0.5)
+    assert not stage_allowed("fallback", min_seconds=5)
+    assert not stage_allowed("fallback", min_seconds=5)
+    assert deadline.skipped == ["fallback", "fallback"]
+    assert _events("test", "fallback", "skipped") == before + 2
+    assert skipped_headers(deadline) == {"X-Deadline-Skipped": "fallback"}
+    assert skipped_headers(None) == {}
@@ -0,0 +1,72 @@
+import pytest
+
+from server.services import estimator
+from server.services.budget import CompletionBudgeter
+from server.services.estimator import PreflightRejected, check, estimate_analyze
+from server.services.providers import get_llm_service
+
+LONG_PROMPT = " ".join(f"word{i}" for i in range(20_000))
+
+
+@pytest.fixture
+def adaptive_budgeter(monkeypatch):
+    analyzer = get_llm_service().analyzer
+    budgeter = CompletionBudgeter(max_tokens=120_000, strategy="adaptive")
+    monkeypatch.setattr(analyzer, "budgeter", budgeter)
+    return budgeter
+
+
+@pytest.mark.parametrize("strategy", ["fixed", "adaptive"])
+def test_expected_completion_never_exceeds_cap(monkeypatch, strategy):
+    monkeypatch.setattr(get_llm_service().analyzer, "budgeter", CompletionBudgeter(max_tokens=120_000, strategy=strategy))
+    for call in estimate_analyze(LONG_PROMPT, "both").calls:
+        assert call.completion_tokens <= call.max_completion_tokens
+
+
+def test_long_prompt_within_default_limits(adaptive_budgeter):
+    # 20k words predict far more completion tokens than the cap allows; only the cap counts,
+    # and the context check stays off until it is configured for the model
+    estimate = estimate_analyze(LONG_PROMPT, "faithfulness")
+    assert check(estimate) is estimate
+
+
+def test_input_limit_boundary(monkeypatch, adaptive_budgeter):
+    estimate = estimate_analyze("Summarize the latest research on it.", "faithfulness")
+    input_tokens = estimate.calls[0].input_tokens
+    monkeypatch.setattr(estimator, "PREFLIGHT_CONTEXT_TOKENS", 0)
+
+    monkeypatch.setattr(estimator, "PREFLIGHT_MAX_INPUT_TOKENS", input_tokens)
+    assert estimator.violation(estimate) is None
+
+    monkeypatch.setattr(estimator, "PREFLIGHT_MAX_INPUT_TOKENS", input_tokens - 1)
+    with pytest.raises(PreflightRejected) as rejected:
+        check(estimate)
+    assert rejected.value.status == 413
+    assert rejected.value.to_dict()["estimate"]["input_tokens"] == input_tokens
+
+
+def test_context_limit_boundary(monkeypatch, adaptive_budgeter):
+    estimate = estimate_analyze("Summarize the latest research on it.", "faithfulness")
+    context_tokens = estimate.calls[0].context_tokens
+    monkeypatch.setattr(estimator, "PREFLIGHT_MAX_INPUT_TOKENS", 0)
+
+    monkeypatch.setattr(estimator, "PREFLIGHT_CONTEXT_TOKENS", context_tokens)
+    assert estimator.violation(estimate) is None
+
+    monkeypatch.setattr(estimator, "PREFLIGHT_CONTEXT_TOKENS", context_tokens - 1)
+    with pytest.raises(PreflightRejected) as rejected:
+        check(estimate)
+    assert rejected.value.status == 422
+
+
+def test_input_limit_checked_before_context(monkeypatch, adaptive_budgeter):
+    estimate = estimate_analyze("Summarize it.", "faithfulness")
+    monkeypatch.setattr(estimator, "PREFLIGHT_MAX_INPUT_TOKENS", 1)
+    monkeypatch.setattr(estimator, "PREFLIGHT_CONTEXT_TOKENS", 1)
+    assert estimator.violation(estimate)[:2] == (413, "input")
+
+
+def test_disabled_limits(monkeypatch, adaptive_budgeter):
+    monkeypatch.setattr(estimator, "PREFLIGHT_MAX_INPUT_TOKENS", 0)
+    monkeypatch.setattr(estimator, "PREFLIGHT_CONTEXT_TOKENS", 0)
+    assert estimator.violation(estimate_analyze(LONG_PROMPT * 3, "both")) is None
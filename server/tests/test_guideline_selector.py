@@ -0,0 +1,93 @@
+import re
+
+import pytest
+
+from server.services.guideline_selector import (
+    ALWAYS_ON_RULES,
+    guideline_rules,
+    minify,
+    prune,
+    select_guidelines,
+    select_rules,
+)
+from server.services.guidelines import read_data_file
+
+_SMALL = """<guidelines>
+  <!-- ===== Pillar X ===== -->
+  <pillar id="A" name="Always">
+    <rule id="A1" name="Broad">
+      <pattern>Anything at all</pattern>
+      <example>one</example>
+      <example>two</example>
+    </rule>
+  </pillar>
+  <pillar id="E" name="Numbers">
+    <rule id="E1" name="Units">
+      <pattern>Unit words: furlong, fortnight</pattern>
+    </rule>
+  </pillar>
+  <pillar id="Z" name="Cued">
+    <rule id="Z1" name="Cue">
+      <example>Do it <RISK>quickly</RISK>.</example>
+    </rule>
+  </pillar>
+</guidelines>
+"""
+
+
+def _pillars(xml):
+    return re.findall(r'<pillar id="(\w+)"', xml)
+
+
+@pytest.fixture(scope="module")
+def both_xml():
+    xml = read_data_file("both.xml")
+    if not xml:
+        pytest.skip("both.xml is not available")
+    return xml
+
+
+def test_rules_and_cues_are_parsed():
+    rules = {rule.rule_id: rule for rule in guideline_rules(_SMALL)}
+    assert [rule.pillar_id for rule in rules.values()] == ["A", "E", "Z"]
+    assert {"furlong", "fortnight"} <= rules["E1"].cues
+    assert "quickly" in rules["Z1"].cues
+
+
+def test_plain_prompt_keeps_only_always_on_rules_and_drops_pillars():
+    assert select_rules(_SMALL, "Write a poem.") == {"A1"}
+    pruned = prune(_SMALL, select_rules(_SMALL, "Write a poem."))
+    assert _pillars(pruned) == ["A"]
+    assert 'id="E1"' not in pruned and 'id="Z1"' not in pruned
+
+
+def test_signals_and_cues_select_rules():
+    assert select_rules(_SMALL, "Give me 3 ideas.") == {"A1", "E1"}
+    assert select_rules(_SMALL, "Walk a furlong.") == {"A1", "E1"}
+    assert select_rules(_SMALL, "Reply quickly") == {"A1", "Z1"}
+
+
+def test_always_on_set_survives_pruning_of_real_guidelines(both_xml):
+    ids = {rule.rule_id for rule in guideline_rules(both_xml)}
+    assert ALWAYS_ON_RULES <= ids
+    selected = select_rules(both_xml, "Write a poem.")
+    assert selected == ALWAYS_ON_RULES
+    pruned = prune(both_xml, selected)
+    assert {rule.rule_id for rule in guideline_rules(pruned)} == ALWAYS_ON_RULES
+    assert not {"E", "F", "G", "H", "K"} & set(_pillars(pruned))
+    assert "E" in _pillars(prune(both_xml, select_rules(both_xml, "Convert 5 km to miles.")))
+
+
+def test_minify_strips_banners_and_extra_examples():
+    small = minify(_SMALL, 1)
+    assert "<!--" not in small and "<example>two</example>" not in small
+    assert "<example>one</example>" in small
+    assert not any(line != line.strip() for line in small.splitlines())
+
+
+def test_select_guidelines_modes(monkeypatch):
+    monkeypatch.delenv("GUIDELINE_MAX_EXAMPLES", raising=False)
+    assert select_guidelines(_SMALL, "Write a poem.", "full") == _SMALL
+    assert select_guidelines(_SMALL, "Write a poem.", "minified") == minify(_SMALL, 1)
+    assert _pillars(select_guidelines(_SMALL, "Write a poem.", "pruned")) == ["A"]
+    assert select_guidelines("", "Write a poem.", "pruned") == ""
@@ -0,0 +1,93 @@
+import random
+
+import httpx
+import openai
+import pytest
+
+from server.mock_llm import MockBehavior, MockLLM
+from server.mock_llm.behavior import LatencyDistribution
+from server.mock_llm.transport import MockLLMTransport
+from server.services.openai_client import create_client
+
+ANALYZER_REQUEST = {
+    "model": "mock-model",
+    "messages": [
+        {"role": "system", "content": "You are the analyzer.\nANALYZE THIS PROMPT:\nTell me everything about the latest research."},
+    ],
+}
+
+
+def _request(**extra):
+    return {**ANALYZER_REQUEST, **extra}
+
+
+def test_plans_are_deterministic_per_seed_and_occurrence():
+    behavior = MockBehavior(latency=LatencyDistribution("lognormal", median_ms=100, sigma=0.5), seed=3)
+    first, second = MockLLM(behavior), MockLLM(behavior)
+    plans = [first.plan(_request()) for _ in range(3)]
+    assert [p.delay_ms for p in plans] == [second.plan(_request()).delay_ms for _ in range(3)]
+    # Repeats of the same request draw new, but still reproducible, samples
+    assert len({p.delay_ms for p in plans}) == 3
+    assert len({p.content for p in plans}) == 1
+
+
+def test_completion_cap_truncates():
+    engine = MockLLM(MockBehavior(reasoning_ratio=1.0))
+    full = engine.plan(_request(reasoning_effort="medium"))
+    assert full.finish_reason == "stop"
+    capped = engine.plan(_request(reasoning_effort="medium", max_completion_tokens=full.usage["completion_tokens"] // 2))
+    assert capped.finish_reason == "length"
+    assert len(capped.content) < len(full.content)
+    assert capped.usage["completion_tokens"] <= full.usage["completion_tokens"] // 2 + 1
+    assert engine.stats["truncated"] == 1
+
+
+def test_latency_distribution_clamps():
+    rng = random.Random(0)
+    fixed = LatencyDistribution("normal", median_ms=100, sigma=1000, min_ms=10, max_ms=200)
+    assert all(10 <= fixed.sample(rng) <= 200 for _ in range(200))
+    assert LatencyDistribution("uniform", min_ms=5, max_ms=6).sample(rng) <= 6
+
+
+def test_from_env_overrides(monkeypatch):
+    monkeypatch.setenv("MOCK_LLM_LATENCY_MS", "250")
+    monkeypatch.setenv("MOCK_LLM_LATENCY_SIGMA", "0.3")
+    monkeypatch.setenv("MOCK_LLM_TRUNCATE_RATE", "0.5")
+    behavior = MockBehavior.from_env()
+    assert behavior.latency.distribution == "lognormal"
+    assert behavior.latency.median_ms == 250 and behavior.latency.sigma == 0.3
+    assert behavior.truncate_rate == 0.5
+
+
+@pytest.mark.asyncio
+async def test_sdk_round_trip_and_streaming():
+    client = create_client("mock://")
+    response = await client.chat.completions.create(**ANALYZER_REQUEST)
+    assert response.choices[0].finish_reason == "stop"
+    assert response.usage.prompt_tokens > 0
+
+    stream = await client.chat.completions.create(**ANALYZER_REQUEST, stream=True, stream_options={"include_usage": True})
+    parts, usage = [], None
+    async for chunk in stream:
+        if chunk.choices:
+            parts.append(chunk.choices[0].delta.content or "")
+        if chunk.usage is not None:
+            usage = chunk.usage
+    assert "".join(parts) == response.choices[0].message.content
+    assert usage is not None and usage.completion_tokens == response.usage.completion_tokens
+
+
+@pytest.mark.asyncio
+async def test_rate_limit_surfaces_as_429():
+    engine = MockLLM(MockBehavior(rate_limit_rate=1.0, retry_after_ms=1000))
+    status, headers, body = await engine.complete(_request())
+    assert status == 429
+    assert headers["retry-after"] == "1"
+    assert body["error"]["code"] == "rate_limit_exceeded"
+
+    client = openai.AsyncOpenAI(
+        api_key="test", base_url="http://mock/v1", max_retries=0,
+        http_client=httpx.AsyncClient(transport=MockLLMTransport(engine)),
+    )
+    with pytest.raises(openai.RateLimitError):
+        await client.chat.completions.create(**ANALYZER_REQUEST)
@@ -0,0 +1,30 @@
+import json
+from types import SimpleNamespace
+
+import pytest
+
+from server.services import preparator as preparator_module
+from server.services.preparator import VARIATION_SPECS, AnalysisPreparator
+
+ANALYSIS = {"risk_tokens": [{"id": "RISK_1", "text": "latest research", "risk_level": "high"}]}
+HISTORY = [{"role": "user", "content": "Make it about 2023."}, {"role": "assistant", "content": "Noted."}]
+
+
+@pytest.mark.asyncio
+async def test_parallel_primary_call_uses_the_refinement_prompt(monkeypatch):
+    calls = []
+
+    async def fake_completion(client, *, agent, mode="n/a", **kwargs):
+        calls.append(kwargs["messages"])
+        content = json.dumps({"refined_prompt": "Summarize 2023 research."}) if len(calls) == 1 else json.dumps({"focus": "f", "prompt": "p"})
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=content), finish_reason="stop")])
+
+    monkeypatch.setattr(preparator_module, "create_chat_completion", fake_completion)
+    agent = AnalysisPreparator(client=object())
+    result = await agent.refine_prompt_parallel("Summarize the latest research.", ANALYSIS, HISTORY, "keep it short", "factuality")
+
+    expected = agent.build_refinement_prompt("Summarize the latest research.", ANALYSIS, HISTORY, "keep it short", "factuality")
+    assert calls[0][0] == {"role": "system", "content": expected}
+    assert result["refined_prompt"] == "Summarize 2023 research."
+    assert len(calls) == 1 + len(VARIATION_SPECS)
+    assert result["variation_sources"] == ["llm"] * len(VARIATION_SPECS)
@@ -0,0 +1,67 @@
+from types import SimpleNamespace
+
+import pytest
+from fastapi import FastAPI
+from starlette.testclient import TestClient
+
+from server.routes import refine
+from server.services import refine_sessions
+from server.services.refine_sessions import CLOSE_TOO_BIG, RefineSession, SessionLimitError
+
+
+@pytest.fixture
+def service(monkeypatch):
+    """A conversation agent whose system prompt records the analysis it was built with."""
+    built = []
+
+    def build_conversation_system_prompt(prompt, analysis_output, analysis_mode):
+        built.append(analysis_output)
+        return "system"
+
+    fake = SimpleNamespace(build_conversation_system_prompt=build_conversation_system_prompt, built=built)
+    monkeypatch.setattr(refine_sessions, "get_llm_service", lambda: fake)
+    monkeypatch.setattr(refine, "get_llm_service", lambda: fake)
+    return fake
+
+
+def _history(count, size=10):
+    return [{"role": "assistant" if i % 2 == 0 else "user", "content": f"{i}" * size} for i in range(count)]
+
+
+def test_trim_keeps_pinned_messages_and_drops_whole_exchanges(service):
+    session = RefineSession("p", history=_history(8), max_bytes=10_000)
+    fixed = session.memory_bytes - 80
+    session.max_bytes = fixed + 55
+    assert session.trim() == 4
+    assert [m["content"][0] for m in session.history] == ["0", "1", "6", "7"]
+    assert session.memory_bytes <= session.max_bytes
+
+
+def test_trim_never_drops_pinned_or_latest_message(service):
+    session = RefineSession("p", history=_history(4), max_bytes=10_000)
+    session.max_bytes = 0
+    assert session.trim() == 1
+    assert [m["content"][0] for m in session.history] == ["0", "1", "3"]
+    assert session.trim() == 0
+
+
+def test_new_session_is_trimmed_and_oversized_messages_refused(service):
+    session = RefineSession("p", history=_history(6, size=100), max_bytes=len("system") + len("p") + 400)
+    assert [m["content"][0] for m in session.history] == ["0", "1", "4", "5"]
+    with pytest.raises(SessionLimitError) as exc:
+        session.add_user_message("x" * 1000)
+    assert exc.value.code == CLOSE_TOO_BIG
+
+
+def test_update_frame_keeps_analysis_unless_cleared(service):
+    app = FastAPI()
+    app.include_router(refine.router, prefix="/api/refine")
+    analysis = {"risk_tokens": [{"text": "quickly"}]}
+    with TestClient(app).websocket_connect("/api/refine/ws") as ws:
+        ws.send_json({"type": "start", "prompt": "Summarize it.", "analysis_output": analysis})
+        assert ws.receive_json()["type"] == "ready"
+        ws.send_json({"type": "update", "prompt": "Summarize it in a paragraph."})
+        assert ws.receive_json()["type"] == "updated"
+        ws.send_json({"type": "update", "prompt": "Summarize it.", "analysis_output": None})
+        assert ws.receive_json()["type"] == "updated"
+    assert service.built == [analysis, analysis, None]
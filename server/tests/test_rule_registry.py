@@ -0,0 +1,87 @@
+import random
+import re
+
+import pytest
+
+from server.services.rule_registry import RuleRegistry, get_rule_registry
+from server.services.scoring_config import CATEGORY_RULES, CRITICAL_RULES
+
+
+# The per-token regexes the registry replaced (span enrichment and deterministic scoring)
+def _old_enrichment_ids(classification):
+    ids = re.findall(r'"(R\d+)"', classification)
+    if not ids:
+        ids = [f"R{n}" for n in re.findall(r'\b(\d+)\b', classification)]
+    return ids
+
+
+def _old_scoring_ids(classification):
+    if "rule_ids:" not in classification:
+        return []
+    rule_part = classification.split("rule_ids:")[-1].strip()
+    return re.findall(r'"(R\d+)"', rule_part) or [f"R{n}" for n in re.findall(r'(\d+)', rule_part)]
+
+
+def _old_category(rule_ids):
+    for category, rules in CATEGORY_RULES.items():
+        if any(rule in rule_ids for rule in rules):
+            return category
+    return None
+
+
+def _old_critical(classification):
+    if "rule_ids:" not in classification:
+        return False
+    rule_part = classification.split("rule_ids:")[-1].strip()
+    return any(rule in CRITICAL_RULES for rule in re.findall(r'"(R\d+)"', rule_part))
+
+
+CASES = [
+    "",
+    "No rule here",
+    'Ambiguous referent; rule_ids: ["R1", "R9"]',
+    "rule_ids: 3, 17",
+    'Mentions "R2" before; rule_ids: 13',
+    "rule_ids: [R10]",
+    "step2 of 3 rule_ids:22",
+    'rule_ids: ["R4"] and rule_ids: ["R13", "R7"]',
+    'x_12 12x 12 "R5" rule_ids:',
+    'rule_ids: "R0012"',
+]
+
+
+def _random_classification(rng):
+    pieces = ['"R{}"'.format(rng.randint(0, 25)), str(rng.randint(0, 25)), "rule_ids:", "R7", "_9", "a1", " ", ", ", "[", "]"]
+    return "".join(rng.choice(pieces) for _ in range(rng.randint(0, 12)))
+
+
+@pytest.fixture(scope="module")
+def registry():
+    return RuleRegistry()
+
+
+@pytest.mark.parametrize(
+    "classification", CASES + [_random_classification(random.Random(seed)) for seed in range(300)]
+)
+def test_classify_matches_old_regexes(registry, classification):
+    token_rules = registry.classify({"classification": classification})
+    scoring_ids = _old_scoring_ids(classification)
+    assert token_rules.rule_ids == _old_enrichment_ids(classification)
+    assert token_rules.scoring_rule_ids == scoring_ids
+    assert token_rules.category == _old_category(scoring_ids)
+    assert token_rules.critical == _old_critical(classification)
+    if token_rules.category is not None:
+        assert registry.categories[token_rules.category_index] == token_rules.category
+
+
+def test_missing_classification(registry):
+    token_rules = registry.classify({})
+    assert token_rules.rule_ids == [] and token_rules.category is None and not token_rules.critical
+
+
+def test_guideline_rules_indexed():
+    registry = get_rule_registry("both")
+    assert registry.get("R9").critical
+    guideline_rules = [info for info in registry.rules.values() if info.pillar_id]
+    assert guideline_rules
+    assert all(info.critical == (info.severity == "critical") for info in guideline_rules)
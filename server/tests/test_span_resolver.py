@@ -0,0 +1,60 @@
+from server.services.span_resolver import SpanIndex, build_annotated_prompt, occurrence_index, resolve_risk_spans
+
+PROMPT = "Tell me about  The Study.\nThe study said the study was new."
+
+
+def test_exact_match():
+    index = SpanIndex(PROMPT)
+    start, end = index.find("study said")
+    assert PROMPT[start:end] == "study said"
+
+
+def test_loose_match_ignores_case_and_whitespace():
+    start, end = SpanIndex(PROMPT).find("about the   study")
+    # Offsets refer to the original prompt, including its double space and capitals
+    assert PROMPT[start:end] == "about  The Study"
+
+
+def test_occurrence_selects_nth_match():
+    index = SpanIndex(PROMPT)
+    first = index.find("study", 1)
+    second = index.find("study", 2)
+    assert second[0] > first[0]
+    assert PROMPT[second[0]:second[1]] == "study"
+    assert occurrence_index(PROMPT, "study", second[0]) == 2
+    assert index.find("study", 4) is None
+
+
+def test_occurrence_falls_back_to_loose_matches():
+    # One exact lowercase match; the loose lookup counts "The Study" and "The study" too
+    start, end = SpanIndex(PROMPT).find("the study", 3)
+    assert PROMPT[start:end] == "the study"
+    assert SpanIndex(PROMPT).find("the study", 4) is None
+
+
+def test_missing_and_blank_quotes():
+    index = SpanIndex(PROMPT)
+    assert index.find("not in the prompt") is None
+    assert index.find("   ") is None
+
+
+def test_resolve_reports_overlap_and_not_found():
+    tokens = [
+        {"id": "RISK_1", "text": "study said the"},
+        {"id": "RISK_2", "text": "said", "occurrence": "1"},
+        {"id": "RISK_3", "text": "nowhere"},
+        {"id": "RISK_4", "text": "new", "occurrence": None},
+    ]
+    unresolved = resolve_risk_spans(PROMPT, tokens)
+    assert [(entry["id"], entry["reason"]) for entry in unresolved] == [("RISK_2", "overlap"), ("RISK_3", "not_found")]
+    assert tokens[1]["occurrence"] == 1 and tokens[3]["occurrence"] == 1
+    assert "span_start" not in tokens[1]
+    assert PROMPT[tokens[3]["span_start"]:tokens[3]["span_end"]] == "new"
+
+
+def test_build_annotated_prompt_round_trip():
+    tokens = [{"id": "RISK_2", "text": "new"}, {"id": "RISK_1", "text": "Tell me"}]
+    assert resolve_risk_spans(PROMPT, tokens) == []
+    annotated = build_annotated_prompt(PROMPT, tokens)
+    assert annotated.startswith("<RISK_1>Tell me</RISK_1> about")
+    assert annotated.endswith("was <RISK_2>new</RISK_2>.")
@@ -0,0 +1,59 @@
+import json
+
+import pytest
+
+from server.services.speculation import high_risk_items, speculation_holds
+from server.services.stream_parser import RiskTokenStreamParser
+
+TOKENS = [
+    {"id": "RISK_1", "text": "the {latest} \"study\"", "risk_level": "high", "notes": ["a]", "b}"]},
+    {"id": "RISK_2", "text": "back\\slash", "risk_level": "medium"},
+]
+CONTENT = json.dumps({
+    "annotated_prompt": "risk_tokens are listed below [not here]",
+    "risk_tokens": TOKENS,
+    "risk_assessment": {"prompt": {"prompt_violations": [{"rule_id": "B1"}]}},
+})
+
+
+@pytest.mark.parametrize("size", [1, 3, 7, len(CONTENT)])
+def test_parser_yields_tokens_across_any_chunking(size):
+    parser = RiskTokenStreamParser()
+    closed = []
+    for start in range(0, len(CONTENT), size):
+        closed.extend(parser.feed(CONTENT[start:start + size]))
+    assert closed == TOKENS == parser.risk_tokens
+    assert parser.complete
+
+
+def test_parser_reports_tokens_before_the_response_ends():
+    parser = RiskTokenStreamParser()
+    cut = CONTENT.index('"risk_assessment"')
+    assert parser.feed(CONTENT[:cut]) == TOKENS
+    assert parser.complete
+    assert parser.feed(CONTENT[cut:]) == []
+
+
+def test_parser_incomplete_and_malformed():
+    parser = RiskTokenStreamParser()
+    assert parser.feed('{"risk_tokens": [{"id": "RISK_1"}, {"id": ') == [{"id": "RISK_1"}]
+    assert not parser.complete
+    parser = RiskTokenStreamParser()
+    assert parser.feed('{"risk_tokens": [{"id": RISK_1}, {"id": "RISK_2"}]}') == [{"id": "RISK_2"}]
+    assert RiskTokenStreamParser().feed('{"annotated_prompt": "no tokens"}') == []
+
+
+def test_high_risk_items_normalize_text_and_level():
+    assert high_risk_items([
+        {"text": "The  Study", "risk_level": "HIGH"},
+        {"text": "x", "risk_level": "medium"},
+        {"text": "y"},
+    ]) == {("the study", "high")}
+
+
+def test_speculation_holds():
+    draft = [{"text": "the study", "risk_level": "high"}, {"text": "it", "risk_level": "medium"}]
+    assert speculation_holds(draft, [{"text": "The study", "risk_level": "high"}, {"text": "new", "risk_level": "medium"}])
+    assert speculation_holds(draft, [])
+    assert not speculation_holds(draft, [{"text": "it", "risk_level": "critical"}])
+    assert not speculation_holds(draft, [{"text": "everything", "risk_level": "high"}])
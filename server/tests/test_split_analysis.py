@@ -0,0 +1,87 @@
+from server.services.split_analysis import merge_analyses, merge_risk_tokens
+
+PROMPT = "Summarize the 2023 report on city budgets and cite every source."
+
+
+def _token(token_id, text, risk_level="medium", **extra):
+    start = PROMPT.index(text)
+    return {"id": token_id, "text": text, "risk_level": risk_level, "span_start": start, "span_end": start + len(text), **extra}
+
+
+def test_overlap_keeps_higher_severity():
+    parts = [
+        {"risk_tokens": [_token("RISK_1", "the 2023 report")]},
+        {"risk_tokens": [_token("RISK_1", "2023 report on city", "high")]},
+    ]
+    merged, renamed = merge_risk_tokens(parts)
+    assert [t["text"] for t in merged] == ["2023 report on city"]
+    assert renamed == [{}, {"RISK_1": "RISK_1"}]
+
+
+def test_renumbers_by_position_across_parts():
+    parts = [
+        {"risk_tokens": [_token("RISK_1", "every source"), _token("RISK_2", "Summarize")]},
+        {"risk_tokens": [_token("RISK_1", "city budgets", "high")]},
+    ]
+    merged, renamed = merge_risk_tokens(parts)
+    assert [(t["id"], t["text"]) for t in merged] == [
+        ("RISK_1", "Summarize"), ("RISK_2", "city budgets"), ("RISK_3", "every source"),
+    ]
+    assert renamed == [{"RISK_1": "RISK_3", "RISK_2": "RISK_1"}, {"RISK_1": "RISK_2"}]
+
+
+def test_unplaced_tokens_dedupe_by_text_after_placed():
+    parts = [
+        {"risk_tokens": [{"id": "RISK_1", "text": "Cite Every Source", "risk_level": "medium"}]},
+        {"risk_tokens": [
+            {"id": "RISK_1", "text": " cite every source", "risk_level": "high"},
+            _token("RISK_2", "Summarize"),
+        ]},
+    ]
+    merged, _ = merge_risk_tokens(parts)
+    assert [(t["id"], t["text"], t["risk_level"]) for t in merged] == [
+        ("RISK_1", "Summarize", "medium"), ("RISK_2", " cite every source", "high"),
+    ]
+
+
+def test_merge_analyses_rebuilds_prompt_and_dedupes_violations():
+    violation = {"rule_id": "B1", "span": "city budgets", "severity": "medium"}
+    parts = [
+        {
+            "risk_tokens": [_token("RISK_1", "city budgets")],
+            "risk_assessment": {"prompt": {"prompt_violations": [violation]}, "meta": {"meta_violations": [{"rule_id": "M1"}]}},
+            "analysis_summary": "first",
+        },
+        {
+            "risk_tokens": [],
+            "risk_assessment": {
+                "prompt": {"prompt_violations": [{**violation, "span": "City budgets ", "severity": "high"}]},
+                "meta": {"meta_violations": [{"rule_id": "M1"}]},
+            },
+            "analysis_summary": "second",
+        },
+    ]
+    merged = merge_analyses(PROMPT, parts)
+    assert "<RISK_1>city budgets</RISK_1>" in merged["annotated_prompt"]
+    assert merged["analysis_summary"] == "first\n\nsecond"
+    prompt_violations = merged["risk_assessment"]["prompt"]["prompt_violations"]
+    assert [v["severity"] for v in prompt_violations] == ["high"]
+    assert len(merged["risk_assessment"]["meta"]["meta_violations"]) == 1
+    assert "unresolved_spans" not in merged
+
+
+def test_unresolved_ids_never_name_merged_tokens():
+    parts = [
+        {
+            "risk_tokens": [_token("RISK_1", "Summarize")],
+            "unresolved_spans": [{"id": "RISK_2", "text": "missing", "occurrence": 1, "reason": "not_found"}],
+        },
+        {
+            "risk_tokens": [_token("RISK_1", "Summarize the", "high"), _token("RISK_2", "every source")],
+            "unresolved_spans": [{"id": "RISK_3", "text": "gone", "occurrence": 1, "reason": "not_found"}],
+        },
+    ]
+    merged = merge_analyses(PROMPT, parts)
+    merged_ids = {t["id"] for t in merged["risk_tokens"]}
+    assert merged_ids == {"RISK_1", "RISK_2"}
+    assert [entry["id"] for entry in merged["unresolved_spans"]] == ["RISK_3", "RISK_4"]
@@ -0,0 +1,139 @@
+import contextvars
+from types import SimpleNamespace
+
+import httpx
+import pytest
+from fastapi import FastAPI
+
+from server.routes import diagnostics, usage
+from server.services import usage_ledger
+from server.services.usage_ledger import UsageLedger, UsageMiddleware, budget_key, client_key_for, set_usage_context
+
+
+def _usage(prompt=100, completion=50, cached=0, reasoning=0):
+    return SimpleNamespace(
+        prompt_tokens=prompt,
+        completion_tokens=completion,
+        prompt_tokens_details=SimpleNamespace(cached_tokens=cached),
+        completion_tokens_details=SimpleNamespace(reasoning_tokens=reasoning),
+    )
+
+
+def _record(ledger, client_key, route="analyze", **usage):
+    def record():
+        set_usage_context(route, client_key)
+        ledger.record("analyzer", "gpt-test", "both", _usage(**usage))
+
+    # A copied context keeps the attribution from leaking into other tests
+    contextvars.copy_context().run(record)
+
+
+def test_client_keys():
+    assert client_key_for(None, "10.0.0.1") == "10.0.0.1"
+    assert client_key_for(" team-a ", "10.0.0.1") == "10.0.0.1/team-a"
+    assert client_key_for("x", None) == "anonymous/x"
+    assert budget_key("10.0.0.1/team-a") == "10.0.0.1"
+
+
+def test_budget_counts_per_ip_across_labels():
+    ledger = UsageLedger(budget=400, budget_window=3600)
+    _record(ledger, "10.0.0.1/a", prompt=100, completion=50)
+    _record(ledger, "10.0.0.1/b", prompt=150, completion=50)
+    _record(ledger, "10.0.0.2", prompt=1000, completion=0)
+    assert ledger.client_tokens("10.0.0.1") == 350
+    assert ledger.client_tokens("10.0.0.1/anything") == 350
+    assert not ledger.over_budget("10.0.0.1/c")
+    _record(ledger, "10.0.0.1", prompt=50, completion=0)
+    # A new label on the same IP does not get a fresh budget
+    assert ledger.over_budget("10.0.0.1/fresh")
+    assert not UsageLedger(budget=0).over_budget("10.0.0.1")
+
+
+def test_budget_window_drops_old_buckets(monkeypatch):
+    ledger = UsageLedger(budget=100, budget_window=600)
+    now = 1_000_000.0
+    monkeypatch.setattr(usage_ledger.time, "time", lambda: now)
+    _record(ledger, "10.0.0.1", prompt=100, completion=0)
+    assert ledger.over_budget("10.0.0.1")
+    now += 600 + usage_ledger.BUCKET_SECONDS
+    assert ledger.client_tokens("10.0.0.1") == 0
+    assert not ledger.over_budget("10.0.0.1")
+
+
+def test_totals_filter_and_cost(monkeypatch):
+    monkeypatch.setattr(usage_ledger, "USAGE_PRICES", {"gpt-test": {"prompt": 1.0, "cached": 0.5, "completion": 4.0}})
+    ledger = UsageLedger()
+    _record(ledger, "10.0.0.1/a", prompt=1_000_000, cached=500_000, completion=250_000, reasoning=100)
+    _record(ledger, "10.0.0.2")
+    assert ledger.totals()["totals"]["calls"] == 2
+    by_ip = ledger.totals(client_key="10.0.0.1")
+    assert [row["client_key"] for row in by_ip["rows"]] == ["10.0.0.1/a"]
+    assert by_ip["rows"][0]["reasoning_tokens"] == 100
+    # 0.5M uncached at $1, 0.5M cached at $0.5, 0.25M completion at $4
+    assert by_ip["totals"]["cost_usd"] == pytest.approx(0.5 + 0.25 + 1.0)
+    assert ledger.totals(client_key="10.0.0.1/b")["rows"] == []
+
+
+@pytest.mark.asyncio
+async def test_sqlite_flush_and_reload(tmp_path):
+    db = str(tmp_path / "usage.db")
+    ledger = UsageLedger(db_path=db, budget=200)
+    _record(ledger, "10.0.0.1/a", prompt=100, completion=50)
+    _record(ledger, "10.0.0.1/a", prompt=100, completion=50)
+    assert await ledger.flush() == 1
+    assert await ledger.flush() == 0
+
+    restarted = UsageLedger(db_path=db, budget=200)
+    assert restarted._load_recent() == 1
+    assert restarted.client_tokens("10.0.0.1") == 300
+    assert restarted.over_budget("10.0.0.1")
+
+
+def test_in_memory_ledger_keeps_nothing_pending():
+    ledger = UsageLedger()
+    _record(ledger, "10.0.0.1")
+    assert not ledger._pending
+
+
+@pytest.fixture
+def ledger(monkeypatch):
+    ledger = UsageLedger(budget=100, budget_window=3600)
+    monkeypatch.setattr(usage_ledger, "_ledger", ledger)
+    return ledger
+
+
+def _middleware_app():
+    async def app(scope, receive, send):
+        await send({"type": "http.response.start", "status": 200, "headers": []})
+        await send({"type": "http.response.body", "body": usage_ledger.current_client_key().encode()})
+
+    return UsageMiddleware(app, lambda path: path.strip("/").split("/")[1] if path.startswith("/api/") else "other")
+
+
+@pytest.mark.asyncio
+async def test_middleware_blocks_every_method_on_llm_routes(ledger):
+    transport = httpx.ASGITransport(app=_middleware_app(), client=("10.0.0.1", 1234))
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+        response = await client.get("/api/refine/stream", headers={"X-Client-Key": "a"})
+        assert response.status_code == 200 and response.text == "10.0.0.1/a"
+
+        _record(ledger, "10.0.0.1/a", prompt=100, completion=0)
+        for method, path in [("GET", "/api/refine/stream"), ("POST", "/api/analyze/"), ("POST", "/api/prepare/")]:
+            response = await client.request(method, path, headers={"X-Client-Key": "another"})
+            assert response.status_code == 429
+            assert response.json()["used_tokens"] == 100
+        assert (await client.get("/api/health")).status_code == 200
+
+
+@pytest.mark.asyncio
+async def test_usage_route_is_admin_only(monkeypatch, ledger):
+    app = FastAPI()
+    app.include_router(usage.router, prefix="/api/usage")
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+        monkeypatch.setattr(diagnostics, "ADMIN_TOKEN", "")
+        assert (await client.get("/api/usage/")).status_code == 404
+        monkeypatch.setattr(diagnostics, "ADMIN_TOKEN", "secret")
+        assert (await client.get("/api/usage/", headers={"X-Admin-Token": "wrong"})).status_code == 403
+        response = await client.get("/api/usage/", headers={"X-Admin-Token": "secret"})
+        assert response.status_code == 200
+        assert response.json()["budget"] == {"tokens": 100, "window_seconds": 3600}